@@ -40,6 +40,12 @@ var gcbCanPostEvents = false;
 var eventXsrfToken = '';
 var assessmentXsrfToken = '';
 
+// asynchronous events wait here to be posted to the server in batches
+var gcbEventQueue = [];
+var gcbEventQueueTimer = null;
+var GCB_EVENT_QUEUE_MAX_LENGTH = 20;
+var GCB_EVENT_QUEUE_FLUSH_DELAY_MILLIS = 2000;
+
 function gcbTagEventAudit(data_dict, name) {
   gcbAudit(gcbCanPostTagEvents, data_dict, 'tag-' + name, true);
 }
@@ -67,18 +73,24 @@ function gcbAudit(can_post, data_dict, source, is_async) {
     data_dict['location'] = '' + window.location;
     data_dict['loc'] = {}
     data_dict['loc']['page_locale'] = $('body').data('gcb-page-locale')
-    var request = {
-        'source': source,
-        'payload': JSON.stringify(data_dict),
-        'xsrf_token': eventXsrfToken};
-    $.ajax({
-        url: 'rest/events',
-        type: 'POST',
-        async: is_async,
-        data: {'request': JSON.stringify(request)},
-        success: function(){},
-        error: function(){}
-    });
+    if (is_async) {
+      gcbQueueEvent(data_dict, source);
+    } else {
+      // Post queued events first, so the server gets events in order.
+      gcbFlushEvents(false);
+      var request = {
+          'source': source,
+          'payload': JSON.stringify(data_dict),
+          'xsrf_token': eventXsrfToken};
+      $.ajax({
+          url: 'rest/events',
+          type: 'POST',
+          async: false,
+          data: {'request': JSON.stringify(request)},
+          success: function(){},
+          error: function(){}
+      });
+    }
   }
 
   // ----------------------------------------------------------------------
@@ -117,6 +129,42 @@ function gcbAudit(can_post, data_dict, source, is_async) {
   }
 }
 
+// Queues an event to be posted with others by gcbFlushEvents(); the queue is
+// flushed once it is long enough or after a short delay.
+function gcbQueueEvent(data_dict, source) {
+  gcbEventQueue.push({'source': source, 'payload': data_dict});
+  if (gcbEventQueue.length >= GCB_EVENT_QUEUE_MAX_LENGTH) {
+    gcbFlushEvents(true);
+  } else if (!gcbEventQueueTimer) {
+    gcbEventQueueTimer = setTimeout(function() {
+      gcbFlushEvents(true);
+    }, GCB_EVENT_QUEUE_FLUSH_DELAY_MILLIS);
+  }
+}
+
+// Posts all queued events to the server in one request.
+function gcbFlushEvents(is_async) {
+  if (gcbEventQueueTimer) {
+    clearTimeout(gcbEventQueueTimer);
+    gcbEventQueueTimer = null;
+  }
+  if (!gcbEventQueue.length) {
+    return;
+  }
+  var request = {
+      'events': gcbEventQueue,
+      'xsrf_token': eventXsrfToken};
+  gcbEventQueue = [];
+  $.ajax({
+      url: 'rest/events/batch',
+      type: 'POST',
+      async: is_async,
+      data: {'request': JSON.stringify(request)},
+      success: function(){},
+      error: function(){}
+  });
+}
+
 // Returns the value of a URL parameter, if it exists.
 function getParamFromUrlByName(name) {
   return decodeURI(
@@ -902,6 +950,11 @@ $(document).ready(function() {
 
 // this code runs when the document unloads
 $(window).unload(function() {
+  // send events still queued to the server
+  try {
+    gcbFlushEvents(false);
+  } catch (e){}
+
   // send 'visit-page' event to the server
   try {
     // duration is in milliseconds
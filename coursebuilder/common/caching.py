@@ -18,15 +18,28 @@ __author__ = 'Pavel Simakov (psimakov@google.com)'
 
 
 import collections
+import copy
 import datetime
 import logging
+import pickle
 import sys
 import threading
 import unittest
 
 import appengine_config
+from models import entities
 from models.counters import PerfCounter
 
+from google.appengine.ext import db
+
+# Max number of changes retained in each change journal; processes that fall
+# further behind than this drop all their cached objects for the namespace.
+MAX_CACHE_JOURNAL_ENTRIES = 1000
+
+# Max number of changes recorded individually by one write; larger batches
+# are recorded as a single flush of the entire namespace.
+MAX_CACHE_JOURNAL_BATCH_SIZE = 100
+
 
 def iter_all(query, batch_size=100):
     """Yields query results iterator. Proven method for large datasets."""
@@ -41,6 +54,97 @@ def iter_all(query, batch_size=100):
         prev_cursor = query.cursor()
 
 
+def _raise_frozen(*unused_args, **unused_kwargs):
+    raise TypeError('Frozen snapshots can not be modified.')
+
+
+class FrozenDict(dict):
+    """An immutable dict; instances are normally made by freeze()."""
+
+    __setitem__ = __delitem__ = _raise_frozen
+    clear = pop = popitem = setdefault = update = _raise_frozen
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+class FrozenList(tuple):
+    """An immutable snapshot of a list; normally made by freeze()."""
+
+
+class FrozenSet(frozenset):
+    """An immutable snapshot of a set; normally made by freeze()."""
+
+
+# Values that are safe to share between callers as is.
+_IMMUTABLE_TYPES = (
+    type(None), bool, int, long, float, basestring, datetime.datetime,
+    datetime.date)
+
+
+def is_frozen(value):
+    """Checks whether the value is a snapshot made by freeze()."""
+    return isinstance(value, (FrozenDict, FrozenList, FrozenSet))
+
+
+def freeze(value):
+    """Returns an immutable snapshot of the value.
+
+    Dicts, lists, tuples and sets are copied recursively into their frozen
+    counterparts, so that the snapshot can be shared by any number of readers
+    without copying. Snapshots are returned as is. Other objects are shared
+    by reference and must not be modified by readers of the snapshot.
+
+    Args:
+        value: a value to freeze
+    Returns:
+        an immutable snapshot of the value
+    """
+    if isinstance(value, _IMMUTABLE_TYPES) or is_frozen(value):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict(
+            (key, freeze(item)) for key, item in value.iteritems())
+    if isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    if type(value) is tuple:  # pylint: disable=unidiomatic-typecheck
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return FrozenSet(freeze(item) for item in value)
+    return value
+
+
+def thaw(value):
+    """Returns a private mutable copy of a value, frozen or not."""
+    if isinstance(value, _IMMUTABLE_TYPES):
+        return value
+    if isinstance(value, FrozenDict):
+        return {key: thaw(item) for key, item in value.iteritems()}
+    if isinstance(value, FrozenList):
+        return [thaw(item) for item in value]
+    if type(value) is tuple:  # pylint: disable=unidiomatic-typecheck
+        return tuple(thaw(item) for item in value)
+    if isinstance(value, FrozenSet):
+        return set(thaw(item) for item in value)
+    return copy.deepcopy(value)
+
+
+def shallow_thaw(value):
+    """Returns a mutable shallow copy of a frozen dict, list or set.
+
+    Unlike thaw(), this does not copy the items, which stay frozen and shared
+    with the snapshot. A caller may add, replace or remove items of the copy,
+    and has to shallow_thaw() a nested item before changing it in place.
+    """
+    if isinstance(value, FrozenDict):
+        return dict(value)
+    if isinstance(value, FrozenList):
+        return list(value)
+    if isinstance(value, FrozenSet):
+        return set(value)
+    return value
+
+
 class AbstractScopedSingleton(object):
     """A singleton object bound to and managed by a container.
 
@@ -181,6 +285,7 @@ class LRUCache(object):
 
     def put(self, key, value):
         assert key
+        self.delete(key)
         if self._allocate_space(key, value):
             self.items[key] = value
             return True
@@ -197,11 +302,145 @@ class LRUCache(object):
     def delete(self, key):
         assert key
         if key in self.items:
-            del self.items[key]
+            value = self.items.pop(key)
+            if self.max_size_bytes:
+                self.total_size -= self.get_entry_size(key, value)
+                assert self.total_size >= 0
             return True
         return False
 
 
+class CacheJournalHeadEntity(entities.BaseEntity):
+    """Head of a change journal; one per namespace and persistent entity kind.
+
+    The head holds the sequence number of the most recent change recorded and
+    the sequence number of the oldest change still retained. Changes are
+    stored as CacheJournalEntryEntity children of the head, so recording a
+    change is serialized by the head's entity group and sequence numbers are
+    assigned in commit order.
+    """
+
+    sequence = db.IntegerProperty(indexed=False, default=0)
+    first_sequence = db.IntegerProperty(indexed=False, default=1)
+
+
+class CacheJournalEntryEntity(entities.BaseEntity):
+    """One change in a change journal; entity id is its sequence number."""
+
+    changed_key = db.StringProperty(indexed=False)
+    op = db.StringProperty(indexed=False)
+    created_on = db.DateTimeProperty(auto_now_add=True, indexed=False)
+
+
+class CacheChangeJournal(object):
+    """Records and reads changes to persistent objects held in local caches.
+
+    Writers record the keys they put or delete; each process remembers the
+    last sequence number it has seen and evicts exactly the changed keys
+    when it syncs again, deletions included.
+    """
+
+    OP_PUT = 'put'
+    OP_DELETE = 'delete'
+    OP_FLUSH = 'flush'
+
+    @classmethod
+    def _head_key(cls, name, namespace=None):
+        return db.Key.from_path(
+            CacheJournalHeadEntity.kind(), name, namespace=namespace)
+
+    @classmethod
+    def _entry_key(cls, head_key, sequence):
+        return db.Key.from_path(
+            CacheJournalEntryEntity.kind(), sequence, parent=head_key)
+
+    @classmethod
+    @db.transactional(propagation=db.ALLOWED, xg=True)
+    def record(cls, name, keys, op, namespace=None):
+        """Records changes to keys in the journal of a namespace.
+
+        Joins the current transaction, if any, so changes are recorded
+        atomically with the writes that caused them. Otherwise, call this
+        only after the writes have been committed.
+
+        Args:
+            name: string. Name of the journal; kind of the persistent entity.
+            keys: list of strings. Cache keys of the changed objects.
+            op: string. Kind of change, OP_PUT or OP_DELETE.
+            namespace: string. Namespace of the changed objects; defaults to
+                the current namespace.
+        """
+        if not keys:
+            return
+        head_key = cls._head_key(name, namespace=namespace)
+        head = CacheJournalHeadEntity.get(head_key)
+        if not head:
+            head = CacheJournalHeadEntity(key=head_key)
+        if len(keys) > MAX_CACHE_JOURNAL_BATCH_SIZE:
+            keys, op = [None], cls.OP_FLUSH
+        to_put = [head]
+        for key in keys:
+            head.sequence += 1
+            to_put.append(CacheJournalEntryEntity(
+                key=cls._entry_key(head_key, head.sequence),
+                changed_key=key, op=op))
+        to_delete = []
+        while head.sequence - head.first_sequence >= MAX_CACHE_JOURNAL_ENTRIES:
+            to_delete.append(cls._entry_key(head_key, head.first_sequence))
+            head.first_sequence += 1
+        entities.put(to_put)
+        if to_delete:
+            entities.delete(to_delete)
+
+    @classmethod
+    def get_changes_since(cls, name, namespace, sequence):
+        """Gets changes recorded after a given sequence number.
+
+        In steady state, when nothing has changed, this costs a single get.
+
+        Args:
+            name: string. Name of the journal.
+            namespace: string. Namespace of the journal.
+            sequence: int. The last sequence number seen by the caller.
+        Returns:
+            A tuple of the sequence number of the most recent change seen and
+            the set of changed keys; the set is None if the changes since the
+            given sequence are no longer known and all objects must be
+            considered changed.
+        """
+        head_key = cls._head_key(name, namespace=namespace)
+        head = CacheJournalHeadEntity.get(head_key)
+        if not head or head.sequence <= sequence:
+            return sequence, set()
+        if sequence + 1 < head.first_sequence:
+            return head.sequence, None
+        query = CacheJournalEntryEntity.all(namespace=namespace).ancestor(
+            head_key)
+        if sequence:
+            query.filter('__key__ >', cls._entry_key(head_key, sequence))
+        last_sequence = head.sequence
+        changed_keys = set()
+        for entry in iter_all(query):
+            if entry.op == cls.OP_FLUSH:
+                return head.sequence, None
+            changed_keys.add(entry.changed_key)
+            last_sequence = max(last_sequence, entry.key().id())
+        return last_sequence, changed_keys
+
+    @classmethod
+    def get_last_sequence(cls, name, namespace):
+        head = CacheJournalHeadEntity.get(
+            cls._head_key(name, namespace=namespace))
+        return head.sequence if head else 0
+
+
+class ProcessScopedCacheJournalPositions(ProcessScopedSingleton):
+    """Last change journal sequence number seen by this process, per cache."""
+
+    def __init__(self):
+        self.positions = {}
+
+
 class NoopCacheConnection(object):
     """Connection to no-op cache that provides no caching."""
 
@@ -218,8 +457,9 @@ class NoopCacheConnection(object):
 class AbstractCacheEntry(object):
     """Object representation while in cache."""
 
-    # we don't track deletions; deleted item will hang around this long
-    CACHE_ENTRY_TTL_SEC = 5 * 60
+    # changes are tracked by CacheChangeJournal; this only bounds how long we
+    # serve objects changed by writers bypassing the journal, like ETL upload
+    CACHE_ENTRY_TTL_SEC = 60 * 60
 
     @classmethod
     def internalize(cls, unused_key, *args, **kwargs):
@@ -288,6 +528,10 @@ class AbstractCacheConnection(object):
             'gcb-models-%s-cache-expire' % name,
             'A number of times an object has expired from cache because it was '
             'too old.')
+        cls.CACHE_FLUSH = PerfCounter(
+            'gcb-models-%s-cache-flush' % name,
+            'A number of times all objects of a namespace were evicted from '
+            'cache because the changes made to them were no longer known.')
 
     @classmethod
     def make_key_prefix(cls, ns):
@@ -301,13 +545,24 @@ class AbstractCacheConnection(object):
     def is_enabled(cls):
         raise NotImplementedError()
 
+    @classmethod
+    def journal_name(cls):
+        return cls.PERSISTENT_ENTITY.kind()
+
+    @classmethod
+    def record_changes(
+        cls, keys, op=CacheChangeJournal.OP_PUT, namespace=None):
+        """Records changes to objects so all processes evict them."""
+        CacheChangeJournal.record(
+            cls.journal_name(), keys, op, namespace=namespace)
+
     @classmethod
     def new_connection(cls, *args, **kwargs):
         if not cls.is_enabled():
             return NoopCacheConnection()
         conn = cls(*args, **kwargs)
         # pylint: disable=protected-access
-        conn.apply_updates(conn._get_incremental_updates())
+        conn._sync_with_journal()
         return conn
 
     def __init__(self, namespace):
@@ -338,51 +593,51 @@ class AbstractCacheConnection(object):
                 self.cache.delete(_key)
                 continue
 
-    def _get_most_recent_updated_on(self):
-        """Get the most recent item cached. Datastore deletions are missed..."""
-        has_items = False
-        max_updated_on = datetime.datetime.fromtimestamp(0)
-        prefix = self.make_key_prefix(self.namespace)
-        for key, entry in self.cache.items.iteritems():
-            if not key.startswith(prefix):
-                continue
-            has_items = True
-            if not entry:
-                continue
-            updated_on = entry.updated_on()
-            if not updated_on:  # old entities may be missing this field
-                updated_on = datetime.datetime.fromtimestamp(0)
-            if updated_on > max_updated_on:
-                max_updated_on = updated_on
-        return has_items, max_updated_on
+    def _evict_namespace(self):
+        """Evicts all objects of this namespace; scans the entire cache."""
+        prefix = '%s:' % self.make_key_prefix(self.namespace)
+        for key in [key for key in self.cache.items if key.startswith(prefix)]:
+            self.cache.delete(key)
 
     def get_updates_when_empty(self):
         """Override this method to pre-load cache when it's completely empty."""
         return {}
 
-    def _get_incremental_updates(self):
-        """Gets a list of global changes older than the most recent item cached.
-
-        WARNING!!! We fetch the updates since the timestamp of the oldest item
-        we have cached so far. This will bring all objects that have changed or
-        were created since that time.
+    def _sync_with_journal(self):
+        """Evicts objects changed since this process last synced.
 
-        This will NOT bring the notifications about object deletions. Thus cache
-        will continue to serve deleted objects until they expire.
-
-        Returns:
-          an dict of {key: update} objects that represent recent updates
+        The first connection to a namespace in this process starts with an
+        empty cache for the namespace; later ones read the change journal
+        from the last sequence number seen, which costs a single get when
+        nothing has changed.
         """
-        has_items, updated_on = self._get_most_recent_updated_on()
-        if not has_items:
-            return self.get_updates_when_empty()
-        q = self.PERSISTENT_ENTITY.all()
-        if updated_on:
-            q.filter('updated_on > ', updated_on)
-        result = {
-            entity.key().name(): entity for entity in iter_all(q)}
-        self.CACHE_UPDATE_COUNT.inc(len(result.keys()))
-        return result
+        self.CACHE_RESYNC.inc()
+        positions = ProcessScopedCacheJournalPositions.instance().positions
+        position_key = self.make_key_prefix(self.namespace)
+        position = positions.get(position_key)
+        if position is None:
+            # Read the position before loading anything, so changes made while
+            # we load are seen on the next sync.
+            position = CacheChangeJournal.get_last_sequence(
+                self.journal_name(), self.namespace)
+            self._evict_namespace()
+            self.apply_updates(self.get_updates_when_empty())
+            positions[position_key] = position
+            return
+
+        position, changed_keys = CacheChangeJournal.get_changes_since(
+            self.journal_name(), self.namespace, position)
+        if changed_keys is None:
+            self.CACHE_FLUSH.inc()
+            self._evict_namespace()
+            self.apply_updates(self.get_updates_when_empty())
+        else:
+            self.CACHE_UPDATE_COUNT.inc(len(changed_keys))
+            for key in changed_keys:
+                _key = self.make_key(self.namespace, key)
+                if self.cache.delete(_key):
+                    self.CACHE_EVICT.inc()
+        positions[position_key] = position
 
     def put(self, key, *args):
         self.CACHE_PUT.inc()
@@ -471,6 +726,15 @@ class LRUCacheTests(unittest.TestCase):
         self.assertFalse(cache.contains('a'))
         self.assertTrue(cache.contains('b'))
 
+    def test_replace_and_delete_release_space(self):
+        cache = LRUCache(max_size_bytes=5000)
+        self.assertTrue(cache.put('a', bytearray(1000)))
+        size = cache.total_size
+        self.assertTrue(cache.put('a', bytearray(1000)))
+        self.assertEquals(size, cache.total_size)
+        self.assertTrue(cache.delete('a'))
+        self.assertEquals(0, cache.total_size)
+
     def test_max_item_size(self):
         cache = LRUCache(max_size_bytes=5000, max_item_size_bytes=1000)
         self.assertFalse(cache.put('a', bytearray(4500)))
@@ -534,10 +798,72 @@ class SingletonTests(unittest.TestCase):
         assert b is not d
 
 
+class SnapshotTests(unittest.TestCase):
+
+    def _make_value(self):
+        return {
+            'a': [1, 2, {'b': 'c'}], 'd': set(['e']), 'f': (3, [4]),
+            'g': datetime.datetime(2015, 1, 1), 'h': None}
+
+    def test_freeze_and_thaw(self):
+        value = self._make_value()
+        snapshot = freeze(value)
+        self.assertEquals(value, thaw(snapshot))
+        self.assertTrue(freeze(snapshot) is snapshot)
+        self.assertTrue(isinstance(thaw(snapshot)['a'], list))
+        self.assertTrue(isinstance(thaw(snapshot)['d'], set))
+
+        # snapshot does not share mutable state with its source
+        value['a'][2]['b'] = 'x'
+        self.assertEquals('c', snapshot['a'][2]['b'])
+
+    def test_frozen_snapshot_can_not_be_modified(self):
+        snapshot = freeze(self._make_value())
+        with self.assertRaises(TypeError):
+            snapshot['a'] = 1
+        with self.assertRaises(TypeError):
+            snapshot['a'][2]['b'] = 1
+        with self.assertRaises(TypeError):
+            snapshot.update({'a': 1})
+        with self.assertRaises(AttributeError):
+            snapshot['a'].append(1)
+        with self.assertRaises(AttributeError):
+            snapshot['d'].add(1)
+
+    def test_thawed_copy_is_private(self):
+        snapshot = freeze(self._make_value())
+        copy_1 = thaw(snapshot)
+        copy_1['a'][2]['b'] = 'x'
+        copy_1['f'][1].append(5)
+        self.assertEquals('c', thaw(snapshot)['a'][2]['b'])
+        self.assertEquals([4], thaw(snapshot)['f'][1])
+
+    def test_shallow_thawed_copy_shares_items(self):
+        snapshot = freeze(self._make_value())
+        shallow = shallow_thaw(snapshot)
+        shallow['h'] = 'x'
+        del shallow['d']
+        self.assertIs(snapshot['a'], shallow['a'])
+        self.assertRaises(TypeError, shallow['a'][2].__setitem__, 'b', 'x')
+        shallow['a'] = shallow_thaw(shallow['a'])
+        shallow['a'].append(5)
+        self.assertEquals(self._make_value(), thaw(snapshot))
+        self.assertEquals('plain', shallow_thaw('plain'))
+
+    def test_snapshot_pickles(self):
+        snapshot = freeze(self._make_value())
+        for protocol in [0, 2]:
+            restored = pickle.loads(pickle.dumps(snapshot, protocol))
+            self.assertTrue(isinstance(restored, FrozenDict))
+            self.assertTrue(isinstance(restored['a'], FrozenList))
+            self.assertEquals(thaw(snapshot), thaw(restored))
+            self.assertTrue(isinstance(copy.deepcopy(snapshot), FrozenDict))
+
+
 def run_all_unit_tests():
     """Runs all unit tests in this module."""
     suites_list = []
-    for test_class in [LRUCacheTests, SingletonTests]:
+    for test_class in [LRUCacheTests, SingletonTests, SnapshotTests]:
         suite = unittest.TestLoader().loadTestsFromTestCase(test_class)
         suites_list.append(suite)
     unittest.TextTestRunner().run(unittest.TestSuite(suites_list))
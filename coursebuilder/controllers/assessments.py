@@ -22,18 +22,58 @@ import logging
 from utils import BaseHandler
 from utils import HUMAN_READABLE_DATETIME_FORMAT
 
+from common import utils as common_utils
 from controllers import lessons
+from controllers import sites
+from models import counters
 from models import courses
 from models import models
 from models import review
 from models import student_work
 from models import transforms
 from models import utils
-from models.models import Student
+from models.config import ConfigProperty
 from models.models import StudentAnswersEntity
+from models.models import StudentAssessmentAnswersEntity
 from tools import verify
 
+from google.appengine.api import namespace_manager
 from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+CAN_DEFER_ASSESSMENT_PROGRESS = ConfigProperty(
+    'gcb_can_defer_assessment_progress', bool, (
+        'Whether or not to record the progress of a student, and to update '
+        'their final grade, in a task queued when they submit an assessment '
+        'rather than while they wait for the confirmation page. Deferring '
+        'makes submission faster when many students submit at once; the '
+        'progress of a student shows the assessment as completed once the '
+        'task has run.'), False)
+
+# Latencies of the steps of an assessment submission.
+SUBMIT_LATENCY = counters.LatencyPerfCounter(
+    'gcb-assessment-submit',
+    'Latency of a whole assessment submission')
+SUBMIT_TRANSACTION_LATENCY = counters.LatencyPerfCounter(
+    'gcb-assessment-submit-transaction',
+    'Latency of the transaction storing the answers and score of a student')
+SUBMIT_READ_LATENCY = counters.LatencyPerfCounter(
+    'gcb-assessment-submit-read',
+    'Latency of reading a student and their answers in the transaction')
+SUBMIT_WRITE_LATENCY = counters.LatencyPerfCounter(
+    'gcb-assessment-submit-write',
+    'Latency of writing a student and their answers in the transaction')
+SUBMIT_SUBMISSION_LATENCY = counters.LatencyPerfCounter(
+    'gcb-assessment-submit-submission',
+    'Latency of writing the submission and starting its review, if any')
+SUBMIT_PROGRESS_LATENCY = counters.LatencyPerfCounter(
+    'gcb-assessment-submit-progress',
+    'Latency of recording progress and final grade, or of queueing a task '
+    'to do so')
+SUBMIT_EVENT_LATENCY = counters.LatencyPerfCounter(
+    'gcb-assessment-submit-event',
+    'Latency of waiting for the submit-assessment event to be written, '
+    'after the response was made')
 
 
 def store_score(course, student, assessment_type, score):
@@ -65,45 +105,106 @@ class AnswerHandler(BaseHandler):
     # Find student entity and save answers
     @db.transactional(xg=True)
     def update_assessment_transaction(
-        self, email, assessment_type, new_answers, score):
+        self, student_key, user_id, assessment_type, new_answers, score,
+        answers_per_assessment=False):
         """Stores answer and updates user scores.
 
+        The student and their answers are read, and then written, with both
+        datastore calls in flight at once. Answers stored per assessment are
+        written without being read.
+
         Args:
-            email: the student's email address.
+            student_key: the key of the Student entity of the student.
+            user_id: the user_id of the student, which keys their answers.
             assessment_type: the title of the assessment.
             new_answers: the latest set of answers supplied by the student.
             score: the numerical assessment score.
+            answers_per_assessment: whether to store the answers in an entity
+                of their own, rather than in the one holding the answers of
+                the student to all assessments.
 
         Returns:
             the student instance.
         """
-        student = Student.get_enrolled_student_by_email(email)
         course = self.get_course()
 
+        with SUBMIT_READ_LATENCY.timer():
+            student_rpc = db.get_async(student_key)
+            answers_rpc = None
+            if not answers_per_assessment:
+                answers_rpc = db.get_async(db.Key.from_path(
+                    StudentAnswersEntity.kind(), user_id))
+            student = student_rpc.get_result()
+            answers = answers_rpc.get_result() if answers_rpc else None
+
         # It may be that old Student entities don't have user_id set; fix it.
         if not student.user_id:
-            student.user_id = self.get_user().user_id()
-
-        answers = StudentAnswersEntity.get_by_key_name(student.user_id)
-        if not answers:
-            answers = StudentAnswersEntity(key_name=student.user_id)
-        answers.updated_on = datetime.datetime.now()
+            student.user_id = user_id
 
-        utils.set_answer(answers, assessment_type, new_answers)
+        if answers_per_assessment:
+            answers = StudentAssessmentAnswersEntity.create(
+                user_id, assessment_type, new_answers)
+        else:
+            if not answers:
+                answers = StudentAnswersEntity(key_name=user_id)
+            answers.updated_on = datetime.datetime.now()
+            utils.set_answer(answers, assessment_type, new_answers)
 
         store_score(course, student, assessment_type, score)
 
-        student.put()
-        answers.put()
+        with SUBMIT_WRITE_LATENCY.timer():
+            rpcs = [student.put_async(), db.put_async(answers)]
+            for rpc in rpcs:
+                rpc.get_result()
 
-        # Also record the event, which is useful for tracking multiple
-        # submissions and history.
-        models.EventEntity.record(
-            'submit-assessment', self.get_user(), transforms.dumps({
+        return student
+
+    def _record_event_async(self, assessment_type, new_answers):
+        """Starts writing the submit-assessment event; returns its RPC.
+
+        The event, which is useful for tracking multiple submissions and
+        history, is not part of the transaction; it is written while the
+        response is made.
+        """
+        return models.EventEntity.record_all_async(
+            self.get_user(), [('submit-assessment', transforms.dumps({
                 'type': 'assessment-%s' % assessment_type,
-                'values': new_answers, 'location': 'AnswerHandler'}))
+                'values': new_answers, 'location': 'AnswerHandler'}))])
+
+    @classmethod
+    def _record_progress(
+        cls, course, student, assessment_type, update_final_grades):
+        """Records completion event in progress tracker."""
+        course.get_progress_tracker().put_assessment_completed(
+            student, assessment_type)
+        if update_final_grades:
+            course.update_final_grades(student)
 
-        return student
+    @classmethod
+    def _record_progress_task(
+        cls, namespace, student_key, assessment_type, update_final_grades):
+        with common_utils.Namespace(namespace):
+            app_context = sites.get_app_context_for_namespace(namespace)
+            if not app_context:
+                return
+            student = db.get(student_key)
+            if not student:
+                return
+            cls._record_progress(
+                courses.Course(None, app_context=app_context), student,
+                assessment_type, update_final_grades)
+
+    def _put_progress(
+        self, course, student, assessment_type, update_final_grades=False):
+        with SUBMIT_PROGRESS_LATENCY.timer():
+            if CAN_DEFER_ASSESSMENT_PROGRESS.value:
+                deferred.defer(
+                    AnswerHandler._record_progress_task,
+                    namespace_manager.get_namespace(), student.key(),
+                    assessment_type, update_final_grades)
+            else:
+                self._record_progress(
+                    course, student, assessment_type, update_final_grades)
 
     def get(self):
         """Handles GET requests.
@@ -116,9 +217,12 @@ class AnswerHandler(BaseHandler):
         """
         self.redirect('/course')
 
-    # pylint: disable=too-many-statements
     def post(self):
         """Handles POST requests."""
+        with SUBMIT_LATENCY.timer():
+            self._post()
+
+    def _post(self):
         student = self.personalize_page_and_get_enrolled()
         if not student:
             return
@@ -158,10 +262,25 @@ class AnswerHandler(BaseHandler):
             score = int(round(float(self.request.get('score'))))
 
         # Record assessment transaction.
-        student = self.update_assessment_transaction(
-            student.key().name(), assessment_type, answers, score)
-
-        if grader == courses.HUMAN_GRADER:
+        with SUBMIT_TRANSACTION_LATENCY.timer():
+            student = self.update_assessment_transaction(
+                student.key(), self.get_user().user_id(), assessment_type,
+                answers, score, answers_per_assessment=(
+                    models.CAN_STORE_ANSWERS_PER_ASSESSMENT.value))
+
+        event_rpc = self._record_event_async(assessment_type, answers)
+        try:
+            self._respond(
+                course, unit, student, assessment_type, answers, score)
+        finally:
+            if event_rpc:
+                with SUBMIT_EVENT_LATENCY.timer():
+                    event_rpc.get_result()
+
+    def _respond(
+        self, course, unit, student, assessment_type, answers, score):
+        """Writes the submission, records progress and renders the result."""
+        if unit.workflow.get_grader() == courses.HUMAN_GRADER:
             rp = course.get_reviews_processor()
 
             # Guard against duplicate submissions of a human-graded assessment.
@@ -183,13 +302,12 @@ class AnswerHandler(BaseHandler):
                     self.render('error.html')
                     return
 
-                submission_key = student_work.Submission.write(
-                    unit.unit_id, student.get_key(), answers)
-                rp.start_review_process_for(
-                    unit.unit_id, submission_key, student.get_key())
-                # Record completion event in progress tracker.
-                course.get_progress_tracker().put_assessment_completed(
-                    student, assessment_type)
+                with SUBMIT_SUBMISSION_LATENCY.timer():
+                    submission_key = student_work.Submission.write(
+                        unit.unit_id, student.get_key(), answers)
+                    rp.start_review_process_for(
+                        unit.unit_id, submission_key, student.get_key())
+                self._put_progress(course, student, assessment_type)
 
             self.template_value['previously_submitted'] = previously_submitted
 
@@ -203,15 +321,13 @@ class AnswerHandler(BaseHandler):
             self.render('reviewed_assessment_confirmation.html')
             return
         else:
-            # Record completion event in progress tracker.
-            course.get_progress_tracker().put_assessment_completed(
-                student, assessment_type)
-
             # Save the submission in the datastore, overwriting the earlier
             # version if it exists.
-            submission_key = student_work.Submission.write(
-                unit.unit_id, student.get_key(), answers)
-            course.update_final_grades(student)
+            with SUBMIT_SUBMISSION_LATENCY.timer():
+                student_work.Submission.write(
+                    unit.unit_id, student.get_key(), answers)
+            self._put_progress(
+                course, student, assessment_type, update_final_grades=True)
 
             parent_unit = course.get_parent_unit(unit.unit_id)
             if parent_unit:
@@ -40,6 +40,7 @@ from models import transforms
 from models.counters import PerfCounter
 from models.models import Student
 from models.models import StudentProfileDAO
+from models.progress import ProgressDocument
 from models.review import ReviewUtils
 from models.student_work import StudentWorkUtils
 from modules.review import domain
@@ -55,6 +56,10 @@ COURSE_EVENTS_RECORDED = PerfCounter(
     'gcb-course-events-recorded',
     'A number of activity/assessment events recorded in a datastore.')
 
+COURSE_EVENT_BATCHES_RECEIVED = PerfCounter(
+    'gcb-course-event-batches-received',
+    'A number of batches of events received by the server.')
+
 UNIT_PAGE_TYPE = 'unit'
 ACTIVITY_PAGE_TYPE = 'activity'
 ASSESSMENT_PAGE_TYPE = 'assessment'
@@ -230,8 +235,10 @@ def add_course_outline_to_template(handler, student):
     _tuples = []
     units = handler.get_track_matching_student(student)
     units = filter_assessments_used_within_units(units)
-    progress = _tracker.get_or_create_progress(
-          student) if is_progress_recorded(handler, student) else None
+    progress = None
+    if is_progress_recorded(handler, student):
+        # Decode once for all the units and lessons in the outline.
+        progress = ProgressDocument(_tracker.get_or_create_progress(student))
     for _unit in units:
         _lessons = handler.get_lessons(_unit.unit_id)
         _lesson_progress = None
@@ -260,7 +267,9 @@ class CourseHandler(BaseHandler):
     @classmethod
     def get_child_routes(cls):
         """Add child handlers for REST."""
-        return [('/rest/events', EventsRESTHandler)]
+        return [
+            ('/rest/events', EventsRESTHandler),
+            ('/rest/events/batch', EventsBatchRESTHandler)]
 
     def get(self):
         """Handles GET requests."""
@@ -278,7 +287,8 @@ class CourseHandler(BaseHandler):
                     student = TRANSIENT_STUDENT
 
             if (student.is_transient and
-                not self.app_context.get_environ()['course']['browsable']):
+                not self.app_context.get_environ(frozen=True)['course'][
+                    'browsable']):
                 self.redirect('/preview')
                 return
 
@@ -304,7 +314,7 @@ class CourseHandler(BaseHandler):
                 profile = StudentProfileDAO.get_profile_by_user_id(
                     user.user_id())
                 additional_registration_fields = self.app_context.get_environ(
-                    )['reg_form']['additional_registration_fields']
+                    frozen=True)['reg_form']['additional_registration_fields']
                 if profile is not None and not additional_registration_fields:
                     self.template_value['show_registration_page'] = False
                     self.template_value['register_xsrf_token'] = (
@@ -312,7 +322,7 @@ class CourseHandler(BaseHandler):
 
             self.template_value['transient_student'] = student.is_transient
             self.template_value['progress'] = tracker.get_unit_progress(student)
-            course = self.app_context.get_environ()['course']
+            course = self.app_context.get_environ(frozen=True)['course']
             self.template_value['video_exists'] = bool(
                 'main_video' in course and
                 'url' in course['main_video'] and
@@ -1242,11 +1252,9 @@ class EventsRESTHandler(BaseRESTHandler):
         self.error(404)
         return
 
-    def _add_request_facts(self, payload_json):
-        payload_dict = transforms.loads(payload_json)
-        if 'loc' not in payload_dict:
-            payload_dict['loc'] = {}
-        loc = payload_dict['loc']
+    def _get_request_facts(self):
+        """Gets facts about the request to add to the payloads of events."""
+        loc = {}
         loc['locale'] = self.get_locale_for(self.request, self.app_context)
         loc['language'] = self.request.headers.get('Accept-Language')
         loc['country'] = self.request.headers.get('X-AppEngine-Country')
@@ -1257,22 +1265,37 @@ class EventsRESTHandler(BaseRESTHandler):
             latitude, longitude = lat_long.split(',')
             loc['lat'] = float(latitude)
             loc['long'] = float(longitude)
-        user_agent = self.request.headers.get('User-Agent')
+        return loc, self.request.headers.get('User-Agent')
+
+    def _add_request_facts(self, payload_dict, request_facts):
+        """Adds request facts to the payload of an event; returns its JSON."""
+        loc_facts, user_agent = request_facts
+        if 'loc' not in payload_dict:
+            payload_dict['loc'] = {}
+        payload_dict['loc'].update(loc_facts)
         if user_agent:
             payload_dict['user_agent'] = user_agent
         payload_json = transforms.dumps(payload_dict).lstrip(
             models.transforms.JSON_XSSI_PREFIX)
         return payload_json
 
+    def _can_persist_events(self):
+        return (
+            CAN_PERSIST_ACTIVITY_EVENTS.value or
+            CAN_PERSIST_PAGE_EVENTS.value or
+            CAN_PERSIST_TAG_EVENTS.value)
+
+    def _can_buffer_events(self):
+        return (
+            models.CAN_BUFFER_EVENTS.value and
+            self.app_context.get_environ(frozen=True)['course'].get(
+                'buffer_events', False))
+
     def post(self):
         """Receives event and puts it into datastore."""
 
         COURSE_EVENTS_RECEIVED.inc()
-        can = (
-            CAN_PERSIST_ACTIVITY_EVENTS.value or
-            CAN_PERSIST_PAGE_EVENTS.value or
-            CAN_PERSIST_TAG_EVENTS.value)
-        if not can:
+        if not self._can_persist_events():
             return
 
         request = transforms.loads(self.request.get('request'))
@@ -1284,22 +1307,27 @@ class EventsRESTHandler(BaseRESTHandler):
             return
 
         source = request.get('source')
-        payload_json = request.get('payload')
-        payload_json = self._add_request_facts(payload_json)
-        models.EventEntity.record(source, user, payload_json)
+        payload = transforms.loads(request.get('payload'))
+        payload_json = self._add_request_facts(
+            payload, self._get_request_facts())
+        models.EventEntity.record(
+            source, user, payload_json, buffered=self._can_buffer_events())
         COURSE_EVENTS_RECORDED.inc()
 
-        self.process_event(user, source, payload_json)
+        student = models.Student.get_enrolled_student_by_email(user.email())
+        self.process_event(student, source, payload)
 
-    def process_event(self, user, source, payload_json):
-        """Processes an event after it has been recorded in the event stream."""
+    def process_event(self, student, source, payload):
+        """Processes an event after it has been recorded in the event stream.
 
-        student = models.Student.get_enrolled_student_by_email(user.email())
+        Args:
+          student: the enrolled Student who triggered the event, or None
+          source: the source of the event
+          payload: the dict of the payload of the event, with request facts
+        """
         if not student:
             return
 
-        payload = transforms.loads(payload_json)
-
         if 'location' not in payload:
             return
 
@@ -1332,3 +1360,86 @@ class EventsRESTHandler(BaseRESTHandler):
                 not lesson.manual_progress):
                 self.get_course().get_progress_tracker().put_html_completed(
                     student, unit_id, lesson_id)
+
+
+class EventsBatchRESTHandler(EventsRESTHandler):
+    """Provides REST API for recording a batch of events at once.
+
+    The request is the JSON of a dict with an 'xsrf_token' and a list of
+    'events', each a dict of 'source' and 'payload'; the payload is a dict or
+    its JSON. All events are put with one datastore call and progress they
+    make is put once for the whole batch. A batch with a malformed event is
+    rejected as a whole.
+    """
+
+    MAX_EVENTS_PER_BATCH = 100
+
+    def _parse_event(self, event):
+        """Gets the source and the payload dict of an event; None if bad."""
+        if not isinstance(event, dict):
+            return None
+        source = event.get('source')
+        payload = event.get('payload')
+        if isinstance(payload, basestring):
+            try:
+                payload = transforms.loads(payload)
+            except ValueError:
+                return None
+        if not isinstance(source, basestring) or not isinstance(payload, dict):
+            return None
+        return source, payload
+
+    def post(self):
+        """Receives events and puts them into datastore."""
+
+        COURSE_EVENT_BATCHES_RECEIVED.inc()
+        if not self._can_persist_events():
+            return
+
+        request = transforms.loads(self.request.get('request'))
+        if not self.assert_xsrf_token_or_fail(request, 'event-post', {}):
+            return
+
+        events = request.get('events') or []
+        if not isinstance(events, list):
+            transforms.send_json_response(
+                self, 400, 'Events must be sent as a list.')
+            return
+        COURSE_EVENTS_RECEIVED.inc(len(events))
+        if len(events) > self.MAX_EVENTS_PER_BATCH:
+            transforms.send_json_response(
+                self, 400, 'At most %s events may be sent at once.' % (
+                    self.MAX_EVENTS_PER_BATCH))
+            return
+
+        sources_and_payloads = [self._parse_event(event) for event in events]
+        if None in sources_and_payloads:
+            transforms.send_json_response(
+                self, 400, 'Each event must have a source and a payload dict.')
+            return
+
+        user = self.get_user()
+        if not user:
+            return
+
+        request_facts = self._get_request_facts()
+        sources_and_data = [
+            (source, self._add_request_facts(payload, request_facts))
+            for source, payload in sources_and_payloads]
+        rpc = models.EventEntity.record_all_async(
+            user, sources_and_data, buffered=self._can_buffer_events())
+
+        student = models.Student.get_enrolled_student_by_email(user.email())
+        if student:
+            tracker = self.get_course().get_progress_tracker()
+            tracker.begin_batch()
+            try:
+                for source, payload in sources_and_payloads:
+                    self.process_event(student, source, payload)
+                tracker.put_batch()
+            finally:
+                tracker.end_batch()
+
+        if rpc:
+            rpc.get_result()
+        COURSE_EVENTS_RECORDED.inc(len(events))
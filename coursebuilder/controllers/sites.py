@@ -104,6 +104,9 @@ not hosting multiple courses, your course will run in a default namespace
 Good luck!
 """
 
+import calendar
+import datetime
+import email.utils
 import logging
 import mimetypes
 import os
@@ -112,6 +115,7 @@ import re
 import threading
 import traceback
 import urlparse
+import uuid
 import zipfile
 
 import utils
@@ -125,6 +129,7 @@ from common import users
 from models import models
 from models import custom_modules
 from models import transforms
+from models import vfs
 from models.config import ConfigProperty
 from models.config import ConfigPropertyEntity
 from models.config import Registry
@@ -168,6 +173,10 @@ SITE_TYPE_COURSE = 'course'
 DEFAULT_CACHE_CONTROL_MAX_AGE = 600
 DEFAULT_CACHE_CONTROL_PUBLIC = 'public'
 
+# max number of byte ranges served in one response; Range headers asking for
+# more are ignored and the entire file is served instead
+MAX_BYTE_RANGES_PER_REQUEST = 16
+
 # default HTTP headers for dynamic responses
 DEFAULT_EXPIRY_DATE = 'Mon, 01 Jan 1990 00:00:00 GMT'
 DEFAULT_PRAGMA = 'no-cache'
@@ -313,6 +322,68 @@ def set_static_resource_cache_control(handler):
     handler.response.cache_control.max_age = DEFAULT_CACHE_CONTROL_MAX_AGE
 
 
+def format_http_date(value):
+    """Formats naive UTC datetime as an HTTP date, like in Last-Modified."""
+    return email.utils.formatdate(
+        calendar.timegm(value.utctimetuple()), usegmt=True)
+
+
+def parse_http_date(value):
+    """Parses HTTP date into seconds since the epoch; None if malformed."""
+    parsed = email.utils.parsedate_tz(value) if value else None
+    if not parsed:
+        return None
+    return email.utils.mktime_tz(parsed)
+
+
+def parse_byte_ranges(header, size):
+    """Parses the value of an HTTP Range header.
+
+    Args:
+        header: string. The value of the Range header; may be None.
+        size: int. The size of the requested file in bytes.
+    Returns:
+        None if there is no header or it is malformed, in which case the
+        header must be ignored. Otherwise a list of (first, last) tuples of
+        inclusive byte positions that are satisfiable for this file; the list
+        is empty if none of the requested ranges are satisfiable.
+    """
+    if not header:
+        return None
+    units, _, specs = header.partition('=')
+    if units.strip().lower() != 'bytes':
+        return None
+    ranges = []
+    for spec in specs.split(','):
+        spec = spec.strip()
+        if not spec:
+            continue
+        first, separator, last = spec.partition('-')
+        first = first.strip()
+        last = last.strip()
+        if not separator or not (first or last):
+            return None
+        try:
+            if not first:
+                suffix_length = int(last)
+                if suffix_length and size:
+                    ranges.append((max(size - suffix_length, 0), size - 1))
+                continue
+            first = int(first)
+            last = int(last) if last else None
+        except ValueError:
+            return None
+        if first < 0 or (last is not None and last < first):
+            return None
+        if first < size:
+            if last is None or last >= size:
+                last = size - 1
+            ranges.append((first, last))
+    if not specs.strip() or len(ranges) > MAX_BYTE_RANGES_PER_REQUEST:
+        return None
+    return ranges
+
+
 def set_default_response_headers(handler):
     """Sets the default headers for outgoing responses."""
 
@@ -479,26 +550,114 @@ class AssetHandler(utils.BaseHandler):
             return default
         return guess
 
-    def _can_view(self, fs, stream):
-        """Checks if current user can view stream."""
-        public = not fs.is_draft(stream)
+    def _can_view(self, stat):
+        """Checks if current user can view file."""
+        public = not stat.is_draft
         return public or Roles.is_course_admin(self.app_context)
 
+    def _is_not_modified(self, stat):
+        """Checks whether the client's cached copy of the file is current."""
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            if not stat.etag:
+                return False
+            etags = [etag.strip() for etag in if_none_match.split(',')]
+            return (
+                '*' in etags or stat.etag in etags or
+                'W/' + stat.etag in etags)
+        if_modified_since = parse_http_date(
+            self.request.headers.get('If-Modified-Since'))
+        if if_modified_since is None or not stat.updated_on:
+            return False
+        return (
+            calendar.timegm(stat.updated_on.utctimetuple()) <=
+            if_modified_since)
+
+    def _get_byte_ranges(self, stat):
+        """Gets byte ranges requested by the client; None means entire file."""
+        if stat.size is None:
+            return None
+        if_range = self.request.headers.get('If-Range')
+        if if_range and if_range.strip() != stat.etag:
+            return None
+        return parse_byte_ranges(self.request.headers.get('Range'), stat.size)
+
+    def _iter_byte_range(self, first, last):
+        """Yields the bytes of file from first to last inclusive."""
+        stream = self.app_context.fs.open(self.filename)
+        offset = 0
+        for shard in vfs.iter_stream_shards(stream):
+            end = offset + len(shard)
+            if end > first:
+                yield shard[max(first - offset, 0):last + 1 - offset]
+            offset = end
+            if offset > last:
+                break
+
+    def _write_byte_ranges(self, stat, ranges, mime_type):
+        self.response.set_status(206)
+        if len(ranges) == 1:
+            first, last = ranges[0]
+            self.response.headers['Content-Type'] = mime_type
+            self.response.headers['Content-Range'] = 'bytes %d-%d/%d' % (
+                first, last, stat.size)
+            for data in self._iter_byte_range(first, last):
+                self.response.write(data)
+            return
+
+        boundary = uuid.uuid4().hex
+        self.response.headers['Content-Type'] = (
+            'multipart/byteranges; boundary=%s' % boundary)
+        for first, last in ranges:
+            self.response.write(
+                '\r\n--%s\r\nContent-Type: %s\r\n'
+                'Content-Range: bytes %d-%d/%d\r\n\r\n' % (
+                    boundary, mime_type, first, last, stat.size))
+            for data in self._iter_byte_range(first, last):
+                self.response.write(data)
+        self.response.write('\r\n--%s--\r\n' % boundary)
+
     def get(self):
         """Handles GET requests."""
         models.MemcacheManager.begin_readonly()
         try:
-            stream = self.app_context.fs.open(self.filename)
-            if not stream:
+            stat = self.app_context.fs.stat(self.filename)
+            if not stat:
                 self.error(404)
                 return
-            if not self._can_view(self.app_context.fs, stream):
+            if not self._can_view(stat):
                 self.error(403)
                 return
             set_static_resource_cache_control(self)
-            self.response.headers['Content-Type'] = self.get_mime_type(
-                self.filename)
-            self.response.write(stream.read())
+            if stat.etag:
+                self.response.headers['ETag'] = stat.etag
+            if stat.updated_on:
+                self.response.headers['Last-Modified'] = format_http_date(
+                    stat.updated_on)
+            if self._is_not_modified(stat):
+                self.response.set_status(304)
+                return
+
+            mime_type = self.get_mime_type(self.filename)
+            ranges = self._get_byte_ranges(stat)
+            if ranges is not None:
+                if not ranges:
+                    self.response.set_status(416)
+                    self.response.headers['Content-Range'] = (
+                        'bytes */%d' % stat.size)
+                    return
+                self._write_byte_ranges(stat, ranges, mime_type)
+                return
+
+            stream = self.app_context.fs.open(self.filename)
+            if not stream:
+                self.error(404)
+                return
+            if stat.size is not None:
+                self.response.headers['Accept-Ranges'] = 'bytes'
+            self.response.headers['Content-Type'] = mime_type
+            for shard in vfs.iter_stream_shards(stream):
+                self.response.write(shard)
         finally:
             models.MemcacheManager.end_readonly()
 
@@ -707,12 +866,12 @@ class ApplicationContext(object):
 
     @property
     def now_available(self):
-        course = self.get_environ().get('course')
+        course = self.get_environ(frozen=True).get('course')
         return course and course.get('now_available')
 
     @property
     def whitelist(self):
-        course = self.get_environ().get('course')
+        course = self.get_environ(frozen=True).get('course')
         return '' if not course else course.get('whitelist', '')
 
     def set_current_locale(self, locale):
@@ -730,14 +889,14 @@ class ApplicationContext(object):
 
     @property
     def default_locale(self):
-        course_settings = self.get_environ().get('course')
+        course_settings = self.get_environ(frozen=True).get('course')
         if not course_settings:
             return None
         return course_settings.get('locale')
 
     def get_title(self):
         try:
-            return self.get_environ()['course']['title']
+            return self.get_environ(frozen=True)['course']['title']
         except KeyError:
             return 'UNTITLED'
 
@@ -756,8 +915,8 @@ class ApplicationContext(object):
         debug('Config file: %s' % filename)
         return filename
 
-    def get_environ(self):
-        return Course.get_environ(self)
+    def get_environ(self, frozen=False):
+        return Course.get_environ(self, frozen=frozen)
 
     def get_home(self):
         """Returns absolute location of a course folder."""
@@ -813,7 +972,7 @@ class ApplicationContext(object):
         return custom_modules.can_pick_all_locales(self)
 
     def get_allowed_locales(self):
-        environ = self.get_environ()
+        environ = self.get_environ(frozen=True)
         default_locale = environ['course'].get('locale')
         extra_locales = environ.get('extra_locales', [])
         return [default_locale] + [
@@ -826,7 +985,7 @@ class ApplicationContext(object):
     def get_all_locales(self):
         """Returns _all_ locales, whether enabled or not.  Dashboard only."""
 
-        environ = self.get_environ()
+        environ = self.get_environ(frozen=True)
         default_locale = self.default_locale
         extra_locales = environ.get('extra_locales', [])
         return [default_locale] + [loc['locale'] for loc in extra_locales]
@@ -1359,6 +1518,7 @@ class ApplicationRequestHandler(webapp2.RequestHandler):
                     self.after_method(handler, verb, path)
         finally:
             count_stats(self)
+            models.EventBuffer.instance().flush_aged()
             unset_path_info()
 
     def _error_404(self, path):
@@ -1771,6 +1931,47 @@ def test_path_construction():
                 os.path.normpath('/a/b/d'))
 
 
+def test_parse_byte_ranges():
+    """Checks that parse_byte_ranges() works correctly."""
+
+    # Header is absent or malformed; entire file is served.
+    assert parse_byte_ranges(None, 100) is None
+    assert parse_byte_ranges('', 100) is None
+    assert parse_byte_ranges('items=0-10', 100) is None
+    assert parse_byte_ranges('bytes=', 100) is None
+    assert parse_byte_ranges('bytes=10', 100) is None
+    assert parse_byte_ranges('bytes=-', 100) is None
+    assert parse_byte_ranges('bytes=a-b', 100) is None
+    assert parse_byte_ranges('bytes=20-10', 100) is None
+    assert parse_byte_ranges('bytes=' + ','.join(
+        ['0-0'] * (MAX_BYTE_RANGES_PER_REQUEST + 1)), 100) is None
+
+    # Satisfiable ranges.
+    assert parse_byte_ranges('bytes=0-9', 100) == [(0, 9)]
+    assert parse_byte_ranges('bytes=90-', 100) == [(90, 99)]
+    assert parse_byte_ranges('bytes=90-200', 100) == [(90, 99)]
+    assert parse_byte_ranges('bytes=-10', 100) == [(90, 99)]
+    assert parse_byte_ranges('bytes=-200', 100) == [(0, 99)]
+    assert parse_byte_ranges('Bytes = 0-0, 5-6 ,-1', 100) == [
+        (0, 0), (5, 6), (99, 99)]
+
+    # Unsatisfiable ranges.
+    assert parse_byte_ranges('bytes=100-', 100) == []
+    assert parse_byte_ranges('bytes=-0', 100) == []
+    assert parse_byte_ranges('bytes=0-10', 0) == []
+    assert parse_byte_ranges('bytes=200-300,0-1', 100) == [(0, 1)]
+
+
+def test_http_dates():
+    """Checks that HTTP dates survive a round trip."""
+    value = datetime.datetime(2015, 1, 2, 3, 4, 5)
+    assert format_http_date(value) == 'Fri, 02 Jan 2015 03:04:05 GMT'
+    assert parse_http_date(format_http_date(value)) == calendar.timegm(
+        value.utctimetuple())
+    assert parse_http_date('not a date') is None
+    assert parse_http_date(None) is None
+
+
 def run_all_unit_tests():
     assert not ApplicationRequestHandler.CAN_IMPERSONATE
 
@@ -1785,6 +1986,8 @@ def run_all_unit_tests():
     test_url_to_handler_mapping_for_course_type()
     test_path_construction()
     test_rule_validations()
+    test_parse_byte_ranges()
+    test_http_dates()
 
 if __name__ == '__main__':
     run_all_unit_tests()
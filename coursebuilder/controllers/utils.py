@@ -764,7 +764,7 @@ class BaseHandler(CourseHandler):
 
         if hasattr(self, 'app_context'):
             self.template_value['can_register'] = self.app_context.get_environ(
-                )['reg_form']['can_register']
+                frozen=True)['reg_form']['can_register']
 
         if user:
             email = user.email()
@@ -806,7 +806,8 @@ class BaseHandler(CourseHandler):
 
         if student.is_transient:
             if supports_transient_student and (
-                    self.app_context.get_environ()['course']['browsable']):
+                    self.app_context.get_environ(frozen=True)['course'][
+                        'browsable']):
                 return TRANSIENT_STUDENT
             elif user is None:
                 self.redirect(
@@ -915,18 +916,19 @@ class PreviewHandler(BaseHandler):
         # If the course is browsable, or the student is logged in and
         # registered, redirect to the main course page.
         if ((student and not student.is_transient) or
-            self.app_context.get_environ()['course']['browsable']):
+            self.app_context.get_environ(frozen=True)['course'][
+                'browsable']):
             self.redirect('/course')
             return
 
         self.template_value['transient_student'] = True
         self.template_value['can_register'] = self.app_context.get_environ(
-            )['reg_form']['can_register']
+            frozen=True)['reg_form']['can_register']
         self.template_value['navbar'] = {'course': True}
         self.template_value['units'] = self.get_units()
         self.template_value['show_registration_page'] = True
 
-        course = self.app_context.get_environ()['course']
+        course = self.app_context.get_environ(frozen=True)['course']
         self.template_value['video_exists'] = bool(
             'main_video' in course and
             'url' in course['main_video'] and
@@ -939,7 +941,7 @@ class PreviewHandler(BaseHandler):
         if user:
             profile = StudentProfileDAO.get_profile_by_user_id(user.user_id())
             additional_registration_fields = self.app_context.get_environ(
-                )['reg_form']['additional_registration_fields']
+                frozen=True)['reg_form']['additional_registration_fields']
             if profile is not None and not additional_registration_fields:
                 self.template_value['show_registration_page'] = False
                 self.template_value['register_xsrf_token'] = (
@@ -964,7 +966,7 @@ class RegisterHandler(BaseHandler):
             return
 
         can_register = self.app_context.get_environ(
-            )['reg_form']['can_register']
+            frozen=True)['reg_form']['can_register']
         if not can_register:
             self.redirect('/course#registration_closed')
             return
@@ -994,7 +996,7 @@ class RegisterHandler(BaseHandler):
             return
 
         can_register = self.app_context.get_environ(
-            )['reg_form']['can_register']
+            frozen=True)['reg_form']['can_register']
         if not can_register:
             self.redirect('/course#registration_closed')
             return
@@ -28,6 +28,9 @@ from controllers import sites
 from models import analytics
 from models import custom_modules
 from models import data_sources
+from models import models
+
+from google.appengine.api import runtime
 
 
 # Set the default users service before we do anything else.
@@ -42,6 +45,9 @@ custom_modules.register_core_module(
     analytics.get_namespaced_handlers() +
     data_sources.get_namespaced_handlers())
 
+# Hand over buffered events to tasks before the instance goes away.
+runtime.set_shutdown_hook(lambda: models.EventBuffer.instance().flush())
+
 # Collect routes (URL-matching regexes -> handler classes) for modules.
 global_routes, namespaced_routes = custom_modules.Registry.get_all_routes()
 
@@ -16,6 +16,12 @@
 
 __author__ = 'Pavel Simakov (psimakov@google.com)'
 
+import collections
+import contextlib
+import math
+import threading
+import time
+
 
 def incr_counter_global_value(unused_name, unused_delta):
     """Hook method for global aggregation."""
@@ -73,6 +79,70 @@ class PerfCounter(object):
         return get_counter_global_value(self.name)
 
 
+class _PercentilePerfCounter(PerfCounter):
+    """Reports a percentile of the latencies kept by a LatencyPerfCounter."""
+
+    def __init__(self, name, doc_string, latency_counter, percentile):
+        super(_PercentilePerfCounter, self).__init__(name, doc_string)
+        self._latency_counter = latency_counter
+        self._percentile = percentile
+
+    def _clear(self):
+        super(_PercentilePerfCounter, self)._clear()
+        self._latency_counter.clear_samples()
+
+    def poll_value(self):
+        return self._latency_counter.get_percentile(self._percentile)
+
+
+class LatencyPerfCounter(object):
+    """Keeps the latest latencies of an operation in this process.
+
+    Plain counters only add up, which hides the slow tail of an operation
+    behind its average. This keeps the latest MAX_SAMPLES latencies and
+    registers two counters, NAME-p50-millis and NAME-p99-millis, whose values
+    are the median and the 99th percentile of these in milliseconds.
+    """
+
+    MAX_SAMPLES = 1000
+
+    def __init__(self, name, doc_string):
+        self._lock = threading.Lock()
+        self._samples = collections.deque(maxlen=self.MAX_SAMPLES)
+        self.p50 = _PercentilePerfCounter(
+            '%s-p50-millis' % name, '%s; the median, in ms.' % doc_string,
+            self, 50)
+        self.p99 = _PercentilePerfCounter(
+            '%s-p99-millis' % name,
+            '%s; the 99th percentile, in ms.' % doc_string, self, 99)
+
+    def record(self, millis):
+        with self._lock:
+            self._samples.append(millis)
+
+    def clear_samples(self):
+        with self._lock:
+            self._samples.clear()
+
+    def get_percentile(self, percentile):
+        """Returns the nearest-rank percentile of the samples, or None."""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        rank = int(math.ceil(len(samples) * percentile / 100.0))
+        return samples[max(rank, 1) - 1]
+
+    @contextlib.contextmanager
+    def timer(self):
+        """Records the latency of the body of a with statement."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(int((time.time() - start) * 1000))
+
+
 class Registry(object):
     """Holds all registered counters."""
     registered = {}
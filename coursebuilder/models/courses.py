@@ -19,12 +19,17 @@ __author__ = 'Pavel Simakov (psimakov@google.com)'
 import collections
 import copy
 from datetime import datetime
+import hashlib
 import logging
 import os
 import pickle
 import re
+import struct
 import sys
 import threading
+import time
+import uuid
+import zlib
 import config
 import custom_units
 
@@ -37,6 +42,7 @@ import vfs
 import yaml
 
 import appengine_config
+from common import caching
 from common import locales
 from common import safe_dom
 from common import schema_fields
@@ -46,6 +52,7 @@ from common.utils import Namespace
 import models
 from models import MemcacheManager
 from models import QuestionImporter
+from models.counters import PerfCounter
 from tools import verify
 
 from google.appengine.api import namespace_manager
@@ -311,13 +318,23 @@ def has_only_new_style_activities(course):
     return not has_at_least_one_old_style_activity(course)
 
 
+# Each shard of a cached object in memcache is a header followed by a slice of
+# the zlib-compressed memento. The header holds the format version, an id of
+# the save() call that wrote the shard, the shard index, the number of shards
+# and an MD5 digest of the entire compressed memento; a set of shards written
+# by different save() calls is detected and is not unpickled.
+_MEMENTO_SHARD_FORMAT_VERSION = 1
+_MEMENTO_SHARD_HEADER = struct.Struct('!B16sHH16s')
+_MEMENTO_SHARD_PAYLOAD_SIZE = models.MEMCACHE_MAX - _MEMENTO_SHARD_HEADER.size
+
+
 class AbstractCachedObject(object):
     """Abstract serializable versioned object that can stored in memcache."""
 
     @classmethod
     def _max_size(cls):
-        # By default, max out at one cache record.
-        return models.MEMCACHE_MAX
+        """Max size of the compressed memento; by default, one cache record."""
+        return _MEMENTO_SHARD_PAYLOAD_SIZE
 
     @classmethod
     def _make_keys(cls):
@@ -329,10 +346,11 @@ class AbstractCachedObject(object):
 
         # Generate the maximum number of cache shard keys indicated by the max
         # allowed size of the derived type.  Not all of these will necessarily
-        # be used, but the number of shards is typically very small (max of 4)
+        # be used, but the number of shards is typically very small (max of 8)
         # so pre-generating these is not a big burden.
         num_shards = (
-            (cls._max_size() + models.MEMCACHE_MAX - 1) // models.MEMCACHE_MAX)
+            (cls._max_size() + _MEMENTO_SHARD_PAYLOAD_SIZE - 1) //
+            _MEMENTO_SHARD_PAYLOAD_SIZE)
         return [
             'course:model:pickle:%s:%s:%d' % (
                 cls.VERSION, os.environ.get('CURRENT_VERSION_ID'), shard)
@@ -353,30 +371,61 @@ class AbstractCachedObject(object):
         """Creates serializable memento from instance."""
         raise Exception('Not implemented')
 
+    @classmethod
+    def _join_shards(cls, shard_keys, shards):
+        """Joins and decompresses shards written by the same save() call.
+
+        Args:
+            shard_keys: a list of all shard keys
+            shards: a dict of shards found in memcache keyed by key
+        Returns:
+            serialized memento or None if shards are missing or inconsistent
+        """
+        shard_0 = shards.get(shard_keys[0])
+        if not shard_0:
+            return None
+        _, generation, _, num_shards, digest = (
+            _MEMENTO_SHARD_HEADER.unpack_from(shard_0))
+        if num_shards > len(shard_keys):
+            logging.warning(
+                'Found %d shards for \'%s\'; expected at most %d.',
+                num_shards, cls.__name__, len(shard_keys))
+            return None
+
+        data = []
+        for index, shard_key in enumerate(shard_keys[:num_shards]):
+            shard = shards.get(shard_key)
+            if not shard:
+                return None
+            header = _MEMENTO_SHARD_HEADER.unpack_from(shard)
+            if header != (
+                _MEMENTO_SHARD_FORMAT_VERSION, generation, index, num_shards,
+                digest):
+                logging.warning(
+                    'Shard %s of \'%s\' was written by another save.',
+                    shard_key, cls.__name__)
+                return None
+            data.append(shard[_MEMENTO_SHARD_HEADER.size:])
+
+        data = ''.join(data)
+        if hashlib.md5(data).digest() != digest:
+            logging.warning(
+                'Shards of \'%s\' do not match their digest.', cls.__name__)
+            return None
+        return zlib.decompress(data)
+
     @classmethod
     def load(cls, app_context):
         """Loads instance from memcache; does not fail on errors."""
         shard_keys = cls._make_keys()
-        shard_contents = {}
         try:
-            shard_0 = MemcacheManager.get(
-                shard_keys[0], namespace=app_context.get_namespace_name())
-            if not shard_0:
-                return None
-
-            num_shards = ord(shard_0[0])
-            shard_contents[shard_keys[0]] = shard_0[1:]
-            if num_shards > 1:
-                shard_contents.update(MemcacheManager.get_multi(
-                    shard_keys[1:], namespace=app_context.get_namespace_name()))
-            if len(shard_contents) != num_shards:
+            shards = MemcacheManager.get_multi(
+                shard_keys, namespace=app_context.get_namespace_name())
+            data = cls._join_shards(shard_keys, shards)
+            if data is None:
                 return None
-
-            data = []
-            for shard_key in sorted(shard_contents.keys()):
-                data.append(shard_contents[shard_key])
             memento = cls.new_memento()
-            memento.deserialize(''.join(data))
+            memento.deserialize(data)
             return cls.instance_from_memento(app_context, memento)
 
         except Exception as e:  # pylint: disable=broad-except
@@ -390,9 +439,8 @@ class AbstractCachedObject(object):
 
         # If item to cache is too large, clear the old cached value for this
         # item, and don't send the new, too-large item to cache.
-        data_bytes = cls.memento_from_instance(instance).serialize()
-        num_shards_required = (len(data_bytes) // models.MEMCACHE_MAX) + 1
-        data_bytes = chr(num_shards_required) + data_bytes
+        data_bytes = zlib.compress(
+            cls.memento_from_instance(instance).serialize())
         if len(data_bytes) > cls._max_size():
             logging.warning(
                 'Not sending %d bytes for %s to Memcache; this is more '
@@ -401,13 +449,20 @@ class AbstractCachedObject(object):
             cls.delete(app_context)
             return
 
+        num_shards_required = max(1, (
+            (len(data_bytes) + _MEMENTO_SHARD_PAYLOAD_SIZE - 1) //
+            _MEMENTO_SHARD_PAYLOAD_SIZE))
+        generation = uuid.uuid4().bytes
+        digest = hashlib.md5(data_bytes).digest()
         mapping = {}
         shard_keys = cls._make_keys()
-        i = 0
-        while i < num_shards_required:
-            mapping[shard_keys[i]] = data_bytes[i * models.MEMCACHE_MAX:
-                                                (i + 1) * models.MEMCACHE_MAX]
-            i += 1
+        for index in xrange(num_shards_required):
+            header = _MEMENTO_SHARD_HEADER.pack(
+                _MEMENTO_SHARD_FORMAT_VERSION, generation, index,
+                num_shards_required, digest)
+            mapping[shard_keys[index]] = header + data_bytes[
+                index * _MEMENTO_SHARD_PAYLOAD_SIZE:
+                (index + 1) * _MEMENTO_SHARD_PAYLOAD_SIZE]
         MemcacheManager.set_multi(
             mapping, namespace=app_context.get_namespace_name())
 
@@ -420,7 +475,7 @@ class AbstractCachedObject(object):
 
     def serialize(self):
         """Saves instance to a pickle representation."""
-        return pickle.dumps(self.__dict__)
+        return pickle.dumps(self.__dict__, pickle.HIGHEST_PROTOCOL)
 
     def deserialize(self, binary_data):
         """Loads instance from a pickle representation."""
@@ -620,6 +675,7 @@ class CourseModel12(object):
         self._units = []
         self._lessons = []
         self._unit_id_to_lessons = {}
+        self._structure_version = None  # made on first use
 
         if units:
             self._units = units
@@ -657,6 +713,9 @@ class CourseModel12(object):
     def get_lessons(self, unit_id):
         return self._unit_id_to_lessons.get(str(unit_id), [])
 
+    def get_units_on_tracks(self, unused_track_ids, unused_student_track_ids):
+        return self.get_units()  # This model does not support labels
+
     def find_unit_by_id(self, unit_id):
         """Finds a unit given its id."""
         for unit in self._units:
@@ -667,6 +726,20 @@ class CourseModel12(object):
     def get_parent_unit(self, unused_unit_id):
         return None  # This model does not support any kind of unit relations
 
+    def get_structure_version(self):
+        if self._structure_version is None:
+            self._structure_version = make_structure_version(
+                self._units, dict(
+                    (unit_id, [lesson.lesson_id for lesson in lessons])
+                    for unit_id, lessons in
+                    self._unit_id_to_lessons.iteritems()))
+        return self._structure_version
+
+    def is_last_assessment(self, unit):
+        """Checks whether the given unit is the last of all the assessments."""
+        assessments = self.get_assessments()
+        return bool(assessments) and assessments[-1].unit_id == unit.unit_id
+
     def get_review_filename(self, unit_id):
         """Returns the review filename from unit id."""
         return 'assets/js/review-%s.js' % unit_id
@@ -979,7 +1052,9 @@ class PersistentCourse13(object):
             persistent.deserialize(stream.read())
             return CourseModel13(
                 app_context, next_id=persistent.next_id,
-                units=persistent.units, lessons=persistent.lessons)
+                units=persistent.units, lessons=persistent.lessons,
+                updated_on=stream.metadata.updated_on if getattr(
+                    stream, 'metadata', None) else None)
         return None
 
     def serialize(self):
@@ -1005,7 +1080,7 @@ class CachedCourse13(AbstractCachedObject):
 
     def __init__(
         self, next_id=None, units=None, lessons=None,
-        unit_id_to_lesson_ids=None):
+        unit_id_to_lesson_ids=None, updated_on=None):
 
         self.version = self.VERSION
         self.next_id = next_id
@@ -1018,11 +1093,14 @@ class CachedCourse13(AbstractCachedObject):
         # nice to have them in memcache.
         self.unit_id_to_lesson_ids = unit_id_to_lesson_ids
 
+        # The updated_on of the course file this course was loaded from.
+        self.updated_on = updated_on
+
     @classmethod
     def _max_size(cls):
-        # Cap at approximately 4M to avoid 1M single-cache-element limit,
-        # which is too small for larger courses.
-        return models.MEMCACHE_MAX * 4
+        # Cap at approximately 8M of compressed memento to avoid 1M
+        # single-cache-element limit, which is too small for larger courses.
+        return _MEMENTO_SHARD_PAYLOAD_SIZE * 8
 
     @classmethod
     def new_memento(cls):
@@ -1033,14 +1111,235 @@ class CachedCourse13(AbstractCachedObject):
         return CourseModel13(
             app_context, next_id=memento.next_id,
             units=memento.units, lessons=memento.lessons,
-            unit_id_to_lesson_ids=memento.unit_id_to_lesson_ids)
+            unit_id_to_lesson_ids=memento.unit_id_to_lesson_ids,
+            updated_on=memento.updated_on)
 
     @classmethod
     def memento_from_instance(cls, course):
         return CachedCourse13(
             next_id=course.next_id,
             units=course.units, lessons=course.lessons,
-            unit_id_to_lesson_ids=course.unit_id_to_lesson_ids)
+            unit_id_to_lesson_ids=course.unit_id_to_lesson_ids,
+            updated_on=course.updated_on)
+
+
+# Max number of course models held by ProcessScopedCourseModelCache.
+MAX_CACHED_COURSE_MODELS = 32
+
+COURSE_MODEL_CACHE_HIT = PerfCounter(
+    'gcb-models-CourseModelCache-cache-hit',
+    'A number of times a course model was found in the process-scoped cache.')
+COURSE_MODEL_CACHE_MISS = PerfCounter(
+    'gcb-models-CourseModelCache-cache-miss',
+    'A number of times a course model was not found or was out of date in the '
+    'process-scoped cache.')
+
+
+def _copy_course_element(element):
+    """Copies a unit or a lesson; only its containers are copied deeply."""
+    result = copy.copy(element)
+    for name, value in result.__dict__.items():
+        if isinstance(value, (dict, list)):
+            setattr(result, name, copy.deepcopy(value))
+    return result
+
+
+class ProcessScopedCourseModelCache(caching.ProcessScopedSingleton):
+    """Process-scoped cache of deserialized course models.
+
+    The cache holds one memento per namespace, along with the updated_on of
+    the course file the memento was loaded from and a navigation index of its
+    units and lessons. Each request compares that updated_on to the one of the
+    course file, which is read without loading the file, so a course changed
+    by any process is noticed by the next request. The mementos are shared by
+    all requests and threads and are never modified; each course model made
+    from a memento gets its own copy of the units and lessons, which post-load
+    hooks are free to modify.
+    """
+
+    def __init__(self):
+        self._cache = caching.LRUCache(max_item_count=MAX_CACHED_COURSE_MODELS)
+        self._lock = threading.Lock()
+
+    def _get(self, namespace):
+        with self._lock:
+            return self._cache.get(namespace)
+
+    def _put(self, namespace, memento, navigation_index):
+        with self._lock:
+            self._cache.put(namespace, (memento, navigation_index))
+
+    def load(self, app_context):
+        """Loads course model from the process cache, memcache or datastore."""
+        fs = app_context.fs.impl
+        filename = fs.physical_to_logical(PersistentCourse13.COURSES_FILENAME)
+        stat = app_context.fs.stat(filename)
+        if not stat or not stat.updated_on:
+            return CourseModel13.load(app_context)
+
+        namespace = app_context.get_namespace_name()
+        found, entry = self._get(namespace)
+        if found and entry[0].updated_on == stat.updated_on:
+            COURSE_MODEL_CACHE_HIT.inc()
+            memento, navigation_index = entry
+        else:
+            COURSE_MODEL_CACHE_MISS.inc()
+            course = CachedCourse13.load(app_context)
+            if course and course.updated_on and (
+                course.updated_on != stat.updated_on):
+                # A memento saved by a reader that raced with a writer may
+                # be older than the course file; don't trust it.
+                course = None
+            if not course:
+                course = PersistentCourse13.load(app_context)
+                if not course:
+                    return None
+                CachedCourse13.save(app_context, course)
+            memento = CachedCourse13.memento_from_instance(course)
+            navigation_index = CourseNavigationIndex(
+                memento.units, memento.lessons, memento.unit_id_to_lesson_ids)
+            if memento.updated_on:
+                self._put(namespace, memento, navigation_index)
+
+        return CourseModel13(
+            app_context, next_id=memento.next_id,
+            units=[_copy_course_element(unit) for unit in memento.units],
+            lessons=[
+                _copy_course_element(lesson) for lesson in memento.lessons],
+            unit_id_to_lesson_ids={
+                key: list(lesson_ids) for key, lesson_ids in
+                memento.unit_id_to_lesson_ids.iteritems()},
+            updated_on=memento.updated_on, navigation_index=navigation_index)
+
+
+def make_structure_version(units, unit_id_to_lesson_ids):
+    """Makes a stamp of the course structure progress roll-ups depend on.
+
+    Args:
+      units: the units of a course, in course order
+      unit_id_to_lesson_ids: a dict of string unit ids to lists of lesson ids
+    Returns:
+      A string which changes whenever a unit is added, removed, moved,
+      relabelled or given other pre or post assessments, or when lessons are
+      added to, removed from or moved between units.
+    """
+    structure = []
+    for unit in units:
+        structure.append([
+            str(unit.unit_id), unit.type, unit.labels or '',
+            str(unit.pre_assessment), str(unit.post_assessment),
+            [str(lesson_id) for lesson_id in
+             unit_id_to_lesson_ids.get(str(unit.unit_id), [])]])
+    return hashlib.md5(transforms.dumps(structure)).hexdigest()
+
+
+class CourseNavigationIndex(object):
+    """Precomputed lookups over the units and lessons of a CourseModel13.
+
+    The index holds positions in the unit and lesson lists of a course model
+    rather than the units and lessons themselves, so a single index can be
+    shared by all course models copied from the same memento. Except for the
+    memoized track orderings, an index is never changed once built; a course
+    model discards its index whenever it changes its units or lessons. The
+    index also stamps the structure of the units and lessons it is built over
+    with make_structure_version(), so unit_id_to_lesson_ids must always be a
+    dict, if an empty one.
+    """
+
+    MAX_TRACK_ORDERINGS = 64
+
+    def __init__(self, units, lessons, unit_id_to_lesson_ids):
+        self._unit_positions = {}
+        self._parent_positions = {}
+        for position, unit in enumerate(units):
+            self._unit_positions.setdefault(str(unit.unit_id), position)
+            for assessment_id in (unit.pre_assessment, unit.post_assessment):
+                if assessment_id is not None:
+                    self._parent_positions.setdefault(
+                        str(assessment_id), position)
+
+        self._lesson_positions = {}
+        for position, lesson in enumerate(lessons):
+            self._lesson_positions.setdefault(str(lesson.lesson_id), position)
+
+        self._unit_lesson_positions = {}
+        for unit_id, lesson_ids in unit_id_to_lesson_ids.iteritems():
+            self._unit_lesson_positions[str(unit_id)] = tuple(
+                self._lesson_positions[str(lesson_id)]
+                for lesson_id in lesson_ids)
+
+        self._assessment_positions = tuple(
+            position for position, unit in enumerate(units)
+            if unit.is_assessment())
+
+        self._last_assessment_id = self._find_last_assessment_id(units)
+        self._unit_label_ids = tuple(
+            frozenset(int(label_id) for label_id in
+                      common_utils.text_to_list(unit.labels))
+            for unit in units)
+        self._track_orderings = {}
+        self._structure_version = make_structure_version(
+            units, unit_id_to_lesson_ids)
+
+    @classmethod
+    def _find_last_assessment_id(cls, units):
+        for unit in reversed(units):
+            if unit.type == verify.UNIT_TYPE_ASSESSMENT:
+                return unit.unit_id
+            elif unit.type == verify.UNIT_TYPE_UNIT:
+                if unit.post_assessment:
+                    return unit.post_assessment
+                if unit.pre_assessment:
+                    return unit.pre_assessment
+        return None
+
+    def get_unit_position(self, unit_id):
+        return self._unit_positions.get(str(unit_id))
+
+    def get_lesson_position(self, lesson_id):
+        return self._lesson_positions.get(str(lesson_id))
+
+    def get_unit_lesson_positions(self, unit_id):
+        return self._unit_lesson_positions.get(str(unit_id), ())
+
+    def get_parent_unit_position(self, unit_id):
+        return self._parent_positions.get(str(unit_id))
+
+    def get_assessment_positions(self):
+        return self._assessment_positions
+
+    def is_last_assessment_id(self, unit_id):
+        return (self._last_assessment_id is not None and
+                self._last_assessment_id == unit_id)
+
+    def get_structure_version(self):
+        return self._structure_version
+
+    def get_unit_positions_on_tracks(self, track_ids, student_track_ids):
+        """Gets positions of units visible to a student on the given tracks.
+
+        Args:
+          track_ids: ids of all the labels of the course track type
+          student_track_ids: ids of the track labels the student has
+        Returns:
+          A tuple of positions of units which have no track labels, or share
+          a track label with the student, or all units if the student has no
+          track labels.
+        """
+        key = (frozenset(track_ids), frozenset(student_track_ids))
+        positions = self._track_orderings.get(key)
+        if positions is None:
+            all_track_ids, student_track_ids = key
+            positions = tuple(
+                position for position, label_ids in enumerate(
+                    self._unit_label_ids)
+                if not student_track_ids or
+                student_track_ids.intersection(label_ids) or
+                all_track_ids.isdisjoint(label_ids))
+            if len(self._track_orderings) >= self.MAX_TRACK_ORDERINGS:
+                self._track_orderings.clear()
+            self._track_orderings[key] = positions
+        return positions
 
 
 class CourseModel13(object):
@@ -1049,8 +1348,18 @@ class CourseModel13(object):
     VERSION = COURSE_MODEL_VERSION_1_3
 
     @classmethod
-    def load(cls, app_context):
-        """Loads course from memcache or persistence."""
+    def load(cls, app_context, use_process_cache=False):
+        """Loads course from memcache or persistence.
+
+        Args:
+            app_context: an application context of the course
+            use_process_cache: whether to make the course from a model shared
+                via ProcessScopedCourseModelCache instead of loading it anew
+        Returns:
+            the course or None if there is no course
+        """
+        if use_process_cache:
+            return ProcessScopedCourseModelCache.instance().load(app_context)
         course = CachedCourse13.load(app_context)
         if not course:
             course = PersistentCourse13.load(app_context)
@@ -1071,14 +1380,16 @@ class CourseModel13(object):
 
     def __init__(
         self, app_context, next_id=None, units=None, lessons=None,
-        unit_id_to_lesson_ids=None):
+        unit_id_to_lesson_ids=None, updated_on=None, navigation_index=None):
 
         # Init default values.
         self._app_context = app_context
+        self._updated_on = updated_on  # of the course file loaded from
         self._next_id = 1  # a counter for creating sequential entity ids
         self._units = []
         self._lessons = []
         self._unit_id_to_lesson_ids = {}
+        self._navigation_index = None  # built on first use
 
         # These array keep dirty object in current transaction.
         self._dirty_units = []
@@ -1095,6 +1406,7 @@ class CourseModel13(object):
             self._lessons = lessons
         if unit_id_to_lesson_ids:
             self._unit_id_to_lesson_ids = unit_id_to_lesson_ids
+            self._navigation_index = navigation_index
         else:
             self._index()
 
@@ -1118,6 +1430,10 @@ class CourseModel13(object):
     def unit_id_to_lesson_ids(self):
         return self._unit_id_to_lesson_ids
 
+    @property
+    def updated_on(self):
+        return self._updated_on
+
     def _get_next_id(self):
         """Allocates next id in sequence."""
         next_id = self._next_id
@@ -1126,10 +1442,18 @@ class CourseModel13(object):
 
     def _index(self):
         """Indexes units and lessons."""
+        self._navigation_index = None
         self._unit_id_to_lesson_ids = self._make_unit_id_to_lessons_lookup_dict(
             self._lessons)
         index_units_and_lessons(self)
 
+    def get_navigation_index(self):
+        """Gets the index of the current units and lessons of this course."""
+        if self._navigation_index is None:
+            self._navigation_index = CourseNavigationIndex(
+                self._units, self._lessons, self._unit_id_to_lesson_ids)
+        return self._navigation_index
+
     def get_file_content(self, filename):
         fs = self.app_context.fs
         path = fs.impl.physical_to_logical(filename)
@@ -1165,7 +1489,9 @@ class CourseModel13(object):
         # requires a valid unit/lesson. If unit was deleted it's no longer
         # found in _units, same for lesson. So we temporarily install deleted
         # unit/lesson array instead of actual. We also temporarily empty
-        # so _unit_id_to_lesson_ids is not accidentally used. This is a hack,
+        # _unit_id_to_lesson_ids so it is not accidentally used; it stays a
+        # dict, as the navigation index built over the deleted unit/lesson
+        # arrays iterates it. This is a hack,
         # and we will improve it as object model gets more complex, but for
         # now it works fine.
 
@@ -1175,7 +1501,8 @@ class CourseModel13(object):
         try:
             self._units = self._deleted_units
             self._lessons = self._deleted_lessons
-            self._unit_id_to_lesson_ids = None
+            self._unit_id_to_lesson_ids = {}
+            self._navigation_index = None
 
             # Delete owned assessments.
             for unit in self._deleted_units:
@@ -1195,17 +1522,20 @@ class CourseModel13(object):
             self._units = units
             self._lessons = lessons
             self._unit_id_to_lesson_ids = unit_id_to_lesson_ids
+            self._navigation_index = None
 
     def _validate_settings_content(self, content):
         yaml.safe_load(content)
 
     def invalidate_cached_course_settings(self):
         """Clear settings cached locally in-process and globally in memcache."""
+        updated_on = Course.get_environ_updated_on(self.app_context)
         keys = [
-            Course.make_locale_environ_key(locale)
+            Course.make_locale_environ_key(locale, updated_on)
             for locale in [None] + self.app_context.get_all_locales()]
         models.MemcacheManager.delete_multi(
             keys, namespace=self.app_context.get_namespace_name())
+        ProcessScopedCourseEnvironCache.invalidate(self.app_context)
 
         self._app_context.clear_per_request_cache()
 
@@ -1266,20 +1596,27 @@ class CourseModel13(object):
         self._index()
         PersistentCourse13.save(self._app_context, self)
         CachedCourse13.delete(self._app_context)
+        self._updated_on = None
 
     def get_units(self):
         return self._units[:]
 
     def get_assessments(self):
-        return [x for x in self.get_units() if x.is_assessment()]
+        return [
+            self._units[position] for position in
+            self.get_navigation_index().get_assessment_positions()]
+
+    def get_units_on_tracks(self, track_ids, student_track_ids):
+        """Gets units visible to a student having the given track labels."""
+        return [
+            self._units[position] for position in
+            self.get_navigation_index().get_unit_positions_on_tracks(
+                track_ids, student_track_ids)]
 
     def get_lessons(self, unit_id):
-        lesson_ids = self._unit_id_to_lesson_ids.get(str(unit_id))
-        lessons = []
-        if lesson_ids:
-            for lesson_id in lesson_ids:
-                lessons.append(self.find_lesson_by_id(None, lesson_id))
-        return lessons
+        return [
+            self._lessons[position] for position in
+            self.get_navigation_index().get_unit_lesson_positions(unit_id)]
 
     def get_assessment_filename(self, unit_id):
         """Returns assessment base filename."""
@@ -1303,28 +1640,27 @@ class CourseModel13(object):
 
     def find_unit_by_id(self, unit_id):
         """Finds a unit given its id."""
-        for unit in self._units:
-            if str(unit.unit_id) == str(unit_id):
-                return unit
-        return None
+        position = self.get_navigation_index().get_unit_position(unit_id)
+        return None if position is None else self._units[position]
 
     def find_lesson_by_id(self, unused_unit, lesson_id):
         """Finds a lesson given its id."""
-        for lesson in self._lessons:
-            if str(lesson.lesson_id) == str(lesson_id):
-                return lesson
-        return None
+        position = self.get_navigation_index().get_lesson_position(lesson_id)
+        return None if position is None else self._lessons[position]
 
     def get_parent_unit(self, unit_id):
         # See if the unit is an assessment being used as a pre/post
-        # unit lesson.
-        for unit in self.get_units():
-            if (str(unit.pre_assessment) == str(unit_id) or
-                str(unit.post_assessment) == str(unit_id)):
-                return unit
+        # unit lesson; there are no other kinds of parentage.
+        position = self.get_navigation_index().get_parent_unit_position(
+            unit_id)
+        return None if position is None else self._units[position]
 
-        # Nope, no other kinds of parentage; no parent.
-        return None
+    def is_last_assessment(self, unit):
+        """Checks whether the given unit is the last of all the assessments."""
+        return self.get_navigation_index().is_last_assessment_id(unit.unit_id)
+
+    def get_structure_version(self):
+        return self.get_navigation_index().get_structure_version()
 
     def add_unit(self, unit_type, title, custom_unit_type=None):
         """Adds a brand new unit."""
@@ -1473,6 +1809,8 @@ class CourseModel13(object):
             existing_unit.html_review_form = unit.html_review_form
             existing_unit.workflow_yaml = unit.workflow_yaml
 
+        # Pre- and post-assessments and labels may have changed.
+        self._navigation_index = None
         self._dirty_units.append(existing_unit)
         return existing_unit
 
@@ -1525,6 +1863,7 @@ class CourseModel13(object):
             unit_ids.add(unit_id)
         assert len(unit_ids) == len(self._units)
         self._units = reordered_units
+        self._navigation_index = None
 
         reordered_lessons = []
         lesson_ids = set()
@@ -2121,6 +2460,81 @@ class Workflow(object):
             return False
 
 
+MAX_CACHED_COURSE_ENVIRONS = 256
+
+COURSE_ENVIRON_CACHE_HIT = PerfCounter(
+    'gcb-models-CourseEnvironCache-cache-hit',
+    'A number of times course settings were found in the process-scoped '
+    'cache.')
+COURSE_ENVIRON_CACHE_MISS = PerfCounter(
+    'gcb-models-CourseEnvironCache-cache-miss',
+    'A number of times course settings were not found or were out of date in '
+    'the process-scoped cache.')
+
+
+class ProcessScopedCourseEnvironCache(caching.ProcessScopedSingleton):
+    """Process-scoped cache of compiled course settings, one per locale.
+
+    Each entry is a frozen snapshot of the settings of a course in a locale,
+    as returned by Course.get_environ() after all post-load hooks have run.
+    An entry is used only while the course.yaml it was compiled from has not
+    changed and the version of course settings kept in memcache is the same;
+    Course.invalidate_cached_course_settings() changes that version, which
+    makes stale the entries of the course in all processes. Like memcache,
+    entries expire after DEFAULT_CACHE_TTL_SECS to pick up other changes.
+    """
+
+    VERSION_KIND = 'CourseEnviron'  # as known to RequestScopedDaoCacheVersions
+
+    @classmethod
+    def is_enabled(cls):
+        return models.CAN_USE_MEMCACHE.value
+
+    def __init__(self):
+        self._cache = caching.LRUCache(
+            max_item_count=MAX_CACHED_COURSE_ENVIRONS)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _get_version(cls, namespace):
+        # Have the version fetched along with those of the cached DAO objects.
+        models.ProcessScopedDaoCache.instance().kinds.add(cls.VERSION_KIND)
+        return models.RequestScopedDaoCacheVersions.instance().get(
+            namespace, cls.VERSION_KIND)
+
+    def get(self, app_context, locale, updated_on):
+        """Gets settings compiled from the course.yaml of the given date."""
+        if not self.is_enabled():
+            return None
+        namespace = app_context.get_namespace_name()
+        version = self._get_version(namespace)
+        with self._lock:
+            found, entry = self._cache.get((namespace, locale))
+        if (found and entry[0] == version and entry[1] == updated_on and
+            entry[2] > time.time()):
+            COURSE_ENVIRON_CACHE_HIT.inc()
+            return entry[3]
+        COURSE_ENVIRON_CACHE_MISS.inc()
+        return None
+
+    def put(self, app_context, locale, updated_on, snapshot):
+        if not self.is_enabled():
+            return
+        namespace = app_context.get_namespace_name()
+        entry = (
+            self._get_version(namespace), updated_on,
+            time.time() + models.DEFAULT_CACHE_TTL_SECS, snapshot)
+        with self._lock:
+            self._cache.put((namespace, locale), entry)
+
+    @classmethod
+    def invalidate(cls, app_context):
+        """Makes stale the settings of a course cached by all processes."""
+        if cls.is_enabled():
+            models.RequestScopedDaoCacheVersions.instance().bump(
+                app_context.get_namespace_name(), cls.VERSION_KIND)
+
+
 class Course(object):
     """Manages a course and all of its components."""
 
@@ -2191,28 +2605,61 @@ class Course(object):
         return ret
 
     @classmethod
-    def make_locale_environ_key(cls, locale):
-        """Returns key used to store localized settings in memcache."""
-        return 'course:environ:locale:%s:%s' % (
-            os.environ.get('CURRENT_VERSION_ID'), locale)
+    def make_locale_environ_key(cls, locale, updated_on=None):
+        """Returns key used to store localized settings in memcache.
+
+        Args:
+            locale: a locale of the settings
+            updated_on: when the course.yaml the settings are compiled from
+                was last changed, if known
+        Returns:
+            a memcache key
+        """
+        return 'course:environ:locale:%s:%s:%s' % (
+            os.environ.get('CURRENT_VERSION_ID'), locale, updated_on)
+
+    @classmethod
+    def get_environ_updated_on(cls, app_context):
+        """Returns when course.yaml was changed; read without loading it."""
+        stat = app_context.fs.stat(app_context.get_config_filename())
+        return stat.updated_on if stat else None
 
     @classmethod
-    def get_environ(cls, app_context):
-        """Returns currently defined course settings as a dictionary."""
+    def get_environ(cls, app_context, frozen=False):
+        """Returns currently defined course settings as a dictionary.
+
+        Args:
+            app_context: an application context of the course
+            frozen: whether to return an immutable snapshot of the settings;
+                the snapshot is shared by all readers and is returned without
+                copying; callers that only read settings should prefer it
+        Returns:
+            a dict of course settings
+        """
         # pylint: disable=protected-access
 
         # get from local cache
         env = app_context._cached_environ
         if env:
-            return copy.deepcopy(env)
+            return env if frozen else caching.thaw(env)
 
-        # get from global cache
+        # get from process cache
         _locale = app_context.get_current_locale()
-        _key = cls.make_locale_environ_key(_locale)
+        _updated_on = cls.get_environ_updated_on(app_context)
+        _process_cache = ProcessScopedCourseEnvironCache.instance()
+        env = _process_cache.get(app_context, _locale, _updated_on)
+        if env:
+            app_context._cached_environ = env
+            return env if frozen else caching.thaw(env)
+
+        # get from global cache
+        _key = cls.make_locale_environ_key(_locale, _updated_on)
         env = models.MemcacheManager.get(
-            _key, namespace=app_context.get_namespace_name())
+            _key, namespace=app_context.get_namespace_name(), frozen=True)
         if env:
-            return env
+            app_context._cached_environ = env
+            _process_cache.put(app_context, _locale, _updated_on, env)
+            return env if frozen else caching.thaw(env)
 
         models.MemcacheManager.begin_readonly()
         try:
@@ -2222,23 +2669,27 @@ class Course(object):
             # Monkey patch to defend against infinite recursion. Downstream
             # calls do not reload the env but just return the copy we have here.
             old_get_environ = cls.get_environ
-            cls.get_environ = classmethod(lambda cl, ac: env)
+            cls.get_environ = classmethod(
+                lambda cl, ac, frozen=False: env)
             try:
                 # run hooks
                 for hook in cls.COURSE_ENV_POST_LOAD_HOOKS:
                     hook(env)
 
-                # put into local and global cache
-                app_context._cached_environ = env
+                # put into local, process and global cache
+                snapshot = caching.freeze(env)
+                app_context._cached_environ = snapshot
+                _process_cache.put(app_context, _locale, _updated_on, snapshot)
                 models.MemcacheManager.set(
-                    _key, env, namespace=app_context.get_namespace_name())
+                    _key, snapshot, namespace=app_context.get_namespace_name(),
+                    frozen=True)
             finally:
                 # Restore the original method from monkey-patch
                 cls.get_environ = old_get_environ
         finally:
             models.MemcacheManager.end_readonly()
 
-        return copy.deepcopy(env)
+        return snapshot if frozen else env
 
     @classmethod
     def _load_environ(cls, app_context):
@@ -2432,6 +2883,16 @@ class Course(object):
                 CONFIG_KEY_GOOGLE_CLIENT_ID, 'Google Client Id', 'string',
                 optional=True, i18n=False, description='Google Client Id'))
 
+        # Course-level event buffering.
+        if models.CAN_BUFFER_EVENTS.value:
+            course_opts.add_property(schema_fields.SchemaField(
+                'course:buffer_events', 'Buffer Events', 'boolean',
+                optional=True, description='Whether to hold the events '
+                'recorded for this course in memory and write them to the '
+                'datastore in batches. This reduces the number of datastore '
+                'writes, but a small number of the most recent events may be '
+                'lost if the server shuts down.'))
+
         # Unit level settings.
         unit_opts = reg.add_sub_registry(
             Course.SCHEMA_SECTION_UNITS_AND_LESSONS, 'Units and Lessons')
@@ -2541,10 +3002,11 @@ class Course(object):
         return reg
 
     def get_course_setting(self, name):
-        course_settings = self.get_environ(self._app_context).get('course')
+        course_settings = self.get_environ(
+            self._app_context, frozen=True).get('course')
         if not course_settings:
             return None
-        return course_settings.get(name)
+        return caching.thaw(course_settings.get(name))
 
     @classmethod
     def validate_course_yaml(cls, raw_string, course):
@@ -2574,14 +3036,15 @@ class Course(object):
         return CourseModel13(app_context)
 
     @classmethod
-    def _load(cls, app_context):
+    def _load(cls, app_context, use_process_cache=False):
         """Loads course data from persistence storage into this instance."""
         if not app_context.is_editable_fs():
             model = CourseModel12.load(app_context)
             if model:
                 return model
         else:
-            model = CourseModel13.load(app_context)
+            model = CourseModel13.load(
+                app_context, use_process_cache=use_process_cache)
             if model:
                 return model
         return cls.create_new_default_course(app_context)
@@ -2609,7 +3072,7 @@ class Course(object):
             _app_context, _course = cls.INSTANCE.current
             if _course and (app_context == _app_context or app_context is None):
                 return _course
-        _course = Course(None, app_context)
+        _course = Course(None, app_context, use_process_cache=True)
         cls.set_current(_course)
         return _course
 
@@ -2633,7 +3096,7 @@ class Course(object):
             del cls.INSTANCE.current
 
     @appengine_config.timeandlog('Course.init')
-    def __init__(self, handler, app_context=None):
+    def __init__(self, handler, app_context=None, use_process_cache=False):
         """Makes an instance of brand new or loads existing course is exists.
 
         Making a new instance of existing Course is expensive. It involves db
@@ -2649,13 +3112,17 @@ class Course(object):
         Args:
           handler: a request handler for the course
           app_context: an app_context of the Course, instance of which you need
+          use_process_cache: whether to make the course from a course model
+              shared by all requests of this process, rather than to load
+              the most up to date course model; see Course.get()
         Returns:
           an instance of a course: cached or newly created if nothing cached
         """
 
         self._app_context = app_context if app_context else handler.app_context
         self._namespace = self._app_context.get_namespace_name()
-        self._model = self._load(self._app_context)
+        self._model = self._load(
+            self._app_context, use_process_cache=use_process_cache)
         self._tracker = None
         self._reviews_processor = None
 
@@ -2706,7 +3173,9 @@ class Course(object):
         return self._reviews_processor
 
     def get_units(self):
-        units = self._model.get_units()
+        return self._set_custom_unit_urls(self._model.get_units())
+
+    def _set_custom_unit_urls(self, units):
         for unit in units:
             if unit.is_custom_unit():
                 cu = custom_units.UnitTypeRegistry.get(unit.custom_unit_type)
@@ -2719,8 +3188,29 @@ class Course(object):
         return [unit for unit in self.get_units() if unit_type == unit.type]
 
     def get_track_matching_student(self, student):
-        return models.LabelDAO.apply_course_track_labels_to_student_labels(
-            self, student, self.get_units())
+        track_ids, student_track_ids = (
+            models.LabelDAO.get_track_ids_and_student_track_ids(student))
+        units = self._set_custom_unit_urls(self._model.get_units_on_tracks(
+            track_ids, student_track_ids))
+        return models.LabelDAO.apply_course_locale_labels_to_student_labels(
+            self, student, units)
+
+    def get_track_matching_student_key(self, student):
+        """Gets a key which changes whenever get_track_matching_student may.
+
+        Args:
+          student: the logged-in Student matching the user for this request.
+        Returns:
+          A string; get_track_matching_student returns the same units for two
+          calls made while the key is the same.
+        """
+        track_ids, student_track_ids = (
+            models.LabelDAO.get_track_ids_and_student_track_ids(student))
+        return hashlib.md5(transforms.dumps([
+            self.get_structure_version(),
+            sorted(track_ids), sorted(student_track_ids),
+            models.LabelDAO.get_course_locale_labels_key(self, student),
+        ])).hexdigest()
 
     def get_unit_track_labels(self, unit):
         all_track_ids = models.LabelDAO.get_set_of_ids_of_type(
@@ -2757,15 +3247,11 @@ class Course(object):
 
     def is_last_assessment(self, unit):
         """Checks whether the given unit is the last of all the assessments."""
-        for current_unit in reversed(self.get_units()):
-            if current_unit.type == verify.UNIT_TYPE_ASSESSMENT:
-                return current_unit.unit_id == unit.unit_id
-            elif current_unit.type == verify.UNIT_TYPE_UNIT:
-                if current_unit.post_assessment:
-                    return current_unit.post_assessment == unit.unit_id
-                if current_unit.pre_assessment:
-                    return current_unit.pre_assessment == unit.unit_id
-        return False
+        return self._model.is_last_assessment(unit)
+
+    def get_structure_version(self):
+        """Gets a stamp of the units and lessons of this course."""
+        return self._model.get_structure_version()
 
     def add_unit(self):
         """Adds new unit to a course."""
@@ -2871,20 +3357,12 @@ class Course(object):
             contributed by the assessment to the final score, and the
             assessment score.
         """
-        unit_list = self.get_units()
         scores = transforms.loads(student.scores) if student.scores else {}
-
-        progress_tracker = self.get_progress_tracker()
-        student_progress = progress_tracker.get_or_create_progress(student)
+        units = self._get_graded_units()
+        summary = self._get_score_summary(student, units)
 
         assessment_score_list = []
-        for unit in unit_list:
-            if unit.is_custom_unit():
-                cu = custom_units.UnitTypeRegistry.get(unit.custom_unit_type)
-                if not cu or not cu.is_graded:
-                    continue
-            elif not unit.is_assessment():
-                continue
+        for unit in units:
             # Compute the weight for this assessment.
             weight = 0
             if hasattr(unit, 'weight'):
@@ -2892,22 +3370,14 @@ class Course(object):
             elif unit.unit_id in DEFAULT_LEGACY_ASSESSMENT_WEIGHTS:
                 weight = DEFAULT_LEGACY_ASSESSMENT_WEIGHTS[unit.unit_id]
 
-            completed = False
-            if unit.is_assessment():
-                completed = progress_tracker.is_assessment_completed(
-                    student_progress, unit.unit_id)
-            else:
-                completed = progress_tracker.is_custom_unit_completed(
-                    student_progress, unit.unit_id)
+            completed = str(unit.unit_id) in summary.completed_unit_ids
 
             # If a human-reviewed assessment is completed, ensure that the
             # required reviews have also been completed.
             if completed and self.needs_human_grader(unit):
-                reviews = self.get_reviews_processor().get_review_steps_by(
-                    unit.unit_id, student.get_key())
                 review_min_count = unit.workflow.get_review_min_count()
-                if not review.ReviewUtils.has_completed_enough_reviews(
-                        reviews, review_min_count):
+                if (summary.get_completed_review_count(unit.unit_id) <
+                    review_min_count):
                     completed = False
 
             assessment_score_list.append({
@@ -2923,12 +3393,88 @@ class Course(object):
 
         return assessment_score_list
 
+    def _get_graded_units(self):
+        """Returns the assessments and graded custom units of the course."""
+        graded_units = []
+        for unit in self.get_units():
+            if unit.is_custom_unit():
+                cu = custom_units.UnitTypeRegistry.get(unit.custom_unit_type)
+                if not cu or not cu.is_graded:
+                    continue
+            elif not unit.is_assessment():
+                continue
+            graded_units.append(unit)
+        return graded_units
+
+    def _get_score_summary(self, student, units):
+        """Gets the score summary of a student, making it if need be.
+
+        The progress tracker and the reviews processor keep the summary up to
+        date, making it on the first change if the student has none. When
+        read, a summary that was never made from progress gets the graded
+        units completed in the progress of the student merged in. The review
+        count of a peer-reviewed unit completed before the unit became
+        peer-reviewed is counted when first needed. Both are merged into the
+        stored summary in a transaction, so that no completion written since
+        the summary was read is lost.
+        """
+        progress_tracker = self.get_progress_tracker()
+        summary = None
+        if not student.is_transient:
+            summary = progress_tracker.get_score_summary(student)
+        if summary is None:
+            summary = progress.ScoreSummary.create(student.user_id)
+
+        completed_unit_ids = set()
+        if not summary.is_made_from_progress:
+            student_progress = progress.ProgressDocument(
+                progress_tracker.get_or_create_progress(student))
+            for unit in units:
+                if unit.is_assessment():
+                    completed = progress_tracker.is_assessment_completed(
+                        student_progress, unit.unit_id)
+                else:
+                    completed = progress_tracker.is_custom_unit_completed(
+                        student_progress, unit.unit_id)
+                if completed:
+                    completed_unit_ids.add(str(unit.unit_id))
+
+        review_counts = {}
+        for unit in units:
+            unit_id = str(unit.unit_id)
+            if ((unit_id in summary.completed_unit_ids or
+                 unit_id in completed_unit_ids) and
+                self.needs_human_grader(unit) and
+                summary.get_completed_review_count(unit_id) is None):
+                reviews = self.get_reviews_processor().get_review_steps_by(
+                    unit.unit_id, student.get_key())
+                review_counts[unit_id] = (
+                    review.ReviewUtils.count_completed_reviews(reviews))
+
+        if summary.is_made_from_progress and not review_counts:
+            return summary
+
+        def merge(summary):
+            changed = not (
+                summary.is_made_from_progress and
+                completed_unit_ids <= summary.completed_unit_ids)
+            summary.is_made_from_progress = True
+            summary.completed_unit_ids.update(completed_unit_ids)
+            for unit_id, count in review_counts.iteritems():
+                if summary.get_completed_review_count(unit_id) is None:
+                    summary.completed_review_counts[unit_id] = count
+                    changed = True
+            if not changed:
+                return False
+
+        if student.is_transient:
+            merge(summary)
+            return summary
+        return progress.ScoreSummary.update(student.user_id, merge)
+
     def get_assessment_list(self):
         """Returns a list of dup units that are assessments."""
-        # TODO(psimakov): Streamline this so that it does not require a full
-        # iteration on each request, probably by modifying the index() method.
-        assessments = [x for x in self.get_units() if x.is_assessment()]
-        return copy.deepcopy(assessments)
+        return copy.deepcopy(self._model.get_assessments())
 
     def get_peer_reviewed_units(self):
         """Returns a list of units that are peer-reviewed assessments.
@@ -18,10 +18,14 @@ __author__ = 'Pavel Simakov (psimakov@google.com)'
 
 import collections
 import copy
+import datetime
 import logging
 import os
 import sys
+import threading
 import time
+import uuid
+import zlib
 
 from config import ConfigProperty
 import counters
@@ -39,6 +43,7 @@ from common import users
 from google.appengine.api import memcache
 from google.appengine.api import namespace_manager
 from google.appengine.ext import db
+from google.appengine.ext import deferred
 
 # We want to use memcache for both objects that exist and do not exist in the
 # datastore. If object exists we cache its instance, if object does not exist
@@ -183,36 +188,76 @@ class MemcacheManager(object):
         return False, None
 
     @classmethod
-    def _local_cache_put(cls, key, namespace, value):
+    def _local_cache_put(cls, key, namespace, value, frozen=False):
+        """Puts an immutable snapshot of the value into the local cache.
+
+        Memcache pickles the values it stores, so a copy is only needed when
+        the value is also held in the local cache. Snapshots are shared by
+        all readers of the local cache, and copied only for the readers that
+        want a mutable value.
+
+        Args:
+            key: a key of the value
+            namespace: a namespace of the value
+            value: a value to put
+            frozen: whether the value is already a snapshot
+        Returns:
+            the snapshot put into the local cache or None
+        """
         if cls._IS_READONLY:
             assert cls._is_same_app_context_if_set()
             _dict = cls._LOCAL_CACHE.get(namespace)
             if not _dict:
                 _dict = {}
                 cls._LOCAL_CACHE[namespace] = _dict
+            if not frozen:
+                value = caching.freeze(value)
             _dict[key] = value
             CACHE_PUT_LOCAL.inc()
+            return value
+        return None
+
+    @classmethod
+    def _local_cache_put_and_get(cls, key, namespace, value, frozen):
+        """Puts a value fetched from memcache into the local cache.
+
+        Args:
+            key: a key of the value
+            namespace: a namespace of the value
+            value: a freshly unpickled value not shared with anyone
+            frozen: whether the caller wants an immutable snapshot
+        Returns:
+            the value to return to the caller
+        """
+        if not cls._IS_READONLY:
+            if frozen:
+                return caching.freeze(value)
+            if caching.is_frozen(value):
+                return caching.thaw(value)
+            return value
+        value = cls._local_cache_put(key, namespace, value)
+        return value if frozen else caching.thaw(value)
 
     @classmethod
     def _local_cache_get_multi(cls, keys, namespace):
         if cls._IS_READONLY:
             assert cls._is_same_app_context_if_set()
-            values = []
+            values = {}
             for key in keys:
                 is_cached, value = cls._local_cache_get(key, namespace)
                 if not is_cached:
-                    return False, []
+                    return False, {}
                 else:
-                    values.append(value)
+                    values[key] = value
             return True, values
-        return False, []
+        return False, {}
 
     @classmethod
-    def _local_cache_put_multi(cls, values, namespace):
+    def _local_cache_put_multi(cls, values, namespace, frozen=False):
         if cls._IS_READONLY:
             assert cls._is_same_app_context_if_set()
             for key, value in values.items():
-                cls._local_cache_put(key, namespace, value)
+                cls._local_cache_put(key, namespace, value, frozen)
 
     @classmethod
     def get_namespace(cls):
@@ -229,15 +274,25 @@ class MemcacheManager(object):
         return cls.get_namespace()
 
     @classmethod
-    def get(cls, key, namespace=None):
-        """Gets an item from memcache if memcache is enabled."""
+    def get(cls, key, namespace=None, frozen=False):
+        """Gets an item from memcache if memcache is enabled.
+
+        Args:
+            key: a key of the item
+            namespace: a namespace of the item; current namespace if None
+            frozen: whether to return an immutable snapshot of the item; such
+                snapshot is shared with other readers and is returned without
+                copying; see caching.freeze() for details
+        Returns:
+            the item or None if the item was not found
+        """
         if not CAN_USE_MEMCACHE.value:
             return None
         _namespace = cls._get_namespace(namespace)
 
         is_cached, value = cls._local_cache_get(key, _namespace)
         if is_cached:
-            return copy.deepcopy(value)
+            return value if frozen else caching.thaw(value)
 
         value = memcache.get(key, namespace=_namespace)
 
@@ -249,12 +304,19 @@ class MemcacheManager(object):
         else:
             CACHE_MISS.inc(context=key)
 
-        cls._local_cache_put(key, _namespace, value)
-        return copy.deepcopy(value)
+        return cls._local_cache_put_and_get(key, _namespace, value, frozen)
 
     @classmethod
-    def get_multi(cls, keys, namespace=None):
-        """Gets a set of items from memcache if memcache is enabled."""
+    def get_multi(cls, keys, namespace=None, frozen=False):
+        """Gets a set of items from memcache if memcache is enabled.
+
+        Args:
+            keys: a list of keys of the items
+            namespace: a namespace of the items; current namespace if None
+            frozen: whether to return immutable snapshots of the items
+        Returns:
+            a dict of the items found, keyed by the item key
+        """
         if not CAN_USE_MEMCACHE.value:
             return {}
 
@@ -262,7 +324,9 @@ class MemcacheManager(object):
 
         is_cached, values = cls._local_cache_get_multi(keys, _namespace)
         if is_cached:
-            return values
+            if frozen:
+                return values
+            return {key: caching.thaw(value) for key, value in values.items()}
 
         values = memcache.get_multi(keys, namespace=_namespace)
         for key, value in values.items():
@@ -272,15 +336,23 @@ class MemcacheManager(object):
                 logging.info('Cache miss, key: %s. %s', key, Exception())
                 CACHE_MISS.inc(context=key)
 
-        cls._local_cache_put_multi(values, _namespace)
-        return values
+        return {
+            key: cls._local_cache_put_and_get(key, _namespace, value, frozen)
+            for key, value in values.items()}
 
     @classmethod
-    def set(cls, key, value, ttl=DEFAULT_CACHE_TTL_SECS, namespace=None):
-        """Sets an item in memcache if memcache is enabled."""
-        # Ensure subsequent mods to value do not affect the cached copy.
-        value = copy.deepcopy(value)
+    def set(cls, key, value, ttl=DEFAULT_CACHE_TTL_SECS, namespace=None,
+            frozen=False):
+        """Sets an item in memcache if memcache is enabled.
 
+        Args:
+            key: a key of the item
+            value: a value of the item
+            ttl: a number of seconds to keep the item for
+            namespace: a namespace of the item; current namespace if None
+            frozen: whether the value is a snapshot made by caching.freeze();
+                such value is stored without copying
+        """
         try:
             if CAN_USE_MEMCACHE.value:
                 size = sys.getsizeof(value)
@@ -290,14 +362,15 @@ class MemcacheManager(object):
                     CACHE_PUT.inc()
                     _namespace = cls._get_namespace(namespace)
                     memcache.set(key, value, ttl, namespace=_namespace)
-                    cls._local_cache_put(key, _namespace, value)
+                    cls._local_cache_put(key, _namespace, value, frozen)
         except:  # pylint: disable=bare-except
             logging.exception(
                 'Failed to set: %s, %s', key, cls._get_namespace(namespace))
             return None
 
     @classmethod
-    def set_multi(cls, mapping, ttl=DEFAULT_CACHE_TTL_SECS, namespace=None):
+    def set_multi(cls, mapping, ttl=DEFAULT_CACHE_TTL_SECS, namespace=None,
+                  frozen=False):
         """Sets a dict of items in memcache if memcache is enabled."""
         try:
             if CAN_USE_MEMCACHE.value:
@@ -312,7 +385,7 @@ class MemcacheManager(object):
                     CACHE_PUT.inc()
                     _namespace = cls._get_namespace(namespace)
                     memcache.set_multi(mapping, time=ttl, namespace=_namespace)
-                    cls._local_cache_put_multi(mapping, _namespace)
+                    cls._local_cache_put_multi(mapping, _namespace, frozen)
         except:  # pylint: disable=bare-except
             logging.exception(
                 'Failed to set_multi: %s, %s',
@@ -847,7 +920,8 @@ class StudentProfileDAO(object):
         if services.unsubscribe.has_unsubscribed(student.email):
             return
 
-        course_settings = handler.app_context.get_environ()['course']
+        course_settings = handler.app_context.get_environ(frozen=True)[
+            'course']
         course_title = course_settings['title']
         sender = cls._get_welcome_notifications_sender(handler)
 
@@ -892,13 +966,13 @@ class StudentProfileDAO(object):
 
     @classmethod
     def _get_send_welcome_notifications(cls, handler):
-        return handler.app_context.get_environ().get(
+        return handler.app_context.get_environ(frozen=True).get(
             'course', {}
         ).get('send_welcome_notifications', False)
 
     @classmethod
     def _get_welcome_notifications_sender(cls, handler):
-        return handler.app_context.get_environ().get(
+        return handler.app_context.get_environ(frozen=True).get(
             'course', {}
         ).get('welcome_notifications_sender')
 
@@ -1014,6 +1088,16 @@ class Student(BaseEntity):
         MemcacheManager.set(self._memcache_key(self.key().name()), self)
         return result
 
+    def put_async(self):
+        """Do an asynchronous put() and also add the object to memcache.
+
+        Returns:
+            The RPC of the put; call its get_result() to wait for it.
+        """
+        rpc = db.put_async(self)
+        MemcacheManager.set(self._memcache_key(self.key().name()), self)
+        return rpc
+
     def delete(self):
         """Do the normal delete() and also remove the object from memcache."""
         super(Student, self).delete()
@@ -1029,6 +1113,11 @@ class Student(BaseEntity):
     def get_by_email(cls, email):
         return Student.get_by_key_name(email.encode('utf8'))
 
+    @classmethod
+    def get_key_by_email(cls, email):
+        """Returns the key of the student get_by_email() would load."""
+        return db.Key.from_path(cls.kind(), email.encode('utf8'))
+
     @classmethod
     def get_enrolled_student_by_email(cls, email):
         """Returns enrolled student or None."""
@@ -1119,6 +1208,271 @@ class TransientStudent(object):
         return False
 
 
+# The most events a process may hold in EventBuffer; these are lost if the
+# process dies before they are handed over to a task.
+MAX_BUFFERED_EVENTS = 200
+
+# Buffered events of a namespace are handed over to a task once there are this
+# many of them, or once the oldest of them is this old.
+EVENT_BUFFER_FLUSH_SIZE = 50
+EVENT_BUFFER_MAX_AGE_SECS = 10
+
+CAN_BUFFER_EVENTS = ConfigProperty(
+    'gcb_can_buffer_events', bool, (
+        'Whether or not courses can buffer the events they record in memory '
+        'and write them to the datastore in batches from a task. If True, '
+        'individual courses must also turn buffering on in their settings. '
+        'Buffering saves a datastore write per event; in exchange, up to %s '
+        'of the most recent events are lost if the instance holding them '
+        'dies without running its shutdown hook.' % MAX_BUFFERED_EVENTS),
+    False)
+
+EVENT_BUFFER_ADD = PerfCounter(
+    'gcb-models-EventBuffer-add',
+    'A number of events put into the in-process event buffer.')
+EVENT_BUFFER_FULL = PerfCounter(
+    'gcb-models-EventBuffer-full',
+    'A number of events written synchronously because the in-process event '
+    'buffer was full.')
+EVENT_BUFFER_FLUSH = PerfCounter(
+    'gcb-models-EventBuffer-flush',
+    'A number of batches of events handed over from the in-process event '
+    'buffer to a task.')
+EVENT_BUFFER_FLUSH_FAILED = PerfCounter(
+    'gcb-models-EventBuffer-flush-failed',
+    'A number of batches of events written synchronously because they could '
+    'not be handed over to a task.')
+EVENT_BUFFER_EVENTS_WRITTEN = PerfCounter(
+    'gcb-models-EventBuffer-events-written',
+    'A number of buffered events written to the datastore.')
+
+
+class EventBuffer(caching.ProcessScopedSingleton):
+    """Process-scoped buffer of events waiting to be written to datastore.
+
+    Events are kept per namespace. Whenever an event is added, the events of
+    any namespace that has EVENT_BUFFER_FLUSH_SIZE of them, or whose oldest
+    one is EVENT_BUFFER_MAX_AGE_SECS old, are handed over to a deferred task
+    that writes them with one datastore call. The same check runs at the end of
+    every request via flush_aged(), so events do not wait for the next event
+    of their namespace, and flush() hands over all events when the instance
+    shuts down. No more than MAX_BUFFERED_EVENTS are held at once; events that
+    do not fit are not buffered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = {}
+        self._oldest = {}
+        self._size = 0
+
+    @property
+    def size(self):
+        return self._size
+
+    def add(self, namespace, source, user_id, data):
+        """Adds an event to the buffer.
+
+        Args:
+            namespace: a namespace to write the event into
+            source: a source of the event
+            user_id: an id of the user who triggered the event
+            data: a JSON string of the payload of the event
+        Returns:
+            True if the event was buffered; False if the buffer is full and
+            the event must be written by the caller.
+        """
+        now = time.time()
+        with self._lock:
+            if self._size >= MAX_BUFFERED_EVENTS:
+                EVENT_BUFFER_FULL.inc()
+                return False
+            events = self._events.setdefault(namespace, [])
+            if not events:
+                self._oldest[namespace] = now
+            events.append((datetime.datetime.utcnow(), source, user_id, data))
+            self._size += 1
+            EVENT_BUFFER_ADD.inc()
+            batches = self._pop_batches(now, False)
+        for batch_namespace, batch in batches:
+            self._write_behind(batch_namespace, batch)
+        return True
+
+    def flush_aged(self):
+        """Hands over events that are due to be written to tasks."""
+        if not self._size:
+            return
+        self._flush(False)
+
+    def flush(self):
+        """Hands over all buffered events to tasks."""
+        self._flush(True)
+
+    def _flush(self, force):
+        with self._lock:
+            batches = self._pop_batches(time.time(), force)
+        for namespace, batch in batches:
+            self._write_behind(namespace, batch)
+
+    def _pop_batches(self, now, force):
+        batches = []
+        for namespace in self._events.keys():
+            events = self._events[namespace]
+            if (force or len(events) >= EVENT_BUFFER_FLUSH_SIZE or
+                now - self._oldest[namespace] >= EVENT_BUFFER_MAX_AGE_SECS):
+                batches.append((namespace, events))
+                del self._events[namespace]
+                del self._oldest[namespace]
+                self._size -= len(events)
+        return batches
+
+    @db.non_transactional
+    def _write_behind(self, namespace, events):
+        EVENT_BUFFER_FLUSH.inc()
+        with common_utils.Namespace(namespace):
+            try:
+                # pylint: disable=protected-access
+                deferred.defer(EventEntity._put_buffered_events, events)
+            except Exception:  # pylint: disable=broad-except
+                logging.exception(
+                    'Failed to defer writing %s events; writing them now.',
+                    len(events))
+                EVENT_BUFFER_FLUSH_FAILED.inc()
+                # pylint: disable=protected-access
+                EventEntity._put_buffered_events(events)
+
+
+CAN_COMPACT_EVENT_DATA = ConfigProperty(
+    'gcb_can_compact_event_data', bool, (
+        'Whether or not to store the payloads of newly recorded events in a '
+        'compressed binary form, which takes several times less datastore '
+        'space than JSON text. Events are always read back as JSON text, '
+        'whichever form they are stored in. Note that versions of this '
+        'application which predate this setting cannot read compact events.'),
+    False)
+
+EVENT_DATA_COMPACTED = PerfCounter(
+    'gcb-models-EventEntity-data-compacted',
+    'A number of event payloads stored in a compact form.')
+EVENT_DATA_BYTES_SAVED = PerfCounter(
+    'gcb-models-EventEntity-data-bytes-saved',
+    'A number of bytes saved by storing event payloads in a compact form.')
+
+# The first byte of a compact event payload is the version of its format.
+# Formats, and schemas below, are only ever added; stored events use them.
+EVENT_DATA_FORMAT_ZLIB_JSON = 1  # zlib-compressed UTF-8 JSON text
+EVENT_DATA_FORMAT_ZLIB_SCHEMA = 2  # zlib-compressed list of schema values
+
+# Top-level keys of the payloads of frequent event sources; the compact form
+# of such a payload omits the names of the keys. Keys are listed in order of
+# the bits of the mask that tells which of them are present.
+EVENT_DATA_SCHEMAS = {
+    1: ('tag-youtube-event', (
+        'location', 'loc', 'user_agent', 'video_id', 'instance_id',
+        'event_id', 'position', 'data')),
+    2: ('tag-youtube-milestone', (
+        'location', 'loc', 'user_agent', 'video_id', 'instance_id',
+        'event_id', 'position')),
+    3: ('attempt-lesson', (
+        'location', 'loc', 'user_agent', 'type', 'answers',
+        'individualScores', 'score', 'containedTypes', 'quids')),
+    4: ('submit-assessment', ('type', 'values', 'location')),
+    5: ('enter-page', ('location', 'loc', 'user_agent')),
+    6: ('exit-page', ('location', 'loc', 'user_agent')),
+}
+_EVENT_DATA_SCHEMA_IDS = dict(
+    (source, schema_id)
+    for schema_id, (source, _) in EVENT_DATA_SCHEMAS.iteritems())
+
+
+def _encode_event_data_with_schema(source, data):
+    schema_id = _EVENT_DATA_SCHEMA_IDS.get(source)
+    if schema_id is None:
+        return None
+    try:
+        payload = transforms.loads(data)
+    except ValueError:
+        return None
+    if not isinstance(payload, dict):
+        return None
+    mask = 0
+    values = []
+    for index, key in enumerate(EVENT_DATA_SCHEMAS[schema_id][1]):
+        if key in payload:
+            mask |= 1 << index
+            values.append(payload.pop(key))
+    record = [schema_id, mask, values]
+    if payload:
+        record.append(payload)
+    return transforms.dumps(record, separators=(',', ':'))
+
+
+def encode_event_data(source, data):
+    """Encodes the JSON payload of an event in a compact binary form.
+
+    Args:
+        source: the source of the event
+        data: the JSON text of the payload
+    Returns:
+        A db.Blob with the compact form, or the data as is if the compact form
+        is no smaller.
+    """
+    text = data.encode('utf-8')
+    schema_json = _encode_event_data_with_schema(source, data)
+    if schema_json is not None:
+        version = EVENT_DATA_FORMAT_ZLIB_SCHEMA
+        text_to_compress = schema_json.encode('utf-8')
+    else:
+        version = EVENT_DATA_FORMAT_ZLIB_JSON
+        text_to_compress = text
+    blob = chr(version) + zlib.compress(text_to_compress)
+    if len(blob) >= len(text):
+        return data
+    EVENT_DATA_COMPACTED.inc()
+    EVENT_DATA_BYTES_SAVED.inc(len(text) - len(blob))
+    return db.Blob(blob)
+
+
+def decode_event_data(blob):
+    """Decodes the compact form of an event payload back into JSON text."""
+    version = ord(blob[0])
+    text = zlib.decompress(blob[1:]).decode('utf-8')
+    if version == EVENT_DATA_FORMAT_ZLIB_JSON:
+        return text
+    if version == EVENT_DATA_FORMAT_ZLIB_SCHEMA:
+        record = transforms.loads(text)
+        keys = EVENT_DATA_SCHEMAS[record[0]][1]
+        mask = record[1]
+        values = iter(record[2])
+        payload = record[3] if len(record) > 3 else {}
+        for index, key in enumerate(keys):
+            if mask & (1 << index):
+                payload[key] = values.next()
+        return transforms.dumps(payload)
+    raise ValueError('Unknown event data format: %s' % version)
+
+
+class EventDataProperty(db.TextProperty):
+    """A TextProperty of event JSON that may be stored in a compact form.
+
+    Payloads are written in the form made by encode_event_data() while
+    CAN_COMPACT_EVENT_DATA is on, and are always read back as JSON text, so
+    the readers of the property need not know how it was stored.
+    """
+
+    def get_value_for_datastore(self, model_instance):
+        value = super(EventDataProperty, self).get_value_for_datastore(
+            model_instance)
+        if not value or not CAN_COMPACT_EVENT_DATA.value:
+            return value
+        return encode_event_data(model_instance.source, value)
+
+    def make_value_from_datastore(self, value):
+        if isinstance(value, db.Blob):
+            return db.Text(decode_event_data(value))
+        return value
+
+
 class EventEntity(BaseEntity):
     """Generic events.
 
@@ -1131,8 +1485,8 @@ class EventEntity(BaseEntity):
     source = db.StringProperty(indexed=False)
     user_id = db.StringProperty(indexed=False)
 
-    # Each of the following is a string representation of a JSON dict.
-    data = db.TextProperty(indexed=False)
+    # A string representation of a JSON dict; see EventDataProperty.
+    data = EventDataProperty(indexed=False)
 
     # Modules may add functions to this list which will receive notification
     # whenever an event is recorded. The method will be called with the
@@ -1151,16 +1505,69 @@ class EventEntity(BaseEntity):
                     source, user.user_id(), data)
 
     @classmethod
-    def record(cls, source, user, data):
-        """Records new event into a datastore."""
+    def record(cls, source, user, data, buffered=False):
+        """Records new event into a datastore.
+
+        Args:
+          source: the source of the event
+          user: the user who triggered the event
+          data: the JSON string of the payload of the event
+          buffered: whether the event may be held in EventBuffer and written
+              later along with others, instead of being put right away
+        """
         cls._run_record_hooks(source, user, data)
 
+        if buffered and EventBuffer.instance().add(
+                namespace_manager.get_namespace(), source, user.user_id(),
+                data):
+            return
+
         event = cls()
         event.source = source
         event.user_id = user.user_id()
         event.data = data
         event.put()
 
+    @classmethod
+    def record_all_async(cls, user, sources_and_data, buffered=False):
+        """Records new events of a user into a datastore with one async put.
+
+        Args:
+          user: the user who triggered the events
+          sources_and_data: a list of (source, data) pairs, one for each event
+          buffered: whether the events may be held in EventBuffer and written
+              later along with others, instead of being put right away
+        Returns:
+          The RPC of the put; call its get_result() to wait for the events to
+          be written. None if all events were buffered.
+        """
+        events = []
+        for source, data in sources_and_data:
+            cls._run_record_hooks(source, user, data)
+            if buffered and EventBuffer.instance().add(
+                    namespace_manager.get_namespace(), source,
+                    user.user_id(), data):
+                continue
+            event = cls()
+            event.source = source
+            event.user_id = user.user_id()
+            event.data = data
+            events.append(event)
+        if not events:
+            return None
+        return db.put_async(events)
+
+    @classmethod
+    def _put_buffered_events(cls, events):
+        """Writes events handed over by EventBuffer with one datastore call."""
+        entities = []
+        for recorded_on, source, user_id, data in events:
+            entities.append(cls(
+                recorded_on=recorded_on, source=source, user_id=user_id,
+                data=data))
+        db.put(entities)
+        EVENT_BUFFER_EVENTS_WRITTEN.inc(len(entities))
+
     def for_export(self, transform_fn):
         model = super(EventEntity, self).for_export(transform_fn)
         model.user_id = transform_fn(self.user_id)
@@ -1180,6 +1587,114 @@ class StudentAnswersEntity(BaseEntity):
         return db.Key.from_path(cls.kind(), transform_fn(db_key.id_or_name()))
 
 
+CAN_STORE_ANSWERS_PER_ASSESSMENT = ConfigProperty(
+    'gcb_can_store_answers_per_assessment', bool, (
+        'Whether or not to store the answers of a student to each assessment '
+        'in an entity of its own, rather than in one entity holding their '
+        'answers to all assessments, which is read and rewritten whole on '
+        'every submission. Once this is turned on, leave it on: answers '
+        'submitted from then on are no longer stored the old way. Answers '
+        'stored the old way are still read, and take a second read per '
+        'student; the Student Answers Migration job, on the Gradebook tab of '
+        'the Analytics page of each course, copies them so that they are '
+        'read in one.'), False)
+
+
+class StudentAssessmentAnswersEntity(BaseEntity):
+    """Student answers to one assessment, keyed by USER_ID-ASSESSMENT_NAME."""
+
+    updated_on = db.DateTimeProperty(indexed=True)
+    user_id = db.StringProperty(indexed=True)
+    assessment_name = db.StringProperty(indexed=False)
+
+    # A string representation of the JSON answers to the assessment.
+    data = db.TextProperty(indexed=False)
+
+    @classmethod
+    def create_key(cls, user_id, assessment_name):
+        return '%s-%s' % (user_id, assessment_name)
+
+    @classmethod
+    def create(cls, user_id, assessment_name, answers):
+        return cls(
+            key_name=cls.create_key(user_id, assessment_name),
+            updated_on=datetime.datetime.now(), user_id=user_id,
+            assessment_name=str(assessment_name),
+            data=transforms.dumps(answers))
+
+    @classmethod
+    def safe_key(cls, db_key, transform_fn):
+        user_id, assessment_name = db_key.name().split('-', 1)
+        return db.Key.from_path(
+            cls.kind(), cls.create_key(transform_fn(user_id), assessment_name))
+
+    def for_export(self, transform_fn):
+        model = super(StudentAssessmentAnswersEntity, self).for_export(
+            transform_fn)
+        model.user_id = transform_fn(self.user_id)
+        return model
+
+
+class StudentAnswersDAO(object):
+    """Reads answers of students stored either per student or per assessment.
+
+    Answers stored per assessment take precedence over those in the legacy
+    StudentAnswersEntity of a student, so answers need not be migrated
+    before they are read; migrating them only saves reading both.
+    """
+
+    @classmethod
+    def get_all_answers(cls, user_id):
+        """Returns a dict of the answers of a student by assessment name."""
+        legacy_entity = StudentAnswersEntity.get_by_key_name(user_id)
+        answers = {}
+        if legacy_entity and legacy_entity.data:
+            answers = transforms.loads(legacy_entity.data)
+        query = StudentAssessmentAnswersEntity.all().filter(
+            StudentAssessmentAnswersEntity.user_id.name, user_id)
+        for entity in query.run():
+            answers[entity.assessment_name] = transforms.loads(entity.data)
+        return answers
+
+    @classmethod
+    def put_legacy_answers(cls, legacy_entity):
+        """Copies answers absent from per-assessment storage into it.
+
+        Each assessment is copied in a transaction of its own, so answers
+        submitted meanwhile are never overwritten.
+
+        Args:
+            legacy_entity: a StudentAnswersEntity.
+
+        Returns:
+            A pair of the number of assessments copied and of those skipped
+            because their answers were already stored per assessment.
+        """
+        if not legacy_entity.data:
+            return 0, 0
+        user_id = legacy_entity.key().name()
+
+        def put_if_absent(assessment_name, answers):
+            key_name = StudentAssessmentAnswersEntity.create_key(
+                user_id, assessment_name)
+            if StudentAssessmentAnswersEntity.get_by_key_name(key_name):
+                return False
+            entity = StudentAssessmentAnswersEntity.create(
+                user_id, assessment_name, answers)
+            entity.updated_on = legacy_entity.updated_on
+            entity.put()
+            return True
+
+        copied = skipped = 0
+        for assessment_name, answers in transforms.loads(
+                legacy_entity.data).iteritems():
+            if db.run_in_transaction(put_if_absent, assessment_name, answers):
+                copied += 1
+            else:
+                skipped += 1
+        return copied, skipped
+
+
 class StudentPropertyEntity(BaseEntity):
     """A property of a student, keyed by the string STUDENT_ID-PROPERTY_NAME."""
 
@@ -1224,7 +1739,12 @@ class StudentPropertyEntity(BaseEntity):
     @classmethod
     def get(cls, student, property_name):
         """Loads student property."""
-        key = cls.create_key(student.user_id, property_name)
+        return cls.get_by_user_id(student.user_id, property_name)
+
+    @classmethod
+    def get_by_user_id(cls, user_id, property_name):
+        """Loads student property given only the user_id of the student."""
+        key = cls.create_key(user_id, property_name)
         value = MemcacheManager.get(cls._memcache_key(key))
         if NO_OBJECT == value:
             return None
@@ -1236,10 +1756,236 @@ class StudentPropertyEntity(BaseEntity):
                 MemcacheManager.set(cls._memcache_key(key), NO_OBJECT)
         return value
 
+    @classmethod
+    @db.non_transactional
+    def update_by_user_id(
+        cls, user_id, property_name, update_fn, create=False):
+        """Updates a student property in a transaction of its own.
+
+        Args:
+            user_id: the user_id of the student owning the property.
+            property_name: the name of the property.
+            update_fn: called with the property entity; it changes the entity
+                in place, or returns False to leave it as it is.
+            create: whether to call update_fn with a new entity, with no
+                value, if the student has no such property.
+
+        Returns:
+            The entity put, or None if the student has no such property and
+            create is False, or if update_fn left it as it is.
+        """
+        key = cls.create_key(user_id, property_name)
+
+        def update():
+            entity = cls.get_by_key_name(key)
+            if entity is None:
+                if not create:
+                    return None
+                entity = cls(key_name=key, name=property_name)
+            if update_fn(entity) is False:
+                return None
+            super(StudentPropertyEntity, entity).put()
+            return entity
+
+        entity = db.run_in_transaction(update)
+        if entity:
+            MemcacheManager.set(cls._memcache_key(key), entity)
+        return entity
+
+
+# Max total size of objects in the process-scoped cache of DAO objects.
+MAX_DAO_CACHE_SIZE_BYTES = 8 * 1024 * 1024
+
+# Max size of one object in the process-scoped cache of DAO objects.
+MAX_DAO_CACHE_ITEM_SIZE_BYTES = 256 * 1024
+
+# Max age in seconds of the versions of DAO objects read by a request. Code
+# running outside of a request, like deferred tasks, mapreduce and cron
+# threads, never clears the request scope; this bounds how long it can use
+# stale objects from the process-scoped cache.
+MAX_DAO_CACHE_VERSIONS_AGE_SECS = 5
+
+DAO_CACHE_HIT = PerfCounter(
+    'gcb-models-DaoCache-cache-hit',
+    'A number of times an object was found in the process-scoped DAO cache.')
+DAO_CACHE_MISS = PerfCounter(
+    'gcb-models-DaoCache-cache-miss',
+    'A number of times an object was not found in the process-scoped DAO '
+    'cache.')
+DAO_CACHE_STALE = PerfCounter(
+    'gcb-models-DaoCache-cache-stale',
+    'A number of times a stale or expired object was dropped from the '
+    'process-scoped DAO cache.')
+DAO_CACHE_VERSION_GET = PerfCounter(
+    'gcb-models-DaoCache-version-get',
+    'A number of times versions of DAO objects were read from memcache.')
+DAO_CACHE_VERSION_BUMP = PerfCounter(
+    'gcb-models-DaoCache-version-bump',
+    'A number of times a version of DAO objects was changed in memcache.')
+
+
+def _get_snapshot_size(value):
+    """Estimates a number of bytes held by a snapshot of JSON-like data."""
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for key, item in value.iteritems():
+            size += sys.getsizeof(key) + _get_snapshot_size(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            size += _get_snapshot_size(item)
+    return size
+
+
+class ProcessScopedDaoCache(caching.ProcessScopedSingleton):
+    """Process-scoped cache of objects read by BaseJsonDao subclasses.
+
+    Each object is cached along with the version of its kind in its namespace
+    at the time it was read. The versions are kept in memcache and are changed
+    by every write made via BaseJsonDao; cached objects with a different
+    version are dropped when read. See RequestScopedDaoCacheVersions.
+    """
+
+    @classmethod
+    def get_cache_len(cls):
+        # pylint: disable=protected-access
+        return len(ProcessScopedDaoCache.instance()._cache.items.keys())
+
+    @classmethod
+    def get_cache_size(cls):
+        # pylint: disable=protected-access
+        return ProcessScopedDaoCache.instance()._cache.total_size
+
+    def __init__(self):
+        self._cache = caching.LRUCache(
+            max_size_bytes=MAX_DAO_CACHE_SIZE_BYTES,
+            max_item_size_bytes=MAX_DAO_CACHE_ITEM_SIZE_BYTES)
+        self._cache.get_entry_size = self._get_entry_size
+        self.kinds = set()
+
+    def _get_entry_size(self, key, value):
+        version, unused_expires_on, data = value
+        return (
+            sys.getsizeof(key) + sys.getsizeof(version) +
+            _get_snapshot_size(data))
+
+    def get(self, namespace, kind, key):
+        """Gets an object if it is cached and up to date.
+
+        Args:
+            namespace: a namespace of the object
+            kind: a kind of the object
+            key: a memcache key of the object
+        Returns:
+            a tuple of a flag whether the object was found, and the object
+        """
+        self.kinds.add(kind)
+        version = RequestScopedDaoCacheVersions.instance().get(namespace, kind)
+        _key = (namespace, kind, key)
+        found, entry = self._cache.get(_key)
+        if not found:
+            DAO_CACHE_MISS.inc()
+            return False, None
+        entry_version, expires_on, data = entry
+        if entry_version != version or expires_on < time.time():
+            DAO_CACHE_STALE.inc()
+            self._cache.delete(_key)
+            return False, None
+        DAO_CACHE_HIT.inc()
+        return True, data
+
+    def put(self, namespace, kind, key, data):
+        """Puts an object read from memcache or datastore during this request.
+
+        Objects are kept for as long as memcache keeps them, so writes not
+        made via BaseJsonDao are not seen for any longer than they used to be.
+
+        Args:
+            namespace: a namespace of the object
+            kind: a kind of the object
+            key: a memcache key of the object
+            data: an immutable object to cache
+        """
+        version = RequestScopedDaoCacheVersions.instance().get(namespace, kind)
+        self._cache.put(
+            (namespace, kind, key),
+            (version, time.time() + DEFAULT_CACHE_TTL_SECS, data))
+
+
+class RequestScopedDaoCacheVersions(caching.RequestScopedSingleton):
+    """Versions of the objects in ProcessScopedDaoCache as of this request.
+
+    The versions of all kinds cached by this process are read from memcache
+    with a single call, when the first object of a namespace is needed in the
+    current request. A missing version, for example one evicted from memcache,
+    is replaced with a new version, which makes stale all objects cached with
+    the old one. The versions of a namespace are read again once they are older
+    than MAX_DAO_CACHE_VERSIONS_AGE_SECS, even if the request scope is never
+    cleared.
+    """
+
+    def __init__(self):
+        self._versions = {}
+
+    @classmethod
+    def _memcache_key(cls, kind):
+        return '(entity-version:%s)' % kind
+
+    @classmethod
+    def _set_new_version(cls, namespace, kind):
+        version = uuid.uuid4().hex
+        MemcacheManager.set(
+            cls._memcache_key(kind), version, ttl=0, namespace=namespace)
+        return version
+
+    def _get_namespace_versions(self, namespace):
+        now = time.time()
+        read_on, versions = self._versions.get(namespace, (None, None))
+        if read_on is None or now - read_on > MAX_DAO_CACHE_VERSIONS_AGE_SECS:
+            versions = {}
+            self._versions[namespace] = (now, versions)
+        return versions
+
+    def get(self, namespace, kind):
+        versions = self._get_namespace_versions(namespace)
+        if kind not in versions:
+            known_kinds = ProcessScopedDaoCache.instance().kinds.union([kind])
+            kinds = [_kind for _kind in known_kinds if _kind not in versions]
+            DAO_CACHE_VERSION_GET.inc()
+            found = MemcacheManager.get_multi(
+                [self._memcache_key(_kind) for _kind in kinds],
+                namespace=namespace)
+            for _kind in kinds:
+                version = found.get(self._memcache_key(_kind))
+                if version is None:
+                    version = self._set_new_version(namespace, _kind)
+                versions[_kind] = version
+        return versions[kind]
+
+    def bump(self, namespace, kind):
+        """Makes stale all objects of a kind cached by all processes."""
+        DAO_CACHE_VERSION_BUMP.inc()
+        self._get_namespace_versions(namespace)[kind] = (
+            self._set_new_version(namespace, kind))
+
+
+DAO_CACHE_LEN = PerfCounter(
+    'gcb-models-DaoCache-cache-len',
+    'A total number of items in the process-scoped DAO cache.')
+DAO_CACHE_SIZE_BYTES = PerfCounter(
+    'gcb-models-DaoCache-cache-bytes',
+    'A total size of items in the process-scoped DAO cache in bytes.')
+
+DAO_CACHE_LEN.poll_value = ProcessScopedDaoCache.get_cache_len
+DAO_CACHE_SIZE_BYTES.poll_value = ProcessScopedDaoCache.get_cache_size
+
 
 class BaseJsonDao(object):
     """Base DAO class for entities storing their data in a single JSON blob."""
 
+    # Whether to keep objects in ProcessScopedDaoCache in front of memcache;
+    # best for small objects that are read on most requests but rarely change.
+    PROCESS_CACHE = False
+
     class EntityKeyTypeId(object):
 
         @classmethod
@@ -1273,10 +2019,62 @@ class BaseJsonDao(object):
         return '(entity-get-all:%s)' % cls.ENTITY.kind()
 
     @classmethod
-    def get_all_mapped(cls):
+    def _use_process_cache(cls):
+        return cls.PROCESS_CACHE and CAN_USE_MEMCACHE.value
+
+    @classmethod
+    def _process_cache_get(cls, memcache_key):
+        if not cls._use_process_cache():
+            return False, None
+        return ProcessScopedDaoCache.instance().get(
+            MemcacheManager.get_namespace(), cls.ENTITY.kind(), memcache_key)
+
+    @classmethod
+    def _process_cache_put(cls, memcache_key, data):
+        if cls._use_process_cache():
+            ProcessScopedDaoCache.instance().put(
+                MemcacheManager.get_namespace(), cls.ENTITY.kind(),
+                memcache_key, data)
+
+    @classmethod
+    def _process_cache_bump_version(cls):
+        if cls._use_process_cache():
+            RequestScopedDaoCacheVersions.instance().bump(
+                MemcacheManager.get_namespace(), cls.ENTITY.kind())
+
+    @classmethod
+    def get_all_mapped(cls, frozen=False):
+        """Returns a dict of all DTOs of a given type keyed by their ids.
+
+        Args:
+            frozen: whether to return an immutable snapshot of the dict; the
+                DTOs in such snapshot are shared with other readers and must
+                not be modified; not supported for DAOs with post-load hooks
+        Returns:
+            a dict of DTOs keyed by DTO id
+        """
+        if frozen and getattr(cls, 'POST_LOAD_HOOKS', None):
+            raise ValueError(
+                'Frozen snapshots are not supported for DAOs with post-load '
+                'hooks.')
+
+        # try to get from process cache
+        is_cached, dicts = cls._process_cache_get(cls._memcache_all_key())
+        if is_cached:
+            if frozen:
+                return caching.FrozenDict(
+                    (dto_id, cls.DTO(dto_id, the_dict))
+                    for dto_id, the_dict in dicts.iteritems())
+            result = {
+                dto_id: cls.DTO(dto_id, caching.thaw(the_dict))
+                for dto_id, the_dict in dicts.iteritems()}
+            cls._maybe_apply_post_load_hooks(result.itervalues())
+            return result
+
         # try to get from memcache
-        entities = MemcacheManager.get(cls._memcache_all_key())
+        entities = MemcacheManager.get(cls._memcache_all_key(), frozen=frozen)
         if entities is not None and entities != NO_OBJECT:
+            cls._put_all_into_process_cache(entities)
             cls._maybe_apply_post_load_hooks(entities.itervalues())
             return entities
 
@@ -1287,11 +2085,22 @@ class BaseJsonDao(object):
         result_to_cache = NO_OBJECT
         if result:
             result_to_cache = result
+            cls._put_all_into_process_cache(result)
         MemcacheManager.set(cls._memcache_all_key(), result_to_cache)
 
         cls._maybe_apply_post_load_hooks(result.itervalues())
+        if frozen:
+            return caching.freeze(result)
         return result
 
+    @classmethod
+    def _put_all_into_process_cache(cls, dtos):
+        """Caches data of all DTOs; must be called before post-load hooks."""
+        if cls._use_process_cache():
+            cls._process_cache_put(cls._memcache_all_key(), caching.FrozenDict(
+                (dto_id, caching.freeze(dto.dict))
+                for dto_id, dto in dtos.iteritems()))
+
     @classmethod
     def get_all(cls):
         return cls.get_all_mapped().values()
@@ -1366,27 +2175,54 @@ class BaseJsonDao(object):
         return entity
 
     @classmethod
-    def load(cls, obj_id):
+    def _load_data(cls, obj_id):
+        """Loads JSON data of an object, or NO_OBJECT if there is none."""
+        memcache_key = cls._memcache_key(obj_id)
+        is_cached, data = cls._process_cache_get(memcache_key)
+        if is_cached:
+            return data
         entity = cls._load_entity(obj_id)
-        if entity:
-            dto = cls.DTO(obj_id, transforms.loads(entity.data))
-            cls._maybe_apply_post_load_hooks([dto])
-            return dto
-        else:
+        data = entity.data if entity else NO_OBJECT
+        cls._process_cache_put(memcache_key, data)
+        return data
+
+    @classmethod
+    def load(cls, obj_id):
+        if not obj_id:
+            return None
+        data = cls._load_data(obj_id)
+        if NO_OBJECT == data:
             return None
+        dto = cls.DTO(obj_id, transforms.loads(data))
+        cls._maybe_apply_post_load_hooks([dto])
+        return dto
 
     @classmethod
     @appengine_config.timeandlog('Models.bulk_load')
     def bulk_load(cls, obj_id_list):
+        both_keys = [
+            (obj_id, cls._memcache_key(obj_id)) for obj_id in obj_id_list]
+
+        # fetch from process cache
+        cached_data = {}
+        for obj_id, memcache_key in both_keys:
+            is_cached, data = cls._process_cache_get(memcache_key)
+            if is_cached:
+                cached_data[obj_id] = data
+
         # fetch from memcache
-        memcache_keys = [cls._memcache_key(obj_id) for obj_id in obj_id_list]
-        memcache_entities = MemcacheManager.get_multi(memcache_keys)
+        memcache_keys = [
+            memcache_key for obj_id, memcache_key in both_keys
+            if obj_id not in cached_data]
+        memcache_entities = {}
+        if memcache_keys:
+            memcache_entities = MemcacheManager.get_multi(memcache_keys)
 
         # fetch missing from datastore
-        both_keys = zip(obj_id_list, memcache_keys)
         datastore_keys = [
             obj_id for obj_id, memcache_key in both_keys
-            if memcache_key not in memcache_entities]
+            if obj_id not in cached_data and
+            memcache_key not in memcache_entities]
         if datastore_keys:
             datastore_entities = dict(zip(
                 datastore_keys, db.get([
@@ -1401,20 +2237,30 @@ class BaseJsonDao(object):
         dtos_for_post_hooks = []
         for obj_id, memcache_key in both_keys:
             entity = datastore_entities.get(obj_id)
-            if entity is not None:
+            if obj_id in cached_data:
+                data = cached_data[obj_id]
+                if NO_OBJECT == data:
+                    ret.append(None)
+                else:
+                    ret.append(cls.DTO(obj_id, transforms.loads(data)))
+            elif entity is not None:
                 dto = cls.DTO(obj_id, transforms.loads(entity.data))
                 ret.append(dto)
                 dtos_for_post_hooks.append(dto)
                 memcache_update[memcache_key] = entity
+                cls._process_cache_put(memcache_key, entity.data)
             elif memcache_key not in memcache_entities:
                 ret.append(None)
                 memcache_update[memcache_key] = NO_OBJECT
+                cls._process_cache_put(memcache_key, NO_OBJECT)
             else:
                 entity = memcache_entities[memcache_key]
                 if NO_OBJECT == entity:
                     ret.append(None)
+                    cls._process_cache_put(memcache_key, NO_OBJECT)
                 else:
                     ret.append(cls.DTO(obj_id, transforms.loads(entity.data)))
+                    cls._process_cache_put(memcache_key, entity.data)
 
         # run hooks
         cls._maybe_apply_post_load_hooks(dtos_for_post_hooks)
@@ -1445,6 +2291,7 @@ class BaseJsonDao(object):
         MemcacheManager.delete(cls._memcache_all_key())
         id_or_name = entity.key().id_or_name()
         MemcacheManager.set(cls._memcache_key(id_or_name), entity)
+        cls._process_cache_bump_version()
         cls._maybe_apply_post_save_hooks([(id_or_name, dto)])
         return id_or_name
 
@@ -1461,6 +2308,7 @@ class BaseJsonDao(object):
         MemcacheManager.delete(cls._memcache_all_key())
         for key, entity in zip(keys, entities):
             MemcacheManager.set(cls._memcache_key(key.id_or_name()), entity)
+        cls._process_cache_bump_version()
 
         id_or_name_list = [key.id_or_name() for key in keys]
         cls._maybe_apply_post_save_hooks(zip(id_or_name_list, dtos))
@@ -1472,6 +2320,7 @@ class BaseJsonDao(object):
         entity.delete()
         MemcacheManager.delete(cls._memcache_all_key())
         MemcacheManager.delete(cls._memcache_key(entity.key().id_or_name()))
+        cls._process_cache_bump_version()
 
     @classmethod
     def clone(cls, dto):
@@ -1540,6 +2389,7 @@ class QuestionDAO(LastModfiedJsonDao):
     DTO = QuestionDTO
     ENTITY = QuestionEntity
     ENTITY_KEY_TYPE = BaseJsonDao.EntityKeyTypeId
+    PROCESS_CACHE = True
     # Enable other modules to add post-load transformations
     POST_LOAD_HOOKS = []
     # Enable other modules to add post-save transformations
@@ -1850,6 +2700,7 @@ class QuestionGroupDAO(LastModfiedJsonDao):
     DTO = QuestionGroupDTO
     ENTITY = QuestionGroupEntity
     ENTITY_KEY_TYPE = BaseJsonDao.EntityKeyTypeId
+    PROCESS_CACHE = True
     # Enable other modules to add post-load transformations
     POST_LOAD_HOOKS = []
     # Enable other modules to add post-save transformations
@@ -1949,9 +2800,7 @@ class LabelManager(caching.RequestScopedSingleton):
         self._key_to_label = None
 
     def _preload(self):
-        self._key_to_label = {}
-        for row in LabelDAO.get_all_iter():
-            self._key_to_label[row.id] = row
+        self._key_to_label = LabelDAO.get_all_mapped(frozen=True)
 
     def _get_all(self):
         if self._key_to_label is None:
@@ -1968,6 +2817,7 @@ class LabelDAO(BaseJsonDao):
     DTO = LabelDTO
     ENTITY = LabelEntity
     ENTITY_KEY_TYPE = BaseJsonDao.EntityKeyTypeId
+    PROCESS_CACHE = True
 
     @classmethod
     def get_all(cls):
@@ -2012,12 +2862,79 @@ class LabelDAO(BaseJsonDao):
         try:
             items = cls._apply_labels_to_student_labels(
                 LabelDTO.LABEL_TYPE_COURSE_TRACK, student, items)
+            return cls._apply_course_locale_labels_to_student_labels(
+                course, student, items)
+        finally:
+            MemcacheManager.end_readonly()
+
+    @classmethod
+    def apply_course_locale_labels_to_student_labels(
+        cls, course, student, items):
+        MemcacheManager.begin_readonly()
+        try:
+            return cls._apply_course_locale_labels_to_student_labels(
+                course, student, items)
+        finally:
+            MemcacheManager.end_readonly()
+
+    @classmethod
+    def _apply_course_locale_labels_to_student_labels(
+        cls, course, student, items):
+        if course.get_course_setting('can_student_change_locale'):
+            return cls._apply_locale_labels_to_locale(
+                course.app_context.get_current_locale(), items)
+        else:
+            return cls._apply_labels_to_student_labels(
+                LabelDTO.LABEL_TYPE_LOCALE, student, items)
+
+    @classmethod
+    def get_track_ids_and_student_track_ids(cls, student):
+        """Gets ids of all course track labels and of those on the student.
+
+        Args:
+          student: the logged-in Student matching the user for this request.
+        Returns:
+          A pair of sets: the ids of all labels of the course track type, and
+          the ids of those the student has, which is empty for a transient
+          student.
+        """
+        MemcacheManager.begin_readonly()
+        try:
+            track_ids = cls.get_set_of_ids_of_type(
+                LabelDTO.LABEL_TYPE_COURSE_TRACK)
+            if student and not student.is_transient:
+                return track_ids, student.get_labels_of_type(
+                    LabelDTO.LABEL_TYPE_COURSE_TRACK)
+            return track_ids, set()
+        finally:
+            MemcacheManager.end_readonly()
+
+    @classmethod
+    def get_course_locale_labels_key(cls, course, student):
+        """Gets all apply_course_locale_labels_to_student_labels depends on.
+
+        Args:
+          course: the course whose items are being filtered.
+          student: the logged-in Student matching the user for this request.
+        Returns:
+          A tuple; items are filtered the same way for any two calls giving
+          equal tuples.
+        """
+        MemcacheManager.begin_readonly()
+        try:
             if course.get_course_setting('can_student_change_locale'):
-                return cls._apply_locale_labels_to_locale(
-                    course.app_context.get_current_locale(), items)
-            else:
-                return cls._apply_labels_to_student_labels(
-                    LabelDTO.LABEL_TYPE_LOCALE, student, items)
+                return (
+                    course.app_context.get_current_locale(),
+                    sorted((label.id, label.title) for label in
+                           cls.get_all_of_type(LabelDTO.LABEL_TYPE_LOCALE)))
+            student_label_ids = set()
+            if student and not student.is_transient:
+                student_label_ids = student.get_labels_of_type(
+                    LabelDTO.LABEL_TYPE_LOCALE)
+            return (
+                None,
+                sorted(cls.get_set_of_ids_of_type(LabelDTO.LABEL_TYPE_LOCALE)),
+                sorted(student_label_ids))
         finally:
             MemcacheManager.end_readonly()
 
@@ -2181,3 +3098,4 @@ class RoleDAO(BaseJsonDao):
     DTO = RoleDTO
     ENTITY = RoleEntity
     ENTITY_KEY_TYPE = BaseJsonDao.EntityKeyTypeId
+    PROCESS_CACHE = True
@@ -19,11 +19,13 @@ __author__ = 'Sean Lip (sll@google.com)'
 import datetime
 import logging
 import os
+import threading
 from collections import defaultdict
 
 import courses
 import transforms
 
+from common import caching
 from common import utils
 from models import QuestionDAO
 from models import QuestionGroupDAO
@@ -37,6 +39,180 @@ TRACKABLE_COMPONENTS = [
     'question-group',
 ]
 
+# Max number of lists of course children kept by ProcessScopedRollupCache.
+MAX_CACHED_ROLLUP_CHILD_KEYS = 256
+
+
+class ProcessScopedRollupCache(caching.ProcessScopedSingleton):
+    """Process-scoped cache of the course children counted by roll-ups.
+
+    A roll-up in the progress of a student holds only counts and the version
+    of the course and the student's track it was made for. The keys of the
+    units and assessments counted toward course completion are the same for
+    all students with the same version, so they are kept here once per
+    namespace and version, rather than in the progress of every student.
+    """
+
+    def __init__(self):
+        self._cache = caching.LRUCache(
+            max_item_count=MAX_CACHED_ROLLUP_CHILD_KEYS)
+        self._lock = threading.Lock()
+
+    def get_course_child_keys(self, namespace, version, make_child_keys):
+        """Gets the set of course child keys, making it if not cached."""
+        with self._lock:
+            found, child_keys = self._cache.get((namespace, version))
+        if not found:
+            child_keys = frozenset(make_child_keys())
+            with self._lock:
+                self._cache.put((namespace, version), child_keys)
+        return child_keys
+
+
+class ProgressDocument(object):
+    """A dict of student progress decoded once from a StudentPropertyEntity.
+
+    Trackers used to decode the JSON value of the entity on every read and to
+    encode it again on every write, which a single completion event cascading
+    up through its lesson, unit and course did dozens of times. A document
+    decodes the value when made and encodes it again only if it was changed,
+    when the value is read via the document or the document is put().
+    """
+
+    def __init__(self, entity):
+        self._entity = entity
+        self._dict = {}
+        self._dirty_keys = set()
+        if entity.value:
+            self._dict = transforms.loads(entity.value)
+
+    @classmethod
+    def wrap(cls, progress):
+        """Makes a document of an entity; a document is returned as is."""
+        if isinstance(progress, ProgressDocument):
+            return progress
+        return cls(progress)
+
+    @property
+    def entity(self):
+        return self._entity
+
+    @property
+    def value(self):
+        """Returns the JSON value of the entity with all changes applied."""
+        self.flush()
+        return self._entity.value
+
+    def is_dirty(self):
+        return bool(self._dirty_keys)
+
+    def get(self, key, default=None):
+        return self._dict.get(key, default)
+
+    def __getitem__(self, key):
+        return self._dict[key]
+
+    def __contains__(self, key):
+        return key in self._dict
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def set(self, key, value):
+        if key not in self._dict or self._dict[key] != value:
+            self._dict[key] = value
+            self._dirty_keys.add(key)
+
+    def inc(self, key, value=1):
+        self.set(key, self._dict.get(key, 0) + value)
+
+    def flush(self):
+        """Encodes changes into the value of the entity; does not put it."""
+        if self._dirty_keys:
+            self._entity.value = transforms.dumps(self._dict)
+            self._dirty_keys = set()
+
+    def put(self):
+        self.flush()
+        self._entity.put()
+
+
+class ScoreSummary(object):
+    """What Course.get_all_scores() needs of a student besides the scores.
+
+    The summary lists the ids of the graded units, i.e. assessments and
+    custom units, the student has completed and, by unit id, how many reviews
+    the student has completed for peer-reviewed units. It is kept up to date
+    as units are completed and reviews are written, which spares reading the
+    scores of a student its progress and its review steps. Completions made
+    before the summary existed are merged in from the progress when the
+    summary is first read; is_made_from_progress tells whether that was done.
+    """
+
+    PROPERTY_KEY = 'score-summary'
+
+    def __init__(self, entity):
+        self._entity = entity
+        value = transforms.loads(entity.value) if entity.value else {}
+        self.completed_unit_ids = set(value.get('completed', []))
+        self.completed_review_counts = value.get('reviews', {})
+        self.is_made_from_progress = value.get('progress', False)
+
+    @classmethod
+    def create(cls, user_id):
+        return cls(StudentPropertyEntity(
+            key_name=StudentPropertyEntity.create_key(
+                user_id, cls.PROPERTY_KEY),
+            name=cls.PROPERTY_KEY))
+
+    @classmethod
+    def get(cls, user_id):
+        """Returns the summary of a student, or None if it was never put."""
+        entity = StudentPropertyEntity.get_by_user_id(
+            user_id, cls.PROPERTY_KEY)
+        return cls(entity) if entity else None
+
+    @classmethod
+    def update(cls, user_id, update_fn):
+        """Applies update_fn(summary) to the summary of a student.
+
+        The summary is read, changed and put in one transaction, and is made
+        if the student has none. update_fn returns False if it left the
+        summary as it is; it is tried on the cached summary first so that no
+        transaction is run for events already recorded, such as another
+        submission of an assessment.
+
+        Returns:
+            The summary as update_fn left it.
+        """
+        summary = cls.get(user_id)
+        if summary is not None and update_fn(summary) is False:
+            return summary
+
+        updated = []
+
+        def update_entity(entity):
+            summary = cls(entity)
+            updated[:] = [summary]
+            if update_fn(summary) is False:
+                return False
+            summary.flush()
+
+        StudentPropertyEntity.update_by_user_id(
+            user_id, cls.PROPERTY_KEY, update_entity, create=True)
+        return updated[0]
+
+    def get_completed_review_count(self, unit_id):
+        """Returns the count for a unit, or None if it is not known."""
+        return self.completed_review_counts.get(str(unit_id))
+
+    def flush(self):
+        self._entity.value = transforms.dumps({
+            'completed': sorted(self.completed_unit_ids),
+            'reviews': self.completed_review_counts,
+            'progress': self.is_made_from_progress})
+        self._entity.updated_on = datetime.datetime.now()
+
 
 class UnitLessonCompletionTracker(object):
     """Tracks student completion for a unit/lesson-based linear course."""
@@ -101,14 +277,99 @@ class UnitLessonCompletionTracker(object):
         EVENT_CODE_MAPPING['custom_unit']
     ]
 
+    # The key of the roll-up of the progress of a student. It holds counts of
+    # the completed children of each unit and of the course, which spare each
+    # event the checking of all lessons of a unit and all units of a course.
+    # It is not a progress element; code iterating over progress must skip it.
+    ROLLUP_KEY = 'rollup'
+
+    # Hooks called as hook(course, student, progress, event_entity, event_key)
+    # before the progress is put. The progress is a ProgressDocument, which is
+    # meant to be read via the status methods of this class.
     POST_UPDATE_PROGRESS_HOOK = []
 
     def __init__(self, course):
         self._course = course
+        self._batch = None  # ProgressDocuments by user id between batch calls
+        self._batch_user_ids_to_put = set()
+        self._batch_completed_unit_ids = defaultdict(set)
 
     def _get_course(self):
         return self._course
 
+    def begin_batch(self):
+        """Starts keeping progress in memory for put_batch() to put at once.
+
+        Until end_batch() is called, events recorded for a student update a
+        single ProgressDocument of theirs, which is put only by put_batch().
+        """
+        self._batch = {}
+        self._batch_user_ids_to_put = set()
+        self._batch_completed_unit_ids = defaultdict(set)
+
+    def put_batch(self):
+        """Puts the progress of students changed since begin_batch()."""
+        for user_id in self._batch_user_ids_to_put:
+            self._batch[user_id].put()
+        self._batch_user_ids_to_put = set()
+        for user_id, unit_ids in self._batch_completed_unit_ids.iteritems():
+            self._put_completed_unit_ids(user_id, unit_ids)
+        self._batch_completed_unit_ids = defaultdict(set)
+
+    def end_batch(self):
+        """Stops batching; changes not put by put_batch() are discarded."""
+        self._batch = None
+        self._batch_user_ids_to_put = set()
+        self._batch_completed_unit_ids = defaultdict(set)
+
+    def _get_progress_document(self, student):
+        if self._batch is None:
+            return ProgressDocument(self.get_or_create_progress(student))
+        document = self._batch.get(student.user_id)
+        if document is None:
+            document = ProgressDocument(self.get_or_create_progress(student))
+            self._batch[student.user_id] = document
+        return document
+
+    def _put_progress_document(self, student, progress):
+        progress.entity.updated_on = datetime.datetime.now()
+        if self._batch is None:
+            progress.put()
+        else:
+            self._batch_user_ids_to_put.add(student.user_id)
+
+    @classmethod
+    def _put_completed_unit_ids(cls, user_id, unit_ids):
+        def update(summary):
+            if unit_ids <= summary.completed_unit_ids:
+                return False
+            summary.completed_unit_ids.update(unit_ids)
+
+        ScoreSummary.update(user_id, update)
+
+    def _put_score_summary_unit_completed(self, student, unit_id):
+        """Adds a completed assessment or custom unit to the score summary."""
+        if student.is_transient:
+            return
+        if self._batch is None:
+            self._put_completed_unit_ids(student.user_id, set([str(unit_id)]))
+        else:
+            self._batch_completed_unit_ids[student.user_id].add(str(unit_id))
+
+    @classmethod
+    def put_score_summary_review_count(cls, user_id, unit_id, review_count):
+        """Records in the score summary the reviews completed for a unit."""
+        def update(summary):
+            if summary.get_completed_review_count(unit_id) == review_count:
+                return False
+            summary.completed_review_counts[str(unit_id)] = review_count
+
+        ScoreSummary.update(user_id, update)
+
+    @classmethod
+    def get_score_summary(cls, student):
+        return ScoreSummary.get(student.user_id)
+
     def get_activity_as_python(self, unit_id, lesson_id):
         """Gets the corresponding activity as a Python object."""
         root_name = 'activity'
@@ -497,28 +758,18 @@ class UnitLessonCompletionTracker(object):
                 'Error: %s, data: %s', e, content)
             return {}
 
-    def _update_course(self, progress, student):
+    def _update_course(self, progress, unused_student):
         event_key = self._get_course_key()
         if self._get_entity_value(progress, event_key) == self.COMPLETED_STATE:
             return
 
         self._set_entity_value(progress, event_key, self.IN_PROGRESS_STATE)
-        course = self._get_course()
-        for unit in course.get_track_matching_student(student):
-            if course.get_parent_unit(unit.unit_id):
-                # Completion of an assessment-as-lesson rolls up to its
-                # containing unit; it is not considered for overall course
-                # completion (except insofar as assessment completion
-                # contributes to the completion of its owning unit)
-                pass
-            else:
-                if unit.type == verify.UNIT_TYPE_ASSESSMENT:
-                    if not self.is_assessment_completed(progress, unit.unit_id):
-                        return
-                elif unit.type == verify.UNIT_TYPE_UNIT:
-                    unit_state = self.get_unit_status(progress, unit.unit_id)
-                    if unit_state != self.COMPLETED_STATE:
-                        return
+
+        # Check if all units and assessments on the track of the student
+        # have been completed.
+        completed, required = progress.get(self.ROLLUP_KEY)['course']
+        if completed < required:
+            return
         self._set_entity_value(progress, event_key, self.COMPLETED_STATE)
 
     def _update_course_forced(self, progress):
@@ -529,9 +780,7 @@ class UnitLessonCompletionTracker(object):
 
     def _update_unit(self, progress, event_key):
         """Updates a unit's progress if all its lessons have been completed."""
-        split_event_key = event_key.split('.')
-        assert len(split_event_key) == 2
-        unit_id = split_event_key[1]
+        assert len(event_key.split('.')) == 2
 
         if self._get_entity_value(progress, event_key) == self.COMPLETED_STATE:
             return
@@ -539,23 +788,10 @@ class UnitLessonCompletionTracker(object):
         # Record that at least one lesson in this unit has been completed.
         self._set_entity_value(progress, event_key, self.IN_PROGRESS_STATE)
 
-        # Check if all lessons in this unit have been completed.
-        lessons = self._get_course().get_lessons(unit_id)
-        for lesson in lessons:
-            if (self.get_lesson_status(
-                    progress,
-                    unit_id, lesson.lesson_id) != self.COMPLETED_STATE):
-                return
-
-        # Check whether pre/post assessments in this unit have been completed.
-        unit = self._get_course().find_unit_by_id(unit_id)
-        pre_assessment_id = unit.pre_assessment
-        if (pre_assessment_id and
-            not self.get_assessment_status(progress, pre_assessment_id)):
-            return
-        post_assessment_id = unit.post_assessment
-        if (post_assessment_id and
-            not self.get_assessment_status(progress, post_assessment_id)):
+        # Check if all lessons and pre/post assessments in this unit have been
+        # completed.
+        counts = progress.get(self.ROLLUP_KEY)['units'].get(event_key)
+        if not counts or counts[0] < counts[1]:
             return
 
         # Record that all lessons in this unit have been completed.
@@ -641,16 +877,112 @@ class UnitLessonCompletionTracker(object):
         self._set_entity_value(progress, event_key, self.COMPLETED_STATE)
 
     def _update_custom_unit(self, student, event_key, state):
-        """Update custom unit."""
+        """Update custom unit; returns whether its state was changed."""
         if student.is_transient:
-            return
-        progress = self.get_or_create_progress(student)
+            return False
+        progress = self._get_progress_document(student)
         current_state = self._get_entity_value(progress, event_key)
         if current_state == state or current_state == self.COMPLETED_STATE:
-            return
+            return False
         self._set_entity_value(progress, event_key, state)
-        progress.updated_on = datetime.datetime.now()
-        progress.put()
+        self._put_progress_document(student, progress)
+        return True
+
+    def _is_key_completed(self, progress, event_key):
+        value = self._get_entity_value(progress, event_key)
+        if self.determine_if_composite_entity(event_key):
+            return value == self.COMPLETED_STATE
+        return value is not None and value > 0
+
+    def _get_unit_child_keys(self, unit):
+        """Gets keys of the lessons and pre/post assessments of a unit."""
+        child_keys = [
+            self._get_lesson_key(unit.unit_id, lesson.lesson_id)
+            for lesson in self._get_course().get_lessons(unit.unit_id)]
+        for assessment_id in (unit.pre_assessment, unit.post_assessment):
+            if assessment_id:
+                child_keys.append(self._get_assessment_key(assessment_id))
+        return child_keys
+
+    def _get_course_child_keys(self, student):
+        """Gets keys of the units and assessments on the student's track."""
+        course = self._get_course()
+        child_keys = []
+        for unit in course.get_track_matching_student(student):
+            if course.get_parent_unit(unit.unit_id):
+                # Completion of an assessment-as-lesson rolls up to its
+                # containing unit; it is not considered for overall course
+                # completion (except insofar as assessment completion
+                # contributes to the completion of its owning unit)
+                pass
+            elif unit.type == verify.UNIT_TYPE_ASSESSMENT:
+                child_keys.append(self._get_assessment_key(unit.unit_id))
+            elif unit.type == verify.UNIT_TYPE_UNIT:
+                child_keys.append(self._get_unit_key(unit.unit_id))
+        return child_keys
+
+    def _get_rollup_course_child_keys(self, student, version):
+        return ProcessScopedRollupCache.instance().get_course_child_keys(
+            self._get_course().app_context.get_namespace_name(), version,
+            lambda: self._get_course_child_keys(student))
+
+    def _make_rollup(self, progress, student, version):
+        """Counts completed children of all units and the course anew."""
+        def count(child_keys):
+            completed = len([
+                key for key in child_keys
+                if self._is_key_completed(progress, key)])
+            return [completed, len(child_keys)]
+
+        units = {}
+        for unit in self._get_course().get_units():
+            if unit.type == verify.UNIT_TYPE_UNIT:
+                units[self._get_unit_key(unit.unit_id)] = count(
+                    self._get_unit_child_keys(unit))
+        return {
+            'version': version,
+            'units': units,
+            'course': count(self._get_rollup_course_child_keys(
+                student, version)),
+        }
+
+    def _update_rollup(self, progress, student):
+        """Remakes the roll-up if the course or the student's track changed.
+
+        Args:
+          progress: the ProgressDocument of the student
+          student: the student
+        """
+        version = self._get_course().get_track_matching_student_key(student)
+        rollup = progress.get(self.ROLLUP_KEY)
+        # Roll-ups used to carry the course child keys; drop such copies.
+        if (not rollup or rollup.get('version') != version or
+            'course_child_keys' in rollup):
+            progress.set(
+                self.ROLLUP_KEY, self._make_rollup(progress, student, version))
+
+    def _count_completed_child(self, student, progress, event_key):
+        """Counts a newly completed child in the roll-up of its container."""
+        rollup = progress.get(self.ROLLUP_KEY)
+        parent_key = '.'.join(event_key.split('.')[:-2])
+        if parent_key:
+            counts = rollup['units'].get(parent_key)
+            if not counts:
+                return
+            unit = self._get_course().find_unit_by_id(
+                parent_key.split('.')[1])
+            if event_key not in self._get_unit_child_keys(unit):
+                return
+            units = dict(rollup['units'])
+            units[parent_key] = [counts[0] + 1, counts[1]]
+            rollup = dict(rollup, units=units)
+        else:
+            if event_key not in self._get_rollup_course_child_keys(
+                    student, rollup['version']):
+                return
+            counts = rollup['course']
+            rollup = dict(rollup, course=[counts[0] + 1, counts[1]])
+        progress.set(self.ROLLUP_KEY, rollup)
 
     UPDATER_MAPPING = {
         'activity': _update_activity,
@@ -771,14 +1103,16 @@ class UnitLessonCompletionTracker(object):
             return
         self._put_event(
             student, 'assessment', self._get_assessment_key(assessment_id))
+        self._put_score_summary_unit_completed(student, assessment_id)
 
     def put_custom_unit_completed(self, student, unit_id):
         """Records that the student has completed the given custom_unit."""
         if not self._get_course().is_valid_custom_unit(unit_id):
             return
-        self._update_custom_unit(
-            student, self._get_custom_unit_key(unit_id),
-            self.COMPLETED_STATE)
+        if self._update_custom_unit(
+                student, self._get_custom_unit_key(unit_id),
+                self.COMPLETED_STATE):
+            self._put_score_summary_unit_completed(student, unit_id)
 
     def put_custom_unit_in_progress(self, student, unit_id):
         """Records that the given student has started the given custom_unit."""
@@ -807,13 +1141,13 @@ class UnitLessonCompletionTracker(object):
         if student.is_transient or event_entity not in self.EVENT_CODE_MAPPING:
             return
 
-        progress = self.get_or_create_progress(student)
+        progress = self._get_progress_document(student)
+        self._update_rollup(progress, student)
 
         self._update_event(
             student, progress, event_entity, event_key, direct_update=True)
 
-        progress.updated_on = datetime.datetime.now()
-        progress.put()
+        self._put_progress_document(student, progress)
 
     def _update_event(self, student, progress, event_entity, event_key,
                       direct_update=False):
@@ -821,12 +1155,13 @@ class UnitLessonCompletionTracker(object):
 
         Args:
           student: the student
-          progress: the StudentProgressEntity for the student
+          progress: the ProgressDocument of the student
           event_entity: the name of the affected entity (unit, lesson, etc.)
           event_key: the key for the recorded event
           direct_update: True if this event is being updated explicitly; False
               if it is being auto-updated.
         """
+        was_completed = self._is_key_completed(progress, event_key)
         if direct_update or event_entity not in self.UPDATER_MAPPING:
             if event_entity in self.UPDATER_MAPPING:
                 # This is a derived event, so directly mark it as completed.
@@ -837,6 +1172,9 @@ class UnitLessonCompletionTracker(object):
                 self._inc(progress, event_key)
         else:
             self.UPDATER_MAPPING[event_entity](self, progress, event_key)
+        if (not was_completed and
+            self._is_key_completed(progress, event_key)):
+            self._count_completed_child(student, progress, event_key)
 
         if event_entity in self.DERIVED_EVENTS:
             for derived_event in self.DERIVED_EVENTS[event_entity]:
@@ -925,7 +1263,7 @@ class UnitLessonCompletionTracker(object):
 
     def get_course_progress(self, student):
         """Return [NOT_STARTED|IN_PROGRESS|COMPLETED]_STATE for course."""
-        progress = self.get_or_create_progress(student)
+        progress = ProgressDocument(self.get_or_create_progress(student))
         return self.get_course_status(progress) or self.NOT_STARTED_STATE
 
     def get_unit_progress(self, student, progress=None):
@@ -936,6 +1274,7 @@ class UnitLessonCompletionTracker(object):
         units = self._get_course().get_units()
         if progress is None:
             progress = self.get_or_create_progress(student)
+        progress = ProgressDocument.wrap(progress)
 
         result = {}
         for unit in units:
@@ -961,7 +1300,7 @@ class UnitLessonCompletionTracker(object):
         assessment_scores = {int(s['id']): s['score'] / 100.0
                              for s in course.get_all_scores(student)}
         result = {}
-        progress = self.get_or_create_progress(student)
+        progress = ProgressDocument(self.get_or_create_progress(student))
         for unit in units:
             # Assessments are scored as themselves.
             if unit.type == verify.UNIT_TYPE_ASSESSMENT:
@@ -1002,6 +1341,7 @@ class UnitLessonCompletionTracker(object):
         lessons = self._get_course().get_lessons(unit_id)
         if progress is None:
             progress = self.get_or_create_progress(student)
+        progress = ProgressDocument.wrap(progress)
 
         result = {}
         for lesson in lessons:
@@ -1024,9 +1364,7 @@ class UnitLessonCompletionTracker(object):
             progress, unit_id, lesson_id, cpt_id) or 0
 
     def _get_entity_value(self, progress, event_key):
-        if not progress.value:
-            return None
-        return transforms.loads(progress.value).get(event_key)
+        return ProgressDocument.wrap(progress).get(event_key)
 
     def _set_entity_value(self, student_property, key, value):
         """Sets the integer value of a student property.
@@ -1035,17 +1373,14 @@ class UnitLessonCompletionTracker(object):
         call put() on the StudentPropertyEntity.
 
         Args:
-          student_property: the StudentPropertyEntity
+          student_property: the ProgressDocument or StudentPropertyEntity
           key: the student property whose value should be incremented
           value: the value to increment this property by
         """
-        try:
-            progress_dict = transforms.loads(student_property.value)
-        except (AttributeError, TypeError):
-            progress_dict = {}
-
-        progress_dict[key] = value
-        student_property.value = transforms.dumps(progress_dict)
+        document = ProgressDocument.wrap(student_property)
+        document.set(key, value)
+        if document is not student_property:
+            document.flush()
 
     def _inc(self, student_property, key, value=1):
         """Increments the integer value of a student property.
@@ -1054,20 +1389,14 @@ class UnitLessonCompletionTracker(object):
         call put() on the StudentPropertyEntity.
 
         Args:
-          student_property: the StudentPropertyEntity
+          student_property: the ProgressDocument or StudentPropertyEntity
           key: the student property whose value should be incremented
           value: the value to increment this property by
         """
-        try:
-            progress_dict = transforms.loads(student_property.value)
-        except (AttributeError, TypeError):
-            progress_dict = {}
-
-        if key not in progress_dict:
-            progress_dict[key] = 0
-
-        progress_dict[key] += value
-        student_property.value = transforms.dumps(progress_dict)
+        document = ProgressDocument.wrap(student_property)
+        document.inc(key, value)
+        if document is not student_property:
+            document.flush()
 
     @classmethod
     def get_elements_from_key(cls, key):
@@ -84,8 +84,9 @@ class Roles(object):
         if cls.is_super_admin():
             return True
 
-        if KEY_COURSE in app_context.get_environ():
-            environ = app_context.get_environ()[KEY_COURSE]
+        environ = app_context.get_environ(frozen=True)
+        if KEY_COURSE in environ:
+            environ = environ[KEY_COURSE]
             if KEY_ADMIN_USER_EMAILS in environ:
                 allowed = environ[KEY_ADMIN_USER_EMAILS]
                 user = users.get_current_user()
@@ -84,6 +84,62 @@ class Notifications(Service):
         """
         raise NotImplementedError()
 
+    def send_bulk_async(
+        self, recipients, sender, intent, body, subject, audit_trail=None,
+        retention_policy=None):
+        """Asyncronously sends one notification to many recipients via email.
+
+        Like calling send_async() once per recipient, but the notifications
+        share a single payload, and are written and enqueued in batches.
+
+        Args:
+          recipients: list of string. Recipient email addresses, each as the
+              to argument of send_async(). Duplicates are sent to once.
+          sender: string. As for send_async().
+          intent: string. As for send_async().
+          body: string. The data payload shared by all the notifications. Must
+              fit in a datastore entity.
+          subject: string. Subject line for the notifications.
+          audit_trail: JSON-serializable object. As for send_async().
+          retention_policy: RetentionPolicy. As for send_async().
+
+        Returns:
+          ([notification_key], payload_key). A 2-tuple of the datastore keys of
+          the created notifications, in recipient order, and of their shared
+          payload.
+
+        Raises:
+          Exception: if values delegated to model initializers are invalid.
+          ValueError: if recipients is empty, or if any recipient or sender are
+              malformed according to App Engine.
+
+        """
+        raise NotImplementedError()
+
+    def send_multi_async(self, messages, sender, intent, retention_policy=None):
+        """Asyncronously sends a distinct notification to each of many users.
+
+        Like calling send_async() once per message, but the notifications are
+        written and enqueued in batches.
+
+        Args:
+          messages: list of (to, body, subject, audit_trail) 4-tuples, each
+              value as for send_async(). Each to must be unique.
+          sender: string. As for send_async().
+          intent: string. As for send_async().
+          retention_policy: RetentionPolicy. As for send_async().
+
+        Returns:
+          List of (notification_key, payload_key) 2-tuples, in message order.
+
+        Raises:
+          Exception: if values delegated to model initializers are invalid.
+          ValueError: if any to is repeated, or if any to or sender are
+              malformed according to App Engine.
+
+        """
+        raise NotImplementedError()
+
 
 class Unsubscribe(Service):
 
@@ -17,6 +17,7 @@
 __author__ = 'Pavel Simakov (psimakov@google.com)'
 
 import datetime
+import logging
 import os
 import re
 import sys
@@ -48,6 +49,15 @@ _MAX_VFS_SHARD_SIZE = 1000 * 1000
 # Max number of shards for a single VFS cached file.
 _MAX_VFS_NUM_SHARDS = 4
 
+# The number of bytes of file content held by each in-process cache shard.
+# Larger files are streamed and cached one such shard at a time; each cache
+# shard must fit under MAX_GLOBAL_CACHE_ITEM_SIZE_BYTES, and must evenly
+# divide _MAX_VFS_SHARD_SIZE so it never spans two datastore shards.
+_VFS_CACHE_SHARD_SIZE = 200 * 1000
+
+# Number of keys fetched per datastore round trip when listing a directory.
+_LIST_BATCH_SIZE = 1000
+
 # Global memcache controls.
 CAN_USE_VFS_IN_PROCESS_CACHE = ConfigProperty(
     'gcb_can_use_vfs_in_process_cache', bool, (
@@ -104,6 +114,10 @@ class AbstractFileSystem(object):
         """Returns a stream with the file content, similar to open(...)."""
         return self._impl.get(filename)
 
+    def stat(self, filename):
+        """Returns FileStat of a file without loading its content."""
+        return self._impl.stat(filename)
+
     def get(self, filename):
         """Returns bytes with the file content, but no metadata."""
         return self.open(filename).read()
@@ -181,6 +195,14 @@ class LocalReadOnlyFileSystem(object):
             return None
         return open(self._logical_to_physical(filename), 'rb')
 
+    def stat(self, filename):
+        if not self.isfile(filename):
+            return None
+        stat_result = os.stat(self._logical_to_physical(filename))
+        return FileStat(
+            datetime.datetime.utcfromtimestamp(stat_result.st_mtime),
+            stat_result.st_size)
+
     def put(self, unused_filename, unused_stream):
         raise Exception('Not implemented.')
 
@@ -234,6 +256,23 @@ class FileDataEntity(BaseEntity):
     data = db.BlobProperty()
 
 
+class FileStat(object):
+    """Version information of a file; enough to validate cached copies."""
+
+    def __init__(self, updated_on, size, is_draft=False):
+        self.updated_on = updated_on
+        self.size = size
+        self.is_draft = is_draft
+
+    @property
+    def etag(self):
+        """Returns a strong HTTP entity tag, or None if version is unknown."""
+        if not self.updated_on or self.size is None:
+            return None
+        return '"%s-%x"' % (
+            self.updated_on.strftime('%Y%m%d%H%M%S%f'), self.size)
+
+
 class FileStreamWrapped(object):
     """A class that wraps a file stream, but adds extra attributes to it."""
 
@@ -247,6 +286,35 @@ class FileStreamWrapped(object):
         self._data = ''
         return data
 
+    def iter_shards(self):
+        """Yields file content; all bytes are already in memory."""
+        data = self.read()
+        if data:
+            yield data
+
+    @property
+    def metadata(self):
+        return self._metadata
+
+
+class ShardedFileStream(object):
+    """A file stream that loads its content lazily, one shard at a time."""
+
+    def __init__(self, metadata, shards):
+        self._metadata = metadata
+        self._shards = shards
+
+    def read(self):
+        """Emulates stream.read(). Returns all bytes and emulates EOF."""
+        return ''.join(self.iter_shards())
+
+    def iter_shards(self):
+        """Yields file content shard by shard and emulates EOF."""
+        shards = self._shards
+        self._shards = iter([])
+        for shard in shards:
+            yield shard
+
     @property
     def metadata(self):
         return self._metadata
@@ -273,6 +341,19 @@ def stream_to_string(stream):
     return stream.read().decode('utf-8')
 
 
+def iter_stream_shards(stream):
+    """Yields the content of a stream returned by open() piece by piece."""
+    if hasattr(stream, 'iter_shards'):
+        for shard in stream.iter_shards():
+            yield shard
+        return
+    while True:
+        data = stream.read(_VFS_CACHE_SHARD_SIZE)
+        if not data:
+            break
+        yield data
+
+
 class VirtualFileSystemTemplateLoader(jinja2.BaseLoader):
     """Loader of jinja2 templates from a virtual file system."""
 
@@ -379,6 +460,33 @@ class CacheFileEntry(caching.AbstractCacheEntry):
         return None
 
 
+class CacheFileShardEntry(caching.AbstractCacheEntry):
+    """Cache entry representing one shard of the content of a large file.
+
+    Shards are keyed by the version of the file they belong to, so a changed
+    file never finds shards of its previous version; those simply age out.
+    """
+
+    def __init__(self, filename, updated_on, data):
+        self.filename = filename
+        self._updated_on = updated_on
+        self.data = data
+        self.created_on = datetime.datetime.utcnow()
+
+    def getsizeof(self):
+        return (
+            sys.getsizeof(self.filename) +
+            sys.getsizeof(self._updated_on) +
+            sys.getsizeof(self.data) +
+            sys.getsizeof(self.created_on))
+
+    def is_up_to_date(self, key, update):
+        return True
+
+    def updated_on(self):
+        return self._updated_on
+
+
 class VfsCacheConnection(caching.AbstractCacheConnection):
 
     PERSISTENT_ENTITY = FileMetadataEntity
@@ -395,6 +503,16 @@ class VfsCacheConnection(caching.AbstractCacheConnection):
         cls.CACHE_INHERITED = PerfCounter(
             'gcb-models-VfsCacheConnection-cache-inherited',
             'A number of times an object was obtained from the inherited vfs.')
+        cls.CACHE_SHARD_PUT = PerfCounter(
+            'gcb-models-VfsCacheConnection-cache-shard-put',
+            'A number of times a shard of a large file was put into cache.')
+        cls.CACHE_SHARD_HIT = PerfCounter(
+            'gcb-models-VfsCacheConnection-cache-shard-hit',
+            'A number of times a shard of a large file was found in cache.')
+        cls.CACHE_SHARD_MISS = PerfCounter(
+            'gcb-models-VfsCacheConnection-cache-shard-miss',
+            'A number of times a shard of a large file was not found in '
+            'cache.')
 
     @classmethod
     def is_enabled(cls):
@@ -404,10 +522,59 @@ class VfsCacheConnection(caching.AbstractCacheConnection):
         super(VfsCacheConnection, self).__init__(namespace)
         self.cache = ProcessScopedVfsCache.instance().cache
 
+    @classmethod
+    def _make_shard_key(cls, filename, metadata, index):
+        return '%s:cache-shard:%s:%s:%d' % (
+            filename, metadata.updated_on, metadata.size, index)
+
+    def put_shard(self, filename, metadata, index, data):
+        self.CACHE_SHARD_PUT.inc()
+        self.cache.put(
+            self.make_key(
+                self.namespace,
+                self._make_shard_key(filename, metadata, index)),
+            CacheFileShardEntry(filename, metadata.updated_on, data))
+
+    def get_shard(self, filename, metadata, index):
+        _key = self.make_key(
+            self.namespace, self._make_shard_key(filename, metadata, index))
+        found, entry = self.cache.get(_key)
+        if not found or not entry:
+            self.CACHE_SHARD_MISS.inc()
+            return False, None
+        if entry.has_expired():
+            self.CACHE_EXPIRE.inc()
+            self.cache.delete(_key)
+            self.CACHE_SHARD_MISS.inc()
+            return False, None
+        self.CACHE_SHARD_HIT.inc()
+        return True, entry.data
+
 
 VfsCacheConnection.init_counters()
 
 
+def _get_prefix_upper_bound(prefix):
+    """Returns the smallest string greater than any starting with prefix.
+
+    Datastore orders key names by their UTF-8 bytes, which is the same as
+    ordering by code points; incrementing the last code point of the prefix
+    gives an exclusive upper bound for a key-range query.
+
+    Args:
+        prefix: unicode. A non-empty prefix.
+    Returns:
+        The exclusive upper bound, or None if there is no such bound.
+    """
+    prefix = AbstractFileSystem.normpath(prefix)
+    while prefix:
+        last = ord(prefix[-1])
+        if last < sys.maxunicode:
+            return prefix[:-1] + unichr(last + 1)
+        prefix = prefix[:-1]
+    return None
+
+
 class DatastoreBackedFileSystem(object):
     """A read-write file system backed by a datastore."""
 
@@ -561,16 +728,17 @@ class DatastoreBackedFileSystem(object):
         if not found:
             metadata = FileMetadataEntity.get_by_key_name(filename)
             if metadata:
+                if metadata.size > _VFS_CACHE_SHARD_SIZE:
+                    # Large files are never cached or held in memory whole;
+                    # their content is streamed and cached shard by shard.
+                    return ShardedFileStream(metadata, self._iter_shards(
+                        filename, metadata, self.cache))
                 keys = self._generate_file_key_names(filename, metadata.size)
                 data_shards = []
                 for data_entity in FileDataEntity.get_by_key_name(keys):
                     data_shards.append(data_entity.data)
                 data = ''.join(data_shards)
                 if data:
-                    # TODO: Note that this will ask the cache to accept
-                    # potentially very large items.  The caching strategy both
-                    # for in-memory and Memcache should be revisited to
-                    # determine how best to address chunking strategies.
                     self.cache.put(filename, metadata, data)
                     return FileStreamWrapped(metadata, data)
 
@@ -590,18 +758,90 @@ class DatastoreBackedFileSystem(object):
         VfsCacheConnection.CACHE_NOT_FOUND.inc()
         return None
 
+    def _iter_shards(self, filename, metadata, cache):
+        """Yields content of a large file one cache shard at a time.
+
+        Each cache shard is served from the in-process cache when present.
+        Otherwise the datastore shard containing it is loaded, and all of its
+        cache shards are cached as they are yielded. At most one datastore
+        shard is held in memory at any time.
+
+        This generator runs after open() has returned, i.e. outside of the
+        namespace open() was called in, so all keys carry their namespace.
+
+        Args:
+            filename: string. Physical name of the file.
+            metadata: FileMetadataEntity. Metadata of the file.
+            cache: VfsCacheConnection. The cache connection to use.
+        Yields:
+            Strings of raw bytes of file content.
+        """
+        key_names = self._generate_file_key_names(filename, metadata.size)
+        shards_per_entity = _MAX_VFS_SHARD_SIZE // _VFS_CACHE_SHARD_SIZE
+        num_shards = (
+            metadata.size + _VFS_CACHE_SHARD_SIZE - 1) // _VFS_CACHE_SHARD_SIZE
+        can_cache = isinstance(cache, VfsCacheConnection)
+        loaded_entity_index = None
+        loaded_data = None
+        for index in xrange(num_shards):
+            found, data = False, None
+            if can_cache:
+                found, data = cache.get_shard(filename, metadata, index)
+            if not found:
+                entity_index = index // shards_per_entity
+                if entity_index != loaded_entity_index:
+                    data_entity = FileDataEntity.get(db.Key.from_path(
+                        FileDataEntity.kind(), key_names[entity_index],
+                        namespace=self._ns))
+                    if not data_entity:
+                        logging.error(
+                            'Missing data shard %s of file %s.',
+                            key_names[entity_index], filename)
+                        return
+                    loaded_entity_index = entity_index
+                    loaded_data = data_entity.data
+                start = (index % shards_per_entity) * _VFS_CACHE_SHARD_SIZE
+                data = loaded_data[start:start + _VFS_CACHE_SHARD_SIZE]
+                if can_cache:
+                    cache.put_shard(filename, metadata, index, data)
+            yield data
+
+    def stat(self, afilename):
+        """Gets FileStat of a file from its metadata; never loads the data."""
+        filename = self._logical_to_physical(afilename)
+        found, stream = self.cache.get(filename)
+        if found and stream:
+            metadata = stream.metadata
+        elif not found:
+            metadata = FileMetadataEntity.get_by_key_name(filename)
+        else:
+            metadata = None
+        if metadata:
+            return FileStat(
+                metadata.updated_on, metadata.size,
+                is_draft=bool(metadata.is_draft))
+        if self._inherits_from and self._can_inherit(filename):
+            return self._inherits_from.stat(afilename)
+        return None
+
     def put(self, filename, stream, is_draft=False, metadata_only=False):
         """Puts a file stream to a database. Raw bytes stream, no encodings."""
         if stream:  # Must be outside the transactional operation
             content = stream.read()
         else:
             content = stream
-        self._transactional_put(filename, content, is_draft, metadata_only)
+        filename = self._transactional_put(
+            filename, content, is_draft, metadata_only)
+        # Recorded once the file is committed rather than in its transaction,
+        # which would then also span the journal head: an entity group more
+        # than the largest files leave room for, and one that all file writes
+        # of a namespace would contend on.
+        VfsCacheConnection.record_changes([filename])
 
     @db.transactional(xg=True)
     def _transactional_put(
         self, filename, stream, is_draft=False, metadata_only=False):
-        self.non_transactional_put(
+        return self._put(
             filename, stream, is_draft=is_draft, metadata_only=metadata_only)
 
     @classmethod
@@ -645,6 +885,12 @@ class DatastoreBackedFileSystem(object):
     def non_transactional_put(
         self, filename, content, is_draft=False, metadata_only=False):
         """Non-transactional put; use only when transactions are impossible."""
+        filename = self._put(
+            filename, content, is_draft=is_draft, metadata_only=metadata_only)
+        VfsCacheConnection.record_changes([filename])
+
+    def _put(self, filename, content, is_draft=False, metadata_only=False):
+        """Writes a file; returns its physical name for the change journal."""
         filename = self._logical_to_physical(filename)
 
         metadata = FileMetadataEntity.get_by_key_name(filename)
@@ -672,6 +918,7 @@ class DatastoreBackedFileSystem(object):
 
         metadata.put()
         self.cache.delete(filename)
+        return filename
 
     def put_multi_async(self, filedata_list):
         """Initiate an async put of the given files.
@@ -729,11 +976,19 @@ class DatastoreBackedFileSystem(object):
         def wait_and_finalize():
             data_future.check_success()
             metadata_future.check_success()
+            VfsCacheConnection.record_changes(
+                filename_list, namespace=self._ns)
 
         return wait_and_finalize
 
-    @db.transactional(xg=True)
     def delete(self, filename):
+        filename = self._transactional_delete(filename)
+        # Recorded once committed, for the same reasons as in put().
+        VfsCacheConnection.record_changes(
+            [filename], op=caching.CacheChangeJournal.OP_DELETE)
+
+    @db.transactional(xg=True)
+    def _transactional_delete(self, filename):
         filename = self._logical_to_physical(filename)
         metadata = FileMetadataEntity.get_by_key_name(filename)
         if metadata:
@@ -742,6 +997,7 @@ class DatastoreBackedFileSystem(object):
         if data:
             data.delete()
         self.cache.delete(filename)
+        return filename
 
     def isfile(self, afilename):
         """Checks file existence by looking up the datastore row."""
@@ -754,6 +1010,29 @@ class DatastoreBackedFileSystem(object):
             result = self._inherits_from.isfile(afilename)
         return result
 
+    @classmethod
+    def _list_query(cls, dir_name):
+        """Makes a keys-only query for all file names starting with dir_name.
+
+        Files are keyed by their physical name, so all files under a directory
+        occupy a contiguous range of keys. Bounding the query by that range
+        lets the datastore return only the keys we need, instead of scanning
+        every file in the namespace and filtering the names here.
+
+        Args:
+            dir_name: string. Physical name of the directory to list.
+        Returns:
+            A keys-only db.Query over FileMetadataEntity.
+        """
+        query = FileMetadataEntity.all(keys_only=True)
+        if dir_name:
+            kind = FileMetadataEntity.kind()
+            query.filter('__key__ >=', db.Key.from_path(kind, dir_name))
+            upper_bound = _get_prefix_upper_bound(dir_name)
+            if upper_bound:
+                query.filter('__key__ <', db.Key.from_path(kind, upper_bound))
+        return query
+
     def list(self, dir_name, include_inherited=False):
         """Lists all files in a directory by using datastore query.
 
@@ -768,11 +1047,9 @@ class DatastoreBackedFileSystem(object):
         """
         dir_name = self._logical_to_physical(dir_name)
         result = set()
-        keys = FileMetadataEntity.all(keys_only=True)
-        for key in keys.fetch(1000):
-            filename = key.name()
-            if filename.startswith(dir_name):
-                result.add(self._physical_to_logical(filename))
+        for key in caching.iter_all(
+                self._list_query(dir_name), batch_size=_LIST_BATCH_SIZE):
+            result.add(self._physical_to_logical(key.name()))
         if include_inherited and self._inherits_from:
             for inheritable_folder in self._inheritable_folders:
                 logical_folder = self._physical_to_logical(inheritable_folder)
@@ -949,6 +1226,54 @@ class VfsTests(unittest.TestCase):
         self.assertFalse(found)
         self.assertEquals(stream, None)
 
+    def test_shard_hit_and_miss(self):
+        ProcessScopedVfsCache.clear_all()
+        conn = VfsCacheConnection('ns_test')
+        meta = FileMetadataEntity()
+        meta.updated_on = datetime.datetime.utcnow()
+        meta.size = 2 * _VFS_CACHE_SHARD_SIZE
+
+        old_miss_count = VfsCacheConnection.CACHE_SHARD_MISS.value
+        old_hit_count = VfsCacheConnection.CACHE_SHARD_HIT.value
+        self.assertEquals(
+            (False, None), conn.get_shard('sample.bin', meta, 0))
+        conn.put_shard('sample.bin', meta, 0, 'shard data')
+        self.assertEquals(
+            (True, 'shard data'), conn.get_shard('sample.bin', meta, 0))
+        self.assertEquals(
+            VfsCacheConnection.CACHE_SHARD_MISS.value - old_miss_count, 1)
+        self.assertEquals(
+            VfsCacheConnection.CACHE_SHARD_HIT.value - old_hit_count, 1)
+
+        # Shards of other versions of the same file are never found.
+        meta.updated_on += datetime.timedelta(0, 1)
+        self.assertEquals(
+            (False, None), conn.get_shard('sample.bin', meta, 0))
+
+    def test_sharded_stream_emulates_eof(self):
+        stream = ShardedFileStream(None, iter(['a', 'b', 'c']))
+        self.assertEquals(['a', 'b', 'c'], list(iter_stream_shards(stream)))
+        self.assertEquals('', stream.read())
+
+    def test_file_stat_etag(self):
+        updated_on = datetime.datetime(2015, 1, 2, 3, 4, 5, 6)
+        self.assertEquals(
+            '"20150102030405000006-ff"', FileStat(updated_on, 255).etag)
+        self.assertNotEquals(
+            FileStat(updated_on, 255).etag, FileStat(updated_on, 256).etag)
+        self.assertEquals(None, FileStat(None, 255).etag)
+        self.assertEquals(None, FileStat(updated_on, None).etag)
+
+    def test_prefix_upper_bound(self):
+        self.assertEquals(u'/assets0', _get_prefix_upper_bound('/assets/'))
+        self.assertEquals(u'/b', _get_prefix_upper_bound('/a'))
+        self.assertTrue(u'/assets/' < _get_prefix_upper_bound('/assets/'))
+        self.assertTrue(
+            u'/assets/\uffff' < _get_prefix_upper_bound('/assets/'))
+        self.assertEquals(None, _get_prefix_upper_bound(''))
+        self.assertEquals(
+            None, _get_prefix_upper_bound(unichr(sys.maxunicode)))
+
 
 def run_all_unit_tests():
     """Runs all unit tests in this module."""
@@ -81,6 +81,12 @@ def register_tabs():
         data_source_classes=[
             student_answers.RawAnswersDataSource,
             student_answers.OrderedQuestionsDataSource])
+    student_answers_migration = analytics.Visualization(
+        'student_answers_migration',
+        'Student Answers Migration',
+        'student_answers_migration.html',
+        data_source_classes=[
+            student_answers.StudentAnswersMigrationDataSource])
     clusters_visualization = analytics.Visualization(
         'clusters',
         'Cluster Manager',
@@ -111,7 +117,8 @@ def register_tabs():
     tabs.Registry.register(ANALYTICS, 'assessments', 'Assessments',
                            analytics.TabRenderer([assessment_difficulty]))
     tabs.Registry.register(ANALYTICS, 'gradebook', 'Gradebook',
-                           analytics.TabRenderer([gradebook]))
+                           analytics.TabRenderer([
+                               gradebook, student_answers_migration]))
     tabs.Registry.register(ANALYTICS, 'clustering', 'Clustering',
                            analytics.TabRenderer([
                                clusters_visualization,
@@ -182,6 +189,8 @@ def register_module():
         data_sources.Registry.register(student_answers.RawAnswersDataSource)
         data_sources.Registry.register(
             student_answers.OrderedQuestionsDataSource)
+        data_sources.Registry.register(
+            student_answers.StudentAnswersMigrationDataSource)
 
         data_sources.Registry.register(
             synchronous_providers.QuestionStatsSource)
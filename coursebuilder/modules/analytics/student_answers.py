@@ -507,6 +507,77 @@ class OrderedQuestionsDataSource(data_sources.SynchronousQuery):
             {'question_keys': question_keys})
 
 
+class StudentAnswersMigrationJob(jobs.AbstractCountingMapReduceJob):
+    """Copies answers stored per student into per-assessment storage.
+
+    Run once CAN_STORE_ANSWERS_PER_ASSESSMENT is turned on. Answers already
+    stored per assessment are left as they are, and StudentAnswersEntity is
+    left in place for versions of this application which predate per-
+    assessment storage. The output counts the assessments copied and those
+    skipped.
+    """
+
+    @staticmethod
+    def get_description():
+        return 'student answers migration'
+
+    @staticmethod
+    def entity_class():
+        return models.StudentAnswersEntity
+
+    @staticmethod
+    def map(student_answers):
+        copied, skipped = models.StudentAnswersDAO.put_legacy_answers(
+            student_answers)
+        if copied:
+            yield ('copied', copied)
+        if skipped:
+            yield ('skipped', skipped)
+
+
+class StudentAnswersMigrationDataSource(
+    data_sources.AbstractSmallRestDataSource):
+    """Reports what StudentAnswersMigrationJob copied; lets admins start it."""
+
+    @staticmethod
+    def required_generators():
+        return [StudentAnswersMigrationJob]
+
+    @classmethod
+    def get_name(cls):
+        return 'student_answers_migration'
+
+    @classmethod
+    def get_title(cls):
+        return 'Student Answers Migration'
+
+    @classmethod
+    def get_schema(cls, unused_app_context, unused_catch_and_log,
+                   unused_source_context):
+        reg = schema_fields.FieldRegistry(
+            'Student Answers Migration',
+            description='Assessments whose answers were copied into '
+            'per-assessment storage')
+        reg.add_property(schema_fields.SchemaField(
+            'outcome', 'Outcome', 'string',
+            description='"copied" for assessments whose answers were '
+            'copied; "skipped" for those whose answers were already stored '
+            'per assessment.'))
+        reg.add_property(schema_fields.SchemaField(
+            'count', 'Count', 'integer',
+            description='The number of assessments, over all students.'))
+        return reg.get_json_schema_dict()['properties']
+
+    @classmethod
+    def fetch_values(cls, unused_app_context, unused_source_context,
+                     unused_schema, unused_catch_and_log, unused_page_number,
+                     migration_job):
+        return [
+            {'outcome': outcome, 'count': int(count)}
+            for outcome, count in jobs.MapReduceJob.get_results(
+                migration_job)], 0
+
+
 class StudentAnswersStatsGenerator(jobs.MapReduceJob):
 
     @staticmethod
@@ -515,6 +586,10 @@ class StudentAnswersStatsGenerator(jobs.MapReduceJob):
 
     @staticmethod
     def entity_class():
+        # Once answers may be stored per assessment, each student's answers
+        # are read from both stores, whether or not they were migrated.
+        if models.CAN_STORE_ANSWERS_PER_ASSESSMENT.value:
+            return models.Student
         return models.StudentAnswersEntity
 
     def build_additional_mapper_params(self, app_context):
@@ -547,7 +622,13 @@ class StudentAnswersStatsGenerator(jobs.MapReduceJob):
         valid_question_ids = params['valid_question_ids']
         group_to_questions = params['group_to_questions']
         assessment_weights = params['assessment_weights']
-        all_answers = transforms.loads(student_answers.data)
+        if isinstance(student_answers, models.Student):
+            if not student_answers.user_id:
+                return
+            all_answers = models.StudentAnswersDAO.get_all_answers(
+                student_answers.user_id)
+        else:
+            all_answers = transforms.loads(student_answers.data)
         for unit_id, unit_responses in all_answers.items():
 
             # Is this a CourseBuilder Question/QuestionGroup set of answers?
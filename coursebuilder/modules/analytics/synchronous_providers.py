@@ -138,6 +138,7 @@ class StudentProgressStatsGenerator(jobs.DurableJob):
                 student_property.name ==
                 progress.UnitLessonCompletionTracker.PROPERTY_KEY):
                 entity_scores = transforms.loads(student_property.value)
+                entity_scores.pop(self._tracker.ROLLUP_KEY, None)
                 for entity in entity_scores:
                     entity_score = self.progress_data.get(
                         entity, {'progress': 0, 'completed': 0})
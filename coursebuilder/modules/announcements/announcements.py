@@ -43,6 +43,9 @@ from modules.oeditor import oeditor
 
 from google.appengine.ext import db
 
+# Int. Number of announcements shown on one page of the list view.
+ANNOUNCEMENTS_PAGE_SIZE = 20
+
 
 class AnnouncementsRights(object):
     """Manages view/edit rights for announcements."""
@@ -96,11 +99,12 @@ class AnnouncementsHandler(BaseHandler, ReflectiveRequestHandler):
         return self.canonicalize_url(
             '/announcements?%s' % urllib.urlencode(args))
 
-    def format_items_for_template(self, items):
-        """Formats a list of entities into template values."""
+    def format_items_for_template(self, items, bodies):
+        """Formats a page of summaries and their bodies into template values."""
         template_items = []
-        for item in items:
-            item = transforms.entity_to_dict(item)
+        for summary in items:
+            item = summary.to_dict()
+            item['html'] = bodies.get(summary.key, '')
 
             # add 'edit' actions
             if AnnouncementsRights.can_edit(self):
@@ -123,6 +127,33 @@ class AnnouncementsHandler(BaseHandler, ReflectiveRequestHandler):
 
         return output
 
+    def get_page(self, items, cursor):
+        """Returns a page of items following the cursor and the next cursor.
+
+        The cursor is the key of the last item of the previous page, so pages
+        stay stable when announcements are added in front of them. An unknown
+        cursor, e.g. one of a deleted announcement, starts from the first page.
+
+        Args:
+            items: a list of AnnouncementSummary visible to the current user
+            cursor: the cursor of the page requested; None for the first page
+        Returns:
+            A pair of the list of items on the page and the cursor of the next
+            page, which is None for the last page.
+        """
+        start = 0
+        if cursor:
+            for index, item in enumerate(items):
+                if item.key == cursor:
+                    start = index + 1
+                    break
+        end = start + ANNOUNCEMENTS_PAGE_SIZE
+        page = items[start:end]
+        next_cursor = None
+        if page and end < len(items):
+            next_cursor = page[-1].key
+        return page, next_cursor
+
     def _render(self):
         self.template_value['navbar'] = {'announcements': True}
         self.render('announcements.html')
@@ -140,14 +171,26 @@ class AnnouncementsHandler(BaseHandler, ReflectiveRequestHandler):
                 transient_student = True
         self.template_value['transient_student'] = transient_student
 
-        items = AnnouncementEntity.get_announcements()
+        # Rights and labels are applied to the summaries, so only the bodies
+        # of the announcements on the requested page are loaded.
+        items = AnnouncementEntity.get_summaries()
         items = AnnouncementsRights.apply_rights(self, items)
         if not roles.Roles.is_course_admin(self.get_course().app_context):
             items = models.LabelDAO.apply_course_track_labels_to_student_labels(
                 self.get_course(), student, items)
 
-        self.template_value['announcements'] = self.format_items_for_template(
-            items)
+        cursor = self.request.get('cursor')
+        items, next_cursor = self.get_page(items, cursor)
+        announcements = self.format_items_for_template(
+            items, AnnouncementEntity.get_html_bodies(
+                [item.key for item in items]))
+        if cursor:
+            announcements['first_page_url'] = self.canonicalize_url(
+                '/announcements')
+        if next_cursor:
+            announcements['next_page_url'] = self.canonicalize_url(
+                '/announcements?%s' % urllib.urlencode({'cursor': next_cursor}))
+        self.template_value['announcements'] = announcements
         self._render()
 
     def get_edit(self):
@@ -344,6 +387,35 @@ class AnnouncementsItemRESTHandler(BaseRESTHandler):
         transforms.send_json_response(self, 200, message)
 
 
+class AnnouncementSummary(object):
+    """The fields of an announcement needed to filter and page the list view.
+
+    Summaries of all announcements are cached together, while the HTML bodies
+    are cached one by one and loaded only for the page being shown.
+    """
+
+    def __init__(self, key, title, date, labels, is_draft):
+        self.key = key
+        self.title = title
+        self.date = date
+        self.labels = labels
+        self.is_draft = is_draft
+
+    @classmethod
+    def from_entity(cls, entity):
+        return cls(
+            str(entity.key()), entity.title, entity.date, entity.labels,
+            entity.is_draft)
+
+    def to_dict(self):
+        return {
+            'key': self.key,
+            'title': self.title,
+            'date': self.date,
+            'labels': self.labels,
+            'is_draft': self.is_draft}
+
+
 class AnnouncementEntity(entities.BaseEntity):
     """A class that represents a persistent database entity of announcement."""
     title = db.StringProperty(indexed=False)
@@ -353,30 +425,70 @@ class AnnouncementEntity(entities.BaseEntity):
     is_draft = db.BooleanProperty()
     send_email = db.BooleanProperty()
 
-    memcache_key = 'announcements'
+    summaries_memcache_key = 'announcement-summaries'
+    html_memcache_key_prefix = 'announcement-html:'
+
+    @classmethod
+    def _get_html_memcache_key(cls, key):
+        return '%s%s' % (cls.html_memcache_key_prefix, key)
+
+    @classmethod
+    def get_announcements(cls):
+        """Returns all announcements, newest first, with their bodies."""
+        return list(cls.all().order('-date').run())
+
+    @classmethod
+    def get_summaries(cls):
+        """Returns an AnnouncementSummary for each announcement, newest first.
+
+        The summaries are small enough to be cached as a single item long
+        after the full announcements would have exceeded the memcache limit.
+        """
+        summaries = MemcacheManager.get(cls.summaries_memcache_key)
+        if summaries is None:
+            summaries = [
+                AnnouncementSummary.from_entity(entity).to_dict()
+                for entity in cls.get_announcements()]
+            MemcacheManager.set(cls.summaries_memcache_key, summaries)
+        return [AnnouncementSummary(**summary) for summary in summaries]
 
     @classmethod
-    def get_announcements(cls, allow_cached=True):
-        items = MemcacheManager.get(cls.memcache_key)
-        if not allow_cached or items is None:
-            items = AnnouncementEntity.all().order('-date').fetch(1000)
+    def get_html_bodies(cls, keys):
+        """Returns a dict of HTML bodies of the given announcements by key."""
+        memcache_keys = {cls._get_html_memcache_key(key): key for key in keys}
+        bodies = {
+            memcache_keys[memcache_key]: html
+            for memcache_key, html in MemcacheManager.get_multi(
+                memcache_keys.keys()).iteritems()
+            if html is not None}
+        missing = [key for key in keys if key not in bodies]
+        if missing:
+            loaded = {}
+            for key, entity in zip(missing, cls.get(missing)):
+                if entity:
+                    loaded[key] = entity.html or ''
+            MemcacheManager.set_multi({
+                cls._get_html_memcache_key(key): html
+                for key, html in loaded.iteritems()})
+            bodies.update(loaded)
+        return bodies
 
-            # TODO(psimakov): prepare to exceed 1MB max item size
-            # read more here: http://stackoverflow.com
-            #   /questions/5081502/memcache-1-mb-limit-in-google-app-engine
-            MemcacheManager.set(cls.memcache_key, items)
-        return items
+    @classmethod
+    def _invalidate_cache(cls, key):
+        MemcacheManager.delete_multi([
+            cls.summaries_memcache_key, cls._get_html_memcache_key(key)])
 
     def put(self):
         """Do the normal put() and also invalidate memcache."""
         result = super(AnnouncementEntity, self).put()
-        MemcacheManager.delete(self.memcache_key)
+        self._invalidate_cache(str(self.key()))
         return result
 
     def delete(self):
         """Do the normal delete() and invalidate memcache."""
+        key = str(self.key())
         super(AnnouncementEntity, self).delete()
-        MemcacheManager.delete(self.memcache_key)
+        self._invalidate_cache(key)
 
 
 custom_module = None
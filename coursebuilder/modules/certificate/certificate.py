@@ -35,8 +35,10 @@ __author__ = [
     'John Orr (jorr@google.com)']
 
 
+import hashlib
 import os
 import StringIO
+import threading
 
 from mapreduce import context
 from reportlab.lib import pagesizes
@@ -50,11 +52,13 @@ from common import tags
 from controllers import sites
 from controllers import utils
 from models import analytics
+from models import counters
 from models import courses
 from models import custom_modules
 from models import data_sources
 from models import jobs
 from models import models
+from models import transforms
 from modules.analytics import student_aggregate
 from modules.certificate import custom_criteria
 from modules.courses import settings
@@ -64,6 +68,16 @@ CERTIFICATE_HANDLER_PATH = 'certificate'
 CERTIFICATE_PDF_HANDLER_PATH = 'certificate.pdf'
 RESOURCES_PATH = '/modules/certificate/resources'
 
+# Seconds a rendered certificate PDF is kept in memcache.
+CERTIFICATE_PDF_CACHE_TTL_SECS = 60 * 60 * 24
+
+COUNTER_CERTIFICATE_PDF_CACHE_HIT = counters.PerfCounter(
+    'gcb-certificate-pdf-cache-hit',
+    'number of certificate PDFs served from memcache')
+COUNTER_CERTIFICATE_PDF_RENDERED = counters.PerfCounter(
+    'gcb-certificate-pdf-rendered',
+    'number of certificate PDFs rendered with reportlab')
+
 
 class ShowCertificateHandler(utils.BaseHandler):
     """Handler for student to print course certificate."""
@@ -93,19 +107,42 @@ class ShowCertificateHandler(utils.BaseHandler):
 class ShowCertificatePdfHandler(utils.BaseHandler):
     """Handler for student to print course certificate."""
 
+    # The background image, decoded once per process and shared by all
+    # requests; see _get_background_image().
+    _background_image = None
+    _background_image_lock = threading.Lock()
+
+    @classmethod
+    def _get_background_image(cls):
+        if cls._background_image is None:
+            with cls._background_image_lock:
+                if cls._background_image is None:
+                    image_path = os.path.join(
+                        appengine_config.BUNDLE_ROOT, 'modules', 'certificate',
+                        'resources', 'images', 'cert.png')
+                    with open(image_path, 'rb') as image_file:
+                        image_data = image_file.read()
+                    image = canvas.ImageReader(StringIO.StringIO(image_data))
+                    image.getRGBData()  # Decode now, not in the first request.
+                    cls._background_image = image
+        return cls._background_image
+
+    @classmethod
+    def _get_pdf_cache_key(cls, student, course, locale):
+        # The name is part of the key so a renamed student gets a new PDF.
+        digest = hashlib.sha1(transforms.dumps(
+            [student.user_id, student.name, course, locale])).hexdigest()
+        return 'certificate-pdf:%s' % digest
+
     def _print_cert(self, out, course, student):
 
         c = canvas.Canvas(out, pagesize=pagesizes.landscape(pagesizes.LETTER))
         c.setTitle('Course Builder Certificate')
 
         # Draw the background image
-        image_path = os.path.join(
-            appengine_config.BUNDLE_ROOT,
-            'modules', 'certificate', 'resources', 'images', 'cert.png')
-        image_data = open(image_path).read()
-        image = canvas.ImageReader(StringIO.StringIO(image_data))
         c.drawImage(
-            image, 0, -1.5 * inch, width=11 * inch, preserveAspectRatio=True)
+            self._get_background_image(), 0, -1.5 * inch, width=11 * inch,
+            preserveAspectRatio=True)
 
         text = c.beginText()
 
@@ -136,22 +173,51 @@ class ShowCertificatePdfHandler(utils.BaseHandler):
         c.showPage()
         c.save()
 
+    def _is_not_modified(self, etag):
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match is None:
+            return False
+        etags = [value.strip() for value in if_none_match.split(',')]
+        return '*' in etags or etag in etags or 'W/' + etag in etags
+
     def get(self):
         """Handles GET requests."""
         student = self.personalize_page_and_get_enrolled()
         if not student:
             return
 
-        if not student_is_qualified(student, self.get_course()):
-            self.redirect('/')
-            return
-
         course = courses.Course.get_environ(self.app_context)['course']['title']
+        cache_key = self._get_pdf_cache_key(
+            student, course, self.app_context.get_current_locale())
+
+        # A certificate is only cached once the student has qualified for it,
+        # so repeat downloads skip both the qualification check and reportlab.
+        pdf = models.MemcacheManager.get(cache_key)
+        if pdf is not None:
+            COUNTER_CERTIFICATE_PDF_CACHE_HIT.inc()
+        else:
+            if not student_is_qualified(student, self.get_course()):
+                self.redirect('/')
+                return
+
+            out = StringIO.StringIO()
+            self._print_cert(out, course, student)
+            pdf = out.getvalue()
+            COUNTER_CERTIFICATE_PDF_RENDERED.inc()
+            models.MemcacheManager.set(
+                cache_key, pdf, ttl=CERTIFICATE_PDF_CACHE_TTL_SECS)
+
+        etag = '"%s"' % hashlib.sha1(pdf).hexdigest()
+        self.response.headers['Cache-Control'] = 'private'
+        self.response.headers['ETag'] = etag
+        if self._is_not_modified(etag):
+            self.response.set_status(304)
+            return
 
         self.response.headers['Content-Type'] = 'application/pdf'
         self.response.headers['Content-Disposition'] = (
             'attachment; filename=certificate.pdf')
-        self._print_cert(self.response.out, course, student)
+        self.response.out.write(pdf)
 
 
 def _get_score_by_id(score_list, assessment_id):
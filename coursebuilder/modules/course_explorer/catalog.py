@@ -0,0 +1,210 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Materialized catalog of the courses listed by the course explorer.
+
+Listing courses used to load the settings of every course on each explorer
+page view. The catalog keeps the few fields the explorer needs for all
+courses in a single entity in the default namespace, so a page view costs one
+read plus a per-user filter. The catalog is dropped whenever course settings
+are saved, and is rebuilt when the list of courses changes or when it gets
+older than CATALOG_MAX_AGE_SECS, which bounds staleness for settings changed
+without going through Course.save_settings().
+"""
+
+__author__ = 'Pavel Simakov (psimakov@google.com)'
+
+import hashlib
+import time
+
+import appengine_config
+from common import utils as common_utils
+from controllers import sites
+from models import counters
+from models import entities
+from models import transforms
+from models.models import MemcacheManager
+
+from google.appengine.ext import db
+
+# Int. Seconds after which the catalog is rebuilt even if nothing invalidated
+# it.
+CATALOG_MAX_AGE_SECS = 60 * 10
+
+CATALOG_CACHE_HIT = counters.PerfCounter(
+    'gcb-course-catalog-cache-hit',
+    'A number of times the course catalog was found in memcache.')
+CATALOG_INVALIDATED = counters.PerfCounter(
+    'gcb-course-catalog-invalidated',
+    'A number of times the course catalog was dropped after a course '
+    'settings change.')
+CATALOG_REBUILT = counters.PerfCounter(
+    'gcb-course-catalog-rebuilt',
+    'A number of times the course catalog was rebuilt from course settings.')
+
+
+class CourseCatalogEntity(entities.BaseEntity):
+    """The materialized course catalog; a single entity in default namespace."""
+
+    KEY_NAME = 'course_catalog'
+
+    data = db.TextProperty(indexed=False)
+
+
+class CourseCatalogEntry(object):
+    """Fields of a single course the explorer needs to list and filter it."""
+
+    def __init__(self, data):
+        self._data = data
+
+    @classmethod
+    def from_app_context(cls, app_context):
+        course = app_context.get_environ(frozen=True).get('course', {})
+        slug = app_context.get_slug()
+        course_preview_url = slug
+        if slug == '/':
+            course_preview_url = '/course'
+            slug = ''
+        whitelist = course.get('whitelist') or ''
+        if not whitelist.strip():
+            whitelist = None
+        return cls({
+            'namespace': app_context.get_namespace_name(),
+            'slug': slug,
+            'course_preview_url': course_preview_url,
+            'title': course.get('title'),
+            'blurb': course.get('blurb'),
+            'instructor_details': course.get('instructor_details'),
+            'now_available': bool(course.get('now_available')),
+            'whitelist': _text_to_list(whitelist) if whitelist else None,
+            'admin_user_emails': _text_to_list(
+                course.get('admin_user_emails') or '')})
+
+    def to_dict(self):
+        return self._data
+
+    def get_namespace_name(self):
+        return self._data['namespace']
+
+    def is_visible_to(self, email, is_super_admin, global_whitelist):
+        """Mirrors Roles.is_user_whitelisted() and Roles.is_course_admin().
+
+        Args:
+            email: the email of the current user; None if not logged in
+            is_super_admin: whether the current user is a super admin
+            global_whitelist: a list of emails from GCB_WHITELISTED_USERS;
+                None if it is blank
+        Returns:
+            True if the course is listed for the current user.
+        """
+        if is_super_admin:
+            return True
+        if email and email in self._data['admin_user_emails']:
+            return True
+        if not self._data['now_available']:
+            return False
+        whitelist = self._data['whitelist']
+        if whitelist is None:
+            whitelist = global_whitelist
+        if whitelist is None:
+            return True
+        return bool(email) and email in whitelist
+
+    def get_course_info(self, is_registered, is_completed):
+        """Returns the 'course' section of the settings as the views use it."""
+        return {'course': {
+            'title': self._data['title'],
+            'blurb': self._data['blurb'],
+            'instructor_details': self._data['instructor_details'],
+            'slug': self._data['slug'],
+            'course_preview_url': self._data['course_preview_url'],
+            'is_registered': is_registered,
+            'is_completed': is_completed}}
+
+
+class CourseCatalog(object):
+    """Reads, rebuilds and invalidates the materialized course catalog."""
+
+    MEMCACHE_KEY = 'course-catalog'
+
+    @classmethod
+    def _get_courses_digest(cls, app_contexts):
+        return hashlib.sha1('\n'.join([
+            '%s:%s' % (app_context.get_slug(),
+                       app_context.get_namespace_name())
+            for app_context in app_contexts])).hexdigest()
+
+    @classmethod
+    def _is_fresh(cls, catalog, digest):
+        return (
+            catalog and catalog['digest'] == digest and
+            time.time() - catalog['updated_on'] < CATALOG_MAX_AGE_SECS)
+
+    @classmethod
+    def _load(cls):
+        with common_utils.Namespace(appengine_config.DEFAULT_NAMESPACE_NAME):
+            entity = CourseCatalogEntity.get_by_key_name(
+                CourseCatalogEntity.KEY_NAME)
+        if entity:
+            return transforms.loads(entity.data)
+        return None
+
+    @classmethod
+    def _build(cls, app_contexts, digest):
+        CATALOG_REBUILT.inc()
+        catalog = {
+            'digest': digest,
+            'updated_on': time.time(),
+            'courses': [
+                CourseCatalogEntry.from_app_context(app_context).to_dict()
+                for app_context in app_contexts]}
+        with common_utils.Namespace(appengine_config.DEFAULT_NAMESPACE_NAME):
+            CourseCatalogEntity(
+                key_name=CourseCatalogEntity.KEY_NAME,
+                data=transforms.dumps(catalog)).put()
+        return catalog
+
+    @classmethod
+    def get_entries(cls):
+        """Returns a CourseCatalogEntry for each course, rebuilding if stale."""
+        app_contexts = sites.get_all_courses()
+        digest = cls._get_courses_digest(app_contexts)
+        catalog = MemcacheManager.get(
+            cls.MEMCACHE_KEY, namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+        if cls._is_fresh(catalog, digest):
+            CATALOG_CACHE_HIT.inc()
+        else:
+            catalog = cls._load()
+            if not cls._is_fresh(catalog, digest):
+                catalog = cls._build(app_contexts, digest)
+            MemcacheManager.set(
+                cls.MEMCACHE_KEY, catalog, ttl=CATALOG_MAX_AGE_SECS,
+                namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+        return [CourseCatalogEntry(data) for data in catalog['courses']]
+
+    @classmethod
+    def invalidate(cls, unused_course_settings=None):
+        """Drops the catalog; used as Course.COURSE_ENV_POST_SAVE_HOOKS."""
+        CATALOG_INVALIDATED.inc()
+        with common_utils.Namespace(appengine_config.DEFAULT_NAMESPACE_NAME):
+            db.delete(db.Key.from_path(
+                CourseCatalogEntity.kind(), CourseCatalogEntity.KEY_NAME))
+        MemcacheManager.delete(
+            cls.MEMCACHE_KEY,
+            namespace=appengine_config.DEFAULT_NAMESPACE_NAME)
+
+
+def _text_to_list(text):
+    return common_utils.text_to_list(
+        text, common_utils.BACKWARD_COMPATIBLE_SPLITTER)
@@ -19,9 +19,11 @@ __author__ = 'Rahul Singal (rahulsingal@google.com)'
 from common import safe_dom
 from common import users
 from controllers import utils
+from models import courses
 from models import custom_modules
 from models.config import ConfigProperty
 from models.models import StudentProfileDAO
+from modules.course_explorer import catalog
 from modules.course_explorer import student
 
 GCB_ENABLE_COURSE_EXPLORER_PAGE = ConfigProperty(
@@ -60,6 +62,10 @@ def register_module():
     # set the page initializer
     utils.PageInitializerService.set(ExplorerPageInitializer)
 
+    # drop the course catalog when course settings or availability change
+    courses.Course.COURSE_ENV_POST_SAVE_HOOKS.append(
+        catalog.CourseCatalog.invalidate)
+
     # setup routes
     explorer_routes = [
         ('/', student.IndexPageHandler),
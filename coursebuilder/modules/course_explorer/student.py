@@ -25,6 +25,7 @@ import webapp2
 import appengine_config
 from common import jinja_utils
 from common import users
+from common import utils as common_utils
 from controllers import sites
 from controllers.utils import ApplicationHandler
 from controllers.utils import PageInitializerService
@@ -32,7 +33,9 @@ from controllers.utils import XsrfTokenManager
 from models import courses as Courses
 from models import transforms
 from models.models import StudentProfileDAO
+from models.roles import GCB_WHITELISTED_USERS
 from models.roles import Roles
+from modules.course_explorer import catalog
 
 # We want to use views file in both /views and /modules/course_explorer/views.
 TEMPLATE_DIRS = [
@@ -103,13 +106,18 @@ class BaseStudentHandler(webapp2.RequestHandler):
             self.courses_progress_dict = transforms.loads(profile.course_info)
 
     def get_public_courses(self):
-        """Get all the public courses."""
-        public_courses = []
-        for course in sites.get_all_courses():
-            if ((course.now_available and Roles.is_user_whitelisted(course))
-                or Roles.is_course_admin(course)):
-                public_courses.append(course)
-        return public_courses
+        """Get the catalog entries of all the public courses."""
+        user = users.get_current_user()
+        email = user.email() if user else None
+        is_super_admin = Roles.is_super_admin()
+        global_whitelist = None
+        if GCB_WHITELISTED_USERS.value.strip():
+            global_whitelist = common_utils.text_to_list(
+                GCB_WHITELISTED_USERS.value,
+                common_utils.BACKWARD_COMPATIBLE_SPLITTER)
+        return [
+            entry for entry in catalog.CourseCatalog.get_entries()
+            if entry.is_visible_to(email, is_super_admin, global_whitelist)]
 
     def is_enrolled(self, course):
         """Returns true if student is enrolled else false."""
@@ -125,17 +133,8 @@ class BaseStudentHandler(webapp2.RequestHandler):
 
     def get_course_info(self, course):
         """Returns course info required in views."""
-        info = sites.ApplicationContext.get_environ(course)
-        slug = course.get_slug()
-        course_preview_url = slug
-        if slug == '/':
-            course_preview_url = '/course'
-            slug = ''
-        info['course']['slug'] = slug
-        info['course']['course_preview_url'] = course_preview_url
-        info['course']['is_registered'] = self.is_enrolled(course)
-        info['course']['is_completed'] = self.is_completed(course)
-        return info
+        return course.get_course_info(
+            self.is_enrolled(course), self.is_completed(course))
 
     def get_enrolled_courses(self, courses):
         """Returns list of courses registered by student."""
@@ -256,6 +256,24 @@ class ResourceBundleDAO(NamedJsonDAO):
         entity.locale = resource_bundle_key.locale
         entity.updated_on = datetime.datetime.utcnow()
 
+    @classmethod
+    def save(cls, dto):
+        id_or_name = super(ResourceBundleDAO, cls).save(dto)
+        ResourceBundleCacheConnection.record_changes([id_or_name])
+        return id_or_name
+
+    @classmethod
+    def save_all(cls, dtos):
+        id_or_name_list = super(ResourceBundleDAO, cls).save_all(dtos)
+        ResourceBundleCacheConnection.record_changes(id_or_name_list)
+        return id_or_name_list
+
+    @classmethod
+    def delete(cls, dto):
+        super(ResourceBundleDAO, cls).delete(dto)
+        ResourceBundleCacheConnection.record_changes(
+            [dto.id], op=caching.CacheChangeJournal.OP_DELETE)
+
     @classmethod
     def get_all_for_locale(cls, locale):
         query = caching.iter_all(
@@ -270,8 +288,12 @@ class ResourceBundleDAO(NamedJsonDAO):
         # allowed for deletion, but apparently not so much.  Here, at least
         # we are only round-tripping the keys, not the whole objects through
         # memory.
-        db.delete(list(common_utils.iter_all(
-            cls.ENTITY.all(keys_only=True).filter('locale = ', locale))))
+        keys = list(common_utils.iter_all(
+            cls.ENTITY.all(keys_only=True).filter('locale = ', locale)))
+        db.delete(keys)
+        ResourceBundleCacheConnection.record_changes(
+            [key.name() for key in keys],
+            op=caching.CacheChangeJournal.OP_DELETE)
 
 
 class TableRow(object):
@@ -1326,8 +1348,9 @@ class I18nProgressManager(caching.RequestScopedSingleton):
 # all caches must have limits
 MAX_GLOBAL_CACHE_SIZE_BYTES = 16 * 1024 * 1024
 
-# we don't track deletions; deleted item will hang around this long
-CACHE_ENTRY_TTL_SEC = 5 * 60
+# changes are tracked by caching.CacheChangeJournal; this only bounds how long
+# we serve bundles changed by writers bypassing it, like course import
+CACHE_ENTRY_TTL_SEC = 60 * 60
 
 # Global memcache controls.
 CAN_USE_RESOURCE_BUNDLE_IN_PROCESS_CACHE = ConfigProperty(
@@ -56,6 +56,8 @@ from modules.courses import settings
 from modules.notifications import notifications
 from modules.unsubscribe import unsubscribe
 
+from google.appengine.ext import db
+
 
 # The intent recorded for the emails sent by the notifications module
 INVITATION_INTENT = 'course_invitation'
@@ -84,6 +86,23 @@ def is_email_valid(email):
         r'^[A-Z0-9._%+-]+@[A-Z0-9.-]+\.[A-Z]{2,4}$', email, flags=re.IGNORECASE)
 
 
+class InvitationEmailTemplates(object):
+    """The invitation email settings of a course, with templates compiled.
+
+    Compiling is costly, so handlers sending several invitations make one of
+    these and pass it to each InvitationEmail.
+    """
+
+    def __init__(self, handler):
+        env = handler.app_context.get_environ()
+        email_env = env['course'].get(INVITATION_EMAIL_KEY)
+
+        self.sender_email = email_env[SENDER_EMAIL_KEY]
+        # Coerce templates to unicode in case they are LazyTranslators.
+        self.subject = jinja2.Template(unicode(email_env[SUBJECT_TEMPLATE_KEY]))
+        self.body = jinja2.Template(unicode(email_env[BODY_TEMPLATE_KEY]))
+
+
 class InvitationEmail(object):
 
     @classmethod
@@ -95,32 +114,23 @@ class InvitationEmail(object):
             and email_env.get(SUBJECT_TEMPLATE_KEY)
             and email_env.get(BODY_TEMPLATE_KEY))
 
-    def __init__(self, handler, recipient_email, sender_name):
+    def __init__(self, handler, recipient_email, sender_name, templates=None):
         self.recipient_email = recipient_email
-        env = handler.app_context.get_environ()
-        email_env = env['course'].get(INVITATION_EMAIL_KEY)
-
-        self.sender_email = email_env[SENDER_EMAIL_KEY]
-        self.subject_template = email_env[SUBJECT_TEMPLATE_KEY]
-        self.body_template = email_env[BODY_TEMPLATE_KEY]
+        self.templates = templates or InvitationEmailTemplates(handler)
+        self.sender_email = self.templates.sender_email
         self.email_vars = {
             'sender_name': sender_name,
             'unsubscribe_url': unsubscribe.get_unsubscribe_url(
                 handler, recipient_email)
         }
 
-    def _render(self, template, env):
-        # Coerce template to unicode in case it is a LazyTranslator.
-        template = unicode(template)
-        return jinja2.Template(template).render(env)
-
     @property
     def subject(self):
-        return self._render(self.subject_template, self.email_vars)
+        return self.templates.subject.render(self.email_vars)
 
     @property
     def body(self):
-        return self._render(self.body_template, self.email_vars)
+        return self.templates.body.render(self.email_vars)
 
     def send(self):
         notifications.Manager.send_async(
@@ -132,6 +142,23 @@ class InvitationEmail(object):
             audit_trail=self.email_vars
         )
 
+    @classmethod
+    def send_all(cls, invitation_emails):
+        """Sends many invitations, enqueueing them in batches.
+
+        Args:
+          invitation_emails: list of InvitationEmail. All must have the same
+              sender_email, and distinct recipients.
+        """
+        if not invitation_emails:
+            return
+
+        notifications.Manager.send_multi_async(
+            [(email.recipient_email, email.body, email.subject,
+              email.email_vars) for email in invitation_emails],
+            invitation_emails[0].sender_email,
+            INVITATION_INTENT)
+
 
 class InvitationStudentProperty(models.StudentPropertyEntity):
     """Entity to hold the list of people already invited."""
@@ -152,6 +179,10 @@ class InvitationStudentProperty(models.StudentPropertyEntity):
         value_dict = transforms.loads(self.value)
         return email in value_dict.get(self.EMAIL_LIST_KEY, [])
 
+    def get_invited_set(self):
+        value_dict = transforms.loads(self.value)
+        return set(value_dict.get(self.EMAIL_LIST_KEY, []))
+
     def append_to_invited_list(self, email_list):
         value_dict = transforms.loads(self.value)
         email_set = set(value_dict.get(self.EMAIL_LIST_KEY, []))
@@ -292,24 +323,35 @@ class InvitationRESTHandler(utils.BaseRESTHandler):
             return
 
         messages = []
+        candidates = []
+        invited_set = invitation_data.get_invited_set()
         for email in email_set:
             if not is_email_valid(email):
                 # I18N: Error indicating an email addresses is not well-formed.
                 messages.append(self.gettext(
                     'Error: Invalid email "%s"' % email))
-            elif invitation_data.is_in_invited_list(email):
+            elif email in invited_set:
                 # I18N: Error indicating an email addresses is already known.
                 messages.append(self.gettext(
                     'Error: You have already sent an invitation email to "%s"'
                     % email))
-            elif unsubscribe.has_unsubscribed(email):
+            else:
+                candidates.append(email)
+
+        templates = InvitationEmailTemplates(self)
+        invitation_emails = []
+        unsubscribed, registered = _get_unsubscribed_and_registered(candidates)
+        for email in candidates:
+            if email in unsubscribed:
                 # No message to the user, for privacy reasons
                 logging.info('Declined to send email to unsubscribed user')
-            elif models.Student.get_enrolled_student_by_email(email):
+            elif email in registered:
                 # No message to the user, for privacy reasons
                 logging.info('Declined to send email to registered user')
             else:
-                InvitationEmail(self, email, student.name).send()
+                invitation_emails.append(InvitationEmail(
+                    self, email, student.name, templates=templates))
+        InvitationEmail.send_all(invitation_emails)
 
         invitation_data.append_to_invited_list(email_set)
         invitation_data.put()
@@ -327,6 +369,35 @@ class InvitationRESTHandler(utils.BaseRESTHandler):
                 self.gettext('OK, %s messages sent' % len(email_set)))
 
 
+def _get_unsubscribed_and_registered(emails):
+    """Finds which of emails must not be sent invitations.
+
+    Reads the subscription states and the students of all the addresses with
+    a single datastore get.
+
+    Args:
+      emails: list of string. The email addresses to check.
+
+    Returns:
+      (unsubscribed, registered). A 2-tuple of sets of the addresses whose
+      users have unsubscribed, and whose users are enrolled students.
+    """
+    keys = [unsubscribe.get_subscription_state_key(email) for email in emails]
+    keys += [models.Student.get_key_by_email(email) for email in emails]
+    entities = db.get(keys)
+
+    unsubscribed = set()
+    registered = set()
+    for email, state, student in zip(
+        emails, entities[:len(emails)], entities[len(emails):]):
+        if unsubscribe.is_unsubscribed_state(state):
+            unsubscribed.add(email)
+        if student and student.is_enrolled:
+            registered.add(email)
+
+    return unsubscribed, registered
+
+
 def get_course_settings_fields():
     enable = schema_fields.SchemaField(
         'course:invitation_email:enabled',
@@ -58,11 +58,7 @@ def process_notification(notification, now, stats):
         stats.skipped_still_enqueued += 1
         return
 
-    payload_key = db.Key.from_path(
-        notifications.Payload.kind(),
-        notifications.Payload.key_name(
-            notification.to, notification.intent, notification.enqueue_date)
-        )
+    payload_key = notifications.Manager._get_payload_key(notification)
     payload = db.get(payload_key)
 
     if not payload:
@@ -102,7 +98,15 @@ def process_notification(notification, now, stats):
                 ', '.join(sorted(notifications._RETENTION_POLICIES.keys()))
                 )
             stats.missing_policy += 1
-        db.put([notification, payload])
+        db.put(
+            notifications.Manager._get_entities_to_put(notification, payload))
+
+        if notification._payload_key_name:
+            # The shared payload's own retention policy can only be run outside
+            # this transaction, once its other notifications are done.
+            deferred.defer(
+                notifications.Manager._run_shared_payload_retention_policy,
+                payload_key, _transactional=True)
     else:
         notifications.Manager._mark_enqueued(notification, now)
         db.put(notification)
@@ -114,6 +118,12 @@ def process_notification(notification, now, stats):
         stats.reenqueued += 1
 
 
+def process_shared_payload(payload_key, stats):
+    # Treat as module-protected. pylint: disable=protected-access
+    if notifications.Manager._run_shared_payload_retention_policy(payload_key):
+        stats.shared_payload_policy_run += 1
+
+
 class _Stats(object):
 
     def __init__(self, namespace):
@@ -122,6 +132,7 @@ class _Stats(object):
         self.namespace = namespace
         self.policy_run = 0
         self.reenqueued = 0
+        self.shared_payload_policy_run = 0
         self.skipped_already_done = 0
         self.skipped_still_enqueued = 0
         self.started = 0
@@ -134,6 +145,7 @@ class _Stats(object):
             '\n\tmissing_policy: %(missing_policy)s'
             '\n\tpolicy_run: %(policy_run)s'
             '\n\tre-enqueued: %(reenqueued)s'
+            '\n\tshared_payload_policy_run: %(shared_payload_policy_run)s'
             '\n\tskipped_already_done: %(skipped_already_done)s'
             '\n\tskipped_still_enqueued: %(skipped_still_enqueued)s'
             '\n\tstarted: %(started)s'
@@ -144,6 +156,9 @@ class _Stats(object):
 class ProcessPendingNotificationsHandler(controllers_utils.BaseHandler):
     """Iterates through all courses, re-enqueueing or expiring pending items.
 
+    Also runs the retention policy on payloads shared by notifications that
+    are all done, if that has not happened yet.
+
     Only one of these jobs runs at any given time. This is enforced by App
     Engine's 10 minute limit plus scheduling this to run daily.
 
@@ -175,3 +190,9 @@ class ProcessPendingNotificationsHandler(controllers_utils.BaseHandler):
             mapper = model_utils.QueryMapper(
                 notifications.Manager._get_in_process_notifications_query())
             mapper.run(process_notification, now, stats)
+
+            # Shared payloads whose last notification was done while an
+            # eventually consistent query still saw it pending.
+            mapper = model_utils.QueryMapper(
+                notifications.Manager._get_pending_shared_payloads_query())
+            mapper.run(process_shared_payload, stats)
@@ -14,8 +14,10 @@
 
 """Notification module.
 
-Provides Manager.send_async, which sends notifications; and Manager.query, which
-queries the current status of notifications.
+Provides Manager.send_async, which sends notifications; Manager.send_bulk_async
+and Manager.send_multi_async, which send the same or distinct notifications to
+many recipients; and Manager.query, which queries the current status of
+notifications.
 
 Notifications are transported by email. Every message you send consumes email
 quota. A message is a single payload delivered to a single user. We do not
@@ -91,6 +93,13 @@ logging.basicConfig()
 _APP_ENGINE_MAIL_FATAL_ERRORS = frozenset([
     mail_errors.BadRequestError, mail_errors.InvalidSenderError,
 ])
+# Number of notifications delivered by each task enqueued by send_bulk_async().
+_BULK_SEND_SLICE_SIZE = 50
+# Max number of entities written by a single db.put() call.
+_DATASTORE_PUT_BATCH_SIZE = 500
+# Url and headers of tasks run by the deferred library; see deferred.defer().
+_DEFERRED_TASK_HEADERS = {'Content-Type': 'application/octet-stream'}
+_DEFERRED_TASK_URL = '/_ah/queue/deferred'
 _ENQUEUED_BUFFER_MULTIPLIER = 1.5
 _KEY_DELIMITER = ':'
 _MAX_ENQUEUED_HOURS = 3
@@ -101,6 +110,12 @@ _MAX_RETRY_DAYS = 3
 _RECOVERABLE_FAILURE_CAP = 20
 _SECONDS_PER_HOUR = 60 * 60
 _SECONDS_PER_DAY = 24 * _SECONDS_PER_HOUR
+# Value of Payload.to for payloads shared by the notifications of one
+# send_bulk_async() call. Not a valid email address, so keys of shared payloads
+# never collide with keys of payloads made by send_async().
+_SHARED_PAYLOAD_TO = 'shared'
+# Max number of tasks added by a single taskqueue.Queue.add() call.
+_TASKQUEUE_ADD_BATCH_SIZE = 100
 _USECS_PER_SECOND = 10 ** 6
 
 COUNTER_RETENTION_POLICY_RUN = counters.PerfCounter(
@@ -123,6 +138,22 @@ COUNTER_SEND_ASYNC_SUCCESS = counters.PerfCounter(
     'gcb-notifications-send-async-success',
     'number of times send_async succeeded'
 )
+COUNTER_SEND_BULK_ASYNC_NOTIFICATIONS = counters.PerfCounter(
+    'gcb-notifications-send-bulk-async-notifications',
+    'number of notifications enqueued by send_bulk_async'
+)
+COUNTER_SEND_BULK_ASYNC_START = counters.PerfCounter(
+    'gcb-notifications-send-bulk-async-called',
+    'number of times send_bulk_async has been called'
+)
+COUNTER_SEND_BULK_ASYNC_SUCCESS = counters.PerfCounter(
+    'gcb-notifications-send-bulk-async-success',
+    'number of times send_bulk_async succeeded'
+)
+COUNTER_SEND_BULK_ASYNC_TASKS = counters.PerfCounter(
+    'gcb-notifications-send-bulk-async-tasks',
+    'number of send mail tasks enqueued by send_bulk_async'
+)
 COUNTER_SEND_MAIL_TASK_FAILED = counters.PerfCounter(
     'gcb-notifications-send-mail-task-failed',
     'number of times the send mail task failed, but could be retried'
@@ -162,6 +193,22 @@ COUNTER_SEND_MAIL_TASK_SUCCESS = counters.PerfCounter(
     'gcb-notifications-send-mail-task-success',
     'number of times send mail task completed successfully'
 )
+COUNTER_SEND_MULTI_ASYNC_NOTIFICATIONS = counters.PerfCounter(
+    'gcb-notifications-send-multi-async-notifications',
+    'number of notifications enqueued by send_multi_async'
+)
+COUNTER_SEND_MULTI_ASYNC_START = counters.PerfCounter(
+    'gcb-notifications-send-multi-async-called',
+    'number of times send_multi_async has been called'
+)
+COUNTER_SEND_MULTI_ASYNC_SUCCESS = counters.PerfCounter(
+    'gcb-notifications-send-multi-async-success',
+    'number of times send_multi_async succeeded'
+)
+COUNTER_SHARED_PAYLOAD_RETENTION_POLICY_RUN = counters.PerfCounter(
+    'gcb-notifications-shared-payload-retention-policy-run',
+    'number of times a retention policy was run on a shared payload'
+)
 
 
 # TODO(johncox): remove suppression once stubs are implemented.
@@ -434,6 +481,241 @@ class Manager(object):
 
         return notification_key, payload_key
 
+    @classmethod
+    def send_bulk_async(
+            cls, recipients, sender, intent, body, subject, audit_trail=None,
+            retention_policy=None):
+        """Asyncronously sends one notification to many recipients via email.
+
+        Behaves like calling send_async() once per recipient, and the resulting
+        notifications are queried, retried and expired exactly like theirs. But
+        instead of one Payload and one transaction per recipient, all the
+        notifications share a single Payload and are written with batched puts.
+        Instead of one task per recipient, we enqueue one task per slice of
+        _BULK_SEND_SLICE_SIZE recipients, adding them to the queue in batches.
+
+        The retention policy is run on each notification when it is done, and
+        on the shared payload once all of its notifications are done.
+
+        Args:
+
+            recipients: list of string. Recipient email addresses. Each must
+                    have a valid form; see send_async(). Duplicates are sent
+                    to once.
+            sender: string. Email address of the sender; see send_async().
+            intent: string. Intent of the notifications; see send_async().
+            body: string. The data payload shared by all the notifications.
+                    Must fit in a datastore entity.
+            subject: string. Subject line for the notifications.
+            audit_trail: JSON-serializable object. Optional audit trail
+                    recorded on every notification; see send_async().
+            retention_policy: RetentionPolicy. The retention policy to use for
+                    data after the notifications have been sent; see
+                    send_async().
+
+        Returns:
+            ([notification_key], payload_key). A 2-tuple of the datastore keys
+            of the created notifications, in recipient order, and of the
+            payload they share.
+
+        Raises:
+            Exception: if values delegated to model initializers are invalid.
+            ValueError: if recipients is empty, or if any recipient or sender
+                    are malformed according to App Engine. Nothing is written
+                    or enqueued in that case.
+
+        """
+        COUNTER_SEND_BULK_ASYNC_START.inc()
+        enqueue_date = datetime.datetime.utcnow()
+        retention_policy = (
+            retention_policy if retention_policy else RetainAuditTrail)
+        unique_recipients = []
+        seen = set()
+
+        for to in recipients:
+            if to not in seen:
+                seen.add(to)
+                unique_recipients.append(to)
+
+        if not unique_recipients:
+            COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+            raise ValueError('No recipients given')
+
+        for email in unique_recipients + [sender]:
+            if not mail.is_email_valid(email):
+                COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+                raise ValueError('Malformed email address: "%s"' % email)
+
+        if retention_policy.NAME not in _RETENTION_POLICIES:
+            COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+            raise ValueError('Invalid retention policy: ' +
+                             str(retention_policy))
+
+        try:
+            # pylint: disable=unbalanced-tuple-unpacking,unpacking-non-sequence
+            notifications, payload = cls._make_unsaved_bulk_models(
+                audit_trail, body, enqueue_date, intent, retention_policy.NAME,
+                sender, subject, unique_recipients,
+                )
+        except Exception, e:
+            COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+            raise e
+
+        for notification in notifications:
+            cls._mark_enqueued(notification, enqueue_date)
+
+        # Not transactional: notifications written before a failure here are
+        # marked enqueued but have no task, and are re-enqueued by the cron
+        # once _is_still_enqueued() says their task would have run.
+        try:
+            payload_key = db.put(payload)
+            notification_keys = []
+            for i in xrange(0, len(notifications), _DATASTORE_PUT_BATCH_SIZE):
+                notification_keys.extend(
+                    db.put(notifications[i:i + _DATASTORE_PUT_BATCH_SIZE]))
+        except Exception, e:
+            COUNTER_SEND_ASYNC_FAILED_DATASTORE_ERROR.inc()
+            raise e
+
+        cls._enqueue_bulk_send_mail_tasks(notification_keys, payload_key)
+        COUNTER_SEND_BULK_ASYNC_NOTIFICATIONS.inc(len(notification_keys))
+        COUNTER_SEND_BULK_ASYNC_SUCCESS.inc()
+
+        return notification_keys, payload_key
+
+    @classmethod
+    def send_multi_async(cls, messages, sender, intent, retention_policy=None):
+        """Asyncronously sends a distinct notification to each of many users.
+
+        Behaves like calling send_async() once per message, and the resulting
+        notifications and payloads are exactly like theirs. But the models are
+        written with batched puts rather than one transaction each, and their
+        send mail tasks are added to the queue in batches. Use send_bulk_async()
+        instead when all recipients get the same body.
+
+        Args:
+
+            messages: list of (to, body, subject, audit_trail) 4-tuples, one
+                    per notification, each value as for send_async(). Each
+                    to must be unique.
+            sender: string. Email address of the sender; see send_async().
+            intent: string. Intent of the notifications; see send_async().
+            retention_policy: RetentionPolicy. The retention policy to use for
+                    data after the notifications have been sent; see
+                    send_async().
+
+        Returns:
+            List of (notification_key, payload_key) 2-tuples, in message order.
+
+        Raises:
+            Exception: if values delegated to model initializers are invalid.
+            ValueError: if any to is repeated, or if any to or sender are
+                    malformed according to App Engine. Nothing is written or
+                    enqueued in that case.
+
+        """
+        COUNTER_SEND_MULTI_ASYNC_START.inc()
+        enqueue_date = datetime.datetime.utcnow()
+        retention_policy = (
+            retention_policy if retention_policy else RetainAuditTrail)
+        recipients = [to for to, _, _, _ in messages]
+
+        if len(set(recipients)) != len(recipients):
+            COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+            raise ValueError('Repeated recipient')
+
+        for email in recipients + [sender]:
+            if not mail.is_email_valid(email):
+                COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+                raise ValueError('Malformed email address: "%s"' % email)
+
+        if retention_policy.NAME not in _RETENTION_POLICIES:
+            COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+            raise ValueError('Invalid retention policy: ' +
+                             str(retention_policy))
+
+        notifications = []
+        payloads = []
+        try:
+            for to, body, subject, audit_trail in messages:
+                # pylint: disable=unbalanced-tuple-unpacking
+                notification, payload = cls._make_unsaved_models(
+                    audit_trail, body, enqueue_date, intent,
+                    retention_policy.NAME, sender, subject, to,
+                    )
+                cls._mark_enqueued(notification, enqueue_date)
+                notifications.append(notification)
+                payloads.append(payload)
+        except Exception, e:
+            COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.inc()
+            raise e
+
+        # Not transactional. Payloads are written before their notifications,
+        # so a failure here leaves no notification without its payload; the
+        # notifications written are re-enqueued by the cron.
+        try:
+            keys = []
+            for i in xrange(0, len(messages), _DATASTORE_PUT_BATCH_SIZE):
+                end = i + _DATASTORE_PUT_BATCH_SIZE
+                payload_keys = db.put(payloads[i:end])
+                keys.extend(zip(db.put(notifications[i:end]), payload_keys))
+        except Exception, e:
+            COUNTER_SEND_ASYNC_FAILED_DATASTORE_ERROR.inc()
+            raise e
+
+        cls._add_tasks([
+            cls._make_send_mail_task(
+                cls._transactional_send_mail_task, notification_key,
+                payload_key)
+            for notification_key, payload_key in keys])
+        COUNTER_SEND_MULTI_ASYNC_NOTIFICATIONS.inc(len(keys))
+        COUNTER_SEND_MULTI_ASYNC_SUCCESS.inc()
+
+        return keys
+
+    @classmethod
+    def _make_unsaved_bulk_models(
+        cls, audit_trail, body, enqueue_date, intent, retention_policy, sender,
+        subject, recipients):
+        payload = Payload(
+            body=body, enqueue_date=enqueue_date, intent=intent,
+            to=_SHARED_PAYLOAD_TO, _retention_policy=retention_policy,
+        )
+        payload_key_name = payload.key().name()
+        notifications = [
+            Notification(
+                audit_trail=audit_trail, enqueue_date=enqueue_date,
+                intent=intent, _payload_key_name=payload_key_name,
+                _retention_policy=retention_policy, sender=sender,
+                subject=subject, to=to,
+            ) for to in recipients]
+
+        return notifications, payload
+
+    @classmethod
+    def _enqueue_bulk_send_mail_tasks(cls, notification_keys, payload_key):
+        tasks = [
+            cls._make_send_mail_task(
+                cls._send_bulk_mail_task,
+                notification_keys[i:i + _BULK_SEND_SLICE_SIZE], payload_key)
+            for i in xrange(0, len(notification_keys), _BULK_SEND_SLICE_SIZE)]
+        cls._add_tasks(tasks)
+        COUNTER_SEND_BULK_ASYNC_TASKS.inc(len(tasks))
+
+    @classmethod
+    def _make_send_mail_task(cls, fn, *args):
+        # Same task deferred.defer() would add, but not yet added to a queue.
+        return taskqueue.Task(
+            headers=_DEFERRED_TASK_HEADERS,
+            payload=deferred.serialize(fn, *args),
+            retry_options=cls._get_retry_options(), url=_DEFERRED_TASK_URL)
+
+    @classmethod
+    def _add_tasks(cls, tasks):
+        queue = taskqueue.Queue()
+        for i in xrange(0, len(tasks), _TASKQUEUE_ADD_BATCH_SIZE):
+            queue.add(tasks[i:i + _TASKQUEUE_ADD_BATCH_SIZE])
+
     @classmethod
     def _make_unsaved_models(
         cls, audit_trail, body, enqueue_date, intent, retention_policy, sender,
@@ -457,13 +739,23 @@ class Manager(object):
 
     @classmethod
     def _send_mail_task(
-            cls, notification_key, payload_key, test_send_mail_fn=None):
+            cls, notification_key, payload_key, test_send_mail_fn=None,
+            shared_payload=None):
         exception = None
         failed_permanently = False
         now = datetime.datetime.utcnow()
-        # pylint: disable=unbalanced-tuple-unpacking,unpacking-non-sequence
-        notification, payload = db.get([notification_key, payload_key])
-        # pylint: enable=unbalanced-tuple-unpacking,unpacking-non-sequence
+
+        if shared_payload:
+            # Already read by the caller for a whole slice of notifications.
+            # Work on a copy so retention policies run here do not blank the
+            # body for the notifications still to be sent.
+            notification = db.get(notification_key)
+            payload = cls._copy_payload(shared_payload)
+        else:
+            # pylint: disable=unbalanced-tuple-unpacking,unpacking-non-sequence
+            notification, payload = db.get([notification_key, payload_key])
+            # pylint: enable=unbalanced-tuple-unpacking,unpacking-non-sequence
+
         send_mail_fn = (
             test_send_mail_fn if test_send_mail_fn else mail.send_mail)
         sent = False
@@ -568,7 +860,7 @@ class Manager(object):
             policy.run(notification, payload)
             cls._mark_done(notification, now)
 
-        db.put([notification, payload])
+        db.put(cls._get_entities_to_put(notification, payload))
 
         COUNTER_RETENTION_POLICY_RUN.inc()
 
@@ -622,7 +914,7 @@ class Manager(object):
             policy.run(notification, payload)
             COUNTER_RETENTION_POLICY_RUN.inc()
 
-        return db.put([notification, payload])
+        return db.put(cls._get_entities_to_put(notification, payload))
 
     @classmethod
     def _get_record_failure_error_message(
@@ -640,6 +932,105 @@ class Manager(object):
             db.create_transaction_options(xg=True), cls._send_mail_task,
             notification_key, payload_key)
 
+        # Notifications sent by send_bulk_async() land here when re-enqueued
+        # by the cron; they may be the last ones their payload waits on.
+        if cls._is_shared_payload_key(payload_key):
+            cls._run_shared_payload_retention_policy(payload_key)
+
+    @classmethod
+    def _send_bulk_mail_task(cls, notification_keys, payload_key):
+        """Sends the notifications of a slice of send_bulk_async() recipients.
+
+        Each notification is sent in its own transaction, exactly as by
+        _send_mail_task(). A recoverable failure does not stop the rest of the
+        slice; the first one is re-raised once the slice is done so the task is
+        retried, and notifications already sent are then skipped.
+        """
+        payload = db.get(payload_key)
+        recoverable_exception = None
+
+        if not payload:
+            COUNTER_SEND_MAIL_TASK_FAILED_PERMANENTLY.inc()
+            raise deferred.PermanentTaskFailure(
+                'Payload missing: ' + str(payload_key)
+                )
+
+        for notification_key in notification_keys:
+            try:
+                db.run_in_transaction(
+                    cls._send_mail_task, notification_key, payload_key,
+                    shared_payload=payload)
+            except deferred.PermanentTaskFailure, e:
+                _LOG.error(
+                    'Unable to send notification with key %s; error was: %s',
+                    str(notification_key), str(e))
+            # Must be vague. pylint: disable=broad-except
+            except Exception, e:
+                if not recoverable_exception:
+                    recoverable_exception = e
+
+        cls._run_shared_payload_retention_policy(payload_key)
+
+        if recoverable_exception:
+            # pylint: disable=raising-bad-type
+            raise recoverable_exception
+
+    @classmethod
+    def _run_shared_payload_retention_policy(cls, payload_key):
+        """Runs the retention policy on a payload shared by notifications.
+
+        The policy is run on each notification as it is done, but it can only
+        be run on the payload they share once none of them needs its body any
+        more. Does nothing while any of the notifications is not done. The
+        notifications are found by an eventually consistent query, which may
+        not yet see the last of them as done; the cron retries each shared
+        payload whose policy has not been run, see
+        _get_pending_shared_payloads_query().
+
+        Args:
+            payload_key: db.Key. Key of the shared payload.
+
+        Returns:
+            Boolean. True if the policy was run on the payload.
+        """
+        query = cls._get_shared_payload_notifications_query(payload_key.name())
+        if query.filter('%s =' % Notification._done_date.name, None).get():
+            return False
+
+        notification = cls._get_shared_payload_notifications_query(
+            payload_key.name(), keys_only=False).get()
+        if not notification:
+            return False
+
+        return cls._apply_shared_payload_retention_policy(
+            notification, payload_key)
+
+    @classmethod
+    @db.transactional
+    def _apply_shared_payload_retention_policy(cls, notification, payload_key):
+        payload = db.get(payload_key)
+        if not payload or payload._done_date:
+            return False
+
+        policy = _RETENTION_POLICIES.get(payload._retention_policy)
+        if not policy:
+            return False
+
+        policy.run(notification, payload)
+        payload._done_date = datetime.datetime.utcnow()
+        payload.put()
+        COUNTER_SHARED_PAYLOAD_RETENTION_POLICY_RUN.inc()
+
+        return True
+
+    @classmethod
+    def _copy_payload(cls, payload):
+        return Payload(
+            body=payload.body, enqueue_date=payload.enqueue_date,
+            intent=payload.intent, to=payload.to,
+            _retention_policy=payload._retention_policy,
+        )
+
     @classmethod
     def _done(cls, notification):
         return bool(notification._done_date)
@@ -657,6 +1048,24 @@ class Manager(object):
             '-' + Notification.enqueue_date.name
         )
 
+    @classmethod
+    def _get_entities_to_put(cls, notification, payload):
+        # Shared payloads are only written once all their notifications are
+        # done; see _run_shared_payload_retention_policy().
+        if notification._payload_key_name:
+            return [notification]
+
+        return [notification, payload]
+
+    @classmethod
+    def _get_payload_key(cls, notification):
+        key_name = notification._payload_key_name
+        if not key_name:
+            key_name = Payload.key_name(
+                notification.to, notification.intent, notification.enqueue_date)
+
+        return db.Key.from_path(Payload.kind(), key_name)
+
     @classmethod
     def _get_query_query(cls, to, intent):
         return Notification.all(
@@ -689,6 +1098,25 @@ class Manager(object):
             task_age_limit=cls._get_task_age_limit_seconds(),
             )
 
+    @classmethod
+    def _get_pending_shared_payloads_query(cls):
+        return Payload.all(
+            keys_only=True
+        ).filter(
+            '%s =' % Payload.to.name, _SHARED_PAYLOAD_TO
+        ).filter(
+            '%s =' % Payload._done_date.name, None
+        )
+
+    @classmethod
+    def _get_shared_payload_notifications_query(
+            cls, payload_key_name, keys_only=True):
+        return Notification.all(
+            keys_only=keys_only
+        ).filter(
+            '%s =' % Notification._payload_key_name.name, payload_key_name
+        )
+
     @classmethod
     def _get_task_age_limit_seconds(cls):
         return _MAX_ENQUEUED_HOURS * _SECONDS_PER_HOUR
@@ -701,6 +1129,11 @@ class Manager(object):
     def _is_send_mail_error_permanent(cls, exception):
         return type(exception) in _APP_ENGINE_MAIL_FATAL_ERRORS
 
+    @classmethod
+    def _is_shared_payload_key(cls, payload_key):
+        _, to, _, _ = Payload._split_key_name(payload_key.name())
+        return to == _SHARED_PAYLOAD_TO
+
     @classmethod
     def _is_still_enqueued(cls, notification, dt):
         """Whether or not an item is still on the deferred queue.
@@ -909,6 +1342,10 @@ class Notification(_Model):
     _fail_date = db.DateTimeProperty()
     # When the notification was last placed on the deferred queue.
     _last_enqueue_date = db.DateTimeProperty()
+    # Key name of the Payload shared with the other notifications made by the
+    # same send_bulk_async() call. None if the notification has its own Payload,
+    # whose key name is computed from to, intent and enqueue_date.
+    _payload_key_name = db.StringProperty()
     # JSON representation of the last recordable exception encountered while
     # processing the notification. Format is
     # {'type': type_str, 'string': str(exception)}.
@@ -939,6 +1376,12 @@ class Payload(_Model):
     # Body of the payload.
     body = db.TextProperty()
 
+    # When the retention policy was run on a payload shared by the
+    # notifications of one send_bulk_async() call, which happens once all of
+    # them are done. None if it has not been run yet, and for payloads that
+    # are not shared, whose policy is run along with their notification.
+    _done_date = db.DateTimeProperty()
+
     _PROPERTY_EXPORT_BLACKLIST = [body]
 
     def __init__(self, *args, **kwargs):
@@ -996,5 +1439,17 @@ def register_module():
                 to, sender, intent, body, subject, audit_trail=audit_trail,
                 retention_policy=retention_policy)
 
+        def send_bulk_async(
+            self, recipients, sender, intent, body, subject, audit_trail=None,
+            retention_policy=None):
+            return Manager.send_bulk_async(
+                recipients, sender, intent, body, subject,
+                audit_trail=audit_trail, retention_policy=retention_policy)
+
+        def send_multi_async(
+            self, messages, sender, intent, retention_policy=None):
+            return Manager.send_multi_async(
+                messages, sender, intent, retention_policy=retention_policy)
+
     services.notifications = Service()
     return custom_module
@@ -33,11 +33,10 @@ logging.basicConfig()
 class ExpireOldAssignedReviewsHandler(utils.BaseHandler):
     """Iterates through all units in all courses, expiring old review steps.
 
-    The system will run a maximum of one of these jobs at any given time. This
-    is enforced by the 10 minute execution time limit on cron jobs plus the
-    scheduler, which is configured to run this every 15 minutes.
+    The handler only enqueues a task per peer-reviewed unit; the tasks find
+    and expire the old review steps of their unit in batches.
 
-    Write operations done by this handler must be atomic since admins may visit
+    Write operations done by the tasks must be atomic since admins may visit
     this page at any time, kicking off any number of runs.
     """
 
@@ -61,48 +60,25 @@ class ExpireOldAssignedReviewsHandler(utils.BaseHandler):
                         'id': str(unit.unit_id),
                     })
 
-            total_count = 0
-            total_expired_count = 0
-            total_exception_count = 0
+            total_unit_count = 0
             _LOG.info('Begin expire_old_assigned_reviews cron')
 
             for namespace, units in namespace_to_units.iteritems():
-                start_namespace_message = (
-                    ('Begin processing course in namespace "%s"; %s unit%s '
-                     'found') % (
-                         namespace, len(units), '' if len(units) == 1 else 's'))
-                _LOG.info(start_namespace_message)
-
+                namespace_manager.set_namespace(namespace)
                 for unit in units:
-                    begin_unit_message = 'Begin processing unit %s' % unit['id']
-                    _LOG.info(begin_unit_message)
-
-                    namespace_manager.set_namespace(namespace)
-                    expired_keys, exception_keys = (
-                        review.Manager.expire_old_reviews_for_unit(
-                            unit['review_window_mins'], unit['id']))
-
-                    unit_expired_count = len(expired_keys)
-                    unit_exception_count = len(exception_keys)
-                    unit_total_count = unit_expired_count + unit_exception_count
-                    total_expired_count += unit_expired_count
-                    total_exception_count += total_exception_count
-                    total_count += unit_total_count
-
-                    end_unit_message = (
-                        'End processing unit %s. Expired: %s, Exceptions: %s, '
-                        'Total: %s' % (
-                            unit['id'], unit_expired_count,
-                            unit_exception_count, unit_total_count))
-                    _LOG.info(end_unit_message)
-
-                _LOG.info('Done processing namespace "%s"', namespace)
-
-            end_message = (
-                ('End expire_old_assigned_reviews cron. Expired: %s, '
-                 'Exceptions : %s, Total: %s') % (
-                     total_expired_count, total_exception_count, total_count))
-            _LOG.info(end_message)
+                    # Expiry itself runs in tasks, one per unit and then one
+                    # per batch of old review steps; see
+                    # review.Manager.schedule_expiry_for_unit.
+                    review.Manager.schedule_expiry_for_unit(
+                        unit['review_window_mins'], unit['id'])
+                total_unit_count += len(units)
+                _LOG.info(
+                    'Scheduled expiry of %s unit%s in namespace "%s"',
+                    len(units), '' if len(units) == 1 else 's', namespace)
+
+            _LOG.info(
+                'End expire_old_assigned_reviews cron. Units scheduled: %s',
+                total_unit_count)
             self.response.write('OK\n')
         except:  # Hide all errors. pylint: disable=bare-except
             pass
@@ -248,3 +248,42 @@ class ReviewStep(student_work.BaseEntity):
         model.submission_key = student_work.Submission.safe_key(
             model.submission_key, transform_fn)
         return model
+
+
+class ReviewCandidatePool(student_work.BaseEntity):
+    """A bucket of review summaries to draw new review assignments from.
+
+    The candidates of a unit are dealt into a fixed number of buckets, so
+    concurrent reviewers hashed to different buckets contend for different
+    review summaries. Buckets are only written when they are refilled.
+    """
+
+    # UTC time the bucket was last refilled.
+    refill_date = db.DateTimeProperty(auto_now=True, required=True)
+    # Keys of ReviewSummary entities, best candidates first.
+    summary_keys = db.ListProperty(db.Key, indexed=False)
+    # Identifier of the unit this bucket is a part of.
+    unit_id = db.StringProperty(required=True)
+
+    def __init__(self, *args, **kwargs):
+        """Constructs a new ReviewCandidatePool."""
+        assert not kwargs.get('key_name'), (
+            'Setting key_name manually not supported')
+        unit_id = kwargs.get('unit_id')
+        bucket = kwargs.pop('bucket', None)
+        assert unit_id, 'Missing required unit_id property'
+        assert bucket is not None, 'Missing required bucket argument'
+        kwargs['key_name'] = self.key_name(unit_id, bucket)
+        super(ReviewCandidatePool, self).__init__(*args, **kwargs)
+
+    @classmethod
+    def key_name(cls, unit_id, bucket):
+        """Creates a key_name string for datastore operations."""
+        return '(review_candidate_pool:%s:%s)' % (unit_id, bucket)
+
+    def for_export(self, transform_fn):
+        model = super(ReviewCandidatePool, self).for_export(transform_fn)
+        model.summary_keys = [
+            ReviewSummary.safe_key(key, transform_fn)
+            for key in model.summary_keys]
+        return model
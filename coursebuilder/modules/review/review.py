@@ -19,11 +19,18 @@ __author__ = [
 ]
 
 import datetime
+import hashlib
+import logging
 import random
+import re
+import time
 
+from common import utils as common_utils
+from models import config
 from models import counters
 from models import custom_modules
 from models import entities
+from models import progress
 from models import student_work
 from models import utils
 import models.review
@@ -32,7 +39,10 @@ from modules.review import dashboard as review_dashboard
 from modules.review import domain
 from modules.review import peer
 from modules.review import stats
+from google.appengine.api import namespace_manager
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
+from google.appengine.ext import deferred
 
 
 # In-process increment-only performance counters.
@@ -71,6 +81,24 @@ COUNTER_ASSIGNMENT_CANDIDATES_QUERY_RESULTS_RETURNED = counters.PerfCounter(
     ('number of results returned by the query returned by '
      'get_assignment_candidates_query()'))
 
+COUNTER_CANDIDATE_POOL_EXHAUSTED = counters.PerfCounter(
+    'gcb-pr-candidate-pool-exhausted',
+    ('number of times get_new_review() could not assign any candidate from '
+     'the bucket of the reviewer and fell back to querying for candidates'))
+COUNTER_CANDIDATE_POOL_HIT = counters.PerfCounter(
+    'gcb-pr-candidate-pool-hit',
+    'number of times get_new_review() drew candidates from a pool bucket')
+COUNTER_CANDIDATE_POOL_MISS = counters.PerfCounter(
+    'gcb-pr-candidate-pool-miss',
+    ('number of times get_new_review() found no candidates in the bucket of '
+     'the reviewer'))
+COUNTER_CANDIDATE_POOL_REFILL_SCHEDULED = counters.PerfCounter(
+    'gcb-pr-candidate-pool-refill-scheduled',
+    'number of times a refill of a candidate pool was scheduled')
+COUNTER_CANDIDATE_POOL_REFILLED = counters.PerfCounter(
+    'gcb-pr-candidate-pool-refilled',
+    'number of times refill_candidate_pool() refilled a candidate pool')
+
 COUNTER_DELETE_REVIEWER_ALREADY_REMOVED = counters.PerfCounter(
     'gcb-pr-review-delete-reviewer-already-removed',
     ('number of times delete_reviewer() called on review step with removed '
@@ -125,6 +153,18 @@ COUNTER_EXPIRE_OLD_REVIEWS_FOR_UNIT_SUCCESS = counters.PerfCounter(
     'gcb-pr-expire-old-reviews-for-unit-success',
     'number of times expire_old_reviews_for_unit() completed successfully')
 
+COUNTER_EXPIRE_REVIEWS_MILLIS = counters.PerfCounter(
+    'gcb-pr-expire-reviews-millis',
+    ('number of milliseconds expire_reviews() has spent; divide the number of '
+     'records expired by it for throughput'))
+COUNTER_EXPIRE_REVIEWS_NOT_EXPIRABLE = counters.PerfCounter(
+    'gcb-pr-expire-reviews-not-expirable',
+    ('number of records expire_reviews() skipped without a transaction '
+     'because they could no longer be expired when read'))
+COUNTER_EXPIRE_REVIEWS_TASKS_SCHEDULED = counters.PerfCounter(
+    'gcb-pr-expire-reviews-tasks-scheduled',
+    'number of tasks scheduled to expire a batch of old review steps')
+
 COUNTER_EXPIRY_QUERY_KEYS_RETURNED = counters.PerfCounter(
     'gcb-pr-expiry-query-keys-returned',
     'number of keys returned by the query returned by get_expiry_query()')
@@ -240,6 +280,29 @@ COUNTER_WRITE_REVIEW_UPDATED_EXISTING_REVIEW = counters.PerfCounter(
     'number of times write_review() updated an existing review')
 
 
+CAN_SHARD_REVIEW_CANDIDATES = config.ConfigProperty(
+    'gcb_can_shard_review_candidates', bool, (
+        'Whether or not to draw new peer review assignments from a pool of '
+        'candidates split into buckets, each shared by a fraction of the '
+        'reviewers. This lets many students ask for reviews at once, for '
+        'example close to a deadline, without contending for the same '
+        'submissions. The pool is refilled in the background, so the order '
+        'in which submissions are reviewed is kept only approximately.'),
+    False)
+
+# Number of review steps expired by one task.
+EXPIRY_TASK_BATCH_SIZE = 100
+# Number of review steps read ahead at a time while expiring.
+EXPIRY_READ_AHEAD_SIZE = 20
+
+# Number of buckets the candidate pool of a unit is split into; reviewers are
+# hashed to buckets.
+CANDIDATE_POOL_BUCKETS = 16
+# Most candidates kept in a bucket.
+CANDIDATE_POOL_BUCKET_SIZE = 20
+# Buckets older than this are refilled, and no more often than this.
+CANDIDATE_POOL_MAX_AGE_SECS = 60
+
 # Number of entities to fetch when querying for all review steps that meet
 # given criteria. Ideally we'd cursor through results rather than setting a
 # ceiling, but for now let's allow as many removed results as unremoved.
@@ -518,30 +581,121 @@ class Manager(object):
         query = cls.get_expiry_query(review_window_mins, unit_id)
         mapper = utils.QueryMapper(
             query, counter=COUNTER_EXPIRY_QUERY_KEYS_RETURNED, report_every=100)
-        expired_keys = []
-        exception_keys = []
+        review_step_keys = []
 
-        def map_fn(review_step_key, expired_keys, exception_keys):
-            try:
-                expired_keys.append(cls.expire_review(review_step_key))
-            except:  # All errors are the same. pylint: disable=bare-except
-                # Skip. Either the entity was updated between the query and
-                # the update, meaning we don't need to expire it; or we ran into
-                # a transient datastore error, meaning we'll expire it next
-                # time.
-                COUNTER_EXPIRE_OLD_REVIEWS_FOR_UNIT_SKIP.inc()
-                exception_keys.append(review_step_key)
+        def map_fn(review_step_key, review_step_keys):
+            review_step_keys.append(review_step_key)
 
         COUNTER_EXPIRE_OLD_REVIEWS_FOR_UNIT_START.inc()
 
-        mapper.run(map_fn, expired_keys, exception_keys)
+        mapper.run(map_fn, review_step_keys)
+        expired_keys, exception_keys = cls.expire_reviews(review_step_keys)
+        COUNTER_EXPIRE_OLD_REVIEWS_FOR_UNIT_SUCCESS.inc()
+        return expired_keys, exception_keys
+
+    @classmethod
+    def schedule_expiry_for_unit(cls, review_window_mins, unit_id):
+        """Enqueues a task that expires all old review steps for a unit.
+
+        The task splits the old review steps of the unit into batches of
+        EXPIRY_TASK_BATCH_SIZE and enqueues a task to expire each batch, so
+        units of any size are expired within task deadlines, with batches
+        running in parallel.
+
+        Args:
+            review_window_mins: int. Number of minutes before we expire reviews
+                assigned by domain.ASSIGNER_KIND_AUTO.
+            unit_id: string. Id of the unit to restrict the query to.
+        """
+        deferred.defer(
+            cls._schedule_expiry_batches_task,
+            namespace_manager.get_namespace(), review_window_mins, unit_id)
+
+    @classmethod
+    def _schedule_expiry_batches_task(
+        cls, namespace, review_window_mins, unit_id):
+        with common_utils.Namespace(namespace):
+            query = cls.get_expiry_query(review_window_mins, unit_id)
+            COUNTER_EXPIRE_OLD_REVIEWS_FOR_UNIT_START.inc()
+            while True:
+                review_step_keys = query.fetch(EXPIRY_TASK_BATCH_SIZE)
+                COUNTER_EXPIRY_QUERY_KEYS_RETURNED.inc(
+                    increment=len(review_step_keys))
+                if not review_step_keys:
+                    break
+                deferred.defer(
+                    cls._expire_reviews_task, namespace, review_step_keys)
+                COUNTER_EXPIRE_REVIEWS_TASKS_SCHEDULED.inc()
+                if len(review_step_keys) < EXPIRY_TASK_BATCH_SIZE:
+                    break
+                query.with_cursor(query.cursor())
+            COUNTER_EXPIRE_OLD_REVIEWS_FOR_UNIT_SUCCESS.inc()
+
+    @classmethod
+    def _expire_reviews_task(cls, namespace, review_step_keys):
+        with common_utils.Namespace(namespace):
+            cls.expire_reviews(review_step_keys)
+
+    @classmethod
+    def expire_reviews(cls, review_step_keys):
+        """Expires review steps, skipping those that cannot be expired.
+
+        Steps are read ahead in batches with async gets while the previous
+        batch is being expired; steps that can no longer be expired when read
+        are skipped without a transaction. Each of the others is expired in
+        its own transaction, as by expire_review.
+
+        Args:
+            review_step_keys: [db.Key of peer.ReviewStep]. Steps to expire.
+
+        Returns:
+            2-tuple of list of db.Key of peer.ReviewStep. 0th element is keys
+            that were written successfully; 1st element is keys that we skipped.
+        """
+        start = time.time()
+        expired_keys = []
+        exception_keys = []
+        batches = [
+            review_step_keys[index:index + EXPIRY_READ_AHEAD_SIZE]
+            for index in xrange(
+                0, len(review_step_keys), EXPIRY_READ_AHEAD_SIZE)]
+        rpc = db.get_async(batches[0]) if batches else None
+
+        for index, batch in enumerate(batches):
+            steps = rpc.get_result()
+            if index + 1 < len(batches):
+                rpc = db.get_async(batches[index + 1])
+
+            for review_step_key, step in zip(batch, steps):
+                if (not step or step.removed or
+                    step.state != domain.REVIEW_STATE_ASSIGNED):
+                    COUNTER_EXPIRE_REVIEWS_NOT_EXPIRABLE.inc()
+                    COUNTER_EXPIRE_OLD_REVIEWS_FOR_UNIT_SKIP.inc()
+                    exception_keys.append(review_step_key)
+                    continue
+                try:
+                    expired_keys.append(cls.expire_review(review_step_key))
+                except:  # All errors are the same. pylint: disable=bare-except
+                    # Skip. Either the entity was updated between the query and
+                    # the update, meaning we don't need to expire it; or we ran
+                    # into a transient datastore error, meaning we'll expire it
+                    # next time.
+                    COUNTER_EXPIRE_OLD_REVIEWS_FOR_UNIT_SKIP.inc()
+                    exception_keys.append(review_step_key)
+
+        elapsed_secs = time.time() - start
         COUNTER_EXPIRE_OLD_REVIEWS_FOR_UNIT_EXPIRE.inc(
             increment=len(expired_keys))
-        COUNTER_EXPIRE_OLD_REVIEWS_FOR_UNIT_SUCCESS.inc()
+        COUNTER_EXPIRE_REVIEWS_MILLIS.inc(increment=int(elapsed_secs * 1000))
+        if review_step_keys:
+            logging.info(
+                'Expired %s and skipped %s review steps in %.2fs (%.1f/s).',
+                len(expired_keys), len(exception_keys), elapsed_secs,
+                len(review_step_keys) / max(elapsed_secs, 0.001))
         return expired_keys, exception_keys
 
     @classmethod
-    def get_assignment_candidates_query(cls, unit_id):
+    def get_assignment_candidates_query(cls, unit_id, keys_only=False):
         """Gets query that returns candidates for new review assignment.
 
         New assignment candidates are scoped to a unit. We prefer first items
@@ -553,11 +707,12 @@ class Manager(object):
 
         Args:
             unit_id: string. Id of the unit to restrict the query to.
+            keys_only: boolean. Whether the query returns keys only.
 
         Returns:
             db.Query that will return [peer.ReviewSummary].
         """
-        return peer.ReviewSummary.all(
+        return peer.ReviewSummary.all(keys_only=keys_only
         ).filter(
             peer.ReviewSummary.unit_id.name, unit_id
         ).order(
@@ -620,9 +775,13 @@ class Manager(object):
         the list. We then retry assignment up to max_retries times. If we run
         out of retries or candidates, we raise domain.NotAssignableError.
 
-        This is a naive implementation because it scales only to relatively low
-        new review assignments per second and because it can raise
-        domain.NotAssignableError when there are in fact assignable reviews.
+        On its own this scales only to relatively low new review assignments
+        per second, because all reviewers contend for the head of the same
+        query. When CAN_SHARD_REVIEW_CANDIDATES is on, candidates are first
+        drawn from the bucket of the candidate pool the reviewer is hashed to;
+        see refill_candidate_pool. The query is used only if no candidate from
+        the bucket can be assigned, so sharding never makes a review
+        unassignable.
 
         Args:
             unit_id: string. The unit to assign work from.
@@ -649,37 +808,144 @@ class Manager(object):
         """
         try:
             COUNTER_GET_NEW_REVIEW_START.inc()
-            # Filter out candidates that are for submissions by the reviewer.
-            raw_candidates = cls.get_assignment_candidates_query(unit_id).fetch(
-                candidate_count)
-            COUNTER_ASSIGNMENT_CANDIDATES_QUERY_RESULTS_RETURNED.inc(
-                increment=len(raw_candidates))
-            candidates = [
-                candidate for candidate in raw_candidates
-                if candidate.reviewee_key != reviewer_key]
-
-            retries = 0
-            while True:
-                if not candidates or retries >= max_retries:
-                    COUNTER_GET_NEW_REVIEW_NOT_ASSIGNABLE.inc()
-                    raise domain.NotAssignableError(
-                        'No reviews assignable for unit %s and reviewer %s' % (
-                            unit_id, repr(reviewer_key)))
-                candidate = cls._choose_assignment_candidate(candidates)
-                candidates.remove(candidate)
-                assigned_key = cls._attempt_review_assignment(
-                    candidate.key(), reviewer_key, candidate.change_date)
-
+            assigned_key = None
+            if CAN_SHARD_REVIEW_CANDIDATES.value:
+                candidates = cls._get_pooled_assignment_candidates(
+                    unit_id, reviewer_key)
+                assigned_key = cls._assign_from_candidates(
+                    candidates, reviewer_key, max_retries)
                 if not assigned_key:
-                    retries += 1
-                else:
-                    COUNTER_GET_NEW_REVIEW_SUCCESS.inc()
-                    return assigned_key
+                    COUNTER_CANDIDATE_POOL_EXHAUSTED.inc()
+                    cls._schedule_candidate_pool_refill(unit_id)
+
+            if not assigned_key:
+                candidates = cls._get_queried_assignment_candidates(
+                    unit_id, reviewer_key, candidate_count)
+                assigned_key = cls._assign_from_candidates(
+                    candidates, reviewer_key, max_retries)
+
+            if not assigned_key:
+                COUNTER_GET_NEW_REVIEW_NOT_ASSIGNABLE.inc()
+                raise domain.NotAssignableError(
+                    'No reviews assignable for unit %s and reviewer %s' % (
+                        unit_id, repr(reviewer_key)))
+            COUNTER_GET_NEW_REVIEW_SUCCESS.inc()
+            return assigned_key
 
         except Exception, e:
             COUNTER_GET_NEW_REVIEW_FAILED.inc()
             raise e
 
+    @classmethod
+    def _get_queried_assignment_candidates(
+        cls, unit_id, reviewer_key, candidate_count):
+        raw_candidates = cls.get_assignment_candidates_query(unit_id).fetch(
+            candidate_count)
+        COUNTER_ASSIGNMENT_CANDIDATES_QUERY_RESULTS_RETURNED.inc(
+            increment=len(raw_candidates))
+        # Filter out candidates that are for submissions by the reviewer.
+        return [
+            candidate for candidate in raw_candidates
+            if candidate.reviewee_key != reviewer_key]
+
+    @classmethod
+    def _get_pooled_assignment_candidates(cls, unit_id, reviewer_key):
+        bucket = cls._get_candidate_pool_bucket(reviewer_key)
+        pool = peer.ReviewCandidatePool.get_by_key_name(
+            peer.ReviewCandidatePool.key_name(unit_id, bucket))
+        if not pool or (
+            datetime.datetime.utcnow() - pool.refill_date >
+            datetime.timedelta(seconds=CANDIDATE_POOL_MAX_AGE_SECS)):
+            cls._schedule_candidate_pool_refill(unit_id)
+        if not pool or not pool.summary_keys:
+            COUNTER_CANDIDATE_POOL_MISS.inc()
+            return []
+
+        COUNTER_CANDIDATE_POOL_HIT.inc()
+        return [
+            candidate for candidate in entities.get(pool.summary_keys)
+            if candidate and candidate.reviewee_key != reviewer_key]
+
+    @classmethod
+    def _assign_from_candidates(cls, candidates, reviewer_key, max_retries):
+        """Attempts to assign one of the candidates; returns step key or None.
+
+        Args:
+            candidates: [peer.ReviewSummary]. Candidates to choose from; the
+                list is consumed.
+            reviewer_key: db.Key of models.models.Student. The reviewer.
+            max_retries: int. Number of failed assignment attempts to make
+                before giving up.
+
+        Returns:
+            db.Key of peer.ReviewStep, or None if no candidate was assigned.
+        """
+        retries = 0
+        while candidates and retries < max_retries:
+            candidate = cls._choose_assignment_candidate(candidates)
+            candidates.remove(candidate)
+            assigned_key = cls._attempt_review_assignment(
+                candidate.key(), reviewer_key, candidate.change_date)
+            if assigned_key:
+                return assigned_key
+            retries += 1
+        return None
+
+    @classmethod
+    def _get_candidate_pool_bucket(cls, reviewer_key):
+        digest = hashlib.md5(str(reviewer_key)).hexdigest()
+        return int(digest[:8], 16) % CANDIDATE_POOL_BUCKETS
+
+    @classmethod
+    def _schedule_candidate_pool_refill(cls, unit_id):
+        """Enqueues a refill of the candidate pool of a unit, at most once."""
+        namespace = namespace_manager.get_namespace()
+        # Tasks with the same name are only added once, so one refill is
+        # made per unit per CANDIDATE_POOL_MAX_AGE_SECS however many
+        # reviewers ask for it.
+        task_name = re.sub(
+            '[^a-zA-Z0-9_-]', '-', 'review-candidate-pool-%s-%s-%s' % (
+                namespace, unit_id,
+                int(time.time()) / CANDIDATE_POOL_MAX_AGE_SECS))
+        try:
+            deferred.defer(
+                cls._refill_candidate_pool_task, namespace, unit_id,
+                _name=task_name)
+            COUNTER_CANDIDATE_POOL_REFILL_SCHEDULED.inc()
+        except (taskqueue.TaskAlreadyExistsError,
+                taskqueue.TombstonedTaskError):
+            pass
+
+    @classmethod
+    def _refill_candidate_pool_task(cls, namespace, unit_id):
+        with common_utils.Namespace(namespace):
+            cls.refill_candidate_pool(unit_id)
+
+    @classmethod
+    def refill_candidate_pool(cls, unit_id):
+        """Deals the best assignment candidates of a unit into pool buckets.
+
+        The head of get_assignment_candidates_query is dealt round-robin, so
+        each bucket holds an equal share of the best candidates, in order.
+        Buckets hold disjoint candidates unless there are fewer candidates
+        than buckets.
+
+        Args:
+            unit_id: string. Id of the unit to refill the pool of.
+        """
+        keys = cls.get_assignment_candidates_query(
+            unit_id, keys_only=True).fetch(
+                CANDIDATE_POOL_BUCKETS * CANDIDATE_POOL_BUCKET_SIZE)
+        pools = []
+        for bucket in xrange(CANDIDATE_POOL_BUCKETS):
+            summary_keys = keys[bucket::CANDIDATE_POOL_BUCKETS]
+            if not summary_keys and keys:
+                summary_keys = [keys[bucket % len(keys)]]
+            pools.append(peer.ReviewCandidatePool(
+                bucket=bucket, summary_keys=summary_keys, unit_id=unit_id))
+        entities.put(pools)
+        COUNTER_CANDIDATE_POOL_REFILLED.inc()
+
     @classmethod
     def _choose_assignment_candidate(cls, candidates):
         """Seam that allows different choice functions in tests."""
@@ -975,8 +1241,21 @@ class Manager(object):
             raise e
 
         COUNTER_WRITE_REVIEW_SUCCESS.inc()
+        if mark_completed:
+            cls._put_completed_review_count(step_key)
         return step_key
 
+    @classmethod
+    def _put_completed_review_count(cls, review_step_key):
+        """Records the reviews a reviewer completed in their score summary."""
+        step = entities.get(review_step_key)
+        review_steps = cls.get_review_steps_by_keys(
+            cls.get_review_step_keys_by(step.unit_id, step.reviewer_key))
+        progress.UnitLessonCompletionTracker.put_score_summary_review_count(
+            step.reviewer_key.name(), step.unit_id,
+            models.review.ReviewUtils.count_completed_reviews(
+                [review_step for review_step in review_steps if review_step]))
+
     @classmethod
     @db.transactional(xg=True)
     def _update_review_contents_and_change_state(
@@ -170,6 +170,7 @@ class _SkillDao(models.LastModfiedJsonDao):
     DTO = Skill
     ENTITY = _SkillEntity
     ENTITY_KEY_TYPE = models.BaseJsonDao.EntityKeyTypeId
+    PROCESS_CACHE = True
     # Using hooks that are in the same file looks awkward, but it's cleaner
     # than overriding all the load/store methods, and is also proof against
     # future changes that extend the DAO API.
@@ -1322,10 +1323,8 @@ class SkillCompletionTracker(object):
             (progress, timestamp). For the state NOT_ATTEMPTED the timestamp
             is always 0.
         """
-        sprogress = self._get_or_create_progress(student)
-        if not sprogress.value:
-            return {id: (self.NOT_ATTEMPTED, 0) for id in skill_bunch}
-        sprogress = transforms.loads(sprogress.value)
+        sprogress = progress.ProgressDocument(
+            self._get_or_create_progress(student))
         result = {}
         for skill_id in skill_bunch:
             skill_progress = sprogress.get(str(skill_id))  # After transforms
@@ -1348,9 +1347,9 @@ class SkillCompletionTracker(object):
         time (seconds since epoch).
 
         Args:
-            progress_value: an dictiory. Corresponds to the value of an
-            models.models.StudentPropertyEntity instance that tracks the
-            skill progress.
+            progress_value: a dict or a progress.ProgressDocument with the
+            value of a models.models.StudentPropertyEntity instance that
+            tracks the skill progress.
             skill_id: the id of the skill to modify.
             state: a valid progress state for the skill.
         """
@@ -1358,15 +1357,19 @@ class SkillCompletionTracker(object):
         if not skill_progress:
             progress_value[str(skill_id)] = {state: time.time()}
         elif not state in skill_progress:
-            progress_value[str(skill_id)][state] = time.time()
+            # Set a changed copy so that a ProgressDocument sees the change.
+            skill_progress = dict(skill_progress)
+            skill_progress[state] = time.time()
+            progress_value[str(skill_id)] = skill_progress
 
     def recalculate_progress(self, lprogress_tracker, lprogress, skill):
         """Calculates the progress of the skill from the linear progress.
 
         Args:
             lprogress_tracker: an instance of UnitLessonCompletionTracker.
-            lprogress: an instance of StudentPropertyEntity that holds
-            the linear progress of the student in the course.
+            lprogress: an instance of progress.ProgressDocument or
+            StudentPropertyEntity that holds the linear progress of the
+            student in the course.
             skill: an instance of SkillInfo or Skill.
 
         Returns:
@@ -1402,26 +1405,24 @@ class SkillCompletionTracker(object):
 
         Args:
             student: an instance of StudentEntity.
-            lprogress: an instance of StudentPropertyEntity with the linear
-            progress of student.
+            lprogress: an instance of progress.ProgressDocument or
+            StudentPropertyEntity with the linear progress of student.
             lesson_id: the id of the lesson.
         """
         # TODO(milit): Add process for lesson None.
         if not self._skill_map:
             return
         lprogress_tracker = progress.UnitLessonCompletionTracker(self.course)
+        lprogress = progress.ProgressDocument.wrap(lprogress)
 
-        sprogress = self._get_or_create_progress(student)
-        progress_value = {}
-        if sprogress.value:
-            progress_value = transforms.loads(sprogress.value)
+        sprogress = progress.ProgressDocument(
+            self._get_or_create_progress(student))
         skills = self._skill_map.get_skills_for_lesson(lesson_id)
         for skill in skills:
             new_progress = self.recalculate_progress(
                 lprogress_tracker, lprogress, skill)
-            self.update_skill_progress(progress_value, skill.id, new_progress)
+            self.update_skill_progress(sprogress, skill.id, new_progress)
 
-        sprogress.value = transforms.dumps(progress_value)
         sprogress.put()
 
 
@@ -1431,7 +1432,7 @@ def post_update_progress(course, student, lprogress, event_entity, event_key):
     Args:
         course: the current course.
         student: an instance of StudentEntity.
-        lprogress: an instance of StudentPropertyEntity with the linear
+        lprogress: an instance of progress.ProgressDocument with the linear
         progress. This function is called before the put() to the database,
         this instance must have the latest changes.
         event_entity: a string. The kind of event or progress that was
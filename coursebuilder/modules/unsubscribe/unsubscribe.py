@@ -85,7 +85,34 @@ def has_unsubscribed(email):
     Returns:
       bool. True if the user has requested to be unsubscribed.
     """
-    model = SubscriptionStateEntity.get_by_key_name(email)
+    return is_unsubscribed_state(
+        SubscriptionStateEntity.get_by_key_name(email))
+
+
+def get_subscription_state_key(email):
+    """Get the datastore key of the subscription state of a user.
+
+    Lets callers fetch the states of many users, together with any other
+    entities, in a single db.get(); see is_unsubscribed_state().
+
+    Args:
+      email: string. The email address of the user.
+
+    Returns:
+      db.Key. The key of the user's SubscriptionStateEntity.
+    """
+    return db.Key.from_path(SubscriptionStateEntity.kind(), email)
+
+
+def is_unsubscribed_state(model):
+    """Check whether a subscription state says the user has unsubscribed.
+
+    Args:
+      model: SubscriptionStateEntity, or None if the user has no state.
+
+    Returns:
+      bool. True if the user has requested to be unsubscribed.
+    """
     return (model is not None) and not model.is_subscribed
 
 
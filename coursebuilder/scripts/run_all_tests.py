@@ -47,6 +47,8 @@ ALL_TEST_CLASSES = {
     'tests.functional.common_users.AppEnginePassthroughUsersServiceTest': 5,
     'tests.functional.common_users.ContextHooksCustomizationTest': 3,
     'tests.functional.common_users.PublicExceptionsAndClassesIdentityTests': 2,
+    'tests.functional.explorer_module.CourseCatalogBenchmark': 1,
+    'tests.functional.explorer_module.CourseCatalogTest': 7,
     'tests.functional.explorer_module.CourseExplorerTest': 3,
     'tests.functional.explorer_module.CourseExplorerDisabledTest': 3,
     'tests.functional.explorer_module.GlobalProfileTest': 1,
@@ -60,7 +62,10 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_analytics.MapReduceSimpleTest': 1,
     'tests.functional.model_analytics.ProgressAnalyticsTest': 9,
     'tests.functional.model_analytics.QuestionAnalyticsTest': 3,
-    'tests.functional.model_courses.CourseCachingTest': 5,
+    'tests.functional.model_courses.CourseCachingTest': 8,
+    'tests.functional.model_courses.CourseEnvironProcessCacheTest': 5,
+    'tests.functional.model_courses.CourseModelProcessCacheTest': 4,
+    'tests.functional.model_courses.CourseNavigationIndexTest': 5,
     'tests.functional.model_data_sources.PaginatedTableTest': 17,
     'tests.functional.model_data_sources.PiiExportTest': 4,
     'tests.functional.model_entities.BaseEntityTestCase': 3,
@@ -69,19 +74,33 @@ ALL_TEST_CLASSES = {
     'tests.functional.model_jobs.JobOperationsTest': 15,
     'tests.functional.model_models.BaseJsonDaoTestCase': 1,
     'tests.functional.model_models.ContentChunkTestCase': 15,
+    'tests.functional.model_models.EventBufferTestCase': 8,
+    'tests.functional.model_models.EventDataCompactionBenchmark': 1,
+    'tests.functional.model_models.EventDataCompactionTestCase': 6,
     'tests.functional.model_models.EventEntityTestCase': 1,
-    'tests.functional.model_models.MemcacheManagerTestCase': 4,
+    'tests.functional.model_models.MemcacheManagerBenchmark': 1,
+    'tests.functional.model_models.MemcacheManagerTestCase': 9,
     'tests.functional.model_models.PersonalProfileTestCase': 1,
+    'tests.functional.model_models.ProcessScopedDaoCacheTestCase': 9,
     'tests.functional.model_models.QuestionDAOTestCase': 3,
+    'tests.functional.model_models.StudentAnswersDAOTestCase': 2,
     'tests.functional.model_models.StudentAnswersEntityTestCase': 1,
+    'tests.functional.model_models.StudentAssessmentAnswersEntityTestCase': 2,
     'tests.functional.model_models.StudentProfileDAOTestCase': 6,
     'tests.functional.model_models.StudentPropertyEntityTestCase': 1,
     'tests.functional.model_models.StudentTestCase': 3,
+    'tests.functional.model_progress.ProgressDocumentBenchmark': 1,
+    'tests.functional.model_progress.ProgressDocumentCascadeTest': 5,
+    'tests.functional.model_progress.ProgressDocumentTest': 6,
+    'tests.functional.model_progress.ProgressRollupTest': 5,
+    'tests.functional.model_progress.ScoreSummaryTest': 6,
     'tests.functional.model_student_work.KeyPropertyTest': 4,
     'tests.functional.model_student_work.ReviewTest': 3,
     'tests.functional.model_student_work.SubmissionTest': 3,
     'tests.functional.model_utils.QueryMapperTest': 4,
-    'tests.functional.model_vfs.VfsLargeFileSupportTest': 6,
+    'tests.functional.model_vfs.VfsCacheJournalTest': 5,
+    'tests.functional.model_vfs.VfsLargeFileSupportTest': 7,
+    'tests.functional.model_vfs.VfsListingTest': 3,
     'tests.functional.module_config_test.ManipulateAppYamlFileTest': 8,
     'tests.functional.module_config_test.ModuleIncorporationTest': 12,
     'tests.functional.module_config_test.ModuleManifestTest': 7,
@@ -93,12 +112,13 @@ ALL_TEST_CLASSES = {
     'tests.functional.modules_analytics.StudentVectorGeneratorProgressTests': 2,
     'tests.functional.modules_analytics.StudentVectorGeneratorTests': 12,
     'tests.functional.modules_analytics.TestClusterStatisticsDataSource': 2,
+    'tests.functional.modules_announcements.AnnouncementsPaginationTest': 7,
     'tests.functional.modules_balancer.ExternalTaskTest': 3,
     'tests.functional.modules_balancer.ManagerTest': 10,
     'tests.functional.modules_balancer.ProjectRestHandlerTest': 5,
     'tests.functional.modules_balancer.TaskRestHandlerTest': 20,
     'tests.functional.modules_balancer.WorkerPoolTest': 2,
-    'tests.functional.modules_certificate.CertificateHandlerTestCase': 5,
+    'tests.functional.modules_certificate.CertificateHandlerTestCase': 7,
     'tests.functional.modules_certificate.CertificateCriteriaTestCase': 6,
     'tests.functional.modules_code_tags.CodeTagTests': 4,
     'tests.functional.modules_core_tags.GoogleDriveRESTHandlerTest': 8,
@@ -142,14 +162,14 @@ ALL_TEST_CLASSES = {
     'tests.functional.modules_i18n_dashboard_jobs'
         '.TranslateToReversedCaseTest': 1,
     'tests.functional.modules_i18n_dashboard_jobs.UploadTranslationsTest': 5,
-    'tests.functional.modules_invitation.InvitationHandlerTests': 16,
+    'tests.functional.modules_invitation.InvitationHandlerTests': 17,
     'tests.functional.modules_invitation.ProfileViewInvitationTests': 5,
     'tests.functional.modules_invitation.SantitationTests': 1,
     'tests.functional.modules_manual_progress.ManualProgressTest': 24,
     'tests.functional.modules_math.MathTagTests': 3,
-    'tests.functional.modules_notifications.CronTest': 9,
+    'tests.functional.modules_notifications.CronTest': 11,
     'tests.functional.modules_notifications.DatetimeConversionTest': 1,
-    'tests.functional.modules_notifications.ManagerTest': 31,
+    'tests.functional.modules_notifications.ManagerTest': 37,
     'tests.functional.modules_notifications.NotificationTest': 8,
     'tests.functional.modules_notifications.PayloadTest': 6,
     'tests.functional.modules_notifications.SerializedPropertyTest': 2,
@@ -187,16 +207,19 @@ ALL_TEST_CLASSES = {
     'tests.functional.modules_usage_reporting.MessagingTests': 8,
     'tests.functional.modules_usage_reporting.UsageReportingTests': 3,
     'tests.functional.progress_percent.ProgressPercent': 4,
-    'tests.functional.review_module.ManagerTest': 55,
+    'tests.functional.review_module.CandidatePoolTest': 5,
+    'tests.functional.review_module.ManagerTest': 57,
+    'tests.functional.review_module.ReviewAssignmentLoadTest': 1,
     'tests.functional.review_peer.ReviewStepTest': 3,
     'tests.functional.review_peer.ReviewSummaryTest': 5,
-    'tests.functional.student_answers.StudentAnswersAnalyticsTest': 1,
+    'tests.functional.student_answers.StudentAnswersAnalyticsTest': 3,
     'tests.functional.student_labels.StudentLabelsTest': 32,
     'tests.functional.student_last_location.NonRootCourse': 9,
     'tests.functional.student_last_location.RootCourse': 3,
     'tests.functional.student_tracks.StudentTracksTest': 10,
     'tests.functional.review_stats.PeerReviewAnalyticsTest': 1,
     'tests.functional.roles.RolesTest': 24,
+    'tests.functional.unit_assessment.AssessmentSubmissionTest': 3,
     'tests.functional.upload_module.TextFileUploadHandlerTestCase': 8,
     'tests.functional.test_classes.ActivityTest': 2,
     'tests.functional.test_classes.AdminAspectTest': 9,
@@ -204,6 +227,7 @@ ALL_TEST_CLASSES = {
     'tests.functional.test_classes.CourseAuthorAspectTest': 4,
     'tests.functional.test_classes.CourseAuthorCourseCreationTest': 1,
     'tests.functional.test_classes.CourseUrlRewritingTest': 44,
+    'tests.functional.test_classes.DatastoreBackedAssetTest': 5,
     'tests.functional.test_classes.DatastoreBackedCustomCourseTest': 6,
     'tests.functional.test_classes.DatastoreBackedSampleCourseTest': 44,
     'tests.functional.test_classes.EtlMainTestCase': 42,
@@ -214,9 +238,9 @@ ALL_TEST_CLASSES = {
     'tests.functional.test_classes.MemcacheTest': 65,
     'tests.functional.test_classes.MultipleCoursesTest': 1,
     'tests.functional.test_classes.NamespaceTest': 2,
-    'tests.functional.test_classes.StaticHandlerTest': 1,
-    'tests.functional.test_classes.StudentAspectTest': 19,
-    'tests.functional.test_classes.StudentUnifiedProfileTest': 19,
+    'tests.functional.test_classes.StaticHandlerTest': 2,
+    'tests.functional.test_classes.StudentAspectTest': 20,
+    'tests.functional.test_classes.StudentUnifiedProfileTest': 20,
     'tests.functional.test_classes.TransformsEntitySchema': 1,
     'tests.functional.test_classes.TransformsJsonFileTestCase': 3,
     'tests.functional.test_classes.VirtualFileSystemTest': 44,
@@ -249,6 +273,7 @@ ALL_TEST_CLASSES = {
     'tests.unit.javascript_tests.AllJavaScriptTests': 9,
     'tests.unit.models_analytics.AnalyticsTests': 5,
     'tests.unit.models_courses.WorkflowValidationTests': 13,
+    'tests.unit.models_counters.LatencyPerfCounterTests': 4,
     'tests.unit.models_transforms.JsonToDictTests': 13,
     'tests.unit.models_transforms.JsonParsingTests': 3,
     'tests.unit.models_transforms.StringValueConversionTests': 2,
@@ -16,16 +16,23 @@
 
 __author__ = 'rahulsingal@google.com (Rahul Singal)'
 
+import logging
+import time
 
 import actions
 from actions import assert_contains
 from actions import assert_does_not_contain
 from actions import assert_equals
+import appengine_config
+from common.utils import Namespace
 from controllers import sites
 from models import config
+from models import entities
 from models import models
 from models import transforms
 from models.models import PersonalProfile
+from models.roles import Roles
+from modules.course_explorer import catalog
 from modules.course_explorer import course_explorer
 from modules.course_explorer import student
 
@@ -310,3 +317,160 @@ class GlobalProfileTest(BaseExplorerTest):
         response.form.set('name', new_name)
         response = response.form.submit(expect_errors=True)
         assert_equals(response.status_int, 400)
+
+
+class CourseCatalogTest(BaseExplorerTest):
+    """Tests the materialized course catalog behind the explorer pages."""
+
+    ADMIN_EMAIL = 'admin@foo.com'
+    STUDENT_EMAIL = 'student@foo.com'
+
+    def setUp(self):
+        super(CourseCatalogTest, self).setUp()
+        actions.simple_add_course('first', self.ADMIN_EMAIL, 'First Course')
+        actions.simple_add_course('second', self.ADMIN_EMAIL, 'Second Course')
+
+    def _get_catalog_entity(self):
+        with Namespace(appengine_config.DEFAULT_NAMESPACE_NAME):
+            return catalog.CourseCatalogEntity.get_by_key_name(
+                catalog.CourseCatalogEntity.KEY_NAME)
+
+    def _get_catalog_namespaces(self):
+        return [
+            entry.get_namespace_name()
+            for entry in catalog.CourseCatalog.get_entries()]
+
+    def test_catalog_is_built_once_for_explorer_pages(self):
+        rebuilt = catalog.CATALOG_REBUILT.value
+        actions.login(self.STUDENT_EMAIL)
+
+        response = self.get('/explorer')
+        assert_contains('First Course', response.body)
+        assert_contains('Second Course', response.body)
+        actions.register(self, 'Student', course='first')
+        response = self.get('/explorer/courses')
+        assert_contains('First Course', response.body)
+        assert_does_not_contain('Second Course', response.body)
+
+        self.assertEquals(rebuilt + 1, catalog.CATALOG_REBUILT.value)
+        self.assertIsNotNone(self._get_catalog_entity())
+
+    def test_catalog_read_is_one_datastore_get(self):
+        catalog.CourseCatalog.get_entries()
+        gets = entities.DB_GET.value
+        self.assertEquals(
+            ['ns_second', 'ns_first', ''], self._get_catalog_namespaces())
+        self.assertEquals(gets + 1, entities.DB_GET.value)
+
+    def test_saving_course_settings_invalidates_catalog(self):
+        response = self.get('/explorer')
+        assert_contains('Second Course', response.body)
+        self.assertIsNotNone(self._get_catalog_entity())
+
+        actions.update_course_config('second', {
+            'course': {'now_available': False}})
+        self.assertIsNone(self._get_catalog_entity())
+
+        response = self.get('/explorer')
+        assert_contains('First Course', response.body)
+        assert_does_not_contain('Second Course', response.body)
+
+    def test_catalog_is_rebuilt_when_courses_change(self):
+        self.assertEquals(
+            ['ns_second', 'ns_first', ''], self._get_catalog_namespaces())
+
+        sites.setup_courses('course:/third::ns_third, %s' % (
+            config.Registry.test_overrides[sites.GCB_COURSES_CONFIG.name]))
+        rebuilt = catalog.CATALOG_REBUILT.value
+        self.assertEquals(
+            ['ns_third', 'ns_second', 'ns_first', ''],
+            self._get_catalog_namespaces())
+        self.assertEquals(rebuilt + 1, catalog.CATALOG_REBUILT.value)
+
+    def test_stale_catalog_is_rebuilt(self):
+        catalog.CourseCatalog.get_entries()
+        rebuilt = catalog.CATALOG_REBUILT.value
+        catalog.CourseCatalog.get_entries()
+        self.assertEquals(rebuilt, catalog.CATALOG_REBUILT.value)
+
+        self.swap(catalog, 'CATALOG_MAX_AGE_SECS', 0)
+        catalog.CourseCatalog.get_entries()
+        self.assertEquals(rebuilt + 1, catalog.CATALOG_REBUILT.value)
+
+    def test_catalog_is_cached_in_memcache(self):
+        with actions.OverriddenConfig(models.CAN_USE_MEMCACHE.name, True):
+            catalog.CourseCatalog.get_entries()
+            hits = catalog.CATALOG_CACHE_HIT.value
+            gets = entities.DB_GET.value
+            catalog.CourseCatalog.get_entries()
+            self.assertEquals(hits + 1, catalog.CATALOG_CACHE_HIT.value)
+            self.assertEquals(gets, entities.DB_GET.value)
+
+            rebuilt = catalog.CATALOG_REBUILT.value
+            catalog.CourseCatalog.invalidate()
+            catalog.CourseCatalog.get_entries()
+            self.assertEquals(hits + 1, catalog.CATALOG_CACHE_HIT.value)
+            self.assertEquals(rebuilt + 1, catalog.CATALOG_REBUILT.value)
+
+    def test_unavailable_course_is_listed_for_its_admin_only(self):
+        actions.update_course_config('second', {
+            'course': {'now_available': False}})
+
+        actions.login(self.STUDENT_EMAIL)
+        response = self.get('/explorer')
+        assert_does_not_contain('Second Course', response.body)
+        actions.logout()
+
+        actions.login(self.ADMIN_EMAIL)
+        response = self.get('/explorer')
+        assert_contains('Second Course', response.body)
+
+
+class CourseCatalogBenchmark(BaseExplorerTest):
+    """Compares per-course settings lookups with the materialized catalog."""
+
+    COURSE_COUNT = 200
+    ITERATIONS = 5
+
+    def setUp(self):
+        super(CourseCatalogBenchmark, self).setUp()
+        sites.setup_courses(', '.join([
+            'course:/course_%s::ns_course_%s' % (index, index)
+            for index in xrange(self.COURSE_COUNT)]))
+        actions.login('student@foo.com')
+
+    def _time(self, fn):
+        start = time.time()
+        for _ in xrange(self.ITERATIONS):
+            # Each page view starts with empty per-request caches.
+            for app_context in sites.get_all_courses():
+                app_context.clear_per_request_cache()
+            fn()
+        return time.time() - start
+
+    def test_benchmark(self):
+
+        def per_course():
+            courses = [
+                course for course in sites.get_all_courses()
+                if (course.now_available and Roles.is_user_whitelisted(course))
+                or Roles.is_course_admin(course)]
+            return [course.get_environ(frozen=True) for course in courses]
+
+        def materialized():
+            return [
+                entry.get_course_info(False, False)
+                for entry in catalog.CourseCatalog.get_entries()
+                if entry.is_visible_to('student@foo.com', False, None)]
+
+        self.assertEquals(len(per_course()), len(materialized()))
+        gets = entities.DB_GET.value
+        materialized_time = self._time(materialized)
+        self.assertEquals(gets + self.ITERATIONS, entities.DB_GET.value)
+        per_course_time = self._time(per_course)
+        logging.info(
+            'Explorer listing of %s courses, %s page views: '
+            'per-course settings %.3fs, materialized catalog %.3fs.',
+            self.COURSE_COUNT, self.ITERATIONS,
+            per_course_time, materialized_time)
+        self.assertLess(materialized_time, per_course_time)
@@ -18,6 +18,10 @@ __author__ = [
     'mgainer@google.com (Mike Gainer)',
 ]
 
+import base64
+import os
+
+import appengine_config
 from common import utils as common_utils
 from models import config
 from models import courses
@@ -63,16 +67,33 @@ class CourseCachingTest(actions.TestBase):
         del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
         super(CourseCachingTest, self).tearDown()
 
-    def _add_large_unit(self, num_lessons):
+    def _add_large_unit(self, num_lessons, compressible=False):
+        """Adds a unit; random lesson text makes the course incompressible."""
         unit = self.course.add_unit()
         for unused in range(num_lessons):
             lesson = self.course.add_lesson(unit)
-            lesson.objectives = LOREM_IPSUM
+            if compressible:
+                lesson.objectives = LOREM_IPSUM
+            else:
+                lesson.objectives = base64.b64encode(
+                    os.urandom(len(LOREM_IPSUM) * 3 / 4))
         self.course.save()
         return unit
 
+    def _assert_lessons_equal(self, unit, course):
+        expected = self.course.get_lessons(unit.unit_id)
+        actual = course.get_lessons(unit.unit_id)
+        self.assertEquals(len(expected), len(actual))
+        for expected_lesson, actual_lesson in zip(expected, actual):
+            self.assertEquals(
+                expected_lesson.objectives, actual_lesson.objectives)
+
+    def _get_shards(self):
+        return models.MemcacheManager.get_multi(
+            courses.CachedCourse13._make_keys(), self.NAMESPACE)
+
     def test_large_course_is_cached_in_memcache(self):
-        num_lessons = models.MEMCACHE_MAX / len(LOREM_IPSUM)
+        num_lessons = 3 * models.MEMCACHE_MAX / 2 / len(LOREM_IPSUM)
         unit = self._add_large_unit(num_lessons)
 
         memcache_keys = courses.CachedCourse13._make_keys()
@@ -116,10 +137,8 @@ class CourseCachingTest(actions.TestBase):
         course = courses.Course(handler=None, app_context=self.app_context)
 
         # Verify contents.
-        lessons = course.get_lessons(unit.unit_id)
-        self.assertEquals(num_lessons, len(lessons))
-        for lesson in lessons:
-            self.assertEquals(lesson.objectives, LOREM_IPSUM)
+        self.assertEquals(num_lessons, len(course.get_lessons(unit.unit_id)))
+        self._assert_lessons_equal(unit, course)
 
         # Delete items from memcache, and verify that loading fails.  This
         # re-verifies that the loaded data was, in fact, coming from memcache.
@@ -134,7 +153,7 @@ class CourseCachingTest(actions.TestBase):
         self._test_recovery_from_missing_shard(1)
 
     def _test_recovery_from_missing_shard(self, shard_index):
-        num_lessons = models.MEMCACHE_MAX / len(LOREM_IPSUM)
+        num_lessons = 3 * models.MEMCACHE_MAX / 2 / len(LOREM_IPSUM)
         unit = self._add_large_unit(num_lessons)
         memcache_keys = courses.CachedCourse13._make_keys()
 
@@ -149,19 +168,64 @@ class CourseCachingTest(actions.TestBase):
         course = courses.Course(handler=None, app_context=self.app_context)
 
         # Verify contents.
-        lessons = course.get_lessons(unit.unit_id)
-        self.assertEquals(num_lessons, len(lessons))
-        for lesson in lessons:
-            self.assertEquals(lesson.objectives, LOREM_IPSUM)
+        self._assert_lessons_equal(unit, course)
 
-    def test_course_that_is_too_large_to_cache_is_not_cached(self):
-        num_lessons = courses.CachedCourse13._max_size() / len(LOREM_IPSUM)
-        # Fudge factor to get size of course as saved to under the VFS limit
-        # but over the memcache limit.
-        num_lessons -= 18
+    def _test_recovery_from_bad_shard(self, corrupt_shards):
+        num_lessons = 3 * models.MEMCACHE_MAX / 2 / len(LOREM_IPSUM)
         unit = self._add_large_unit(num_lessons)
         memcache_keys = courses.CachedCourse13._make_keys()
 
+        # Load course to get shards put into memcache; then damage them.
+        courses.Course(handler=None, app_context=self.app_context)
+        shards = self._get_shards()
+        self.assertEquals(2, len(shards))
+        corrupt_shards(memcache_keys, shards)
+        models.MemcacheManager.set_multi(shards, namespace=self.NAMESPACE)
+
+        # Shards are not unpickled; course is loaded from VFS instead.
+        self.assertIsNone(courses.CachedCourse13.load(self.app_context))
+        course = courses.Course(handler=None, app_context=self.app_context)
+        self._assert_lessons_equal(unit, course)
+
+    def test_recovery_from_torn_write(self):
+
+        def corrupt_shards(memcache_keys, shards):
+            # Shard #1 written by another save() of a course of same size.
+            generation = shards[memcache_keys[1]][1:17]
+            shards[memcache_keys[1]] = (
+                shards[memcache_keys[1]][0] + os.urandom(16) +
+                shards[memcache_keys[1]][17:])
+            self.assertNotEquals(generation, shards[memcache_keys[1]][1:17])
+
+        self._test_recovery_from_bad_shard(corrupt_shards)
+
+    def test_recovery_from_corrupt_shard(self):
+
+        def corrupt_shards(memcache_keys, shards):
+            shard = shards[memcache_keys[1]]
+            shards[memcache_keys[1]] = shard[:-16] + os.urandom(16)
+
+        self._test_recovery_from_bad_shard(corrupt_shards)
+
+    def test_compressible_course_occupies_only_one_shard(self):
+        num_lessons = 3 * models.MEMCACHE_MAX / 2 / len(LOREM_IPSUM)
+        unit = self._add_large_unit(num_lessons, compressible=True)
+        courses.Course(handler=None, app_context=self.app_context)
+        self.assertEquals(
+            courses.CachedCourse13._make_keys()[0:1], self._get_shards().keys())
+        self.assertIsNotNone(courses.CachedCourse13.load(self.app_context))
+        course = courses.Course(handler=None, app_context=self.app_context)
+        self._assert_lessons_equal(unit, course)
+
+    def test_course_that_is_too_large_to_cache_is_not_cached(self):
+        # Limit cached course to one shard; course is cached in two.
+        self.swap(
+            courses.CachedCourse13, '_max_size',
+            classmethod(lambda cls: courses._MEMENTO_SHARD_PAYLOAD_SIZE))
+        num_lessons = 3 * models.MEMCACHE_MAX / 2 / len(LOREM_IPSUM)
+        self._add_large_unit(num_lessons)
+        memcache_keys = courses.CachedCourse13._make_keys()
+
         # Load the course, which would normally populate memcache with the
         # loaded content, but will not have, because the course is too large.
         # Verify that.
@@ -184,3 +248,304 @@ class CourseCachingTest(actions.TestBase):
             memcache_keys[0:1],
             memcache_values.keys(),
             'Only shard zero should be present in memcache.')
+
+
+class CourseModelProcessCacheTest(actions.TestBase):
+
+    COURSE_NAME = 'test_course'
+    ADMIN_EMAIL = 'admin@foo.com'
+
+    def setUp(self):
+        super(CourseModelProcessCacheTest, self).setUp()
+        self.app_context = actions.simple_add_course(
+            self.COURSE_NAME, self.ADMIN_EMAIL, 'Test Course')
+        config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
+        course = courses.Course(None, app_context=self.app_context)
+        self.unit = course.add_unit()
+        self.unit.title = 'Original'
+        self.lesson = course.add_lesson(self.unit)
+        course.save()
+        courses.ProcessScopedCourseModelCache.clear_all()
+        courses.Course.clear_current()
+
+    def tearDown(self):
+        courses.Course.clear_current()
+        del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
+        super(CourseModelProcessCacheTest, self).tearDown()
+
+    def _get_course(self):
+        courses.Course.clear_current()
+        return courses.Course.get(self.app_context)
+
+    def test_second_load_hits_process_cache(self):
+        hits = courses.COURSE_MODEL_CACHE_HIT.value
+        misses = courses.COURSE_MODEL_CACHE_MISS.value
+        self._get_course()
+        self.assertEquals(misses + 1, courses.COURSE_MODEL_CACHE_MISS.value)
+        self.assertEquals(hits, courses.COURSE_MODEL_CACHE_HIT.value)
+
+        course = self._get_course()
+        self.assertEquals(misses + 1, courses.COURSE_MODEL_CACHE_MISS.value)
+        self.assertEquals(hits + 1, courses.COURSE_MODEL_CACHE_HIT.value)
+        self.assertEquals(
+            'Original', course.find_unit_by_id(self.unit.unit_id).title)
+
+    def test_loaded_units_and_lessons_are_private(self):
+        course = self._get_course()
+        unit = course.find_unit_by_id(self.unit.unit_id)
+        unit.title = 'Changed but not saved'
+        lesson = course.find_lesson_by_id(unit, self.lesson.lesson_id)
+        lesson.objectives = 'Changed but not saved'
+        course.get_units().append(course.get_units()[0])
+
+        course = self._get_course()
+        self.assertEquals(1, len(course.get_units()))
+        unit = course.find_unit_by_id(self.unit.unit_id)
+        self.assertEquals('Original', unit.title)
+        self.assertNotEquals(
+            'Changed but not saved',
+            course.find_lesson_by_id(unit, self.lesson.lesson_id).objectives)
+
+    def test_saved_edit_is_seen_by_next_load(self):
+        self._get_course()
+        editor = courses.Course(None, app_context=self.app_context)
+        editor.find_unit_by_id(self.unit.unit_id).title = 'Edited'
+        editor.save()
+
+        misses = courses.COURSE_MODEL_CACHE_MISS.value
+        course = self._get_course()
+        self.assertEquals(misses + 1, courses.COURSE_MODEL_CACHE_MISS.value)
+        self.assertEquals(
+            'Edited', course.find_unit_by_id(self.unit.unit_id).title)
+
+    def test_stale_memcache_memento_is_not_trusted(self):
+        stale_model = courses.CourseModel13.load(self.app_context)
+        self.assertIsNotNone(stale_model.updated_on)
+        editor = courses.Course(None, app_context=self.app_context)
+        editor.find_unit_by_id(self.unit.unit_id).title = 'Edited'
+        editor.save()
+
+        # Simulate a reader that loaded the old course and wrote it to
+        # memcache after the writer had already saved the new one.
+        courses.CachedCourse13.save(self.app_context, stale_model)
+        courses.ProcessScopedCourseModelCache.clear_all()
+
+        course = self._get_course()
+        self.assertEquals(
+            'Edited', course.find_unit_by_id(self.unit.unit_id).title)
+
+
+class CourseNavigationIndexTest(actions.TestBase):
+
+    def setUp(self):
+        super(CourseNavigationIndexTest, self).setUp()
+        self.app_context = actions.simple_add_course(
+            'test_course', 'admin@foo.com', 'Test Course')
+        self.course = courses.Course(None, app_context=self.app_context)
+        self.pre = self.course.add_assessment()
+        self.unit = self.course.add_unit()
+        self.unit.pre_assessment = self.pre.unit_id
+        self.course.update_unit(self.unit)
+        self.lessons = [self.course.add_lesson(self.unit) for _ in range(3)]
+        self.other_unit = self.course.add_unit()
+        self.other_unit.labels = '1'
+        self.course.update_unit(self.other_unit)
+        self.final = self.course.add_assessment()
+        self.final.labels = '2'
+        self.course.update_unit(self.final)
+        self.course.save()
+
+    def test_lookups(self):
+        self.assertIs(
+            self.unit, self.course.find_unit_by_id(str(self.unit.unit_id)))
+        self.assertIsNone(self.course.find_unit_by_id(9999))
+        self.assertIs(
+            self.lessons[1],
+            self.course.find_lesson_by_id(None, self.lessons[1].lesson_id))
+        self.assertIsNone(self.course.find_lesson_by_id(None, 9999))
+        self.assertEquals(
+            self.lessons, self.course.get_lessons(self.unit.unit_id))
+        self.assertEquals([], self.course.get_lessons(self.other_unit.unit_id))
+        self.assertIs(self.unit, self.course.get_parent_unit(self.pre.unit_id))
+        self.assertIsNone(self.course.get_parent_unit(self.final.unit_id))
+        self.assertEquals(
+            [self.pre.unit_id, self.final.unit_id],
+            [unit.unit_id for unit in self.course.get_assessment_list()])
+        self.assertTrue(self.course.is_last_assessment(self.final))
+        self.assertFalse(self.course.is_last_assessment(self.pre))
+
+    def test_units_on_tracks(self):
+        model = self.course._model  # pylint: disable=protected-access
+        all_units = self.course.get_units()
+        self.assertEquals(all_units, model.get_units_on_tracks([1, 2], []))
+        self.assertEquals(
+            [self.pre, self.unit, self.other_unit],
+            model.get_units_on_tracks([1, 2], [1]))
+        self.assertEquals(
+            [self.pre, self.unit, self.final],
+            model.get_units_on_tracks([1, 2], [2]))
+
+        # Labels which are not tracks do not hide units.
+        self.assertEquals(
+            [self.pre, self.unit, self.other_unit, self.final],
+            model.get_units_on_tracks([2], [2]))
+
+    def test_index_follows_changes(self):
+        self.course.move_lesson_to(self.lessons[0], self.other_unit)
+        self.assertEquals(
+            self.lessons[1:], self.course.get_lessons(self.unit.unit_id))
+        self.assertEquals(
+            self.lessons[:1], self.course.get_lessons(self.other_unit.unit_id))
+
+        self.unit.pre_assessment = None
+        self.unit.post_assessment = self.pre.unit_id
+        self.course.update_unit(self.unit)
+        self.assertIs(self.unit, self.course.get_parent_unit(self.pre.unit_id))
+
+        self.course.delete_unit(self.final)
+        self.assertIsNone(self.course.find_unit_by_id(self.final.unit_id))
+        self.assertTrue(self.course.is_last_assessment(self.pre))
+
+        self.course.reorder_units([
+            {'id': self.other_unit.unit_id,
+             'lessons': [{'id': self.lessons[0].lesson_id}]},
+            {'id': self.unit.unit_id,
+             'lessons': [{'id': lesson.lesson_id}
+                         for lesson in reversed(self.lessons[1:])]},
+            {'id': self.pre.unit_id}])
+        self.assertIs(
+            self.other_unit, self.course.find_unit_by_id(
+                self.other_unit.unit_id))
+        self.assertEquals(
+            list(reversed(self.lessons[1:])),
+            self.course.get_lessons(self.unit.unit_id))
+        self.course.save()
+
+        courses.Course.clear_current()
+        course = courses.Course.get(self.app_context)
+        self.assertEquals(
+            [lesson.lesson_id for lesson in reversed(self.lessons[1:])],
+            [lesson.lesson_id for lesson in course.get_lessons(
+                self.unit.unit_id)])
+
+
+    def test_save_after_deleting_assessment_and_activity(self):
+        lesson = self.lessons[0]
+        lesson.has_activity = True
+        self.course.update_lesson(lesson)
+        errors = []
+        self.course.set_activity_content(
+            lesson, u'var activity = []', errors)
+        self.assertEquals([], errors)
+        with open(os.path.join(
+            appengine_config.BUNDLE_ROOT, 'assets/js/assessment-Pre.js'),
+                  'rb') as assessment_file:
+            self.course.set_assessment_content(
+                self.final, assessment_file.read().decode('utf-8'), errors)
+        self.assertEquals([], errors)
+        self.course.save()
+        fs = self.app_context.fs
+        activity_path = fs.impl.physical_to_logical(
+            self.course.get_activity_filename(None, lesson.lesson_id))
+        assessment_path = fs.impl.physical_to_logical(
+            self.course.get_assessment_filename(self.final.unit_id))
+        self.assertTrue(fs.isfile(activity_path))
+        self.assertTrue(fs.isfile(assessment_path))
+
+        self.course.delete_lesson(lesson)
+        self.course.delete_unit(self.final)
+        self.course.save()
+
+        self.assertFalse(fs.isfile(activity_path))
+        self.assertFalse(fs.isfile(assessment_path))
+        self.assertEquals(
+            self.lessons[1:], self.course.get_lessons(self.unit.unit_id))
+        self.assertIsNone(self.course.find_unit_by_id(self.final.unit_id))
+
+    def test_structure_version_after_saving_deletions(self):
+        version = self.course.get_structure_version()
+        self.course.delete_lesson(self.lessons[0])
+        self.course.delete_unit(self.final)
+        self.course.save()
+
+        # Not the version of the deleted units and lessons, which are
+        # indexed while their files are deleted on save.
+        self.assertEquals(
+            courses.make_structure_version(
+                self.course.get_units(),
+                {str(self.unit.unit_id): [
+                    lesson.lesson_id for lesson in self.lessons[1:]]}),
+            self.course.get_structure_version())
+        self.assertNotEquals(version, self.course.get_structure_version())
+
+        courses.Course.clear_current()
+        self.assertEquals(
+            self.course.get_structure_version(),
+            courses.Course.get(self.app_context).get_structure_version())
+
+class CourseEnvironProcessCacheTest(actions.TestBase):
+
+    def setUp(self):
+        super(CourseEnvironProcessCacheTest, self).setUp()
+        self.app_context = actions.simple_add_course(
+            'test_course', 'admin@foo.com', 'Test Course')
+        config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name] = True
+        courses.ProcessScopedCourseEnvironCache.clear_all()
+
+    def tearDown(self):
+        del config.Registry.test_overrides[models.CAN_USE_MEMCACHE.name]
+        super(CourseEnvironProcessCacheTest, self).tearDown()
+
+    def _get_environ(self, frozen=False):
+        self.app_context.clear_per_request_cache()
+        return self.app_context.get_environ(frozen=frozen)
+
+    def test_second_read_hits_process_cache(self):
+        hits = courses.COURSE_ENVIRON_CACHE_HIT.value
+        self._get_environ()
+        self.assertEquals(hits, courses.COURSE_ENVIRON_CACHE_HIT.value)
+        env = self._get_environ()
+        self.assertEquals(hits + 1, courses.COURSE_ENVIRON_CACHE_HIT.value)
+        self.assertEquals('Test Course', env['course']['title'])
+
+    def test_frozen_reads_share_and_others_copy(self):
+        snapshot = self._get_environ(frozen=True)
+        self.assertIs(snapshot, self._get_environ(frozen=True))
+        self.assertRaises(
+            TypeError, snapshot['course'].__setitem__, 'title', 'Changed')
+
+        env = self._get_environ()
+        env['course']['title'] = 'Changed'
+        self.assertEquals(
+            'Test Course', self._get_environ()['course']['title'])
+
+    def test_saved_settings_are_seen_by_next_read(self):
+        self._get_environ()
+        course = courses.Course(None, app_context=self.app_context)
+        settings = course.get_environ(self.app_context)
+        settings['course']['title'] = 'New Title'
+        self.assertTrue(course.save_settings(settings))
+        self.assertEquals('New Title', self._get_environ()['course']['title'])
+
+    def test_invalidation_by_other_process_is_seen(self):
+        self._get_environ()
+        misses = courses.COURSE_ENVIRON_CACHE_MISS.value
+
+        # Another process bumps the version in memcache; this process sees
+        # it with its next request.
+        courses.Course(
+            None, app_context=self.app_context
+        ).invalidate_cached_course_settings()
+        models.RequestScopedDaoCacheVersions.clear_all()
+        self._get_environ()
+        self.assertEquals(misses + 1, courses.COURSE_ENVIRON_CACHE_MISS.value)
+
+    def test_course_yaml_written_directly_is_seen_by_next_read(self):
+        self._get_environ()
+        filename = self.app_context.get_config_filename()
+        content = self.app_context.fs.get(filename).replace(
+            'Test Course', 'Written Directly')
+        self.app_context.fs.put(filename, vfs.string_to_stream(
+            content.decode('utf-8')))
+        self.assertEquals(
+            'Written Directly', self._get_environ()['course']['title'])
@@ -19,14 +19,22 @@ __author__ = [
 ]
 
 import datetime
+import logging
+import time
+import zlib
 
+from common import caching
+from common import users
+from common import utils as common_utils
 from models import config
 from models import entities
 from models import models
 from models import services
+from models import transforms
 from modules.notifications import notifications
 from tests.functional import actions
 
+from google.appengine.api import datastore
 from google.appengine.ext import db
 
 
@@ -43,6 +51,285 @@ class EventEntityTestCase(actions.ExportTestBase):
         self.assertEqual(key, models.EventEntity.safe_key(key, self.transform))
 
 
+def _make_event_mix():
+    """Makes (source, data) of events in proportions seen in a live course."""
+    loc = {
+        'locale': 'en_US', 'page_locale': 'en_US',
+        'language': 'en-US,en;q=0.8', 'country': 'US', 'region': 'ca',
+        'city': 'mountain view', 'lat': 37.386052, 'long': -122.083851}
+    user_agent = (
+        'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, '
+        'like Gecko) Chrome/41.0.2272.101 Safari/537.36')
+    location = 'http://localhost/course/unit?unit=%s&lesson=%s'
+    events = []
+    for index in xrange(100):
+        common = {
+            'location': location % (index % 7, index % 13), 'loc': loc,
+            'user_agent': user_agent}
+        if index % 10 < 4:
+            source = 'tag-youtube-event'
+            payload = dict(
+                common, video_id='Kdg2drcUjYI', instance_id='QDVvQqEd2xbv',
+                event_id=index, position=index * 5, data=index % 2)
+        elif index % 10 < 6:
+            source = 'tag-youtube-milestone'
+            payload = dict(
+                common, video_id='Kdg2drcUjYI', instance_id='QDVvQqEd2xbv',
+                event_id=index, position=index * 30)
+        elif index % 10 < 8:
+            source = 'enter-page' if index % 2 else 'exit-page'
+            payload = common
+        elif index % 20 == 8:
+            source = 'attempt-lesson'
+            payload = dict(
+                common, type='scored-lesson',
+                answers={'version': '1.5', 'q%s' % index: [index % 4]},
+                individualScores={'q%s' % index: 1}, score=1,
+                containedTypes={'q%s' % index: 'McQuestion'},
+                quids={'q%s' % index: str(5000 + index)})
+        elif index % 20 == 18:
+            source = 'submit-assessment'
+            payload = {
+                'type': 'assessment-Pre', 'location': 'AnswerHandler',
+                'values': {'version': '1.5', 'answers': [
+                    {'index': answer, 'value': answer % 3}
+                    for answer in xrange(10)]}}
+        else:
+            source = 'tag-assessment'
+            payload = dict(
+                common, type='McQuestion', instanceid='xK6uIJvrYwrM',
+                answer=[index % 4], score=1)
+        events.append((source, transforms.dumps(payload)))
+    return events
+
+
+class EventDataCompactionTestCase(actions.TestBase):
+    """Tests storage of event payloads in a compact form."""
+
+    def setUp(self):
+        super(EventDataCompactionTestCase, self).setUp()
+        config.Registry.test_overrides = {
+            models.CAN_COMPACT_EVENT_DATA.name: True}
+
+    def tearDown(self):
+        config.Registry.test_overrides = {}
+        super(EventDataCompactionTestCase, self).tearDown()
+
+    def _put(self, source, data):
+        return models.EventEntity(
+            source=source, user_id='1', data=data).put()
+
+    def _get_stored_data(self, key):
+        return datastore.Get(key)['data']
+
+    def test_known_sources_are_stored_with_schema(self):
+        for source, data in _make_event_mix():
+            key = self._put(source, data)
+            stored = self._get_stored_data(key)
+            self.assertIsInstance(stored, db.Blob)
+            if source in ('tag-assessment',):
+                expected_version = models.EVENT_DATA_FORMAT_ZLIB_JSON
+            else:
+                expected_version = models.EVENT_DATA_FORMAT_ZLIB_SCHEMA
+            self.assertEquals(expected_version, ord(stored[0]))
+            event = models.EventEntity.get(key)
+            self.assertEquals(
+                transforms.loads(data), transforms.loads(event.data))
+
+    def test_keys_missing_from_schema_are_kept(self):
+        data = transforms.dumps({'video_id': 'a', 'position': 5, 'extra': 1})
+        key = self._put('tag-youtube-event', data)
+        self.assertEquals(
+            {'video_id': 'a', 'position': 5, 'extra': 1},
+            transforms.loads(models.EventEntity.get(key).data))
+
+    def test_short_payload_is_stored_as_text(self):
+        key = self._put('enter-page', '{}')
+        self.assertIsInstance(self._get_stored_data(key), db.Text)
+        self.assertEquals('{}', models.EventEntity.get(key).data)
+
+    def test_text_payloads_are_read_when_compaction_is_on(self):
+        config.Registry.test_overrides = {}
+        source, data = _make_event_mix()[0]
+        key = self._put(source, data)
+        self.assertIsInstance(self._get_stored_data(key), db.Text)
+
+        config.Registry.test_overrides = {
+            models.CAN_COMPACT_EVENT_DATA.name: True}
+        self.assertEquals(data, models.EventEntity.get(key).data)
+
+    def test_for_export_decodes_payload(self):
+        source, data = _make_event_mix()[0]
+        key = self._put(source, data)
+        exported = models.EventEntity.get(key).for_export(
+            lambda value: 'transformed_%s' % value)
+        self.assertEquals(
+            transforms.loads(data), transforms.loads(exported.data))
+
+    def test_unknown_format_is_rejected(self):
+        with self.assertRaises(ValueError):
+            models.decode_event_data(db.Blob(chr(255) + zlib.compress('{}')))
+
+
+class EventDataCompactionBenchmark(actions.TestBase):
+    """Compares size and decode time of text and compact event payloads."""
+
+    ITERATIONS = 20
+
+    def _time(self, fn):
+        start = time.time()
+        for _ in xrange(self.ITERATIONS):
+            fn()
+        return time.time() - start
+
+    def test_benchmark(self):
+        events = _make_event_mix()
+        blobs = [models.encode_event_data(source, data)
+                 for source, data in events]
+        text_size = sum(len(data.encode('utf-8')) for _, data in events)
+        compact_size = sum(len(blob) for blob in blobs)
+
+        def decode_text():
+            for _, data in events:
+                transforms.loads(data)
+
+        def decode_compact():
+            for blob in blobs:
+                transforms.loads(models.decode_event_data(blob))
+
+        text_time = self._time(decode_text)
+        compact_time = self._time(decode_compact)
+        logging.info(
+            'EventEntity data, %s events: text %s bytes, compact %s bytes '
+            '(%.0f%%); %s decodes of all events: text %.3fs, compact %.3fs.',
+            len(events), text_size, compact_size,
+            100.0 * compact_size / text_size, self.ITERATIONS, text_time,
+            compact_time)
+        self.assertLess(compact_size, text_size * 0.75)
+
+
+class EventBufferTestCase(actions.TestBase):
+    """Tests write-behind of events via the in-process event buffer."""
+
+    def setUp(self):
+        super(EventBufferTestCase, self).setUp()
+        models.EventBuffer.clear_all()
+        self.user = users.User(email='a@example.com', _user_id='1')
+
+    def tearDown(self):
+        models.EventBuffer.clear_all()
+        super(EventBufferTestCase, self).tearDown()
+
+    def _record(self, count, source='source'):
+        for index in xrange(count):
+            models.EventEntity.record(
+                source, self.user, transforms.dumps({'index': index}),
+                buffered=True)
+
+    def test_unbuffered_event_is_put_at_once(self):
+        models.EventEntity.record('source', self.user, '{}')
+        self.assertEquals(1, models.EventEntity.all().count())
+        self.assertEquals(0, models.EventBuffer.instance().size)
+
+    def test_buffered_events_are_written_behind_in_batch(self):
+        self._record(models.EVENT_BUFFER_FLUSH_SIZE - 1)
+        self.assertEquals(0, models.EventEntity.all().count())
+        self.assertEquals(0, len(self.taskq.GetTasks('default')))
+
+        self._record(1)
+        self.assertEquals(0, models.EventBuffer.instance().size)
+        self.assertEquals(1, len(self.taskq.GetTasks('default')))
+        self.assertEquals(0, models.EventEntity.all().count())
+
+        written = models.EVENT_BUFFER_EVENTS_WRITTEN.value
+        self.execute_all_deferred_tasks()
+        events = models.EventEntity.all().fetch(None)
+        self.assertEquals(models.EVENT_BUFFER_FLUSH_SIZE, len(events))
+        self.assertEquals(
+            written + models.EVENT_BUFFER_FLUSH_SIZE,
+            models.EVENT_BUFFER_EVENTS_WRITTEN.value)
+        self.assertEquals(
+            set(range(models.EVENT_BUFFER_FLUSH_SIZE)),
+            set(transforms.loads(event.data)['index'] for event in events))
+        for event in events:
+            self.assertEquals('source', event.source)
+            self.assertEquals('1', event.user_id)
+            self.assertIsNotNone(event.recorded_on)
+
+    def test_old_events_are_written_behind(self):
+        now = time.time()
+        self.swap(time, 'time', lambda: now)
+        self._record(1)
+        self.assertEquals(0, len(self.taskq.GetTasks('default')))
+
+        now += models.EVENT_BUFFER_MAX_AGE_SECS
+        self._record(1)
+        self.assertEquals(1, len(self.taskq.GetTasks('default')))
+        self.execute_all_deferred_tasks()
+        self.assertEquals(2, models.EventEntity.all().count())
+
+    def test_old_events_are_written_behind_at_end_of_request(self):
+        now = time.time()
+        self.swap(time, 'time', lambda: now)
+        self._record(1)
+        self.get('/')
+        self.assertEquals(1, models.EventBuffer.instance().size)
+        self.assertEquals(0, len(self.taskq.GetTasks('default')))
+
+        now += models.EVENT_BUFFER_MAX_AGE_SECS
+        self.get('/')
+        self.assertEquals(0, models.EventBuffer.instance().size)
+        self.assertEquals(1, len(self.taskq.GetTasks('default')))
+        self.execute_all_deferred_tasks()
+        self.assertEquals(1, models.EventEntity.all().count())
+
+    def test_events_are_written_into_their_namespace(self):
+        with common_utils.Namespace('ns_a'):
+            self._record(1)
+        with common_utils.Namespace('ns_b'):
+            self._record(2)
+        models.EventBuffer.instance().flush()
+        self.assertEquals(2, len(self.taskq.GetTasks('default')))
+
+        self.execute_all_deferred_tasks()
+        with common_utils.Namespace('ns_a'):
+            self.assertEquals(1, models.EventEntity.all().count())
+        with common_utils.Namespace('ns_b'):
+            self.assertEquals(2, models.EventEntity.all().count())
+
+    def test_full_buffer_writes_events_synchronously(self):
+        self.swap(models, 'EVENT_BUFFER_FLUSH_SIZE', 1000)
+        self.swap(models, 'MAX_BUFFERED_EVENTS', 3)
+        full = models.EVENT_BUFFER_FULL.value
+        self._record(5)
+        self.assertEquals(3, models.EventBuffer.instance().size)
+        self.assertEquals(2, models.EventEntity.all().count())
+        self.assertEquals(full + 2, models.EVENT_BUFFER_FULL.value)
+
+    def test_events_are_written_if_task_cannot_be_enqueued(self):
+        def defer(*unused_args, **unused_kwargs):
+            raise Exception('Task queue is unavailable.')
+
+        self.swap(models.deferred, 'defer', defer)
+        failed = models.EVENT_BUFFER_FLUSH_FAILED.value
+        self._record(models.EVENT_BUFFER_FLUSH_SIZE)
+        self.assertEquals(
+            models.EVENT_BUFFER_FLUSH_SIZE, models.EventEntity.all().count())
+        self.assertEquals(failed + 1, models.EVENT_BUFFER_FLUSH_FAILED.value)
+
+    def test_record_all_async_buffers_events(self):
+        rpc = models.EventEntity.record_all_async(
+            self.user, [('a', '{}'), ('b', '{}')], buffered=True)
+        self.assertIsNone(rpc)
+        self.assertEquals(2, models.EventBuffer.instance().size)
+
+        self.swap(models, 'MAX_BUFFERED_EVENTS', 2)
+        rpc = models.EventEntity.record_all_async(
+            self.user, [('c', '{}')], buffered=True)
+        rpc.get_result()
+        self.assertEquals(1, models.EventEntity.all().count())
+
+
 class ContentChunkTestCase(actions.ExportTestBase):
     """Tests ContentChunkEntity|DAO|DTO."""
 
@@ -338,6 +625,140 @@ class MemcacheManagerTestCase(actions.TestBase):
         data = models.MemcacheManager.get_multi(['a', 'b', 'c'])
         self.assertEquals(0, len(data.keys()))
 
+    def test_get_returns_private_copy(self):
+        models.MemcacheManager.set('a', {'b': ['c']})
+        models.MemcacheManager.begin_readonly()
+        try:
+            for _ in xrange(2):
+                value = models.MemcacheManager.get('a')
+                self.assertEquals({'b': ['c']}, value)
+                value['b'].append('d')
+        finally:
+            models.MemcacheManager.end_readonly()
+
+    def test_set_does_not_keep_reference_to_value(self):
+        value = {'b': ['c']}
+        models.MemcacheManager.begin_readonly()
+        try:
+            models.MemcacheManager.set('a', value)
+            value['b'].append('d')
+            self.assertEquals({'b': ['c']}, models.MemcacheManager.get('a'))
+        finally:
+            models.MemcacheManager.end_readonly()
+
+    def test_frozen_get_is_shared_and_immutable(self):
+        models.MemcacheManager.set('a', {'b': ['c']})
+        models.MemcacheManager.begin_readonly()
+        try:
+            value = models.MemcacheManager.get('a', frozen=True)
+            self.assertTrue(
+                value is models.MemcacheManager.get('a', frozen=True))
+            with self.assertRaises(TypeError):
+                value['b'] = 'd'
+            with self.assertRaises(AttributeError):
+                value['b'].append('d')
+            self.assertEquals(
+                {'b': ['c']}, models.MemcacheManager.get('a'))
+            self.assertTrue(isinstance(
+                models.MemcacheManager.get('a')['b'], list))
+        finally:
+            models.MemcacheManager.end_readonly()
+
+    def test_frozen_set(self):
+        snapshot = caching.freeze({'b': ['c']})
+        models.MemcacheManager.begin_readonly()
+        try:
+            models.MemcacheManager.set('a', snapshot, frozen=True)
+            self.assertTrue(
+                snapshot is models.MemcacheManager.get('a', frozen=True))
+        finally:
+            models.MemcacheManager.end_readonly()
+        self.assertEquals({'b': ['c']}, models.MemcacheManager.get('a'))
+
+    def test_get_multi_from_local_cache(self):
+        models.MemcacheManager.set_multi({'a': ['A'], 'b': ['B']})
+        models.MemcacheManager.begin_readonly()
+        try:
+            for _ in xrange(2):
+                data = models.MemcacheManager.get_multi(['a', 'b'])
+                self.assertEquals({'a': ['A'], 'b': ['B']}, data)
+                data['a'].append('C')
+            data = models.MemcacheManager.get_multi(['a', 'b'], frozen=True)
+            self.assertEquals(('A',), data['a'])
+        finally:
+            models.MemcacheManager.end_readonly()
+
+
+class MemcacheManagerBenchmark(actions.TestBase):
+    """Compares copying and frozen reads and writes of typical payloads."""
+
+    ITERATIONS = 200
+
+    def setUp(self):
+        super(MemcacheManagerBenchmark, self).setUp()
+        config.Registry.test_overrides = {models.CAN_USE_MEMCACHE.name: True}
+
+    def tearDown(self):
+        config.Registry.test_overrides = {}
+        super(MemcacheManagerBenchmark, self).tearDown()
+
+    def _make_payloads(self):
+        small = {'id': 1, 'title': 'Label', 'type': 0}
+        environ = {
+            'course': dict(
+                ('setting_%s' % index, 'value %s' % index)
+                for index in xrange(100)),
+            'extra_locales': [
+                {'locale': 'l%s' % index, 'availability': 'available'}
+                for index in xrange(20)],
+            'reg_form': {'additional_registration_fields': '<div/>' * 100},
+            'unit': {'hide_lesson_navigation_buttons': False}}
+        dao_map = dict(
+            (index, {'title': 'Item %s' % index, 'labels': [1, 2, 3],
+                     'props': {'a': index, 'b': 'x' * 100}})
+            for index in xrange(500))
+        return [('small', small), ('environ', environ), ('dao map', dao_map)]
+
+    def _time(self, fn):
+        start = time.time()
+        for _ in xrange(self.ITERATIONS):
+            fn()
+        return time.time() - start
+
+    def _benchmark(self, name, value):
+        keys = ['%s:%s' % (name, index) for index in xrange(10)]
+        snapshot = caching.freeze(value)
+        manager = models.MemcacheManager
+        manager.set_multi({key: value for key in keys})
+
+        manager.begin_readonly()
+        try:
+            results = [
+                self._time(lambda: manager.get(keys[0])),
+                self._time(lambda: manager.get(keys[0], frozen=True)),
+                self._time(lambda: manager.get_multi(keys)),
+                self._time(lambda: manager.get_multi(keys, frozen=True)),
+                self._time(lambda: manager.set(keys[0], value)),
+                self._time(
+                    lambda: manager.set(keys[0], snapshot, frozen=True))]
+        finally:
+            manager.end_readonly()
+
+        logging.info(
+            'MemcacheManager, %s payload, %s iterations: '
+            'get %.3fs, frozen get %.3fs, get_multi %.3fs, '
+            'frozen get_multi %.3fs, set %.3fs, frozen set %.3fs.',
+            name, self.ITERATIONS, *results)
+        return results
+
+    def test_benchmark(self):
+        for name, value in self._make_payloads():
+            get, frozen_get, get_multi, frozen_get_multi, _, _ = (
+                self._benchmark(name, value))
+            if name != 'small':
+                self.assertLess(frozen_get, get)
+                self.assertLess(frozen_get_multi, get_multi)
+
 
 class TestEntity(entities.BaseEntity):
     data = db.TextProperty(indexed=False)
@@ -414,6 +835,144 @@ class BaseJsonDaoTestCase(actions.TestBase):
         assert_bulk_load_succeeds()
 
 
+class ProcessCachedTestDao(TestDao):
+    PROCESS_CACHE = True
+
+
+class ProcessScopedDaoCacheTestCase(actions.TestBase):
+    """Tests the process-scoped cache in front of memcache for DAO objects."""
+
+    VERSION_KEY = '(entity-version:TestEntity)'
+
+    def setUp(self):
+        super(ProcessScopedDaoCacheTestCase, self).setUp()
+        config.Registry.test_overrides = {models.CAN_USE_MEMCACHE.name: True}
+        models.ProcessScopedDaoCache.clear_all()
+        caching.RequestScopedSingleton.clear_all()
+
+    def tearDown(self):
+        config.Registry.test_overrides = {}
+        super(ProcessScopedDaoCacheTestCase, self).tearDown()
+
+    def _new_request(self):
+        caching.RequestScopedSingleton.clear_all()
+
+    def _write_from_another_process(self, dto_id, the_dict):
+        """Writes an object and bumps its version as another process would."""
+        entity = TestEntity(key_name=dto_id, data=transforms.dumps(the_dict))
+        entity.put()
+        models.MemcacheManager.set('(entity:TestEntity:%s)' % dto_id, entity)
+        models.MemcacheManager.delete('(entity-get-all:TestEntity)')
+        models.MemcacheManager.set(self.VERSION_KEY, 'other', ttl=0)
+
+    def test_load_is_served_from_process_cache(self):
+        ProcessCachedTestDao.save(TestDto('a', {'a': 1}))
+        self._new_request()
+        self.assertEquals({'a': 1}, ProcessCachedTestDao.load('a').dict)
+
+        hits = models.DAO_CACHE_HIT.value
+        self._new_request()
+        dto = ProcessCachedTestDao.load('a')
+        self.assertEquals({'a': 1}, dto.dict)
+        self.assertEquals(hits + 1, models.DAO_CACHE_HIT.value)
+
+        # loaded objects are private to the caller
+        dto.dict['a'] = 2
+        self.assertEquals({'a': 1}, ProcessCachedTestDao.load('a').dict)
+
+    def test_missing_object_is_cached(self):
+        self.assertIsNone(ProcessCachedTestDao.load('a'))
+        hits = models.DAO_CACHE_HIT.value
+        self._new_request()
+        self.assertIsNone(ProcessCachedTestDao.load('a'))
+        self.assertEquals(hits + 1, models.DAO_CACHE_HIT.value)
+
+    def test_versions_are_read_once_per_request(self):
+        ProcessCachedTestDao.save(TestDto('a', {'a': 1}))
+        models.LabelDAO.get_all()
+        self._new_request()
+        gets = models.DAO_CACHE_VERSION_GET.value
+        ProcessCachedTestDao.load('a')
+        ProcessCachedTestDao.bulk_load(['a', 'b'])
+        ProcessCachedTestDao.get_all_mapped()
+        models.LabelDAO.get_all()
+        self.assertEquals(gets + 1, models.DAO_CACHE_VERSION_GET.value)
+
+    def test_write_by_another_process_is_seen_by_next_request(self):
+        ProcessCachedTestDao.save(TestDto('a', {'a': 1}))
+        self._new_request()
+        self.assertEquals({'a': 1}, ProcessCachedTestDao.load('a').dict)
+        self.assertEquals(
+            [{'a': 1}, None],
+            [dto and dto.dict
+             for dto in ProcessCachedTestDao.bulk_load(['a', 'b'])])
+
+        self._write_from_another_process('a', {'a': 2})
+        self._write_from_another_process('b', {'b': 2})
+        self._new_request()
+        self.assertEquals({'a': 2}, ProcessCachedTestDao.load('a').dict)
+        self.assertEquals(
+            [{'a': 2}, {'b': 2}],
+            [dto.dict for dto in ProcessCachedTestDao.bulk_load(['a', 'b'])])
+
+    def test_write_by_another_process_is_seen_outside_of_requests(self):
+        ProcessCachedTestDao.save(TestDto('a', {'a': 1}))
+        self.assertEquals({'a': 1}, ProcessCachedTestDao.load('a').dict)
+
+        # Deferred tasks and cron threads never clear the request scope.
+        self._write_from_another_process('a', {'a': 2})
+        self.assertEquals({'a': 1}, ProcessCachedTestDao.load('a').dict)
+        self.swap(models, 'MAX_DAO_CACHE_VERSIONS_AGE_SECS', -1)
+        self.assertEquals({'a': 2}, ProcessCachedTestDao.load('a').dict)
+
+    def test_evicted_version_makes_objects_stale(self):
+        ProcessCachedTestDao.save(TestDto('a', {'a': 1}))
+        self._new_request()
+        ProcessCachedTestDao.load('a')
+
+        self._write_from_another_process('a', {'a': 2})
+        models.MemcacheManager.delete(self.VERSION_KEY)
+        self._new_request()
+        self.assertEquals({'a': 2}, ProcessCachedTestDao.load('a').dict)
+
+    def test_own_writes_are_seen_in_same_request(self):
+        ProcessCachedTestDao.save(TestDto('a', {'a': 1}))
+        self.assertEquals({'a': 1}, ProcessCachedTestDao.load('a').dict)
+        self.assertEquals(1, len(ProcessCachedTestDao.get_all_mapped()))
+
+        ProcessCachedTestDao.save(TestDto('a', {'a': 2}))
+        ProcessCachedTestDao.save(TestDto('b', {'b': 1}))
+        self.assertEquals({'a': 2}, ProcessCachedTestDao.load('a').dict)
+        self.assertEquals(2, len(ProcessCachedTestDao.get_all_mapped()))
+
+        ProcessCachedTestDao.delete(ProcessCachedTestDao.load('a'))
+        self.assertIsNone(ProcessCachedTestDao.load('a'))
+        self.assertEquals(
+            ['b'], ProcessCachedTestDao.get_all_mapped(frozen=True).keys())
+
+    def test_get_all_mapped(self):
+        ProcessCachedTestDao.save_all([
+            TestDto('a', {'a': [1]}), TestDto('b', {'b': [2]})])
+        ProcessCachedTestDao.get_all_mapped()
+
+        hits = models.DAO_CACHE_HIT.value
+        self._new_request()
+        result = ProcessCachedTestDao.get_all_mapped()
+        self.assertEquals({'a': [1]}, result['a'].dict)
+        result['a'].dict['a'].append(3)
+        frozen = ProcessCachedTestDao.get_all_mapped(frozen=True)
+        self.assertEquals({'a': (1,)}, frozen['a'].dict)
+        with self.assertRaises(TypeError):
+            frozen['a'].dict['a'] = 2
+        self.assertEquals(hits + 2, models.DAO_CACHE_HIT.value)
+
+    def test_process_cache_is_not_used_without_memcache(self):
+        config.Registry.test_overrides = {}
+        ProcessCachedTestDao.save(TestDto('a', {'a': 1}))
+        ProcessCachedTestDao.load('a')
+        self.assertEquals(0, models.ProcessScopedDaoCache.get_cache_len())
+
+
 class QuestionDAOTestCase(actions.TestBase):
     """Functional tests for QuestionDAO."""
 
@@ -624,6 +1183,69 @@ class StudentAnswersEntityTestCase(actions.ExportTestBase):
                 answers_key, self.transform).name())
 
 
+class StudentAssessmentAnswersEntityTestCase(actions.ExportTestBase):
+
+    def test_safe_key_transforms_user_id_component(self):
+        answers_key = models.StudentAssessmentAnswersEntity.create(
+            'user_id', 'Pre', []).put()
+        self.assertEqual(
+            'transformed_user_id-Pre',
+            models.StudentAssessmentAnswersEntity.safe_key(
+                answers_key, self.transform).name())
+
+    def test_for_export_transforms_user_id(self):
+        answers = models.StudentAssessmentAnswersEntity.create(
+            'user_id', 'Pre', [])
+        answers.put()
+        self.assertEqual(
+            'transformed_user_id',
+            answers.for_export(self.transform).user_id)
+
+
+class StudentAnswersDAOTestCase(actions.TestBase):
+    """Tests reading and migrating answers stored per student."""
+
+    def setUp(self):
+        super(StudentAnswersDAOTestCase, self).setUp()
+        self.user_id = 'user_id'
+        models.StudentAnswersEntity(
+            key_name=self.user_id, updated_on=datetime.datetime(2015, 1, 1),
+            data=transforms.dumps({'Pre': ['a'], 'Mid': ['b']})).put()
+
+    def test_put_legacy_answers_copies_only_absent_answers(self):
+        models.StudentAssessmentAnswersEntity.create(
+            self.user_id, 'Mid', ['c']).put()
+
+        legacy_entity = models.StudentAnswersEntity.get_by_key_name(
+            self.user_id)
+        self.assertEqual(
+            (1, 1), models.StudentAnswersDAO.put_legacy_answers(legacy_entity))
+        pre = models.StudentAssessmentAnswersEntity.get_by_key_name(
+            models.StudentAssessmentAnswersEntity.create_key(
+                self.user_id, 'Pre'))
+        self.assertEqual(['a'], transforms.loads(pre.data))
+        self.assertEqual(legacy_entity.updated_on, pre.updated_on)
+        mid = models.StudentAssessmentAnswersEntity.get_by_key_name(
+            models.StudentAssessmentAnswersEntity.create_key(
+                self.user_id, 'Mid'))
+        self.assertEqual(['c'], transforms.loads(mid.data))
+
+        self.assertEqual(
+            (0, 2), models.StudentAnswersDAO.put_legacy_answers(legacy_entity))
+
+    def test_get_all_answers_merges_legacy_and_per_assessment_answers(self):
+        models.StudentAssessmentAnswersEntity.create(
+            self.user_id, 'Mid', ['c']).put()
+        models.StudentAssessmentAnswersEntity.create(
+            self.user_id, 'Fin', ['d']).put()
+
+        self.assertEqual(
+            {'Pre': ['a'], 'Mid': ['c'], 'Fin': ['d']},
+            models.StudentAnswersDAO.get_all_answers(self.user_id))
+        self.assertEqual(
+            {}, models.StudentAnswersDAO.get_all_answers('other_user_id'))
+
+
 class StudentPropertyEntityTestCase(actions.ExportTestBase):
 
     def test_safe_key_transforms_user_id_component(self):
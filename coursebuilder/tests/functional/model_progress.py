@@ -0,0 +1,661 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for models/progress.py."""
+
+__author__ = 'Pavel Simakov (psimakov@google.com)'
+
+import logging
+import time
+import urllib
+
+from common import crypto
+from common.utils import Namespace
+from controllers import lessons
+from controllers import utils
+from models import courses
+from models import models
+from models import progress
+from models import review
+from models import student_work
+from models import transforms
+from modules.review import domain
+from modules.review import peer
+from modules.review import review as review_module
+from tests.functional import actions
+
+from google.appengine.ext import db
+
+COURSE_NAME = 'progress_document'
+NAMESPACE = 'ns_%s' % COURSE_NAME
+COURSE_TITLE = 'Progress Document'
+ADMIN_EMAIL = 'admin@foo.com'
+STUDENT_EMAIL = 'foo@foo.com'
+
+
+class CountingTransforms(object):
+    """Stands in for transforms in models.progress to count JSON coding."""
+
+    def __init__(self):
+        self.loads_count = 0
+        self.dumps_count = 0
+
+    def loads(self, *args, **kwargs):
+        self.loads_count += 1
+        return transforms.loads(*args, **kwargs)
+
+    def dumps(self, *args, **kwargs):
+        self.dumps_count += 1
+        return transforms.dumps(*args, **kwargs)
+
+
+class ProgressDocumentTest(actions.TestBase):
+    """Tests the decode-once document over a student property entity."""
+
+    def setUp(self):
+        super(ProgressDocumentTest, self).setUp()
+        self.transforms = CountingTransforms()
+        self.swap(progress, 'transforms', self.transforms)
+
+    def _make_entity(self, value=None):
+        return models.StudentPropertyEntity(
+            key_name='1-%s' % progress.UnitLessonCompletionTracker.PROPERTY_KEY,
+            name=progress.UnitLessonCompletionTracker.PROPERTY_KEY,
+            value=value)
+
+    def test_empty_entity_makes_empty_document(self):
+        document = progress.ProgressDocument(self._make_entity())
+        self.assertIsNone(document.get('u.1'))
+        self.assertNotIn('u.1', document)
+        self.assertFalse(document.is_dirty())
+        self.assertEquals(0, self.transforms.loads_count)
+
+    def test_value_is_decoded_once(self):
+        document = progress.ProgressDocument(
+            self._make_entity('{"u.1": 1, "u.1.l.2": 2}'))
+        for _ in xrange(10):
+            self.assertEquals(1, document.get('u.1'))
+            self.assertEquals(2, document['u.1.l.2'])
+        self.assertEquals(1, self.transforms.loads_count)
+
+    def test_only_changes_mark_document_dirty(self):
+        entity = self._make_entity('{"u.1": 1}')
+        document = progress.ProgressDocument(entity)
+        document.set('u.1', 1)
+        self.assertFalse(document.is_dirty())
+        document.inc('u.1.l.2.h.0')
+        document.inc('u.1.l.2.h.0', 2)
+        document['u.1'] = 2
+        self.assertTrue(document.is_dirty())
+        self.assertEquals(3, document['u.1.l.2.h.0'])
+        self.assertEquals(0, self.transforms.dumps_count)
+        self.assertEquals('{"u.1": 1}', entity.value)
+
+    def test_value_and_flush_encode_changes_once(self):
+        entity = self._make_entity('{"u.1": 1}')
+        document = progress.ProgressDocument(entity)
+        document.set('u.1', 2)
+        document.set('u.2', 1)
+        self.assertEquals(
+            {'u.1': 2, 'u.2': 1}, transforms.loads(document.value))
+        self.assertEquals(document.value, entity.value)
+        document.flush()
+        self.assertFalse(document.is_dirty())
+        self.assertEquals(1, self.transforms.dumps_count)
+
+    def test_wrap_keeps_document(self):
+        entity = self._make_entity('{"u.1": 1}')
+        document = progress.ProgressDocument.wrap(entity)
+        self.assertIs(entity, document.entity)
+        self.assertIs(document, progress.ProgressDocument.wrap(document))
+
+    def test_tracker_accepts_entity_or_document(self):
+        tracker = progress.UnitLessonCompletionTracker(None)
+        entity = self._make_entity('{}')
+        tracker._set_entity_value(entity, 'u.1', 1)
+        tracker._inc(entity, 'u.1.l.2.h.0')
+        self.assertEquals(
+            {'u.1': 1, 'u.1.l.2.h.0': 1}, transforms.loads(entity.value))
+
+        document = progress.ProgressDocument(entity)
+        self.transforms.dumps_count = 0
+        tracker._set_entity_value(document, 'u.1', 2)
+        tracker._inc(document, 'u.1.l.2.h.0')
+        self.assertEquals(2, tracker._get_entity_value(document, 'u.1'))
+        self.assertEquals(0, self.transforms.dumps_count)
+        self.assertEquals(2, tracker._get_entity_value(entity, 'u.1.l.2.h.0'))
+
+
+class ProgressDocumentCascadeTest(actions.TestBase):
+    """Tests that one event cascade decodes and encodes progress once."""
+
+    LESSON_COUNT = 20
+
+    def setUp(self):
+        super(ProgressDocumentCascadeTest, self).setUp()
+        context = actions.simple_add_course(
+            COURSE_NAME, ADMIN_EMAIL, COURSE_TITLE)
+        self.course = courses.Course(None, context)
+        self.unit = self.course.add_unit()
+        self.unit.now_available = True
+        self.lessons = []
+        for index in xrange(self.LESSON_COUNT):
+            lesson = self.course.add_lesson(self.unit)
+            lesson.title = 'Lesson %s' % index
+            lesson.objectives = 'body of lesson'
+            lesson.now_available = True
+            self.lessons.append(lesson)
+        self.course.save()
+
+        actions.login(STUDENT_EMAIL)
+        actions.register(self, STUDENT_EMAIL, COURSE_NAME)
+        self.tracker = self.course.get_progress_tracker()
+        with Namespace(NAMESPACE):
+            self.student = models.Student.get_by_email(STUDENT_EMAIL)
+
+    def test_completion_event_decodes_and_encodes_once(self):
+        counting_transforms = CountingTransforms()
+        with Namespace(NAMESPACE):
+            self.tracker.put_html_completed(
+                self.student, self.unit.unit_id, self.lessons[0].lesson_id)
+
+            # Hooks keep documents of their own; count only this tracker's.
+            self.swap(
+                progress.UnitLessonCompletionTracker,
+                'POST_UPDATE_PROGRESS_HOOK', [])
+            self.swap(progress, 'transforms', counting_transforms)
+            self.tracker.put_html_completed(
+                self.student, self.unit.unit_id, self.lessons[1].lesson_id)
+            self.assertEquals(1, counting_transforms.loads_count)
+            self.assertEquals(1, counting_transforms.dumps_count)
+
+            entity = self.tracker.get_or_create_progress(self.student)
+            unit_id = self.unit.unit_id
+            self.assertEquals(
+                self.tracker.COMPLETED_STATE, self.tracker.get_lesson_status(
+                    entity, unit_id, self.lessons[1].lesson_id))
+            self.assertEquals(
+                self.tracker.IN_PROGRESS_STATE,
+                self.tracker.get_unit_status(entity, unit_id))
+
+    def test_unit_completes_after_last_lesson(self):
+        with Namespace(NAMESPACE):
+            for lesson in self.lessons:
+                self.tracker.put_html_completed(
+                    self.student, self.unit.unit_id, lesson.lesson_id)
+            entity = self.tracker.get_or_create_progress(self.student)
+            self.assertEquals(
+                self.tracker.COMPLETED_STATE,
+                self.tracker.get_unit_status(entity, self.unit.unit_id))
+            self.assertEquals(
+                self.tracker.COMPLETED_STATE,
+                self.tracker.get_course_status(entity))
+
+    def _post_batch(self, events):
+        request = {
+            'events': events,
+            'xsrf_token': crypto.XsrfTokenManager.create_xsrf_token(
+                'event-post')}
+        return self.post('/%s/rest/events/batch?%s' % (
+            COURSE_NAME, urllib.urlencode(
+                {'request': transforms.dumps(request)})), {})
+
+    def test_event_batch_puts_progress_once(self):
+        put_count = [0]
+        put = progress.ProgressDocument.put
+
+        def counting_put(document):
+            put_count[0] += 1
+            put(document)
+
+        self.swap(progress.ProgressDocument, 'put', counting_put)
+        self.swap(
+            progress.UnitLessonCompletionTracker, 'POST_UPDATE_PROGRESS_HOOK',
+            [])
+        events = [
+            {'source': 'attempt-lesson',
+             'payload': {'location': 'http://localhost/%s/unit?%s' % (
+                 COURSE_NAME, urllib.urlencode({
+                     'unit': self.unit.unit_id,
+                     'lesson': lesson.lesson_id}))}}
+            for lesson in self.lessons]
+        with actions.OverriddenConfig(
+            utils.CAN_PERSIST_ACTIVITY_EVENTS.name, True):
+            response = self._post_batch(events)
+        self.assertEquals(200, response.status_int)
+        self.assertEquals(1, put_count[0])
+
+        with Namespace(NAMESPACE):
+            self.assertEquals(
+                self.LESSON_COUNT, len(models.EventEntity.all().fetch(1000)))
+            entity = self.tracker.get_or_create_progress(self.student)
+            self.assertEquals(
+                self.tracker.COMPLETED_STATE,
+                self.tracker.get_course_status(entity))
+
+    def test_event_batch_size_is_limited(self):
+        events = [{'source': 'test-source', 'payload': {}}] * (
+            lessons.EventsBatchRESTHandler.MAX_EVENTS_PER_BATCH + 1)
+        with actions.OverriddenConfig(
+            utils.CAN_PERSIST_ACTIVITY_EVENTS.name, True):
+            response = self._post_batch(events)
+        self.assertIn('"status": 400', response.body)
+        with Namespace(NAMESPACE):
+            self.assertEquals([], models.EventEntity.all().fetch(1000))
+
+    def test_malformed_event_batch_is_rejected(self):
+        good = {'source': 'test-source', 'payload': {}}
+        for events in [
+            'not a list', [good, 'not a dict'], [good, {'source': 'x'}],
+            [good, {'source': 'x', 'payload': None}],
+            [good, {'source': 'x', 'payload': '[1, 2]'}],
+            [good, {'source': 'x', 'payload': 'not json'}],
+            [good, {'payload': {}}]]:
+            with actions.OverriddenConfig(
+                utils.CAN_PERSIST_ACTIVITY_EVENTS.name, True):
+                response = self._post_batch(events)
+            self.assertEquals(200, response.status_int)
+            self.assertIn('"status": 400', response.body)
+        with Namespace(NAMESPACE):
+            self.assertEquals([], models.EventEntity.all().fetch(1000))
+
+
+class ProgressRollupTest(actions.TestBase):
+    """Tests counting of completed children of units and of the course."""
+
+    def setUp(self):
+        super(ProgressRollupTest, self).setUp()
+        progress.ProcessScopedRollupCache.clear_all()
+        self.app_context = actions.simple_add_course(
+            COURSE_NAME, ADMIN_EMAIL, COURSE_TITLE)
+        course = courses.Course(None, self.app_context)
+
+        self.unit_one = course.add_unit()
+        self.unit_one.now_available = True
+        self.lessons_one = [
+            course.add_lesson(self.unit_one) for _ in xrange(2)]
+
+        self.pre_assessment = course.add_assessment()
+        self.pre_assessment.now_available = True
+        self.unit_two = course.add_unit()
+        self.unit_two.now_available = True
+        self.unit_two.pre_assessment = self.pre_assessment.unit_id
+        self.lesson_two = course.add_lesson(self.unit_two)
+
+        self.assessment = course.add_assessment()
+        self.assessment.now_available = True
+        for lesson in self.lessons_one + [self.lesson_two]:
+            lesson.now_available = True
+        course.save()
+
+        actions.login(STUDENT_EMAIL)
+        actions.register(self, STUDENT_EMAIL, COURSE_NAME)
+        with Namespace(NAMESPACE):
+            self.student = models.Student.get_by_email(STUDENT_EMAIL)
+
+    def _get_tracker(self):
+        return courses.Course(
+            None, app_context=self.app_context).get_progress_tracker()
+
+    def _get_progress(self):
+        return progress.ProgressDocument(
+            self._get_tracker().get_or_create_progress(self.student))
+
+    def _complete_lesson(self, unit, lesson):
+        self._get_tracker().put_html_completed(
+            self.student, unit.unit_id, lesson.lesson_id)
+
+    def _complete_assessment(self, assessment):
+        self._get_tracker().put_assessment_completed(
+            self.student, assessment.unit_id)
+
+    def test_children_are_counted_once(self):
+        with Namespace(NAMESPACE):
+            self._complete_lesson(self.unit_one, self.lessons_one[0])
+            self._complete_lesson(self.unit_one, self.lessons_one[0])
+            self._complete_assessment(self.pre_assessment)
+            self._complete_assessment(self.pre_assessment)
+
+            rollup = self._get_progress()[
+                progress.UnitLessonCompletionTracker.ROLLUP_KEY]
+            self.assertEquals(
+                [1, 2], rollup['units']['u.%s' % self.unit_one.unit_id])
+            self.assertEquals(
+                [1, 2], rollup['units']['u.%s' % self.unit_two.unit_id])
+            self.assertEquals([0, 3], rollup['course'])
+            self.assertNotIn('course_child_keys', rollup)
+
+    def test_course_completes_with_last_child(self):
+        with Namespace(NAMESPACE):
+            tracker = self._get_tracker()
+            for lesson in self.lessons_one:
+                self._complete_lesson(self.unit_one, lesson)
+            self._complete_lesson(self.unit_two, self.lesson_two)
+            self._complete_assessment(self.assessment)
+
+            document = self._get_progress()
+            self.assertEquals(
+                tracker.COMPLETED_STATE,
+                tracker.get_unit_status(document, self.unit_one.unit_id))
+            self.assertEquals(
+                tracker.IN_PROGRESS_STATE,
+                tracker.get_unit_status(document, self.unit_two.unit_id))
+            self.assertEquals(
+                tracker.IN_PROGRESS_STATE, tracker.get_course_status(document))
+
+            self._complete_assessment(self.pre_assessment)
+            document = self._get_progress()
+            self.assertEquals(
+                tracker.COMPLETED_STATE,
+                tracker.get_unit_status(document, self.unit_two.unit_id))
+            self.assertEquals(
+                tracker.COMPLETED_STATE, tracker.get_course_status(document))
+
+    def test_course_child_keys_are_made_once_per_version(self):
+        with Namespace(NAMESPACE):
+            self._complete_lesson(self.unit_two, self.lesson_two)
+
+            def fail(*unused_args):
+                raise AssertionError('Course child keys are not cached.')
+
+            self.swap(
+                progress.UnitLessonCompletionTracker,
+                '_get_course_child_keys', fail)
+            self._complete_assessment(self.assessment)
+            self.assertEquals(
+                [1, 3], self._get_progress()[
+                    progress.UnitLessonCompletionTracker.ROLLUP_KEY][
+                        'course'])
+
+    def test_rollup_is_made_from_progress_without_one(self):
+        with Namespace(NAMESPACE):
+            tracker = self._get_tracker()
+            entity = tracker.get_or_create_progress(self.student)
+            entity.value = transforms.dumps(dict(
+                [('u.%s' % self.unit_one.unit_id, tracker.COMPLETED_STATE),
+                 ('s.%s' % self.assessment.unit_id, 1)] +
+                [('u.%s.l.%s' % (self.unit_one.unit_id, lesson.lesson_id),
+                  tracker.COMPLETED_STATE) for lesson in self.lessons_one]))
+            entity.put()
+
+            self._complete_assessment(self.pre_assessment)
+            self._complete_lesson(self.unit_two, self.lesson_two)
+
+            document = self._get_progress()
+            self.assertEquals(
+                [3, 3], document[tracker.ROLLUP_KEY]['course'])
+            self.assertEquals(
+                tracker.COMPLETED_STATE, tracker.get_course_status(document))
+
+    def test_rollup_is_remade_when_course_changes(self):
+        with Namespace(NAMESPACE):
+            self._complete_lesson(self.unit_two, self.lesson_two)
+            self._complete_assessment(self.pre_assessment)
+            version = self._get_progress()[
+                progress.UnitLessonCompletionTracker.ROLLUP_KEY]['version']
+
+        course = courses.Course(None, app_context=self.app_context)
+        new_lesson = course.add_lesson(
+            course.find_unit_by_id(self.unit_two.unit_id))
+        new_lesson.now_available = True
+        course.save()
+
+        with Namespace(NAMESPACE):
+            tracker = self._get_tracker()
+            self._complete_lesson(self.unit_one, self.lessons_one[0])
+            document = self._get_progress()
+            rollup = document[tracker.ROLLUP_KEY]
+            self.assertNotEquals(version, rollup['version'])
+            self.assertEquals(
+                [2, 3], rollup['units']['u.%s' % self.unit_two.unit_id])
+            self.assertEquals([1, 3], rollup['course'])
+
+            self._complete_lesson(self.unit_two, new_lesson)
+            self.assertEquals(
+                [3, 3], self._get_progress()[tracker.ROLLUP_KEY]['units'][
+                    'u.%s' % self.unit_two.unit_id])
+
+
+class ScoreSummaryTest(actions.TestBase):
+    """Tests the score summary read by Course.get_all_scores()."""
+
+    def setUp(self):
+        super(ScoreSummaryTest, self).setUp()
+        self.app_context = actions.simple_add_course(
+            COURSE_NAME, ADMIN_EMAIL, COURSE_TITLE)
+        course = courses.Course(None, self.app_context)
+
+        self.assessment = course.add_assessment()
+        self.assessment.now_available = True
+        self.peer_graded = course.add_assessment()
+        self.peer_graded.workflow_yaml = (
+            '{grader: human,'
+            'matcher: peer,'
+            'review_due_date: \'2034-07-01 12:00\','
+            'review_min_count: 1,'
+            'review_window_mins: 20,'
+            'submission_due_date: \'2034-07-01 12:00\'}')
+        self.peer_graded.now_available = True
+        course.save()
+
+        actions.login(STUDENT_EMAIL)
+        actions.register(self, STUDENT_EMAIL, COURSE_NAME)
+        with Namespace(NAMESPACE):
+            self.student = models.Student.get_by_email(STUDENT_EMAIL)
+
+    def _get_course(self):
+        return courses.Course(None, app_context=self.app_context)
+
+    def _get_completed(self):
+        return dict(
+            (score['id'], score['completed'])
+            for score in self._get_course().get_all_scores(self.student))
+
+    def _complete_assessment(self, assessment):
+        self._get_course().get_progress_tracker().put_assessment_completed(
+            self.student, assessment.unit_id)
+
+    def _forbid(self, cls, name):
+        def fail(*unused_args, **unused_kwargs):
+            self.fail('%s.%s() was called' % (cls.__name__, name))
+
+        self.swap(cls, name, fail)
+
+    def _write_review(self):
+        """Writes a completed review by the student of another student."""
+        unit_id = str(self.peer_graded.unit_id)
+        reviewee_key = models.Student(key_name='reviewee@example.com').put()
+        submission_key = db.Key.from_path(
+            student_work.Submission.kind(),
+            student_work.Submission.key_name(
+                reviewee_key=reviewee_key, unit_id=unit_id))
+        summary_key = peer.ReviewSummary(
+            assigned_count=1, reviewee_key=reviewee_key,
+            submission_key=submission_key, unit_id=unit_id).put()
+        step_key = peer.ReviewStep(
+            assigner_kind=domain.ASSIGNER_KIND_HUMAN,
+            review_summary_key=summary_key, reviewee_key=reviewee_key,
+            reviewer_key=self.student.get_key(),
+            submission_key=submission_key,
+            state=domain.REVIEW_STATE_ASSIGNED, unit_id=unit_id).put()
+        review_module.Manager.write_review(step_key, 'contents')
+
+    def _drop_summary(self):
+        """Drops the summary, as if the student predated score summaries."""
+        models.StudentPropertyEntity.get_by_user_id(
+            self.student.user_id, progress.ScoreSummary.PROPERTY_KEY).delete()
+
+    def test_completion_makes_missing_summary(self):
+        with Namespace(NAMESPACE):
+            self.assertIsNone(progress.ScoreSummary.get(self.student.user_id))
+            self._complete_assessment(self.assessment)
+
+            summary = progress.ScoreSummary.get(self.student.user_id)
+            self.assertEquals(
+                set([str(self.assessment.unit_id)]),
+                summary.completed_unit_ids)
+            self.assertFalse(summary.is_made_from_progress)
+
+    def test_summary_is_made_from_progress_on_first_read(self):
+        with Namespace(NAMESPACE):
+            self._complete_assessment(self.assessment)
+            self._drop_summary()
+            self.assertIsNone(progress.ScoreSummary.get(self.student.user_id))
+
+            completed = self._get_completed()
+            self.assertTrue(completed[str(self.assessment.unit_id)])
+            self.assertFalse(completed[str(self.peer_graded.unit_id)])
+            self.assertEquals(
+                set([str(self.assessment.unit_id)]),
+                progress.ScoreSummary.get(
+                    self.student.user_id).completed_unit_ids)
+
+    def test_first_read_keeps_completion_put_meanwhile(self):
+        with Namespace(NAMESPACE):
+            self._complete_assessment(self.assessment)
+            self._drop_summary()
+
+            get_or_create_progress = (
+                progress.UnitLessonCompletionTracker.get_or_create_progress)
+
+            def get_progress_and_complete_peer_graded(tracker, student):
+                student_progress = get_or_create_progress(tracker, student)
+                # Another request completes a unit while this one reads.
+                self.swap(
+                    progress.UnitLessonCompletionTracker,
+                    'get_or_create_progress', get_or_create_progress)
+                self._complete_assessment(self.peer_graded)
+                return student_progress
+
+            self.swap(
+                progress.UnitLessonCompletionTracker, 'get_or_create_progress',
+                get_progress_and_complete_peer_graded)
+            self._get_completed()
+
+            summary = progress.ScoreSummary.get(self.student.user_id)
+            self.assertEquals(
+                set([str(self.assessment.unit_id),
+                     str(self.peer_graded.unit_id)]),
+                summary.completed_unit_ids)
+            self.assertTrue(summary.is_made_from_progress)
+
+    def test_completion_is_read_without_progress(self):
+        with Namespace(NAMESPACE):
+            self.assertFalse(
+                self._get_completed()[str(self.assessment.unit_id)])
+            self._complete_assessment(self.assessment)
+
+            self._forbid(
+                progress.UnitLessonCompletionTracker, 'get_or_create_progress')
+            self.assertTrue(
+                self._get_completed()[str(self.assessment.unit_id)])
+
+    def test_reviews_are_read_without_review_steps(self):
+        with Namespace(NAMESPACE):
+            self._complete_assessment(self.peer_graded)
+            self.assertFalse(
+                self._get_completed()[str(self.peer_graded.unit_id)])
+            self.assertEquals(
+                0, progress.ScoreSummary.get(
+                    self.student.user_id).get_completed_review_count(
+                        self.peer_graded.unit_id))
+
+            self._write_review()
+
+            self._forbid(review.ReviewsProcessor, 'get_review_steps_by')
+            self._forbid(
+                progress.UnitLessonCompletionTracker, 'get_or_create_progress')
+            self.assertTrue(
+                self._get_completed()[str(self.peer_graded.unit_id)])
+
+    def test_batch_puts_completions_into_summary(self):
+        with Namespace(NAMESPACE):
+            self._get_completed()
+            tracker = self._get_course().get_progress_tracker()
+            tracker.begin_batch()
+            tracker.put_assessment_completed(
+                self.student, self.assessment.unit_id)
+            self.assertEquals(
+                set(), progress.ScoreSummary.get(
+                    self.student.user_id).completed_unit_ids)
+
+            tracker.put_batch()
+            tracker.end_batch()
+            self.assertEquals(
+                set([str(self.assessment.unit_id)]),
+                progress.ScoreSummary.get(
+                    self.student.user_id).completed_unit_ids)
+
+
+class ProgressDocumentBenchmark(actions.TestBase):
+    """Compares per-access decoding of progress with a decode-once document."""
+
+    ITERATIONS = 20
+    LESSON_COUNT = 200
+
+    def _make_value(self):
+        value = {'course': 1}
+        for unit_id in xrange(1, 11):
+            value['u.%s' % unit_id] = 1
+            for lesson_id in xrange(self.LESSON_COUNT / 10):
+                lesson_key = 'u.%s.l.%s' % (unit_id, lesson_id)
+                value[lesson_key] = 1
+                value['%s.h.0' % lesson_key] = 1
+                for cpt_id in xrange(3):
+                    value['%s.h.0.c.%s' % (lesson_key, cpt_id)] = 1
+        return transforms.dumps(value)
+
+    def _cascade_keys(self):
+        keys = []
+        for lesson_id in xrange(self.LESSON_COUNT / 10):
+            lesson_key = 'u.1.l.%s' % lesson_id
+            keys.extend([
+                '%s.h.0.c.0' % lesson_key, '%s.h.0' % lesson_key, lesson_key,
+                'u.1', 'course'])
+        return keys
+
+    def _time(self, fn):
+        start = time.time()
+        for _ in xrange(self.ITERATIONS):
+            fn()
+        return time.time() - start
+
+    def test_benchmark(self):
+        value = self._make_value()
+        keys = self._cascade_keys()
+
+        def per_access():
+            entity = models.StudentPropertyEntity(value=value)
+            for key in keys:
+                state = transforms.loads(entity.value).get(key)
+                data = transforms.loads(entity.value)
+                data[key] = (state or 0) + 1
+                entity.value = transforms.dumps(data)
+
+        def decode_once():
+            document = progress.ProgressDocument(
+                models.StudentPropertyEntity(value=value))
+            for key in keys:
+                state = document.get(key)
+                document.set(key, (state or 0) + 1)
+            document.flush()
+
+        per_access_time = self._time(per_access)
+        decode_once_time = self._time(decode_once)
+        logging.info(
+            'Progress of %s lessons, %s events of %s updates: '
+            'per-access decoding %.3fs, decode-once document %.3fs.',
+            self.LESSON_COUNT, self.ITERATIONS, len(keys),
+            per_access_time, decode_once_time)
+        self.assertLess(decode_once_time, per_access_time)
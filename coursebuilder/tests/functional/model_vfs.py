@@ -18,17 +18,22 @@ __author__ = [
     'mgainer@google.com (Mike Gainer)',
 ]
 
+import logging
 import os
 import random
 import StringIO
 import tempfile
+import time
 
+from common import caching
 from common import utils as common_utils
 from models import vfs
 from models import courses
 from tests.functional import actions
 from tools.etl import etl
 
+from google.appengine.ext import db
+
 LOREM_IPSUM = """
 Lorem ipsum dolor sit amet, consectetur adipiscing elit. Pellentesque nisl
 libero, interdum vel lectus eget, lacinia vestibulum eros. Maecenas posuere
@@ -169,6 +174,38 @@ class VfsLargeFileSupportTest(actions.TestBase):
             shard_1 = vfs.FileDataEntity.get_by_key_name(file_key_names[1])
             self.assertEquals(1, len(shard_1.data))
 
+    def test_large_file_is_streamed_and_cached_by_shard(self):
+        r = random.Random()
+        r.seed(0)
+        orig_data = ''.join(
+            [chr(r.randrange(256))
+             for x in xrange(int(vfs._MAX_VFS_SHARD_SIZE * 2 + 1))])
+        fs = vfs.DatastoreBackedFileSystem('ns_foo', '/')
+        fs.put('/foo', StringIO.StringIO(orig_data))
+        num_shards = len(orig_data) / vfs._VFS_CACHE_SHARD_SIZE + 1
+
+        old_miss_count = vfs.VfsCacheConnection.CACHE_SHARD_MISS.value
+        stream = fs.open('/foo')
+        shards = list(vfs.iter_stream_shards(stream))
+        self.assertEquals(num_shards, len(shards))
+        self.assertTrue(all(
+            len(shard) <= vfs._VFS_CACHE_SHARD_SIZE for shard in shards))
+        self.assertEquals(orig_data, ''.join(shards))
+        self.assertEquals(
+            num_shards,
+            vfs.VfsCacheConnection.CACHE_SHARD_MISS.value - old_miss_count)
+
+        old_hit_count = vfs.VfsCacheConnection.CACHE_SHARD_HIT.value
+        self.assertEquals(orig_data, fs.get('/foo').read())
+        self.assertEquals(
+            num_shards,
+            vfs.VfsCacheConnection.CACHE_SHARD_HIT.value - old_hit_count)
+
+        # A new version of the file does not see shards of the old one.
+        new_data = orig_data[::-1]
+        fs.put('/foo', StringIO.StringIO(new_data))
+        self.assertEquals(new_data, fs.get('/foo').read())
+
     def test_illegal_file_name(self):
         namespace = 'ns_foo'
         fs = vfs.DatastoreBackedFileSystem(namespace, '/')
@@ -199,3 +236,185 @@ class VfsLargeFileSupportTest(actions.TestBase):
         # from AppEngine about cross-group transaction having too many
         # entities involved.
         self.course.save()
+
+
+class VfsListingTest(actions.TestBase):
+    """Tests and benchmarks directory listing over a large number of files."""
+
+    NAMESPACE = 'ns_listing'
+    NUM_FILES = 10 * 1000
+    NUM_FILES_IN_DIR = 1500
+    BATCH_SIZE = 500
+
+    def setUp(self):
+        super(VfsListingTest, self).setUp()
+        self.fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+        self.expected = set()
+        entities = []
+        for index in xrange(self.NUM_FILES):
+            if index < self.NUM_FILES_IN_DIR:
+                filename = u'/assets/img/%05d.png' % index
+                self.expected.add(filename)
+            else:
+                filename = u'/assets/z_other/%05d.txt' % index
+            entities.append(vfs.FileMetadataEntity(key_name=filename, size=0))
+        with common_utils.Namespace(self.NAMESPACE):
+            for start in xrange(0, len(entities), self.BATCH_SIZE):
+                db.put(entities[start:start + self.BATCH_SIZE])
+
+    def _legacy_list(self, dir_name):
+        """The former listing: scan the first 1000 keys and filter names."""
+        result = set()
+        with common_utils.Namespace(self.NAMESPACE):
+            keys = vfs.FileMetadataEntity.all(keys_only=True)
+            for key in keys.fetch(1000):
+                if key.name().startswith(dir_name):
+                    result.add(key.name())
+        return result
+
+    def _full_scan_list(self, dir_name):
+        """The former listing without the 1000 key cap."""
+        result = set()
+        with common_utils.Namespace(self.NAMESPACE):
+            keys = vfs.FileMetadataEntity.all(keys_only=True)
+            for key in caching.iter_all(keys, batch_size=1000):
+                if key.name().startswith(dir_name):
+                    result.add(key.name())
+        return result
+
+    def _time(self, fn):
+        start = time.time()
+        result = fn()
+        return result, time.time() - start
+
+    def test_list_is_not_capped(self):
+        self.assertEquals(
+            sorted(self.expected), self.fs.list('/assets/img/'))
+        self.assertLess(
+            len(self._legacy_list('/assets/img/')), len(self.expected))
+
+    def test_list_does_not_include_sibling_prefixes(self):
+        with common_utils.Namespace(self.NAMESPACE):
+            vfs.FileMetadataEntity(key_name=u'/assets/img_extra.png').put()
+            vfs.FileMetadataEntity(key_name=u'/assets/im').put()
+        listed = self.fs.list('/assets/img')
+        self.assertIn(u'/assets/img_extra.png', listed)
+        self.assertNotIn(u'/assets/im', listed)
+        self.assertEquals(
+            set(listed), self._full_scan_list('/assets/img'))
+
+    def test_benchmark_list(self):
+        indexed, indexed_sec = self._time(
+            lambda: self.fs.list('/assets/img/'))
+        scanned, scanned_sec = self._time(
+            lambda: self._full_scan_list('/assets/img/'))
+        _, legacy_sec = self._time(
+            lambda: self._legacy_list('/assets/img/'))
+        self.assertEquals(set(indexed), scanned)
+        logging.info(
+            'Listed %s of %s files: key range %.3fs, full scan %.3fs, '
+            'legacy capped scan %.3fs.', len(indexed), self.NUM_FILES,
+            indexed_sec, scanned_sec, legacy_sec)
+
+
+class VfsCacheJournalTest(actions.TestBase):
+    """Tests the change journal keeping process-local VFS caches in sync."""
+
+    NAMESPACE = 'ns_journal'
+
+    def setUp(self):
+        super(VfsCacheJournalTest, self).setUp()
+        vfs.ProcessScopedVfsCache.clear_all()
+
+    def _connect(self):
+        with common_utils.Namespace(self.NAMESPACE):
+            return vfs.VfsCacheConnection.new_connection(self.NAMESPACE)
+
+    def _cache_file(self, conn, filename):
+        """Puts a file into cache as if this process has just served it."""
+        metadata = vfs.FileMetadataEntity(key_name=filename)
+        conn.put(filename, metadata, 'cached data')
+        self.assertTrue(conn.get(filename)[0])
+
+    def _record(self, keys, op=caching.CacheChangeJournal.OP_PUT):
+        """Records changes as if they were made by another process."""
+        with common_utils.Namespace(self.NAMESPACE):
+            vfs.VfsCacheConnection.record_changes(keys, op=op)
+
+    def test_changes_are_evicted_and_others_kept(self):
+        conn = self._connect()
+        self._cache_file(conn, '/a.txt')
+        self._cache_file(conn, '/b.txt')
+        self._cache_file(conn, '/c.txt')
+        self._record(['/a.txt'])
+        self._record(['/b.txt'], op=caching.CacheChangeJournal.OP_DELETE)
+
+        conn = self._connect()
+        self.assertFalse(conn.get('/a.txt')[0])
+        self.assertFalse(conn.get('/b.txt')[0])
+        self.assertTrue(conn.get('/c.txt')[0])
+
+        # Changes already seen are not applied again.
+        self._cache_file(conn, '/a.txt')
+        conn = self._connect()
+        self.assertTrue(conn.get('/a.txt')[0])
+
+    def test_delete_through_file_system_is_journaled(self):
+        fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+        fs.put('/a.txt', StringIO.StringIO('file data'))
+        conn = self._connect()
+        fs.delete('/a.txt')
+        self._cache_file(conn, '/a.txt')
+        with common_utils.Namespace(self.NAMESPACE):
+            self.assertEquals(2, caching.CacheChangeJournal.get_last_sequence(
+                vfs.VfsCacheConnection.journal_name(), self.NAMESPACE))
+        self.assertFalse(self._connect().get('/a.txt')[0])
+
+    def test_largest_file_is_journaled_after_its_transaction(self):
+        in_transaction = []
+        record_changes = vfs.VfsCacheConnection.record_changes
+
+        def record_changes_and_check(unused_cls, keys, **kwargs):
+            in_transaction.append(db.is_in_transaction())
+            record_changes(keys, **kwargs)
+
+        self.swap(
+            vfs.VfsCacheConnection, 'record_changes',
+            classmethod(record_changes_and_check))
+
+        # The most shards a file may have, plus its metadata, already take
+        # as many entity groups as a transaction may span.
+        size = (vfs._MAX_VFS_NUM_SHARDS - 1) * vfs._MAX_VFS_SHARD_SIZE + 1
+        self.assertEquals(
+            vfs._MAX_VFS_NUM_SHARDS,
+            len(vfs.DatastoreBackedFileSystem._generate_file_key_names(
+                '/big.bin', size)))
+        fs = vfs.DatastoreBackedFileSystem(self.NAMESPACE, '/')
+        fs.put('/big.bin', StringIO.StringIO('x' * size))
+        self.assertEquals(size, len(fs.get('/big.bin').read()))
+        fs.delete('/big.bin')
+
+        self.assertEquals([False, False], in_transaction)
+        with common_utils.Namespace(self.NAMESPACE):
+            self.assertEquals(2, caching.CacheChangeJournal.get_last_sequence(
+                vfs.VfsCacheConnection.journal_name(), self.NAMESPACE))
+
+    def test_lagging_process_flushes_namespace(self):
+        self.swap(caching, 'MAX_CACHE_JOURNAL_ENTRIES', 3)
+        conn = self._connect()
+        self._cache_file(conn, '/a.txt')
+        old_flush_count = vfs.VfsCacheConnection.CACHE_FLUSH.value
+        self._record(['/b.txt', '/c.txt', '/d.txt', '/e.txt'])
+
+        conn = self._connect()
+        self.assertFalse(conn.get('/a.txt')[0])
+        self.assertEquals(
+            1, vfs.VfsCacheConnection.CACHE_FLUSH.value - old_flush_count)
+
+    def test_large_batch_flushes_namespace(self):
+        conn = self._connect()
+        self._cache_file(conn, '/a.txt')
+        self._record([
+            '/file_%s.txt' % index
+            for index in xrange(caching.MAX_CACHE_JOURNAL_BATCH_SIZE + 1)])
+        self.assertFalse(self._connect().get('/a.txt')[0])
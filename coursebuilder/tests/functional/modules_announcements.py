@@ -0,0 +1,159 @@
+# Copyright 2015 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the paginated list of announcements."""
+
+__author__ = 'Pavel Simakov (psimakov@google.com)'
+
+import datetime
+import re
+
+from common import utils as common_utils
+from controllers import sites
+from models import models
+from modules.announcements import announcements
+from tests.functional import actions
+
+ADMIN_EMAIL = 'admin@foo.com'
+COURSE_NAME = 'news'
+NAMESPACE = 'ns_%s' % COURSE_NAME
+STUDENT_EMAIL = 'student@foo.com'
+STUDENT_NAME = 'A. Student'
+
+
+class AnnouncementsPaginationTest(actions.TestBase):
+    """Tests paging through announcements with cursors."""
+
+    COUNT = announcements.ANNOUNCEMENTS_PAGE_SIZE + 5
+
+    def setUp(self):
+        super(AnnouncementsPaginationTest, self).setUp()
+        self.base = '/' + COURSE_NAME
+        actions.simple_add_course(COURSE_NAME, ADMIN_EMAIL, 'News Course')
+        for index in xrange(self.COUNT):
+            self._add_announcement(index)
+        actions.login(STUDENT_EMAIL)
+        actions.register(self, STUDENT_NAME)
+
+    def tearDown(self):
+        del sites.Registry.test_overrides[sites.GCB_COURSES_CONFIG.name]
+        super(AnnouncementsPaginationTest, self).tearDown()
+
+    def _add_announcement(self, index, is_draft=False, labels=None):
+        with common_utils.Namespace(NAMESPACE):
+            entity = announcements.AnnouncementEntity(
+                title='Announcement %02d' % index,
+                date=datetime.date(2015, 1, 1) + datetime.timedelta(index),
+                html='Body of announcement %02d' % index,
+                labels=labels, is_draft=is_draft)
+            entity.put()
+            return entity
+
+    def _get_titles(self, response):
+        return [int(index) for index in re.findall(
+            r'Announcement (\d\d)', response.body)]
+
+    def _get_next_page_url(self, response):
+        match = re.search(r'href="([^"]+cursor=[^"]+)"', response.body)
+        return match.group(1) if match else None
+
+    def _expected_titles(self, start, stop):
+        return range(start - 1, stop - 1, -1)
+
+    def test_first_page_shows_newest_announcements(self):
+        response = self.get('announcements')
+        self.assertEquals(
+            self._expected_titles(self.COUNT, 5), self._get_titles(response))
+        self.assertIn('Older Announcements', response.body)
+        self.assertNotIn('Newer Announcements', response.body)
+
+    def test_next_page_continues_after_cursor(self):
+        response = self.get('announcements')
+        response = self.get(self._get_next_page_url(response))
+        self.assertEquals(
+            self._expected_titles(5, 0), self._get_titles(response))
+        self.assertIn('Newer Announcements', response.body)
+        self.assertNotIn('Older Announcements', response.body)
+
+    def test_new_announcement_does_not_shift_next_page(self):
+        next_page_url = self._get_next_page_url(self.get('announcements'))
+        self._add_announcement(self.COUNT)
+
+        response = self.get(next_page_url)
+        self.assertEquals(
+            self._expected_titles(5, 0), self._get_titles(response))
+
+    def test_unknown_cursor_starts_from_first_page(self):
+        response = self.get('announcements?cursor=unknown')
+        self.assertEquals(
+            self._expected_titles(self.COUNT, 5), self._get_titles(response))
+
+    def test_only_bodies_of_visible_page_are_loaded(self):
+        drafts = [self._add_announcement(self.COUNT + index, is_draft=True)
+                  for index in xrange(3)]
+        loaded = []
+        get = announcements.AnnouncementEntity.get
+
+        def get_spy(keys):
+            loaded.extend(keys)
+            return get(keys)
+
+        self.swap(announcements.AnnouncementEntity, 'get',
+                  staticmethod(get_spy))
+        response = self.get('announcements')
+        self.assertEquals(
+            self._expected_titles(self.COUNT, 5), self._get_titles(response))
+        self.assertEquals(announcements.ANNOUNCEMENTS_PAGE_SIZE, len(loaded))
+        for draft in drafts:
+            self.assertNotIn(str(draft.key()), loaded)
+
+    def test_labels_are_applied_before_paging(self):
+        with common_utils.Namespace(NAMESPACE):
+            foo_id = models.LabelDAO.save(models.LabelDTO(
+                None, {'title': 'Foo',
+                       'descripton': 'foo',
+                       'type': models.LabelDTO.LABEL_TYPE_COURSE_TRACK}))
+            bar_id = models.LabelDAO.save(models.LabelDTO(
+                None, {'title': 'Bar',
+                       'descripton': 'bar',
+                       'type': models.LabelDTO.LABEL_TYPE_COURSE_TRACK}))
+            models.Student.set_labels_for_current(str(foo_id))
+        for index in xrange(self.COUNT, self.COUNT + 10):
+            self._add_announcement(index, labels=str(bar_id))
+
+        response = self.get('announcements')
+        self.assertEquals(
+            self._expected_titles(self.COUNT, 5), self._get_titles(response))
+
+    def test_bodies_are_cached_separately_from_summaries(self):
+        with actions.OverriddenConfig(models.CAN_USE_MEMCACHE.name, True):
+            self.get('announcements')
+            with common_utils.Namespace(NAMESPACE):
+                summaries = models.MemcacheManager.get(
+                    announcements.AnnouncementEntity.summaries_memcache_key)
+                self.assertEquals(self.COUNT, len(summaries))
+                self.assertNotIn('html', summaries[0])
+
+                entity = self._add_announcement(self.COUNT)
+                self.assertIsNone(models.MemcacheManager.get(
+                    announcements.AnnouncementEntity.summaries_memcache_key))
+
+                key = str(entity.key())
+                self.assertEquals(
+                    {key: 'Body of announcement %02d' % self.COUNT},
+                    announcements.AnnouncementEntity.get_html_bodies([key]))
+                self.assertEquals(
+                    'Body of announcement %02d' % self.COUNT,
+                    models.MemcacheManager.get(
+                        'announcement-html:%s' % key))
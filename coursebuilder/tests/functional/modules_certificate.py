@@ -105,6 +105,46 @@ class CertificateHandlerTestCase(actions.TestBase):
             response.headers['Content-Disposition'])
         self.assertIn('/Title (Course Builder Certificate)', response.body)
 
+    def test_download_pdf_is_cached_per_student_with_etag(self):
+        actions.login('test@example.com')
+        models.Student.add_new_student_for_current_user('Test User', None, self)
+
+        rendered = certificate.COUNTER_CERTIFICATE_PDF_RENDERED
+        cache_hit = certificate.COUNTER_CERTIFICATE_PDF_CACHE_HIT
+        rendered_before = rendered.value
+        cache_hit_before = cache_hit.value
+
+        with actions.OverriddenConfig(models.CAN_USE_MEMCACHE.name, True):
+            response = self.get('/certificate.pdf')
+            etag = response.headers['ETag']
+            self.assertEqual(rendered_before + 1, rendered.value)
+
+            # Cached copy is served without checking qualification again.
+            self.is_qualified = False
+            response = self.get('/certificate.pdf')
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(etag, response.headers['ETag'])
+            self.assertIn('/Title (Course Builder Certificate)', response.body)
+            self.assertEqual(rendered_before + 1, rendered.value)
+            self.assertEqual(cache_hit_before + 1, cache_hit.value)
+
+            response = self.get(
+                '/certificate.pdf', headers={'If-None-Match': etag})
+            self.assertEqual(304, response.status_code)
+            self.assertEqual('', response.body)
+
+            # A renamed student gets a newly rendered certificate.
+            self.is_qualified = True
+            models.Student.rename_current('Other Name')
+            self.get('/certificate.pdf')
+            self.assertEqual(rendered_before + 2, rendered.value)
+
+    def test_background_image_is_decoded_once_per_process(self):
+        handler = certificate.ShowCertificatePdfHandler
+        self.swap(handler, '_background_image', None)
+        image = handler._get_background_image()
+        self.assertIs(image, handler._get_background_image())
+
     def test_certificate_table_entry(self):
         actions.login('test@example.com')
         models.Student.add_new_student_for_current_user('Test User', None, self)
@@ -1861,14 +1861,15 @@ class CourseContentTranslationTests(actions.TestBase):
             ResourceBundleDTO(str(key_el), invitation_bundle))
 
         # Set up a spy to capture mails sent
-        send_async_call_log = []
-        def send_async_spy(unused_cls, *args, **kwargs):
-            send_async_call_log.append({'args': args, 'kwargs': kwargs})
+        send_multi_async_call_log = []
+        def send_multi_async_spy(unused_cls, *args, **kwargs):
+            send_multi_async_call_log.append({'args': args, 'kwargs': kwargs})
 
         # Patch the course env and the notifications sender
         courses.Course.ENVIRON_TEST_OVERRIDES = email_env
-        old_send_async = notifications.Manager.send_async
-        notifications.Manager.send_async = classmethod(send_async_spy)
+        old_send_multi_async = notifications.Manager.send_multi_async
+        notifications.Manager.send_multi_async = classmethod(
+            send_multi_async_spy)
         try:
             # register a student
             actions.login(self.STUDENT_EMAIL, is_admin=False)
@@ -1895,12 +1896,13 @@ class CourseContentTranslationTests(actions.TestBase):
             self.assertEquals(200, response['status'])
             self.assertEquals('OK, 1 messages sent', response['message'])
 
-            self.assertEquals(
-                translated_subject, send_async_call_log[0]['args'][4])
+            # Messages are (to, body, subject, audit_trail) tuples.
+            messages = send_multi_async_call_log[0]['args'][0]
+            self.assertEquals(translated_subject, messages[0][2])
 
         finally:
             courses.Course.ENVIRON_TEST_OVERRIDES = []
-            notifications.Manager.send_async = old_send_async
+            notifications.Manager.send_multi_async = old_send_multi_async
 
 
 class TranslationImportExportTests(actions.TestBase):
@@ -78,18 +78,30 @@ class InvitationHandlerTests(BaseInvitationTests):
         super(InvitationHandlerTests, self).setUp()
 
         self.old_send_async = notifications.Manager.send_async
+        self.old_send_multi_async = notifications.Manager.send_multi_async
         notifications.Manager.send_async = self._send_async_spy
+        notifications.Manager.send_multi_async = self._send_multi_async_spy
         self.send_async_count = 0
         self.send_async_call_log = []
+        self.send_multi_async_count = 0
 
     def tearDown(self):
         notifications.Manager.send_async = self.old_send_async
+        notifications.Manager.send_multi_async = self.old_send_multi_async
         super(InvitationHandlerTests, self).tearDown()
 
     def _send_async_spy(self, *args, **kwargs):
         self.send_async_count += 1
         self.send_async_call_log.append({'args': args, 'kwargs': kwargs})
 
+    def _send_multi_async_spy(self, messages, sender, intent, **kwargs):
+        # Logs each message as the equivalent send_async() call.
+        self.send_multi_async_count += 1
+        for to, body, subject, audit_trail in messages:
+            self._send_async_spy(
+                to, sender, intent, body, subject, audit_trail=audit_trail,
+                **kwargs)
+
     def test_invitation_panel_unavailable_when_email_is_not_fully_set_up(self):
         self.register()
         for sender_email in ['', 'foo@bar.com']:
@@ -269,6 +281,7 @@ class InvitationHandlerTests(BaseInvitationTests):
         self.assertEquals(200, response['status'])
         self.assertEquals('OK, 3 messages sent', response['message'])
         self.assertEqual(3, self.send_async_count)
+        self.assertEqual(1, self.send_multi_async_count)
         self.assertEquals(
             set(email_list),
             {log['args'][0] for log in self.send_async_call_log})
@@ -293,6 +306,34 @@ class InvitationHandlerTests(BaseInvitationTests):
             response['message'])
         self.assertEqual(2, self.send_async_count)
 
+    def test_rest_handler_checks_eligibility_with_one_datastore_get(self):
+        registered_student = 'some_other_student@foo.com'
+        models.Student(key_name=registered_student, is_enrolled=True).put()
+        unsubscribed_email = 'unsubscribed@foo.com'
+        unsubscribe.set_subscribed(unsubscribed_email, False)
+        state_kind = unsubscribe.SubscriptionStateEntity.kind()
+        state_gets = []
+        original_get = invitation.db.get
+
+        def get_spy(keys, **kwargs):
+            if isinstance(keys, list) and keys:
+                kinds = {key.kind() for key in keys}
+                if state_kind in kinds:
+                    state_gets.append((len(keys), kinds))
+            return original_get(keys, **kwargs)
+
+        self.register()
+        self.swap(invitation.db, 'get', get_spy)
+        response = self._do_valid_email_list_post(
+            ['a@foo.com', registered_student, unsubscribed_email, 'b@foo.com'])
+
+        self.assertEquals(200, response['status'])
+        self.assertEqual(
+            [(8, {state_kind, models.Student.kind()})], state_gets)
+        self.assertEqual(
+            {'a@foo.com', 'b@foo.com'},
+            {log['args'][0] for log in self.send_async_call_log})
+
     def test_rest_handler_limits_number_of_invitations(self):
         old_max_emails = invitation.MAX_EMAILS
         invitation.MAX_EMAILS = 2
@@ -30,6 +30,7 @@ from modules.notifications import stats
 from tests.functional import actions
 
 from google.appengine.api import mail_errors
+from google.appengine.api import taskqueue
 from google.appengine.ext import db
 from google.appengine.ext import deferred
 
@@ -225,6 +226,62 @@ class CronTest(actions.TestBase):
         self.assertEqual(1, self.stats.policy_run)
         self.assertEqual(1, self.stats.started)
 
+    def test_process_notification_if_send_date_set_and_payload_shared(self):
+        notification_keys, payload_key = (
+            notifications.Manager.send_bulk_async(
+                [self.to], self.sender, self.intent, self.body, self.subject))
+        self.taskq.FlushQueue('default')
+        notification = db.get(notification_keys[0])
+        notification._send_date = self.now
+        notification.put()
+        cron.process_notification(db.get(notification_keys[0]), self.now,
+                                  self.stats)
+        notification, payload = db.get([notification_keys[0], payload_key])
+
+        self.assertTrue(notification._done_date)
+        self.assertEqual(self.body, payload.body)    # Not yet for shared.
+        self.assertEqual(1, self.stats.policy_run)
+
+        self.assert_task_enqueued()
+        self.execute_all_deferred_tasks()
+
+        self.assertIsNone(db.get(payload_key).body)
+        self.assertEqual(
+            1,
+            notifications.COUNTER_SHARED_PAYLOAD_RETENTION_POLICY_RUN.value)
+
+    def test_process_shared_payload_runs_policy_once_all_are_done(self):
+        notification_keys, payload_key = (
+            notifications.Manager.send_bulk_async(
+                [self.to, 'other@example.com'], self.sender, self.intent,
+                self.body, self.subject))
+        self.taskq.FlushQueue('default')
+        cron.process_shared_payload(payload_key, self.stats)
+        self.assertEqual(self.body, db.get(payload_key).body)
+
+        # Done without the policy run on the payload, as when the query for
+        # its pending notifications was not yet consistent.
+        done = db.get(notification_keys)
+        for notification in done:
+            notification._send_date = self.now
+            notification._done_date = self.now
+        db.put(done)
+        self.assertEqual(
+            [payload_key],
+            list(notifications.Manager._get_pending_shared_payloads_query()))
+
+        cron.process_shared_payload(payload_key, self.stats)
+        payload = db.get(payload_key)
+        self.assertIsNone(payload.body)
+        self.assertTrue(payload._done_date)
+        self.assertEqual(1, self.stats.shared_payload_policy_run)
+        self.assertEqual(
+            [],
+            list(notifications.Manager._get_pending_shared_payloads_query()))
+
+        cron.process_shared_payload(payload_key, self.stats)
+        self.assertEqual(1, self.stats.shared_payload_policy_run)
+
     def test_process_notification_skips_if_already_done(self):
         notification_key, _ = db.put(
             notifications.Manager._make_unsaved_models(
@@ -679,6 +736,163 @@ class ManagerTest(actions.TestBase):
                 invalid_to, self.sender, self.intent, self.body, self.subject,
                 )
 
+    def test_send_bulk_async_shares_payload_and_sends_to_all(self):
+        to2 = 'to2@example.com'
+        to3 = 'to3@example.com'
+        self.swap(notifications, '_BULK_SEND_SLICE_SIZE', 2)
+        notification_keys, payload_key = (
+            notifications.Manager.send_bulk_async(
+                [self.to, to2, self.to, to3], self.sender, self.intent,
+                self.body, self.subject, audit_trail=self.audit_trail))
+        notification_list = db.get(notification_keys)
+        payload = db.get(payload_key)
+
+        self.assertEqual(
+            [self.to, to2, to3], [n.to for n in notification_list])
+        for notification in notification_list:
+            self.assertEqual(self.audit_trail, notification.audit_trail)
+            self.assertEqual(payload.enqueue_date, notification.enqueue_date)
+            self.assertEqual(notification.enqueue_date,
+                             notification._last_enqueue_date)
+            self.assertEqual(payload_key.name(),
+                             notification._payload_key_name)
+            self.assertEqual(
+                payload_key,
+                notifications.Manager._get_payload_key(notification))
+            self.assertTrue(notifications.Manager._is_still_enqueued(
+                notification, notification.enqueue_date))
+
+        self.assertEqual(self.body, payload.body)
+        self.assertEqual(notifications._SHARED_PAYLOAD_TO, payload.to)
+        self.assertEqual(
+            notifications.Status.PENDING,
+            notifications.Manager.query([to2], self.intent)[to2][0].state)
+
+        self.assertEqual(2, len(self.taskq.GetTasks('default')))
+        self.execute_all_deferred_tasks()
+        messages = self.get_mail_stub().get_sent_messages()
+
+        self.assertEqual(
+            sorted([self.to, to2, to3]), sorted([m.to for m in messages]))
+        self.assertEqual(
+            [self.body] * 3, [m.body.decode() for m in messages])
+        self.assertIsNone(db.get(payload_key).body)    # Ran default policy.
+        self.assertEqual(
+            [notifications.Status.SUCCEEDED] * 3,
+            [statuses[0].state for statuses in notifications.Manager.query(
+                [self.to, to2, to3], self.intent).values()])
+
+        self.assertEqual(
+            3, notifications.COUNTER_SEND_BULK_ASYNC_NOTIFICATIONS.value)
+        self.assertEqual(1, notifications.COUNTER_SEND_BULK_ASYNC_SUCCESS.value)
+        self.assertEqual(2, notifications.COUNTER_SEND_BULK_ASYNC_TASKS.value)
+        self.assertEqual(3, notifications.COUNTER_SEND_MAIL_TASK_SENT.value)
+        self.assertEqual(
+            1,
+            notifications.COUNTER_SHARED_PAYLOAD_RETENTION_POLICY_RUN.value)
+
+    def test_send_bulk_async_enqueues_tasks_in_batches(self):
+        recipients = ['to%s@example.com' % i for i in xrange(5)]
+        added = []
+        original_add = taskqueue.Queue.add
+
+        def add(queue, tasks, *args, **kwargs):
+            added.append(len(tasks))
+            return original_add(queue, tasks, *args, **kwargs)
+
+        self.swap(notifications, '_BULK_SEND_SLICE_SIZE', 1)
+        self.swap(notifications, '_TASKQUEUE_ADD_BATCH_SIZE', 2)
+        self.swap(taskqueue.Queue, 'add', add)
+        notifications.Manager.send_bulk_async(
+            recipients, self.sender, self.intent, self.body, self.subject)
+
+        self.assertEqual([2, 2, 1], added)
+        self.assertEqual(5, len(self.taskq.GetTasks('default')))
+        self.execute_all_deferred_tasks()
+        self.assertEqual(5, len(self.get_mail_stub().get_sent_messages()))
+
+    def test_send_bulk_async_keeps_payload_until_all_notifications_done(self):
+        to2 = 'to2@example.com'
+        notification_keys, payload_key = (
+            notifications.Manager.send_bulk_async(
+                [self.to, to2], self.sender, self.intent, self.body,
+                self.subject))
+
+        notifications.Manager._send_bulk_mail_task(
+            notification_keys[:1], payload_key)
+        self.assertEqual(self.body, db.get(payload_key).body)
+
+        notifications.Manager._send_bulk_mail_task(
+            notification_keys[1:], payload_key)
+        self.assertIsNone(db.get(payload_key).body)
+
+        messages = self.get_mail_stub().get_sent_messages()
+        self.assertEqual([self.to, to2], [m.to for m in messages])
+        self.assertEqual(
+            [self.body] * 2, [m.body.decode() for m in messages])
+
+    def test_send_bulk_async_raises_value_error_if_recipient_invalid(self):
+        with self.assertRaisesRegexp(ValueError, 'Malformed email address'):
+            notifications.Manager.send_bulk_async(
+                [self.to, 'bad'], self.sender, self.intent, self.body,
+                self.subject)
+
+        self.assertEqual(0, notifications.Notification.all().count())
+        self.assertEqual(0, notifications.Payload.all().count())
+        self.assertEqual(0, len(self.taskq.GetTasks('default')))
+        self.assertEqual(
+            1, notifications.COUNTER_SEND_ASYNC_FAILED_BAD_ARGUMENTS.value)
+
+    def test_send_multi_async_writes_distinct_models_and_can_run_tasks(self):
+        to2 = 'to2@example.com'
+        added = []
+        original_add = taskqueue.Queue.add
+
+        def add(queue, tasks, *args, **kwargs):
+            added.append(len(tasks))
+            return original_add(queue, tasks, *args, **kwargs)
+
+        self.swap(taskqueue.Queue, 'add', add)
+        keys = notifications.Manager.send_multi_async(
+            [(self.to, 'body1', 'subject1', self.audit_trail),
+             (to2, 'body2', 'subject2', None)],
+            self.sender, self.intent)
+
+        self.assertEqual([2], added)
+        notification1, payload1 = db.get(keys[0])
+        notification2, payload2 = db.get(keys[1])
+        self.assertEqual(self.to, notification1.to)
+        self.assertEqual('subject1', notification1.subject)
+        self.assertEqual(self.audit_trail, notification1.audit_trail)
+        self.assertEqual('body1', payload1.body)
+        self.assertEqual(to2, notification2.to)
+        self.assertEqual('body2', payload2.body)
+        for notification in (notification1, notification2):
+            self.assertIsNone(notification._payload_key_name)
+            self.assertEqual(notification.enqueue_date,
+                             notification._last_enqueue_date)
+
+        self.execute_all_deferred_tasks()
+        messages = self.get_mail_stub().get_sent_messages()
+
+        self.assertEqual(
+            [(self.to, 'body1'), (to2, 'body2')],
+            sorted([(m.to, m.body.decode()) for m in messages]))
+        self.assertIsNone(db.get(keys[0][1]).body)    # Ran default policy.
+        self.assertEqual(
+            2, notifications.COUNTER_SEND_MULTI_ASYNC_NOTIFICATIONS.value)
+        self.assertEqual(2, notifications.COUNTER_SEND_MAIL_TASK_SENT.value)
+
+    def test_send_multi_async_raises_value_error_if_to_repeated(self):
+        with self.assertRaisesRegexp(ValueError, 'Repeated recipient'):
+            notifications.Manager.send_multi_async(
+                [(self.to, self.body, self.subject, None),
+                 (self.to, self.body, self.subject, None)],
+                self.sender, self.intent)
+
+        self.assertEqual(0, notifications.Notification.all().count())
+        self.assertEqual(0, len(self.taskq.GetTasks('default')))
+
     def test_send_mail_task_fails_permanent_and_marks_entities_if_cap_hit(self):
         over_cap = notifications._RECOVERABLE_FAILURE_CAP + 1
         notification_key, payload_key = db.put(
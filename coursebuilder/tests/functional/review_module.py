@@ -18,8 +18,12 @@ __author__ = [
     'johncox@google.com (John Cox)',
 ]
 
+import logging
+import random
+import time
 import types
 
+from models import config
 from models import models
 from models import student_work
 from modules.review import domain
@@ -447,6 +451,70 @@ class ManagerTest(actions.TestBase):
         self.assertEqual(1, summary.completed_count)
         self.assertEqual(1, summary.expired_count)
 
+    def _make_assigned_steps(self, count, summary_key):
+        step_keys = []
+        for index in xrange(count):
+            step_keys.append(peer.ReviewStep(
+                assigner_kind=domain.ASSIGNER_KIND_AUTO,
+                review_summary_key=summary_key, reviewee_key=self.reviewee_key,
+                reviewer_key=models.Student(
+                    key_name='reviewer%s@example.com' % index).put(),
+                submission_key=self.submission_key,
+                state=domain.REVIEW_STATE_ASSIGNED, unit_id=self.unit_id
+            ).put())
+        return step_keys
+
+    def test_schedule_expiry_for_unit_expires_reviews_in_batches(self):
+        self.swap(review_module, 'EXPIRY_TASK_BATCH_SIZE', 2)
+        summary_key = peer.ReviewSummary(
+            assigned_count=3, reviewee_key=self.reviewee_key,
+            submission_key=self.submission_key, unit_id=self.unit_id
+        ).put()
+        step_keys = self._make_assigned_steps(3, summary_key)
+        scheduled = review_module.COUNTER_EXPIRE_REVIEWS_TASKS_SCHEDULED.value
+
+        review_module.Manager.schedule_expiry_for_unit(0, self.unit_id)
+        self.assertEqual(1, len(self.taskq.GetTasks('default')))
+        self.execute_all_deferred_tasks()
+
+        self.assertEqual(
+            scheduled + 2,
+            review_module.COUNTER_EXPIRE_REVIEWS_TASKS_SCHEDULED.value)
+        self.assertEqual(
+            [domain.REVIEW_STATE_EXPIRED] * 3,
+            [step.state for step in db.get(step_keys)])
+        summary = db.get(summary_key)
+        self.assertEqual(0, summary.assigned_count)
+        self.assertEqual(3, summary.expired_count)
+
+    def test_expire_reviews_skips_steps_that_cannot_be_expired(self):
+        self.swap(review_module, 'EXPIRY_READ_AHEAD_SIZE', 2)
+        summary_key = peer.ReviewSummary(
+            assigned_count=3, reviewee_key=self.reviewee_key,
+            submission_key=self.submission_key, unit_id=self.unit_id
+        ).put()
+        assigned_key, completed_key, removed_key = self._make_assigned_steps(
+            3, summary_key)
+        completed, removed = db.get([completed_key, removed_key])
+        completed.state = domain.REVIEW_STATE_COMPLETED
+        removed.removed = True
+        db.put([completed, removed])
+        missing_key = db.Key.from_path(peer.ReviewStep.kind(), 'missing')
+        not_expirable = (
+            review_module.COUNTER_EXPIRE_REVIEWS_NOT_EXPIRABLE.value)
+
+        expired_keys, exception_keys = review_module.Manager.expire_reviews(
+            [completed_key, assigned_key, missing_key, removed_key])
+
+        self.assertEqual([assigned_key], expired_keys)
+        self.assertEqual(
+            [completed_key, missing_key, removed_key], exception_keys)
+        self.assertEqual(
+            not_expirable + 3,
+            review_module.COUNTER_EXPIRE_REVIEWS_NOT_EXPIRABLE.value)
+        self.assertEqual(
+            domain.REVIEW_STATE_EXPIRED, db.get(assigned_key).state)
+
     def test_get_assignment_candidates_query_filters_and_orders_correctly(self):
         unused_wrong_unit_key = peer.ReviewSummary(
             reviewee_key=self.reviewee_key, submission_key=self.submission_key,
@@ -1353,3 +1421,206 @@ class ManagerTest(actions.TestBase):
         self.assertEqual(domain.REVIEW_STATE_ASSIGNED, step2.state)
         self.assertEqual(step2.review_key, updated_review.key())
         self.assertEqual('contents2', updated_review.contents)
+
+
+class _CandidatePoolTestBase(actions.TestBase):
+
+    def setUp(self):
+        super(_CandidatePoolTestBase, self).setUp()
+        config.Registry.test_overrides = {
+            review_module.CAN_SHARD_REVIEW_CANDIDATES.name: True}
+
+    def tearDown(self):
+        config.Registry.test_overrides = {}
+        super(_CandidatePoolTestBase, self).tearDown()
+
+    def _make_submissions(self, count, unit_id):
+        """Makes students with a submission each; returns their keys."""
+        student_keys = []
+        for index in xrange(count):
+            student_key = models.Student(
+                key_name='student%s@example.com' % index).put()
+            submission_key = student_work.Submission(
+                reviewee_key=student_key, unit_id=unit_id).put()
+            peer.ReviewSummary(
+                reviewee_key=student_key, submission_key=submission_key,
+                unit_id=unit_id).put()
+            student_keys.append(student_key)
+        return student_keys
+
+    def _get_pools(self, unit_id):
+        return peer.ReviewCandidatePool.get_by_key_name([
+            peer.ReviewCandidatePool.key_name(unit_id, bucket)
+            for bucket in xrange(review_module.CANDIDATE_POOL_BUCKETS)])
+
+
+class CandidatePoolTest(_CandidatePoolTestBase):
+    """Tests for the sharded pool of review assignment candidates."""
+
+    def setUp(self):
+        super(CandidatePoolTest, self).setUp()
+        self.unit_id = '1'
+        self.reviewer_key = models.Student(
+            key_name='reviewer@example.com').put()
+
+    def test_refill_deals_candidates_into_disjoint_buckets(self):
+        self._make_submissions(40, self.unit_id)
+        review_module.Manager.refill_candidate_pool(self.unit_id)
+
+        ordered_keys = review_module.Manager.get_assignment_candidates_query(
+            self.unit_id, keys_only=True).fetch(None)
+        pooled_keys = []
+        for pool in self._get_pools(self.unit_id):
+            self.assertEqual(
+                sorted(pool.summary_keys, key=ordered_keys.index),
+                pool.summary_keys)
+            pooled_keys.extend(pool.summary_keys)
+        self.assertEqual(40, len(pooled_keys))
+        self.assertEqual(set(ordered_keys), set(pooled_keys))
+
+    def test_refill_fills_all_buckets_when_candidates_are_few(self):
+        self._make_submissions(3, self.unit_id)
+        review_module.Manager.refill_candidate_pool(self.unit_id)
+
+        for pool in self._get_pools(self.unit_id):
+            self.assertEqual(1, len(pool.summary_keys))
+
+    def test_get_new_review_draws_from_bucket_of_reviewer(self):
+        self._make_submissions(40, self.unit_id)
+        review_module.Manager.refill_candidate_pool(self.unit_id)
+        # pylint: disable=protected-access
+        bucket = review_module.Manager._get_candidate_pool_bucket(
+            self.reviewer_key)
+        pool = peer.ReviewCandidatePool.get_by_key_name(
+            peer.ReviewCandidatePool.key_name(self.unit_id, bucket))
+
+        step_key = review_module.Manager.get_new_review(
+            self.unit_id, self.reviewer_key)
+
+        self.assertIn(db.get(step_key).review_summary_key, pool.summary_keys)
+        self.assertEqual(0, len(self.taskq.GetTasks('default')))
+
+    def test_get_new_review_without_pool_queries_and_schedules_refill(self):
+        self.swap(time, 'time', lambda: 1000.0)
+        self._make_submissions(2, self.unit_id)
+
+        step_key = review_module.Manager.get_new_review(
+            self.unit_id, self.reviewer_key)
+
+        self.assertIsNotNone(step_key)
+        self.assertEqual(1, len(self.taskq.GetTasks('default')))
+
+        # Other reviewers do not schedule more refills.
+        review_module.Manager.get_new_review(
+            self.unit_id, models.Student(key_name='other@example.com').put())
+        self.assertEqual(1, len(self.taskq.GetTasks('default')))
+
+        self.execute_all_deferred_tasks()
+        for pool in self._get_pools(self.unit_id):
+            self.assertEqual(1, len(pool.summary_keys))
+
+    def test_get_new_review_falls_back_to_query_when_bucket_exhausted(self):
+        student_keys = self._make_submissions(2, self.unit_id)
+        own_summary_key = peer.ReviewSummary.all(keys_only=True).filter(
+            'reviewee_key', student_keys[0]).get()
+        # pylint: disable=protected-access
+        bucket = review_module.Manager._get_candidate_pool_bucket(
+            student_keys[0])
+        peer.ReviewCandidatePool(
+            bucket=bucket, summary_keys=[own_summary_key],
+            unit_id=self.unit_id).put()
+
+        step_key = review_module.Manager.get_new_review(
+            self.unit_id, student_keys[0])
+
+        self.assertEqual(student_keys[1], db.get(step_key).reviewee_key)
+        self.assertEqual(1, len(self.taskq.GetTasks('default')))
+
+
+class ReviewAssignmentLoadTest(_CandidatePoolTestBase):
+    """Simulates many reviewers asking for new reviews at once.
+
+    Reviewers arrive in waves. All reviewers of a wave read their candidates
+    before any of them assigns one, as they would when arriving at the same
+    time, and then contend for them. A reviewer left without a review while
+    there is a submission they could review is a false negative.
+    """
+
+    STUDENTS = 64
+    WAVE_SIZE = 32
+    ROUNDS = 2
+
+    def _is_assignable(self, unit_id, reviewer_key):
+        for summary in peer.ReviewSummary.all().filter('unit_id', unit_id):
+            if summary.reviewee_key == reviewer_key:
+                continue
+            if not peer.ReviewStep.get_by_key_name(peer.ReviewStep.key_name(
+                    summary.submission_key, reviewer_key)):
+                return True
+        return False
+
+    def _simulate(self, unit_id, sharded):
+        # pylint: disable=protected-access
+        manager = review_module.Manager
+        random.seed(0)
+        student_keys = self._make_submissions(self.STUDENTS, unit_id)
+        changed = review_module.COUNTER_GET_NEW_REVIEW_SUMMARY_CHANGED.value
+        assigned = false_negatives = 0
+
+        start = time.time()
+        if sharded:
+            manager.refill_candidate_pool(unit_id)
+        for _ in xrange(self.ROUNDS):
+            for offset in xrange(0, len(student_keys), self.WAVE_SIZE):
+                reads = []
+                for reviewer_key in student_keys[
+                        offset:offset + self.WAVE_SIZE]:
+                    pooled = []
+                    if sharded:
+                        pooled = manager._get_pooled_assignment_candidates(
+                            unit_id, reviewer_key)
+                    queried = manager._get_queried_assignment_candidates(
+                        unit_id, reviewer_key, 20)
+                    reads.append((reviewer_key, pooled, queried))
+
+                for reviewer_key, pooled, queried in reads:
+                    step_key = (
+                        pooled and
+                        manager._assign_from_candidates(
+                            pooled, reviewer_key, 5))
+                    if not step_key:
+                        step_key = manager._assign_from_candidates(
+                            queried, reviewer_key, 5)
+                    if step_key:
+                        assigned += 1
+                    elif self._is_assignable(unit_id, reviewer_key):
+                        false_negatives += 1
+
+                # As the refill task would between waves.
+                if sharded:
+                    manager.refill_candidate_pool(unit_id)
+        elapsed = time.time() - start
+
+        conflicts = (
+            review_module.COUNTER_GET_NEW_REVIEW_SUMMARY_CHANGED.value -
+            changed)
+        logging.info(
+            'Review assignment, %s students, waves of %s, %s: %s assigned '
+            '(%.1f/s), %s false negatives, %s conflicts.',
+            self.STUDENTS, self.WAVE_SIZE,
+            'sharded' if sharded else 'not sharded', assigned,
+            assigned / elapsed, false_negatives, conflicts)
+        return assigned, false_negatives, conflicts
+
+    def test_load(self):
+        assigned, false_negatives, conflicts = self._simulate('1', False)
+        (sharded_assigned, sharded_false_negatives,
+         sharded_conflicts) = self._simulate('2', True)
+
+        self.assertEqual(
+            self.STUDENTS * self.ROUNDS, assigned + false_negatives)
+        self.assertEqual(
+            self.STUDENTS * self.ROUNDS,
+            sharded_assigned + sharded_false_negatives)
+        self.assertLessEqual(sharded_false_negatives, false_negatives)
+        self.assertLess(sharded_conflicts, conflicts)
@@ -306,6 +306,10 @@ class StudentAnswersAnalyticsTest(actions.TestBase):
                 to_store = entity.entity_class(key_name=entity.entity_key_name,
                                                data=entity.data)
             to_store.put()
+            if entity.entity_class is models.StudentAnswersEntity:
+                models.Student(
+                    key_name='%s@example.com' % entity.entity_key_name,
+                    user_id=entity.entity_key_name, is_enrolled=True).put()
 
     def _get_data_source(self, source_name):
         xsrf_token = crypto.XsrfTokenManager.create_xsrf_token(
@@ -320,6 +324,33 @@ class StudentAnswersAnalyticsTest(actions.TestBase):
             self.assertDictContainsSubset(expected_item, actual_item)
 
     def test_end_to_end(self):
+        self._run_and_verify_analytics()
+
+    def test_end_to_end_with_answers_stored_per_assessment(self):
+        # Answers stored the old way are still read before any migration.
+        with actions.OverriddenConfig(
+            models.CAN_STORE_ANSWERS_PER_ASSESSMENT.name, True):
+            self._run_and_verify_analytics()
+
+    def test_end_to_end_with_migrated_answers(self):
+        actions.login(ADMIN_EMAIL, is_admin=True)
+        response = self.get(
+            '/test_course/dashboard?action=analytics&tab=gradebook')
+        form = response.forms[
+            'gcb-run-visualization-student_answers_migration']
+        self.submit(form, response)
+        self.execute_all_deferred_tasks()
+        self.assertEquals(
+            [{'outcome': 'copied', 'count': 6}],
+            self._get_data_source('student_answers_migration'))
+
+        with common_utils.Namespace(self.context.get_namespace_name()):
+            db.delete(models.StudentAnswersEntity.all(keys_only=True).run())
+        with actions.OverriddenConfig(
+            models.CAN_STORE_ANSWERS_PER_ASSESSMENT.name, True):
+            self._run_and_verify_analytics()
+
+    def _run_and_verify_analytics(self):
         actions.login(ADMIN_EMAIL, is_admin=True)
 
         # Start map/reduce analysis job.
@@ -2213,6 +2213,57 @@ class StudentAspectTest(actions.TestBase):
         # Clean up.
         config.Registry.test_overrides = {}
 
+    def test_attempt_activity_event_batch(self):
+        """Test a batch of events is recorded at once."""
+
+        email = 'test_attempt_activity_event_batch@example.com'
+        name = 'Test Attempt Activity Event Batch'
+
+        actions.login(email)
+        actions.register(self, name)
+
+        # Enable event recording.
+        config.Registry.test_overrides[
+            lessons.CAN_PERSIST_ACTIVITY_EVENTS.name] = True
+
+        # Prepare events; payloads may be dicts or their JSON.
+        request = {'events': [
+            {'source': 'test-source',
+             'payload': transforms.dumps({'Alice': u'Bob (тест данные)'})},
+            {'source': 'test-source', 'payload': {'Alice': 'Carol'}}]}
+
+        # Check XSRF token is required.
+        response = self.post('rest/events/batch?%s' % urllib.urlencode(
+            {'request': transforms.dumps(request)}), {})
+        assert_equals(response.status_int, 200)
+        assert_contains('"status": 403', response.body)
+
+        # Check PUT works.
+        request['xsrf_token'] = XsrfTokenManager.create_xsrf_token(
+            'event-post')
+        response = self.post('rest/events/batch?%s' % urllib.urlencode(
+            {'request': transforms.dumps(request)}), {})
+        assert_equals(response.status_int, 200)
+        assert not response.body
+
+        # Check events are properly recorded.
+        old_namespace = namespace_manager.get_namespace()
+        namespace_manager.set_namespace(self.namespace)
+        try:
+            events = models.EventEntity.all().fetch(1000)
+            assert 2 == len(events)
+            names = sorted(
+                transforms.loads(event.data)['Alice'] for event in events)
+            assert_equals([u'Bob (тест данные)', u'Carol'], names)
+            for event in events:
+                assert_equals('test-source', event.source)
+                assert 'loc' in transforms.loads(event.data)
+        finally:
+            namespace_manager.set_namespace(old_namespace)
+
+        # Clean up.
+        config.Registry.test_overrides = {}
+
     def test_two_students_dont_see_each_other_pages(self):
         """Test a user can't see another user pages."""
         email1 = 'user1@foo.com'
@@ -2342,6 +2393,103 @@ class StaticHandlerTest(actions.TestBase):
         assert_response(self.testapp.get(
             '/static/inputex-3.1.0/src/inputex/assets/skins/sam/inputex.css'))
 
+    def test_local_file_conditional_get(self):
+        """Test static files from the file system honor validators."""
+        response = self.get('/assets/css/main.css')
+        assert_equals(response.status_int, 200)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        assert_equals('bytes', response.headers['Accept-Ranges'])
+
+        response = self.get(
+            '/assets/css/main.css', headers={'If-None-Match': etag})
+        assert_equals(response.status_int, 304)
+        assert_equals('', response.body)
+
+        response = self.get(
+            '/assets/css/main.css',
+            headers={'If-Modified-Since': last_modified})
+        assert_equals(response.status_int, 304)
+
+        response = self.get(
+            '/assets/css/main.css', headers={'If-None-Match': '"other"'})
+        assert_equals(response.status_int, 200)
+
+
+class DatastoreBackedAssetTest(actions.TestBase):
+    """Check serving of static resources stored in the datastore."""
+
+    FILENAME = '/assets/img/data.bin'
+
+    def setUp(self):
+        super(DatastoreBackedAssetTest, self).setUp()
+        sites.setup_courses('course:/::ns_assets')
+        self.app_context = sites.get_all_courses()[0]
+        self.data = ''.join(chr(index % 256) for index in xrange(1000))
+        self.app_context.fs.put(
+            sites.abspath(self.app_context.get_home_folder(), self.FILENAME),
+            cStringIO.StringIO(self.data))
+
+    def tearDown(self):
+        sites.reset_courses()
+        super(DatastoreBackedAssetTest, self).tearDown()
+
+    def test_conditional_get(self):
+        response = self.get(self.FILENAME)
+        assert_equals(response.status_int, 200)
+        assert_equals(self.data, response.body)
+        etag = response.headers['ETag']
+
+        response = self.get(self.FILENAME, headers={'If-None-Match': etag})
+        assert_equals(response.status_int, 304)
+        assert_equals(etag, response.headers['ETag'])
+
+        # Changing the file changes its validators.
+        self.app_context.fs.put(
+            sites.abspath(self.app_context.get_home_folder(), self.FILENAME),
+            cStringIO.StringIO(self.data[::-1]))
+        response = self.get(self.FILENAME, headers={'If-None-Match': etag})
+        assert_equals(response.status_int, 200)
+        assert_equals(self.data[::-1], response.body)
+
+    def test_single_range(self):
+        response = self.get(self.FILENAME, headers={'Range': 'bytes=10-19'})
+        assert_equals(response.status_int, 206)
+        assert_equals(self.data[10:20], response.body)
+        assert_equals(
+            'bytes 10-19/1000', response.headers['Content-Range'])
+
+        response = self.get(self.FILENAME, headers={'Range': 'bytes=-5'})
+        assert_equals(response.status_int, 206)
+        assert_equals(self.data[-5:], response.body)
+
+    def test_multiple_ranges(self):
+        response = self.get(
+            self.FILENAME, headers={'Range': 'bytes=0-1,998-'})
+        assert_equals(response.status_int, 206)
+        assert_contains(
+            'multipart/byteranges', response.headers['Content-Type'])
+        assert_contains(
+            'Content-Range: bytes 0-1/1000\r\n\r\n' + self.data[0:2],
+            response.body)
+        assert_contains(
+            'Content-Range: bytes 998-999/1000\r\n\r\n' + self.data[998:],
+            response.body)
+
+    def test_unsatisfiable_range(self):
+        response = self.get(
+            self.FILENAME, headers={'Range': 'bytes=1000-'},
+            expect_errors=True)
+        assert_equals(response.status_int, 416)
+        assert_equals('bytes */1000', response.headers['Content-Range'])
+
+    def test_range_with_stale_if_range_gets_entire_file(self):
+        response = self.get(
+            self.FILENAME,
+            headers={'Range': 'bytes=0-1', 'If-Range': '"stale"'})
+        assert_equals(response.status_int, 200)
+        assert_equals(self.data, response.body)
+
 
 class ActivityTest(actions.TestBase):
     """Test for activities."""
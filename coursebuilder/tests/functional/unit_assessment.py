@@ -20,11 +20,13 @@ import re
 
 from common import crypto
 from common import utils as common_utils
+from controllers import assessments
 from controllers import sites
 from controllers import utils
 from models import config
 from models import courses
 from models import models
+from models import transforms
 from modules.dashboard import unit_lesson_editor
 from tests.functional import actions
 from tools import verify
@@ -674,3 +676,94 @@ class UnitPrePostAssessmentTest(actions.TestBase):
         self.assertIn('Previous Page', response.body)
         self.assertNotIn('Next Page', response.body)
         self.assertIn(' End ', response.body)
+
+
+class AssessmentSubmissionTest(actions.TestBase):
+    """Tests the steps of storing a submitted assessment."""
+
+    def setUp(self):
+        super(AssessmentSubmissionTest, self).setUp()
+        context = actions.simple_add_course(
+            COURSE_NAME, ADMIN_EMAIL, COURSE_TITLE)
+        self.course = courses.Course(None, context)
+        self.assessment = self.course.add_assessment()
+        self.assessment.title = 'Assessment'
+        self.assessment.html_content = 'assessment content'
+        self.assessment.now_available = True
+        self.course.save()
+
+        actions.login(STUDENT_EMAIL)
+        actions.register(self, STUDENT_EMAIL, COURSE_NAME)
+
+    def _post_assessment(self):
+        return self.post(BASE_URL + '/answer', {
+            'xsrf_token': crypto.XsrfTokenManager.create_xsrf_token(
+                'assessment-post'),
+            'assessment_type': self.assessment.unit_id,
+            'answers': transforms.dumps([{'foo': 'bar'}]),
+            'score': '75'})
+
+    def _is_completed(self):
+        with common_utils.Namespace(NAMESPACE):
+            student = models.Student.get_enrolled_student_by_email(
+                STUDENT_EMAIL)
+            tracker = self.course.get_progress_tracker()
+            return tracker.is_assessment_completed(
+                tracker.get_or_create_progress(student),
+                self.assessment.unit_id)
+
+    def test_submission_is_stored(self):
+        response = self._post_assessment()
+        self.assertEquals(200, response.status_int)
+
+        with common_utils.Namespace(NAMESPACE):
+            student = models.Student.get_enrolled_student_by_email(
+                STUDENT_EMAIL)
+            self.assertEquals(
+                {str(self.assessment.unit_id): 75},
+                transforms.loads(student.scores))
+            answers = models.StudentAnswersEntity.get_by_key_name(
+                student.user_id)
+            self.assertEquals(
+                {str(self.assessment.unit_id): [{'foo': 'bar'}]},
+                transforms.loads(answers.data))
+            events = models.EventEntity.all().filter(
+                'source =', 'submit-assessment').fetch(10)
+            self.assertEquals(1, len(events))
+        self.assertTrue(self._is_completed())
+
+        for latency in (
+            assessments.SUBMIT_LATENCY, assessments.SUBMIT_READ_LATENCY,
+            assessments.SUBMIT_WRITE_LATENCY,
+            assessments.SUBMIT_EVENT_LATENCY):
+            self.assertIsNotNone(latency.p50.poll_value())
+            self.assertIsNotNone(latency.p99.poll_value())
+
+    def test_answers_are_stored_per_assessment(self):
+        with actions.OverriddenConfig(
+            models.CAN_STORE_ANSWERS_PER_ASSESSMENT.name, True):
+            response = self._post_assessment()
+        self.assertEquals(200, response.status_int)
+
+        with common_utils.Namespace(NAMESPACE):
+            student = models.Student.get_enrolled_student_by_email(
+                STUDENT_EMAIL)
+            self.assertIsNone(
+                models.StudentAnswersEntity.get_by_key_name(student.user_id))
+            answers = models.StudentAssessmentAnswersEntity.get_by_key_name(
+                models.StudentAssessmentAnswersEntity.create_key(
+                    student.user_id, self.assessment.unit_id))
+            self.assertEquals([{'foo': 'bar'}], transforms.loads(answers.data))
+            self.assertEquals(
+                {str(self.assessment.unit_id): 75},
+                transforms.loads(student.scores))
+
+    def test_progress_is_recorded_by_task_if_deferred(self):
+        with actions.OverriddenConfig(
+            assessments.CAN_DEFER_ASSESSMENT_PROGRESS.name, True):
+            response = self._post_assessment()
+        self.assertEquals(200, response.status_int)
+        self.assertFalse(self._is_completed())
+
+        self.execute_all_deferred_tasks()
+        self.assertTrue(self._is_completed())
@@ -0,0 +1,72 @@
+# Copyright 2014 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS-IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Unit tests for models/counters.py."""
+
+__author__ = 'Pavel Simakov (psimakov@google.com)'
+
+import unittest
+
+from models import counters
+
+
+class LatencyPerfCounterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.latency = counters.LatencyPerfCounter(
+            'test-latency', 'Latency of a test operation')
+
+    def tearDown(self):
+        for counter in (self.latency.p50, self.latency.p99):
+            del counters.Registry.registered[counter.name]
+
+    def test_percentiles_are_registered_counters(self):
+        self.assertIs(
+            self.latency.p50,
+            counters.Registry.registered['test-latency-p50-millis'])
+        self.assertIs(
+            self.latency.p99,
+            counters.Registry.registered['test-latency-p99-millis'])
+        self.assertIsNone(self.latency.get_percentile(50))
+        self.assertEquals(0, self.latency.p50.value)
+
+    def test_percentiles_of_samples(self):
+        for millis in reversed(xrange(1, 101)):
+            self.latency.record(millis)
+        self.assertEquals(50, self.latency.p50.value)
+        self.assertEquals(99, self.latency.p99.value)
+
+        self.latency.record(1000)
+        self.latency.record(1000)
+        self.assertEquals(51, self.latency.p50.value)
+        self.assertEquals(1000, self.latency.p99.value)
+
+    def test_only_latest_samples_are_kept(self):
+        for _ in xrange(counters.LatencyPerfCounter.MAX_SAMPLES):
+            self.latency.record(1000)
+        for _ in xrange(counters.LatencyPerfCounter.MAX_SAMPLES):
+            self.latency.record(10)
+        self.assertEquals(10, self.latency.p99.value)
+
+        self.latency.p50._clear()  # pylint: disable=protected-access
+        self.assertIsNone(self.latency.get_percentile(99))
+
+    def test_timer_records_latency(self):
+        with self.latency.timer():
+            pass
+        self.assertEquals(0, self.latency.get_percentile(50))
+
+
+if __name__ == '__main__':
+    unittest.main()